@@ -1,17 +1,55 @@
-from flask import Flask, render_template, request, redirect, url_for, g, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, g, jsonify, flash, Response, stream_with_context, send_file, abort
 import sqlite3
 import datetime
 import os
+import sys
 import json
+import threading
 from decimal import Decimal
 #from zoneinfo import ZoneInfo  # Para Python 3.9+
 from pytz import timezone
+from export_stream import iter_order_lines, csv_stream, xlsx_stream
+from jobs import JobQueue, job_handler, create_jobs_table, PRIORITY_PRINT, PRIORITY_EXPORT
+from printing import TicketCache, load_printers, items_digest, DIGEST_COLUMNS, RENDERERS
+from kitchen_display import (KitchenBoard, ACTIVE_STATUSES, NEXT_STATUS, STATIONS, STATION_LABELS, filter_station,
+                             add_bump_column)
+from variation_snapshot import add_snapshot_columns, backfill_snapshots, snapshot_cart, decode_snapshot
+from order_repository import OrderRepository
+from timestamps import format_timestamp, to_datetime, now_parts, add_timestamp_columns, migrate_timestamps
+from sql_profiler import SqlProfiler, ProfilingConnection, set_lock_observer
+from catalog_cache import CatalogCache
+from cache_coherence import ChangeTracker, create_change_log, domain_version
+from dashboard_stats import DashboardStats, ORDER_COLUMNS, INGREDIENT_COLUMNS
+from order_analytics import OrderAnalytics
+from category_sales import CategorySales, period_range, comparison_range
+import sales_rollup
+from sales_rollup import create_sales_rollup, order_hour, refresh_hours
+import basket_analysis
+from basket_analysis import create_basket_tables, order_basket, update_basket
+from recipe_costing import (CostingEngine, add_cost_columns, recompute_line_costs, create_cost_history,
+                            backfill_cost_history, record_cost, recorded_line_costs)
+import menu_engineering
+from bill_of_materials import BillOfMaterials, CycleError, add_sub_recipe_column
+from cost_simulation import CostSimulator, sales_volumes
+from inventory_valuation import InventoryValuation, METHODS as VALUATION_METHODS, METHOD_LABELS as VALUATION_LABELS
+from menu_engineering import create_menu_engineering_tables
+import metrics
 
 # Si tienes Python < 3.9, usa: from pytz import timezone
 
 app = Flask(__name__)
 app.secret_key = 'epicuro_secret_key_2024'
 
+# Imprimir automáticamente el ticket de cocina al crear cada orden
+app.config['AUTO_PRINT_KITCHEN'] = os.environ.get('EPICURO_AUTO_PRINT', '0') == '1'
+
+# Perfil de SQL por petición (ver sql_profiler.py y /debug/profile)
+sql_profiler = SqlProfiler(app)
+
+# Métricas para Prometheus (ver metrics.py y /metrics)
+metrics.RequestMetrics(app)
+set_lock_observer(metrics.LockWaitObserver())
+
 # Configurar zona horaria de Chile
 #CHILE_TZ = ZoneInfo("America/Santiago")  # Para Python 3.9+
 CHILE_TZ = timezone('America/Santiago') # Para Python < 3.9 usar: 
@@ -30,38 +68,11 @@ def get_chile_timestamp():
 
 @app.template_filter('dateformat')
 def dateformat(value, format='%d/%m/%Y'):
-    """Filtro para formatear fechas que pueden ser strings o datetime objects"""
-    if not value:
-        return 'N/A'
+    """Filtro para formatear fechas (texto, epoch o datetime) en hora de Chile
     
-    if isinstance(value, str):
-        try:
-            # Intentar convertir string a datetime
-            if 'T' in value:
-                # Formato ISO con T: 2025-09-16T10:30:00
-                dt = datetime.datetime.fromisoformat(value.replace('T', ' '))
-            else:
-                # Formato normal: 2025-09-16 10:30:00
-                dt = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
-            
-            # Si la fecha viene de SQLite (sin zona horaria), convertir a Chile
-            if dt.tzinfo is None:
-                # Asumir que es UTC y convertir a Chile
-                dt = dt.replace(tzinfo=datetime.timezone.utc)
-                dt = dt.astimezone(CHILE_TZ)
-            
-            return dt.strftime(format)
-        except:
-            # Si falla la conversión, devolver solo la fecha (primeros 10 caracteres)
-            return value[:10] if len(value) >= 10 else value
-    else:
-        # Si ya es datetime, convertir a zona horaria de Chile si es necesario
-        if hasattr(value, 'tzinfo'):
-            if value.tzinfo is None:
-                # Sin zona horaria, asumir UTC
-                value = value.replace(tzinfo=datetime.timezone.utc)
-            value = value.astimezone(CHILE_TZ)
-        return value.strftime(format)
+    El parseo y el formateo se guardan en caché (ver timestamps.py).
+    """
+    return format_timestamp(value, format)
 
 @app.template_filter('nl2br')
 def nl2br_filter(text):
@@ -73,19 +84,148 @@ def nl2br_filter(text):
 # Configuración de la base de datos
 DATABASE = 'data/sandwich.db'
 
+# Segundos que una escritura espera el lock de SQLite antes de fallar
+DB_TIMEOUT = float(os.environ.get('EPICURO_DB_TIMEOUT', 5))
+
+# Varios procesos con gunicorn (ver gunicorn.conf.py): base en WAL preparada
+# por el maestro y una conexión por hilo de worker reutilizada entre peticiones
+PREFORK = os.environ.get('EPICURO_PREFORK', '0') == '1'
+_thread_db = threading.local()
+
+# Cola de trabajos en segundo plano (impresión, exportaciones, importaciones, correos)
+job_queue = JobQueue(DATABASE, workers=int(os.environ.get('EPICURO_JOB_WORKERS', 2)),
+                     recover_on_start=not PREFORK)
+EXPORTS_DIR = os.path.join('data', 'exports')
+IMPORTS_DIR = os.path.join('data', 'imports')
+
+# Hora local del recálculo nocturno de ingeniería de menú (ver menu_engineering.py)
+MENU_ENGINEERING_HOUR = int(os.environ.get('EPICURO_MENU_ENGINEERING_HOUR', 3))
+
+# Impresoras térmicas ESC/POS y caché de tickets ya renderizados
+printers = load_printers()
+ticket_cache = TicketCache()
+
+# Pantalla de cocina en memoria (categoría -> estación configurable con JSON)
+kitchen_board = KitchenBoard(json.loads(os.environ.get('EPICURO_KITCHEN_STATIONS', '{}')))
+
+# Menú y variaciones para tomar pedidos (compartido entre workers, ver catalog_cache.py)
+catalog_cache = CatalogCache.from_env()
+
+# Cachés en memoria al día con lo que escriben otros workers o scripts (ver cache_coherence.py)
+change_tracker = ChangeTracker()
+change_tracker.on_change('menu', lambda version, conn: catalog_cache.require(version))
+CHANGE_POLL_INTERVAL = float(os.environ.get('EPICURO_CHANGE_POLL', 1.0))
+
+# Cifras de los dashboards en memoria (ver dashboard_stats.py)
+dashboard_stats = DashboardStats(today=lambda: get_chile_today().isoformat(),
+                                 reconcile_interval=float(os.environ.get('EPICURO_STATS_RECONCILE', 300)))
+dashboard_stats.watch(change_tracker)
+
+# Líneas de órdenes en columnas NumPy para los reportes (ver order_analytics.py)
+order_analytics = OrderAnalytics()
+order_analytics.watch(change_tracker)
+
+# Sub-recetas explotadas en ingredientes por porción, memorizadas (ver bill_of_materials.py)
+recipe_bom = BillOfMaterials()
+recipe_bom.watch(change_tracker)
+
+# Costo de receta por producto para copiarlo en cada línea vendida (ver recipe_costing.py)
+costing_engine = CostingEngine(bom=recipe_bom)
+costing_engine.watch(change_tracker)
+
+# Valor del inventario y costo de ventas por promedio ponderado y FIFO (ver inventory_valuation.py)
+inventory_valuation = InventoryValuation()
+inventory_valuation.watch(change_tracker)
+
+# Recetas × ingredientes para simular cambios de precio (ver cost_simulation.py)
+cost_simulator = CostSimulator(bom=recipe_bom)
+cost_simulator.watch(change_tracker)
+
+def connect_db():
+    """Nueva conexión a la base de datos de la app"""
+    conn = sqlite3.connect(DATABASE, factory=ProfilingConnection, timeout=DB_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    if PREFORK:
+        # En WAL, NORMAL solo sincroniza en los checkpoints y sigue siendo seguro
+        conn.execute('PRAGMA synchronous = NORMAL')
+    metrics.DB_CONNECTIONS_OPEN.inc()
+    metrics.DB_CONNECTIONS_TOTAL.inc()
+    return conn
+
 def get_db():
     """Obtener conexión a la base de datos"""
     if 'db' not in g:
-        g.db = sqlite3.connect(DATABASE)
-        g.db.row_factory = sqlite3.Row
+        if PREFORK:
+            conn = getattr(_thread_db, 'conn', None)
+            if conn is None or _thread_db.path != DATABASE:
+                conn = _thread_db.conn = connect_db()
+                _thread_db.path = DATABASE
+            g.db = conn
+        else:
+            g.db = connect_db()
         g.db.execute("PRAGMA table_info(categories)")
     return g.db
 
+def release_db(db):
+    """Devolver la conexión de la petición (en PREFORK queda abierta para el hilo)"""
+    if PREFORK and db is getattr(_thread_db, 'conn', None):
+        if db.in_transaction:
+            db.rollback()
+        return
+    db.close()
+    metrics.DB_CONNECTIONS_OPEN.dec()
+
+def get_catalog():
+    """Catálogo vigente de categorías, productos y variaciones"""
+    return catalog_cache.get(get_db())
+
+def get_orders():
+    """Repositorio de órdenes sobre la conexión de la petición"""
+    return OrderRepository(get_db())
+
+def get_dashboard_stats():
+    """Cifras de los dashboards, con su hilo de recarga en marcha"""
+    dashboard_stats.start(DATABASE)
+    return dashboard_stats
+
+def get_order_analytics():
+    """Caché columnar de líneas de órdenes, cargada y al día"""
+    order_analytics.refresh(get_db())
+    return order_analytics
+
+def begin_order_write(db):
+    """Tomar el lock de escritura y devolver la versión de 'orders' antes de escribir
+
+    Hasta el commit nadie más confirma: lo que suba la versión desde aquí es
+    de esta transacción (ver DashboardStats.order_saved).
+    """
+    if not db.in_transaction:
+        db.execute('BEGIN IMMEDIATE')
+    return domain_version(db, 'orders')
+
+def order_stats_row(order_id):
+    """Columnas de la orden que usan los contadores del dashboard"""
+    return get_db().execute(f'SELECT {ORDER_COLUMNS} FROM orders WHERE id = ?', (order_id,)).fetchone()
+
+def inventory_written(ingredient_ids=(), purchase_ids=()):
+    """Llevar al dashboard de inventario ingredientes y compras ya confirmados"""
+    db = get_db()
+    for ingredient_id in {int(i) for i in ingredient_ids}:
+        dashboard_stats.ingredient_saved(ingredient_id, db.execute(
+            f'SELECT {INGREDIENT_COLUMNS} FROM ingredients WHERE id = ?', (ingredient_id,)).fetchone())
+    for purchase_id in purchase_ids:
+        dashboard_stats.purchase_saved(purchase_id, db.execute('''
+            SELECT p.*, s.name as supplier_name
+            FROM purchases p
+            LEFT JOIN suppliers s ON p.supplier_id = s.id
+            WHERE p.id = ?
+        ''', (purchase_id,)).fetchone())
+
 def close_db(e=None):
     """Cerrar conexión a la base de datos"""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        release_db(db)
 
 def init_db():
     """Inicializar la base de datos con estructura limpia"""
@@ -146,6 +286,9 @@ def init_db():
     except sqlite3.OperationalError:
         pass  # La columna ya existe
     
+    # Hora de creación como epoch + desfase UTC (ver timestamps.py)
+    add_timestamp_columns(cursor)
+    
     # Tabla de detalles de orden
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS order_items (
@@ -161,6 +304,15 @@ def init_db():
             FOREIGN KEY (product_id) REFERENCES products (id)
         )
     ''')
+    
+    # Copia de las variaciones elegidas en cada línea (ver variation_snapshot.py)
+    snapshot_added = add_snapshot_columns(cursor)
+    
+    # Receta de cada producto y costo de cada línea vendida (ver recipe_costing.py)
+    cost_added = add_cost_columns(cursor)
+
+    # Items marcados como listos en la pantalla de cocina (ver kitchen_display.py)
+    add_bump_column(cursor)
 
     # Tablas de inventario
     cursor.execute('''
@@ -226,6 +378,9 @@ def init_db():
         )
     ''')
 
+    # Líneas que usan otra receta como preparación (ver bill_of_materials.py)
+    add_sub_recipe_column(cursor)
+
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS purchases (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -332,10 +487,64 @@ def init_db():
         )
     ''')
     
+    # Cola de trabajos en segundo plano
+    create_jobs_table(cursor)
+    
+    # Índices para consultas por fecha y por orden
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_item_variations_item ON order_item_variations (order_item_id)')
+    
+    # Las líneas creadas antes de existir la copia la obtienen una sola vez
+    if snapshot_added:
+        backfill_snapshots(cursor)
+    
+    # Fechas de órdenes antiguas o importadas al formato canónico
+    migrate_timestamps(cursor)
+    
+    # Versiones por dominio para invalidar cachés entre procesos
+    create_change_log(cursor)
+    
+    # Costo de cada ingrediente en el tiempo; se llena una sola vez desde las compras
+    if create_cost_history(cursor):
+        backfill_cost_history(cursor)
+    
+    # Las líneas vendidas antes de existir el costo lo obtienen una sola vez
+    if cost_added:
+        recompute_line_costs(cursor)
+    
+    # Resumen de ventas por hora (ver sales_rollup.py); se llena una sola vez al crearse
+    if create_sales_rollup(cursor):
+        sales_rollup.backfill(cursor)
+    
+    # Conteos de productos comprados juntos (ver basket_analysis.py)
+    if create_basket_tables(cursor):
+        basket_analysis.backfill(cursor)
+    
+    # Clasificación de ingeniería de menú por período (la llena el trabajo nocturno)
+    create_menu_engineering_tables(cursor)
+    
     # Solo crear estructuras básicas, sin datos iniciales
     db.commit()
     db.close()
 
+def prepare_production_db():
+    """Dejar la base lista para varios procesos; lo llama una vez el maestro de gunicorn
+
+    WAL permite que los workers lean mientras otro escribe, y queda guardado
+    en el archivo de la base. Los trabajos interrumpidos vuelven a la cola
+    aquí y no en cada worker (que los robaría a otro worker en ejecución).
+    """
+    init_db()
+    db = sqlite3.connect(DATABASE)
+    try:
+        journal_mode = db.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+    finally:
+        db.close()
+    recovered = job_queue.recover_interrupted()
+    return journal_mode, recovered
+
 # ===== FUNCIONES AUXILIARES =====
 
 def get_all_ingredients(active_only=False):
@@ -358,74 +567,34 @@ def get_ingredient_by_id(ingredient_id):
 @app.before_request
 def before_request():
     g.db = get_db()
+    change_tracker.check(g.db)
 
 @app.teardown_appcontext
 def close_db(error):
     """Cerrar conexión a la base de datos"""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        release_db(db)
 
 # ===== RUTAS PRINCIPALES =====
 
 @app.route('/')
 def index():
     """Dashboard principal con estadísticas"""
-    db = get_db()
-    
-    # Estadísticas del día usando fecha local
-    today = get_chile_today()
-    stats = {
-        'orders_today': db.execute(
-            'SELECT COUNT(*) FROM orders WHERE date(created_at) = date(?)', 
-            (today,)
-        ).fetchone()[0],
-        'revenue_today': db.execute(
-            'SELECT COALESCE(SUM(total_amount), 0) FROM orders WHERE date(created_at) = date(?)', 
-            (today,)
-        ).fetchone()[0],
-        'total_orders': db.execute('SELECT COUNT(*) FROM orders').fetchone()[0],
-        'total_products': db.execute('SELECT COUNT(*) FROM products WHERE available = 1').fetchone()[0],
-        'total_categories': db.execute('SELECT COUNT(*) FROM categories WHERE active = 1').fetchone()[0]
-    }
-    
-    # Órdenes recientes
-    recent_orders = db.execute('''
-        SELECT id, order_number, customer_name, total_amount, status, created_at
-        FROM orders 
-        ORDER BY created_at DESC 
-        LIMIT 5
-    ''').fetchall()
+    # Estadísticas del día y órdenes recientes desde memoria
+    stats, recent_orders = get_dashboard_stats().index_stats(get_db())
     
     return render_template('index.html', stats=stats, recent_orders=recent_orders)
 
 @app.route('/orders/new')
 def new_order():
     """Página para crear nueva comanda"""
-    db = get_db()
-    
-    # Obtener categorías activas
-    categories = db.execute('''
-        SELECT * FROM categories 
-        WHERE active = 1 
-        ORDER BY name
-    ''').fetchall()
-    
-    # Obtener productos por categoría con información de categoría
-    products_by_category = {}
-    for category in categories:
-        products = db.execute('''
-            SELECT p.*, c.name as category_name
-            FROM products p
-            JOIN categories c ON p.category_id = c.id
-            WHERE p.category_id = ? AND p.available = 1 
-            ORDER BY p.name
-        ''', (category['id'],)).fetchall()
-        products_by_category[category['id']] = products
+    # Categorías activas y sus productos disponibles desde el catálogo en caché
+    catalog = get_catalog()
     
     return render_template('new_order.html', 
-                         categories=categories, 
-                         products_by_category=products_by_category)
+                         categories=catalog.categories, 
+                         products_by_category=catalog.products_by_category)
 
 @app.route('/orders/create', methods=['POST'])
 def create_order():
@@ -452,6 +621,7 @@ def create_order():
         # Generar número único de orden con timestamp de Chile
         chile_now = get_chile_now()
         order_number = f"ORD-{chile_now.strftime('%Y%m%d%H%M%S')}"
+        created_at, created_epoch, utc_offset = now_parts()
         
         # Calcular totales de la orden
         subtotal = sum(item['quantity'] * item['price'] for item in cart_items)
@@ -459,20 +629,27 @@ def create_order():
         total_amount = subtotal - discount
         
         # Insertar la orden principal en la base de datos
+        base_version = begin_order_write(db)
         cursor = db.cursor()
         cursor.execute('''
             INSERT INTO orders (order_number, customer_name, customer_phone, 
                               subtotal, discount, total_amount, payment_method, 
-                              notes, order_type, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                              notes, order_type, created_at, updated_at,
+                              created_epoch, utc_offset)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (order_number, customer_name, customer_phone, 
               subtotal, discount, total_amount, payment_method, 
-              notes, order_type, get_chile_timestamp()))
+              notes, order_type, created_at, created_at,
+              created_epoch, utc_offset))
         
         order_id = cursor.lastrowid
         
+        # Copia de las variaciones de todos los items (una sola consulta) y costo de receta
+        snapshots = snapshot_cart(db, cart_items)
+        line_costs = costing_engine.cost_cart(db, cart_items)
+        
         # Insertar cada producto del carrito
-        for item in cart_items:
+        for item, (variations_json, variations_display), unit_cost in zip(cart_items, snapshots, line_costs):
             # Datos básicos del producto
             product_id = item.get('id')
             product_name = item.get('name', '')
@@ -484,10 +661,12 @@ def create_order():
             # Insertar el item en order_items
             cursor.execute('''
                 INSERT INTO order_items (order_id, product_id, product_name, 
-                                       quantity, unit_price, total_price, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
+                                       quantity, unit_price, total_price, notes,
+                                       variations_json, variations_display, unit_cost)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (order_id, product_id, product_name, quantity, 
-                  unit_price, total_price, item_notes))
+                  unit_price, total_price, item_notes,
+                  variations_json, variations_display, unit_cost))
             
             # Obtener el ID del item recién insertado
             item_id = cursor.lastrowid
@@ -506,8 +685,25 @@ def create_order():
                             VALUES (?, ?, ?)
                         ''', (item_id, option_id, price_modifier))
         
+        # Resumen por hora y canasta en la misma transacción
+        refresh_hours(db, [order_hour(db, order_id)])
+        update_basket(db, frozenset(), order_basket(db, order_id))
+        
+        # Fila y versión para el dashboard, leídas antes de confirmar
+        stats_row, stats_version = order_stats_row(order_id), domain_version(db, 'orders')
+        
         # Confirmar todas las transacciones
         db.commit()
+        dashboard_stats.order_saved(None, stats_row, stats_version, base_version)
+        order_analytics.sync_order(db, order_id, stats_version, base_version)
+        
+        metrics.ORDERS_CREATED.inc(order_type=order_type)
+        metrics.ORDER_REVENUE.inc(total_amount)
+        metrics.ITEMS_SOLD.inc(sum(item.get('quantity', 1) for item in cart_items))
+        
+        notify_kitchen(order_id)
+        if app.config['AUTO_PRINT_KITCHEN']:
+            auto_print_kitchen_ticket(order_id)
         
         # Mensaje de éxito y redirección
         flash(f'Orden {order_number} creada exitosamente', 'success')
@@ -528,26 +724,11 @@ def create_order():
 @app.route('/orders')
 def list_orders():
     """Lista de todas las órdenes"""
-    db = get_db()
-    
     # Filtros
     status_filter = request.args.get('status', '')
     date_filter = request.args.get('date', '')
     
-    query = 'SELECT * FROM orders WHERE 1=1'
-    params = []
-    
-    if status_filter:
-        query += ' AND status = ?'
-        params.append(status_filter)
-    
-    if date_filter:
-        query += ' AND DATE(created_at) = ?'
-        params.append(date_filter)
-    
-    query += ' ORDER BY created_at DESC'
-    
-    orders = db.execute(query, params).fetchall()
+    orders = get_orders().find(status=status_filter, date=date_filter)
     
     return render_template('orders_list.html', orders=orders, 
                          status_filter=status_filter, date_filter=date_filter)
@@ -555,35 +736,32 @@ def list_orders():
 @app.route('/orders/<int:order_id>')
 def view_order(order_id):
     """Ver detalle de una orden específica"""
-    db = get_db()
-    
-    # Obtener orden
-    order = db.execute('SELECT * FROM orders WHERE id = ?', (order_id,)).fetchone()
+    # Obtener orden con sus items
+    order = get_orders().get(order_id)
     if not order:
         flash('Orden no encontrada', 'error')
         return redirect(url_for('list_orders'))
     
-    # Obtener items de la orden
-    order_items = db.execute('''
-        SELECT * FROM order_items 
-        WHERE order_id = ? 
-        ORDER BY id
-    ''', (order_id,)).fetchall()
-    
-    return render_template('order_detail.html', order=order, order_items=order_items)
+    return render_template('order_detail.html', order=order, order_items=order.items)
 
 @app.route('/orders/<int:order_id>/update_status', methods=['POST'])
 def update_order_status(order_id):
     """Actualizar estado de una orden"""
     db = get_db()
     new_status = request.form.get('status')
+    base_version = begin_order_write(db)
+    previous = order_stats_row(order_id)
     
     db.execute('''
         UPDATE orders 
         SET status = ?, updated_at = ?
         WHERE id = ?
     ''', (new_status, get_chile_timestamp(), order_id))
+    stats_row, stats_version = order_stats_row(order_id), domain_version(db, 'orders')
     db.commit()
+    dashboard_stats.order_saved(previous, stats_row, stats_version, base_version)
+    order_analytics.advance(stats_version, base_version)
+    notify_kitchen(order_id)
     
     flash('Estado actualizado correctamente', 'success')
     return redirect(url_for('view_order', order_id=order_id))
@@ -601,39 +779,21 @@ def edit_order(order_id):
         flash('Orden no encontrada', 'error')
         return redirect(url_for('list_orders'))
     
-    # Obtener items de la orden con variaciones
-    order_items = db.execute('''
-        SELECT oi.*, 
-               GROUP_CONCAT(vo.display_name, ', ') as variations
-        FROM order_items oi
-        LEFT JOIN order_item_variations oiv ON oi.id = oiv.order_item_id
-        LEFT JOIN variation_options vo ON oiv.variation_option_id = vo.id
-        WHERE oi.order_id = ?
-        GROUP BY oi.id
-        ORDER BY oi.id
-    ''', (order_id,)).fetchall()
-    
-    # Obtener categorías y productos para el formulario
-    categories = db.execute('''
-        SELECT * FROM categories 
-        WHERE active = 1 
-        ORDER BY name
-    ''').fetchall()
+    # Obtener items de la orden con la lista de variaciones copiada
+    order_items = []
+    for row in db.execute('SELECT * FROM order_items WHERE order_id = ? ORDER BY id', (order_id,)).fetchall():
+        item = dict(row)
+        item['variations'] = decode_snapshot(row['variations_json'])
+        order_items.append(item)
     
-    products_by_category = {}
-    for category in categories:
-        products = db.execute('''
-            SELECT * FROM products 
-            WHERE category_id = ? AND available = 1 
-            ORDER BY name
-        ''', (category['id'],)).fetchall()
-        products_by_category[category['id']] = products
+    # Categorías y productos para el formulario desde el catálogo en caché
+    catalog = get_catalog()
     
     return render_template('edit_order.html', 
                          order=order, 
                          order_items=order_items,
-                         categories=categories, 
-                         products_by_category=products_by_category)
+                         categories=catalog.categories, 
+                         products_by_category=catalog.products_by_category)
 
 @app.route('/orders/<int:order_id>/update', methods=['POST'])
 def update_order(order_id):
@@ -642,11 +802,15 @@ def update_order(order_id):
         db = get_db()
         
         # Verificar que la orden existe
+        base_version = begin_order_write(db)
         order = db.execute('SELECT * FROM orders WHERE id = ?', (order_id,)).fetchone()
         if not order:
+            db.rollback()
             flash('Orden no encontrada', 'error')
             return redirect(url_for('list_orders'))
         
+        basket = order_basket(db, order_id)
+        
         # Datos de la orden
         customer_name = request.form.get('customer_name', '')
         customer_phone = request.form.get('customer_phone', '')
@@ -658,6 +822,7 @@ def update_order(order_id):
         cart_items = json.loads(request.form.get('cart_items', '[]'))
         
         if not cart_items:
+            db.rollback()
             flash('Debe haber al menos un producto en la orden', 'error')
             return redirect(url_for('edit_order', order_id=order_id))
         
@@ -675,6 +840,16 @@ def update_order(order_id):
         ''', (customer_name, customer_phone, payment_method, notes, status, 
               subtotal, total_amount, get_chile_timestamp(), order_id))
         
+        # Costo registrado de las líneas actuales: se conserva en las que no cambian
+        recorded_costs = recorded_line_costs(db, order_id)
+        
+        # Items ya listos en cocina: siguen listos si quedan en la orden
+        bumped = dict(db.execute('''
+            SELECT product_name || '|' || quantity, MIN(bumped_at) FROM order_items
+            WHERE order_id = ? AND bumped_at IS NOT NULL
+            GROUP BY product_name, quantity
+        ''', (order_id,)).fetchall())
+        
         # Eliminar items existentes y sus variaciones
         existing_items = db.execute('SELECT id FROM order_items WHERE order_id = ?', (order_id,)).fetchall()
         for item in existing_items:
@@ -683,25 +858,36 @@ def update_order(order_id):
         
         # Insertar nuevos items
         cursor = db.cursor()
-        for item in cart_items:
+        snapshots = snapshot_cart(db, cart_items)
+        line_costs = costing_engine.cost_edited_cart(db, cart_items, recorded_costs)
+        for item, (variations_json, variations_display), unit_cost in zip(cart_items, snapshots, line_costs):
             cursor.execute('''
                 INSERT INTO order_items (order_id, product_id, product_name, 
-                                       quantity, unit_price, total_price, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
+                                       quantity, unit_price, total_price, notes,
+                                       variations_json, variations_display, unit_cost, bumped_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (order_id, item['id'], item['name'], item['quantity'], 
-                  item['price'], item['quantity'] * item['price'], item.get('notes', '')))
+                  item['price'], item['quantity'] * item['price'], item.get('notes', ''),
+                  variations_json, variations_display, unit_cost,
+                  bumped.get(f"{item['name']}|{item['quantity']}")))
             
             item_id = cursor.lastrowid
             
             # Insertar variaciones si las hay
-            if 'variations' in item:
+            if item.get('variations'):
                 for variation in item['variations']:
                     cursor.execute('''
                         INSERT INTO order_item_variations (order_item_id, variation_option_id, price_modifier)
                         VALUES (?, ?, ?)
                     ''', (item_id, variation['option_id'], variation['price_modifier']))
         
+        refresh_hours(db, [order_hour(db, order_id)])
+        update_basket(db, basket, order_basket(db, order_id))
+        stats_row, stats_version = order_stats_row(order_id), domain_version(db, 'orders')
         db.commit()
+        dashboard_stats.order_saved(order, stats_row, stats_version, base_version)
+        order_analytics.sync_order(db, order_id, stats_version, base_version)
+        notify_kitchen(order_id)
         flash('Orden actualizada exitosamente', 'success')
         return redirect(url_for('view_order', order_id=order_id))
         
@@ -717,10 +903,13 @@ def delete_order(order_id):
         db = get_db()
         
         # Verificar que la orden existe
-        order = db.execute('SELECT order_number FROM orders WHERE id = ?', (order_id,)).fetchone()
+        base_version = begin_order_write(db)
+        order = order_stats_row(order_id)
         if not order:
+            db.rollback()
             flash('Orden no encontrada', 'error')
             return redirect(url_for('list_orders'))
+        hour, basket = order_hour(db, order_id), order_basket(db, order_id)
         
         # Eliminar variaciones de items
         db.execute('''
@@ -735,8 +924,14 @@ def delete_order(order_id):
         
         # Eliminar la orden
         db.execute('DELETE FROM orders WHERE id = ?', (order_id,))
+        refresh_hours(db, [hour])
+        update_basket(db, basket, frozenset())
         
+        stats_version = domain_version(db, 'orders')
         db.commit()
+        dashboard_stats.order_saved(order, None, stats_version, base_version)
+        order_analytics.sync_order(db, order_id, stats_version, base_version)
+        kitchen_board.remove_order(order_id)
         flash(f'Orden {order["order_number"]} eliminada exitosamente', 'success')
         return redirect(url_for('list_orders'))
         
@@ -748,49 +943,166 @@ def delete_order(order_id):
 @app.route('/orders/<int:order_id>/print')
 def print_order(order_id):
     """Generar impresión térmica de la orden"""
-    db = get_db()
-    
-    # Obtener orden
-    order = db.execute('SELECT * FROM orders WHERE id = ?', (order_id,)).fetchone()
+    # Obtener orden con sus items
+    order = get_orders().get(order_id)
     if not order:
         flash('Orden no encontrada', 'error')
         return redirect(url_for('list_orders'))
     
-    # Obtener items con variaciones
-    order_items = db.execute('''
-        SELECT oi.*, 
-               GROUP_CONCAT(vo.display_name, ', ') as variations
-        FROM order_items oi
-        LEFT JOIN order_item_variations oiv ON oi.id = oiv.order_item_id
-        LEFT JOIN variation_options vo ON oiv.variation_option_id = vo.id
-        WHERE oi.order_id = ?
-        GROUP BY oi.id
-        ORDER BY oi.id
-    ''', (order_id,)).fetchall()
-    
     # Generar contenido para impresión térmica
-    return render_template('print_order.html', order=order, order_items=order_items)
+    return render_template('print_order.html', order=order, order_items=order.items)
+
+# ===== PANTALLA DE COCINA =====
+
+def get_kitchen_board():
+    """Tablero de cocina, cargado desde la base de datos la primera vez"""
+    if not kitchen_board.loaded:
+        kitchen_board.load(get_db())
+        # El stream SSE no espera peticiones: revisar cambios de otros procesos en segundo plano
+        change_tracker.start_polling(DATABASE, CHANGE_POLL_INTERVAL)
+    return kitchen_board
+
+@change_tracker.on_change('orders')
+def kitchen_orders_changed(version, conn):
+    """Órdenes escritas fuera de este proceso (u omitidas por notify_kitchen)"""
+    if kitchen_board.loaded:
+        kitchen_board.reconcile(conn)
+
+def notify_kitchen(order_id):
+    """Propagar a la pantalla de cocina los cambios ya confirmados de una orden"""
+    if not kitchen_board.loaded:
+        return
+    try:
+        kitchen_board.sync_order(get_db(), order_id)
+    except Exception as e:
+        print(f"Error actualizando pantalla de cocina: {e}")
+
+@app.route('/kitchen')
+def kitchen_display():
+    """Pantalla de cocina por estación"""
+    station = request.args.get('station', '')
+    if station and station not in STATIONS:
+        flash('Estación no encontrada', 'error')
+        return redirect(url_for('kitchen_display'))
+    
+    return render_template('kitchen_display.html', station=station,
+                           stations=STATIONS, station_labels=STATION_LABELS)
+
+@app.route('/api/kitchen/board')
+def api_kitchen_board():
+    """API con el estado actual del tablero de cocina"""
+    return jsonify(get_kitchen_board().snapshot(request.args.get('station') or None))
+
+@app.route('/api/kitchen/stream')
+def api_kitchen_stream():
+    """Eventos incrementales del tablero (Server-Sent Events)"""
+    board = get_kitchen_board()
+    since = request.args.get('since', board.version, type=int)
+    station = request.args.get('station') or None
+    
+    def events():
+        version = since
+        while True:
+            pending = board.wait_for_events(version)
+            if not pending:
+                # Comentario SSE para mantener viva la conexión
+                yield ': keepalive\n\n'
+                continue
+            for event in pending:
+                version = event['version']
+                if event['type'] == 'order':
+                    event = dict(event, order=filter_station(event['order'], station))
+                yield f"id: {version}\ndata: {json.dumps(event)}\n\n"
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/kitchen/orders/<int:order_id>/bump', methods=['POST'])
+def api_kitchen_bump_order(order_id):
+    """Avanzar el estado de una orden desde cocina (pendiente → preparando → lista)"""
+    db = get_db()
+    base_version = begin_order_write(db)
+    order = order_stats_row(order_id)
+    if not order:
+        db.rollback()
+        return jsonify({'success': False, 'error': 'Orden no encontrada'}), 404
+    
+    new_status = NEXT_STATUS.get(order['status'])
+    if not new_status:
+        db.rollback()
+        return jsonify({'success': False, 'error': f"La orden ya está '{order['status']}'"}), 409
+    
+    updated_at = get_chile_timestamp()
+    db.execute('UPDATE orders SET status = ?, updated_at = ? WHERE id = ?',
+               (new_status, updated_at, order_id))
+    stats_row, stats_version = order_stats_row(order_id), domain_version(db, 'orders')
+    db.commit()
+    dashboard_stats.order_saved(order, stats_row, stats_version, base_version)
+    order_analytics.advance(stats_version, base_version)
+    get_kitchen_board().set_status(order_id, new_status, updated_at)
+    
+    return jsonify({'success': True, 'order_id': order_id, 'status': new_status})
+
+@app.route('/api/kitchen/orders/<int:order_id>/items/<int:item_id>/bump', methods=['POST'])
+def api_kitchen_bump_item(order_id, item_id):
+    """Marcar (o desmarcar) un item como listo en la pantalla de cocina"""
+    db = get_db()
+    base_version = begin_order_write(db)
+    placeholders = ','.join('?' * len(ACTIVE_STATUSES))
+    item = db.execute(f'''
+        SELECT oi.bumped_at FROM order_items oi
+        JOIN orders o ON oi.order_id = o.id
+        WHERE oi.id = ? AND oi.order_id = ? AND o.status IN ({placeholders})
+    ''', (item_id, order_id, *ACTIVE_STATUSES)).fetchone()
+    if item is None:
+        db.rollback()
+        return jsonify({'success': False, 'error': 'Item no encontrado en cocina'}), 404
+    
+    bumped_at = None if item['bumped_at'] else get_chile_timestamp()
+    db.execute('UPDATE order_items SET bumped_at = ? WHERE id = ?', (bumped_at, item_id))
+    order, stats_version = order_stats_row(order_id), domain_version(db, 'orders')
+    db.commit()
+    dashboard_stats.order_saved(order, order, stats_version, base_version)
+    order_analytics.advance(stats_version, base_version)
+    get_kitchen_board().sync_order(db, order_id)
+    
+    return jsonify({'success': True, 'item_id': item_id, 'done': bumped_at is not None})
 
 def auto_print_kitchen_ticket(order_id):
-    """Impresión automática para cocina al crear orden"""
+    """Impresión automática para cocina al crear orden (se encola con prioridad máxima)"""
     try:
-        import webbrowser
-        import threading
-        from urllib.parse import urljoin
-        from flask import request
-        
-        def print_async():
-            # Usar la URL base de tu aplicación
-            base_url = request.url_root if request else 'http://localhost:5000/'
-            print_url = urljoin(base_url, f'kitchen-ticket/{order_id}')
-            webbrowser.open(print_url)
-        
-        # Ejecutar en hilo separado
-        threading.Thread(target=print_async, daemon=True).start()
-        
+        return job_queue.enqueue('print_ticket', {'order_id': order_id, 'kind': 'kitchen', 'printer': 'kitchen'})
     except Exception as e:
         print(f"Error en impresión automática: {e}")
 
+# ===== PERFIL DE RUTAS =====
+
+@app.route('/debug/profile')
+def debug_profile():
+    """Tiempo y consultas SQL agregados por endpoint"""
+    if not sql_profiler.allows(request):
+        abort(404)
+    stats = sql_profiler.stats()
+    if request.args.get('format') == 'json':
+        return jsonify({'enabled': sql_profiler.enabled, 'slow_ms': sql_profiler.slow_ms, 'endpoints': stats})
+    
+    return render_template('debug_profile.html', stats=stats,
+                           enabled=sql_profiler.enabled, slow_ms=sql_profiler.slow_ms)
+
+@app.route('/debug/profile/reset', methods=['POST'])
+def debug_profile_reset():
+    """Reiniciar los agregados del perfil"""
+    if not sql_profiler.allows(request):
+        abort(404)
+    sql_profiler.reset()
+    flash('Perfil reiniciado', 'success')
+    return redirect(url_for('debug_profile', token=request.args.get('token')))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Métricas del proceso en formato de texto de Prometheus"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 # ===== GESTIÓN DE PRODUCTOS =====
 
 @app.route('/products')
@@ -798,21 +1110,26 @@ def list_products():
     """Lista de productos"""
     db = get_db()
     
+    # Clase de ingeniería de menú del período nocturno (ver menu_engineering.py)
     products = db.execute('''
-        SELECT p.*, c.name as category_name, c.color as category_color
+        SELECT p.*, c.name as category_name, c.color as category_color, m.class as menu_class
         FROM products p
         LEFT JOIN categories c ON p.category_id = c.id
+        LEFT JOIN menu_engineering m ON m.product_id = p.id
+            AND m.period_id = (SELECT id FROM menu_engineering_periods WHERE nightly = 1)
         ORDER BY c.name, p.name
     ''').fetchall()
     
-    return render_template('products_list.html', products=products)
+    return render_template('products_list.html', products=products,
+                           menu_labels=menu_engineering.CLASS_LABELS)
 
 @app.route('/products/new')
 def new_product():
     """Formulario para nuevo producto"""
     db = get_db()
     categories = db.execute('SELECT * FROM categories WHERE active = 1 ORDER BY name').fetchall()
-    return render_template('product_form.html', categories=categories)
+    recipes = db.execute('SELECT id, name FROM recipes WHERE active = 1 ORDER BY name').fetchall()
+    return render_template('product_form.html', categories=categories, recipes=recipes)
 
 @app.route('/products/create', methods=['POST'])
 def create_product():
@@ -825,12 +1142,13 @@ def create_product():
         description = request.form.get('description', '')
         price = float(request.form.get('price'))
         category_id = request.form.get('category_id')
+        recipe_id = request.form.get('recipe_id') or None
         
         # Insertar producto
         cursor.execute('''
-            INSERT INTO products (name, description, price, category_id)
-            VALUES (?, ?, ?, ?)
-        ''', (name, description, price, category_id))
+            INSERT INTO products (name, description, price, category_id, recipe_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (name, description, price, category_id, recipe_id))
         
         product_id = cursor.lastrowid
         
@@ -860,7 +1178,8 @@ def edit_product(product_id):
         return redirect(url_for('list_products'))
     
     categories = db.execute('SELECT * FROM categories WHERE active = 1 ORDER BY name').fetchall()
-    return render_template('product_form.html', product=product, categories=categories)
+    recipes = db.execute('SELECT id, name FROM recipes WHERE active = 1 ORDER BY name').fetchall()
+    return render_template('product_form.html', product=product, categories=categories, recipes=recipes)
 
 @app.route('/products/<int:product_id>/update', methods=['POST'])
 def update_product(product_id):
@@ -872,13 +1191,14 @@ def update_product(product_id):
         description = request.form.get('description', '')
         price = float(request.form.get('price'))
         category_id = request.form.get('category_id')
+        recipe_id = request.form.get('recipe_id') or None
         available = 1 if request.form.get('available') else 0
         
         db.execute('''
             UPDATE products 
-            SET name = ?, description = ?, price = ?, category_id = ?, available = ?
+            SET name = ?, description = ?, price = ?, category_id = ?, recipe_id = ?, available = ?
             WHERE id = ?
-        ''', (name, description, price, category_id, available, product_id))
+        ''', (name, description, price, category_id, recipe_id, available, product_id))
          # Manejar variaciones
         variation_groups = request.form.getlist('variation_groups[]')
         required_groups = request.form.getlist('required_groups[]')
@@ -1027,75 +1347,59 @@ def api_categories():
 
 # ===== REPORTES =====
 
+# Semanas del mapa de calor día × hora
+HEATMAP_WEEKS = 12
+
+def sales_stats(analytics, today):
+    """Ventas del día, de los últimos 7 y de los últimos 30 días"""
+    tomorrow = today + datetime.timedelta(days=1)
+    return {
+        'today_sales': analytics.totals(today, tomorrow)['sales'],
+        'week_sales': analytics.totals(today - datetime.timedelta(days=7))['sales'],
+        'month_sales': analytics.totals(today - datetime.timedelta(days=30))['sales'],
+    }
+
+def top_products_report(analytics, start, limit=10):
+    """Productos más vendidos desde start, con las columnas de los reportes"""
+    return [
+        {'product_name': group['key'], 'total_quantity': group['quantity'], 'total_revenue': group['revenue']}
+        for group in analytics.top_n('product_name', limit, start)
+    ]
+
 @app.route('/reports')
 def reports():
     """Página de reportes"""
     db = get_db()
+    analytics = get_order_analytics()
     
     # Estadísticas para los últimos 7 días usando fechas locales
     today = get_chile_today()
     week_ago = today - datetime.timedelta(days=7)
     
     # Ventas reales de los últimos 7 días
-    stats = {
-        'today_sales': db.execute(
-            'SELECT COALESCE(SUM(total_amount), 0) FROM orders WHERE DATE(created_at) = ?',
-            (today,)
-        ).fetchone()[0],
-        'week_sales': db.execute(
-            'SELECT COALESCE(SUM(total_amount), 0) FROM orders WHERE DATE(created_at) >= ?',
-            (week_ago,)
-        ).fetchone()[0],
-        'month_sales': db.execute(
-            'SELECT COALESCE(SUM(total_amount), 0) FROM orders WHERE DATE(created_at) >= ?',
-            (today - datetime.timedelta(days=30),)
-        ).fetchone()[0],
-        'total_orders': db.execute(
-            'SELECT COUNT(*) FROM orders WHERE DATE(created_at) >= ?',
-            (week_ago,)
-        ).fetchone()[0]
-    }
+    stats = sales_stats(analytics, today)
+    stats['total_orders'] = analytics.totals(week_ago)['orders']
     
     # Productos más vendidos (últimos 7 días)
-    top_products_raw = db.execute('''
-        SELECT oi.product_name, SUM(oi.quantity) as total_quantity, SUM(oi.total_price) as total_revenue
-        FROM order_items oi
-        JOIN orders o ON oi.order_id = o.id
-        WHERE DATE(o.created_at) >= ?
-        GROUP BY oi.product_name
-        ORDER BY total_quantity DESC
-        LIMIT 10
-    ''', (week_ago,)).fetchall()
-
-    # Convertir a diccionarios y manejar caso sin datos
-    top_products = [dict(row) for row in top_products_raw] if top_products_raw else []
+    top_products = top_products_report(analytics, week_ago)
     
     # Ventas por categoría (últimos 7 días)
-    category_sales = db.execute('''
-        SELECT c.name as category_name, c.color, COALESCE(SUM(oi.total_price), 0) as total_sales
-        FROM categories c
-        LEFT JOIN products p ON c.id = p.category_id
-        LEFT JOIN order_items oi ON p.id = oi.product_id
-        LEFT JOIN orders o ON oi.order_id = o.id AND DATE(o.created_at) >= ?
-        WHERE c.active = 1
-        GROUP BY c.id, c.name, c.color
-        ORDER BY total_sales DESC
-    ''', (week_ago,)).fetchall()
-    
-    # Ventas por hora (últimos 7 días)
-    hourly_sales = db.execute('''
-        SELECT strftime('%H', created_at) as hour, COUNT(*) as order_count
-        FROM orders 
-        WHERE DATE(created_at) >= ?
-        GROUP BY strftime('%H', created_at)
-        ORDER BY hour
-    ''', (week_ago,)).fetchall()
+    category_sales = CategorySales(analytics).report(get_catalog().categories, week_ago)
+    
+    # Ventas por hora (últimos 7 días) y mapa de calor día × hora desde sales_hourly
+    tomorrow = today + datetime.timedelta(days=1)
+    hourly_sales = sales_rollup.hourly_sales(db, week_ago, tomorrow)
+    heatmap = sales_rollup.heatmap(db, tomorrow - datetime.timedelta(weeks=HEATMAP_WEEKS), tomorrow)
     
     return render_template('reports.html', 
                          stats=stats, 
                          top_products=top_products,
-                         category_sales=[dict(row) for row in category_sales],
-                         hourly_sales=[dict(row) for row in hourly_sales])
+                         category_sales=category_sales,
+                         hourly_sales=hourly_sales,
+                         heatmap=heatmap,
+                         heatmap_hours=[hour for hour in heatmap['hours'] if any(row[hour] for row in heatmap['totals'])],
+                         heatmap_max=max(max(row) for row in heatmap['averages']),
+                         heatmap_weeks=HEATMAP_WEEKS)
 
 # ===== RUTAS DEL SISTEMA DE INVENTARIO =====
 
@@ -1144,11 +1448,14 @@ def create_ingredient():
         unit_cost = float(request.form.get('unit_cost', 0))
         supplier_id = request.form.get('supplier_id') or None
         
-        db.execute('''
+        cursor = db.execute('''
             INSERT INTO ingredients (name, description, unit, min_stock, max_stock, unit_cost, preferred_supplier_id)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (name, description, unit, min_stock, max_stock, unit_cost, supplier_id))
+        if unit_cost:
+            record_cost(db, cursor.lastrowid, unit_cost, get_chile_timestamp(), 'manual')
         db.commit()
+        inventory_written(ingredient_ids=[cursor.lastrowid])
         
         flash('Ingrediente creado exitosamente', 'success')
         return redirect(url_for('list_ingredients'))
@@ -1185,13 +1492,18 @@ def update_ingredient(ingredient_id):
         supplier_id = request.form.get('supplier_id') or None
         active = 1 if request.form.get('active') else 0
         
+        previous = db.execute('SELECT unit_cost FROM ingredients WHERE id = ?', (ingredient_id,)).fetchone()
+        updated_at = get_chile_timestamp()
         db.execute('''
             UPDATE ingredients 
             SET name = ?, description = ?, unit = ?, min_stock = ?, max_stock = ?, 
                 unit_cost = ?, preferred_supplier_id = ?, active = ?, updated_at = ?
             WHERE id = ?
-        ''', (name, description, unit, min_stock, max_stock, unit_cost, supplier_id, active, get_chile_timestamp(), ingredient_id))
+        ''', (name, description, unit, min_stock, max_stock, unit_cost, supplier_id, active, updated_at, ingredient_id))
+        if previous is not None and previous['unit_cost'] != unit_cost:
+            record_cost(db, ingredient_id, unit_cost, updated_at, 'manual')
         db.commit()
+        inventory_written(ingredient_ids=[ingredient_id])
         
         flash('Ingrediente actualizado exitosamente', 'success')
         return redirect(url_for('list_ingredients'))
@@ -1237,6 +1549,7 @@ def adjust_ingredient_stock():
         ''', (ingredient_id, movement_type, adjustment, current['unit_cost'], notes, get_chile_timestamp()))
         
         db.commit()
+        inventory_written(ingredient_ids=[ingredient_id])
         flash('Stock ajustado correctamente', 'success')
         
     except Exception as e:
@@ -1336,6 +1649,45 @@ def update_supplier(supplier_id):
 # GESTIÓN DE RECETAS - RUTAS ACTUALIZADAS PARA SQLITE
 # ============================================================================
 
+def current_unit_costs(db):
+    """{ingredient_id: costo unitario actual}"""
+    return dict(db.execute('SELECT id, COALESCE(unit_cost, 0) FROM ingredients').fetchall())
+
+def recipe_cost_per_serving(db, recipe_id, unit_costs):
+    """Costo por porción con las sub-recetas explotadas; 0 si la receta tiene un ciclo"""
+    try:
+        ingredient_ids, quantities = recipe_bom.vector(db, recipe_id)
+    except CycleError:
+        return 0
+    return sum(quantity * unit_costs.get(ingredient_id, 0)
+               for ingredient_id, quantity in zip(ingredient_ids.tolist(), quantities.tolist()))
+
+def recipe_sub_recipes(db, recipe_id, unit_costs):
+    """Sub-recetas directas de una receta con el costo de las porciones que usa"""
+    lines = []
+    for row in db.execute('''
+        SELECT ri.id, ri.sub_recipe_id, ri.quantity, r.name as sub_recipe_name, r.servings as sub_recipe_servings
+        FROM recipe_ingredients ri
+        JOIN recipes r ON ri.sub_recipe_id = r.id
+        WHERE ri.recipe_id = ?
+        ORDER BY r.name
+    ''', (recipe_id,)).fetchall():
+        line = dict(row)
+        line['cost_per_serving'] = recipe_cost_per_serving(db, row['sub_recipe_id'], unit_costs)
+        line['cost'] = line['quantity'] * line['cost_per_serving']
+        lines.append(line)
+    return lines
+
+def sub_recipe_form_lines(db, recipe_id=None):
+    """[(sub_recipe_id, porciones)] del formulario; lanza ValueError si alguna no existe o forma un ciclo"""
+    lines = []
+    for sub_recipe_id, portions in zip(request.form.getlist('sub_recipe_id[]'), request.form.getlist('sub_quantity[]')):
+        if sub_recipe_id and portions:
+            lines.append((int(sub_recipe_id), float(portions)))
+    names = dict(db.execute('SELECT id, name FROM recipes').fetchall())
+    recipe_bom.check_components(db, recipe_id, [sub_recipe_id for sub_recipe_id, _ in lines], names)
+    return lines
+
 @app.route('/inventory/recipes')
 def list_recipes():
     """Lista de recetas"""
@@ -1344,22 +1696,20 @@ def list_recipes():
     recipes = db.execute('''
         SELECT r.*,
                COUNT(ri.ingredient_id) as ingredient_count,
-               COALESCE(SUM(ri.quantity * i.unit_cost), 0) as estimated_cost
+               COUNT(ri.sub_recipe_id) as sub_recipe_count
         FROM recipes r
         LEFT JOIN recipe_ingredients ri ON r.id = ri.recipe_id
-        LEFT JOIN ingredients i ON ri.ingredient_id = i.id
         GROUP BY r.id
         ORDER BY r.name
     ''').fetchall()
     
-    # Calcular costo por porción para cada receta
+    # Calcular costo por porción para cada receta, con sus sub-recetas explotadas
+    unit_costs = current_unit_costs(db)
     recipes_with_cost = []
     for recipe in recipes:
         recipe_dict = dict(recipe)
-        if recipe['estimated_cost'] and recipe['servings']:
-            recipe_dict['cost_per_serving'] = recipe['estimated_cost'] / recipe['servings']
-        else:
-            recipe_dict['cost_per_serving'] = 0
+        recipe_dict['cost_per_serving'] = recipe_cost_per_serving(db, recipe['id'], unit_costs)
+        recipe_dict['estimated_cost'] = recipe_dict['cost_per_serving'] * (recipe['servings'] or 1)
         recipes_with_cost.append(recipe_dict)
     
     return render_template('inventory/recipes_list.html', recipes=recipes_with_cost)
@@ -1370,9 +1720,11 @@ def new_recipe():
     try:
         # Obtener todos los ingredientes activos para el formulario
         ingredients = get_all_ingredients(active_only=True)
+        sub_recipes = get_db().execute('SELECT id, name FROM recipes WHERE active = 1 ORDER BY name').fetchall()
         return render_template('inventory/recipe_form.html', 
                              recipe=None, 
-                             ingredients=ingredients)
+                             ingredients=ingredients,
+                             sub_recipes=sub_recipes)
     except Exception as e:
         flash(f'Error al cargar formulario de receta: {str(e)}', 'error')
         return redirect(url_for('list_recipes'))
@@ -1402,6 +1754,13 @@ def create_recipe():
             flash('El número de porciones debe ser mayor a 0', 'error')
             return redirect(url_for('new_recipe'))
         
+        # Sub-recetas (preparaciones) que usa, en porciones de cada una
+        try:
+            sub_recipe_lines = sub_recipe_form_lines(db)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('new_recipe'))
+        
         # Convertir tiempos a enteros si están presentes
         prep_time = int(prep_time) if prep_time else None
         cook_time = int(cook_time) if cook_time else None
@@ -1431,6 +1790,12 @@ def create_recipe():
                     VALUES (?, ?, ?, ?)
                 ''', (recipe_id, ingredient_id, quantity, unit))
         
+        for sub_recipe_id, portions in sub_recipe_lines:
+            cursor.execute('''
+                INSERT INTO recipe_ingredients (recipe_id, sub_recipe_id, quantity, unit)
+                VALUES (?, ?, ?, 'porciones')
+            ''', (recipe_id, sub_recipe_id, portions))
+        
         db.commit()
         
         flash('Receta creada exitosamente', 'success')
@@ -1450,11 +1815,9 @@ def view_recipe(recipe_id):
         # Obtener datos de la receta
         recipe = db.execute('''
             SELECT r.*, 
-                   COUNT(ri.ingredient_id) as ingredient_count,
-                   COALESCE(SUM(ri.quantity * i.unit_cost), 0) as estimated_cost
+                   COUNT(ri.ingredient_id) as ingredient_count
             FROM recipes r
             LEFT JOIN recipe_ingredients ri ON r.id = ri.recipe_id
-            LEFT JOIN ingredients i ON ri.ingredient_id = i.id
             WHERE r.id = ?
             GROUP BY r.id
         ''', (recipe_id,)).fetchone()
@@ -1463,12 +1826,11 @@ def view_recipe(recipe_id):
             flash('Receta no encontrada', 'error')
             return redirect(url_for('list_recipes'))
         
-        # Convertir a diccionario y calcular costo por porción
+        # Convertir a diccionario y calcular costo por porción con las sub-recetas explotadas
+        unit_costs = current_unit_costs(db)
         recipe_dict = dict(recipe)
-        if recipe['estimated_cost'] and recipe['servings']:
-            recipe_dict['cost_per_serving'] = recipe['estimated_cost'] / recipe['servings']
-        else:
-            recipe_dict['cost_per_serving'] = 0
+        recipe_dict['cost_per_serving'] = recipe_cost_per_serving(db, recipe_id, unit_costs)
+        recipe_dict['estimated_cost'] = recipe_dict['cost_per_serving'] * (recipe['servings'] or 1)
         
         # Obtener ingredientes de la receta
         recipe_ingredients = db.execute('''
@@ -1482,7 +1844,8 @@ def view_recipe(recipe_id):
         
         return render_template('inventory/recipe_view.html', 
                              recipe=recipe_dict, 
-                             recipe_ingredients=recipe_ingredients)
+                             recipe_ingredients=recipe_ingredients,
+                             recipe_sub_recipes=recipe_sub_recipes(db, recipe_id, unit_costs))
         
     except Exception as e:
         flash(f'Error al cargar receta: {str(e)}', 'error')
@@ -1513,10 +1876,22 @@ def edit_recipe(recipe_id):
         # Obtener todos los ingredientes disponibles
         ingredients = get_all_ingredients(active_only=True)
         
+        # Sub-recetas que usa y las que puede usar (no ella misma)
+        sub_recipe_lines = db.execute('''
+            SELECT ri.sub_recipe_id, ri.quantity
+            FROM recipe_ingredients ri
+            WHERE ri.recipe_id = ? AND ri.sub_recipe_id IS NOT NULL
+            ORDER BY ri.id
+        ''', (recipe_id,)).fetchall()
+        sub_recipes = db.execute('SELECT id, name FROM recipes WHERE active = 1 AND id != ? ORDER BY name',
+                                 (recipe_id,)).fetchall()
+        
         return render_template('inventory/recipe_form.html', 
                              recipe=recipe, 
                              recipe_ingredients=recipe_ingredients,
-                             ingredients=ingredients)
+                             ingredients=ingredients,
+                             sub_recipe_lines=sub_recipe_lines,
+                             sub_recipes=sub_recipes)
         
     except Exception as e:
         flash(f'Error al cargar receta: {str(e)}', 'error')
@@ -1553,6 +1928,13 @@ def update_recipe(recipe_id):
             flash('El número de porciones debe ser mayor a 0', 'error')
             return redirect(url_for('edit_recipe', recipe_id=recipe_id))
         
+        # Sub-recetas: ninguna puede usar, directa o indirectamente, esta receta
+        try:
+            sub_recipe_lines = sub_recipe_form_lines(db, recipe_id)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('edit_recipe', recipe_id=recipe_id))
+        
         # Convertir tiempos a enteros si están presentes
         prep_time = int(prep_time) if prep_time else None
         cook_time = int(cook_time) if cook_time else None
@@ -1583,6 +1965,12 @@ def update_recipe(recipe_id):
                     VALUES (?, ?, ?, ?)
                 ''', (recipe_id, ingredient_id, quantity, unit))
         
+        for sub_recipe_id, portions in sub_recipe_lines:
+            db.execute('''
+                INSERT INTO recipe_ingredients (recipe_id, sub_recipe_id, quantity, unit)
+                VALUES (?, ?, ?, 'porciones')
+            ''', (recipe_id, sub_recipe_id, portions))
+        
         db.commit()
         
         flash('Receta actualizada exitosamente', 'success')
@@ -1606,6 +1994,13 @@ def delete_recipe(recipe_id):
             flash('Receta no encontrada', 'error')
             return redirect(url_for('list_recipes'))
         
+        # Una receta usada como sub-receta no se puede eliminar
+        used_by = db.execute("SELECT COUNT(DISTINCT recipe_id) FROM recipe_ingredients WHERE sub_recipe_id = ?",
+                             (recipe_id,)).fetchone()[0]
+        if used_by:
+            flash(f'La receta "{recipe[0]}" se usa como sub-receta en {used_by} receta(s)', 'error')
+            return redirect(url_for('view_recipe', recipe_id=recipe_id))
+        
         # Eliminar ingredientes de la receta
         db.execute("DELETE FROM recipe_ingredients WHERE recipe_id = ?", (recipe_id,))
         
@@ -1647,7 +2042,10 @@ def api_calculate_recipe_cost(recipe_id):
             WHERE ri.recipe_id = ?
         ''', (recipe_id,)).fetchall()
         
-        total_cost = sum(ingredient['cost'] or 0 for ingredient in ingredients)
+        sub_recipes = recipe_sub_recipes(db, recipe_id, current_unit_costs(db))
+        
+        total_cost = (sum(ingredient['cost'] or 0 for ingredient in ingredients)
+                      + sum(sub_recipe['cost'] for sub_recipe in sub_recipes))
         cost_per_serving = total_cost / recipe['servings'] if recipe['servings'] > 0 else 0
         
         ingredients_cost = [
@@ -1658,6 +2056,14 @@ def api_calculate_recipe_cost(recipe_id):
                 'cost': ing['cost'] or 0
             }
             for ing in ingredients
+        ] + [
+            {
+                'name': sub_recipe['sub_recipe_name'],
+                'quantity': sub_recipe['quantity'],
+                'unit': 'porciones',
+                'cost': sub_recipe['cost']
+            }
+            for sub_recipe in sub_recipes
         ]
         
         return jsonify({
@@ -1698,8 +2104,8 @@ def api_duplicate_recipe(recipe_id):
         
         # Copiar ingredientes de la receta
         db.execute('''
-            INSERT INTO recipe_ingredients (recipe_id, ingredient_id, quantity, unit)
-            SELECT ?, ingredient_id, quantity, unit
+            INSERT INTO recipe_ingredients (recipe_id, ingredient_id, sub_recipe_id, quantity, unit)
+            SELECT ?, ingredient_id, sub_recipe_id, quantity, unit
             FROM recipe_ingredients
             WHERE recipe_id = ?
         ''', (new_recipe_id, recipe_id))
@@ -1787,6 +2193,7 @@ def create_purchase():
                 ''', (purchase_id, ingredient_id, quantity, unit_price, total_price))
         
         db.commit()
+        inventory_written(purchase_ids=[purchase_id])
         flash(f'Compra {purchase_number} creada exitosamente', 'success')
         return redirect(url_for('list_purchases'))
         
@@ -1835,6 +2242,7 @@ def receive_purchase(purchase_id):
         ''', (purchase_id,)).fetchall()
         
         cursor = db.cursor()
+        received_at = get_chile_timestamp()
         
         # Procesar cada item
         for item in items:
@@ -1854,14 +2262,17 @@ def receive_purchase(purchase_id):
                     unit_cost = ?,
                     updated_at = ?
                 WHERE id = ?
-            ''', (received_qty, item['unit_price'], get_chile_timestamp(), item['ingredient_id']))
+            ''', (received_qty, item['unit_price'], received_at, item['ingredient_id']))
+            
+            # Cada precio recibido queda en la historia de costos (ver recipe_costing.py)
+            record_cost(cursor, item['ingredient_id'], item['unit_price'], received_at, 'purchase', purchase_id)
             
             # Registrar movimiento de inventario
             cursor.execute('''
                 INSERT INTO inventory_movements 
                 (ingredient_id, movement_type, quantity, unit_cost, reference_type, reference_id, notes, created_at)
                 VALUES (?, 'purchase', ?, ?, 'purchase', ?, ?, ?)
-            ''', (item['ingredient_id'], received_qty, item['unit_price'], purchase_id, f'Compra recibida: {item["ingredient_name"]}', get_chile_timestamp()))
+            ''', (item['ingredient_id'], received_qty, item['unit_price'], purchase_id, f'Compra recibida: {item["ingredient_name"]}', received_at))
         
         # Actualizar estado de la compra
         cursor.execute('''
@@ -1871,6 +2282,8 @@ def receive_purchase(purchase_id):
         ''', (purchase_id,))
         
         db.commit()
+        inventory_written([item['ingredient_id'] for item in items], [purchase_id])
+        metrics.STOCK_MOVEMENTS.inc(len(items), movement_type='purchase')
         flash('Compra recibida y stock actualizado', 'success')
         
     except Exception as e:
@@ -1885,13 +2298,18 @@ def consume_recipe_ingredients(recipe_id, quantity=1):
     db = get_db()
     
     try:
-        # Obtener ingredientes de la receta
-        ingredients = db.execute('''
-            SELECT ri.*, i.name as ingredient_name, i.current_stock
-            FROM recipe_ingredients ri
-            JOIN ingredients i ON ri.ingredient_id = i.id
-            WHERE ri.recipe_id = ?
-        ''', (recipe_id,)).fetchall()
+        # Ingredientes crudos de la receta con sus sub-recetas explotadas (ver bill_of_materials.py)
+        recipe = db.execute("SELECT servings FROM recipes WHERE id = ?", (recipe_id,)).fetchone()
+        per_serving = recipe_bom.explode(db, recipe_id)
+        batch = (recipe['servings'] or 1) if recipe else 1
+        ingredients = [
+            dict(row, quantity=per_serving[row['ingredient_id']] * batch)
+            for row in db.execute(f'''
+                SELECT id as ingredient_id, name as ingredient_name, current_stock
+                FROM ingredients
+                WHERE id IN ({','.join('?' * len(per_serving))})
+            ''', list(per_serving)).fetchall()
+        ]
         
         cursor = db.cursor()
         
@@ -1929,6 +2347,8 @@ def consume_recipe_ingredients(recipe_id, quantity=1):
             ''', (ingredient['ingredient_id'], -consumed, recipe_id, f'Consumo por receta: {ingredient["ingredient_name"]}', get_chile_timestamp()))
         
         db.commit()
+        inventory_written([ingredient['ingredient_id'] for ingredient in ingredients])
+        metrics.STOCK_MOVEMENTS.inc(len(ingredients), movement_type='consumption')
         return True, None
         
     except Exception as e:
@@ -1965,6 +2385,21 @@ def api_ingredient_movements(ingredient_id):
     
     return jsonify([dict(movement) for movement in movements])
 
+@app.route('/api/inventory/cost-history/<int:ingredient_id>')
+def api_ingredient_cost_history(ingredient_id):
+    """Costos de un ingrediente con su fecha de vigencia, del más reciente al más antiguo"""
+    db = get_db()
+    
+    changes = db.execute('''
+        SELECT unit_cost, effective_at, source, reference_id
+        FROM ingredient_cost_history
+        WHERE ingredient_id = ?
+        ORDER BY effective_at DESC, id DESC
+        LIMIT 100
+    ''', (ingredient_id,)).fetchall()
+    
+    return jsonify([dict(change) for change in changes])
+
 @app.route('/api/inventory/recipe-cost/<int:recipe_id>')
 def api_recipe_cost(recipe_id):
     """API para calcular costo de una receta"""
@@ -1991,13 +2426,89 @@ def api_recipe_cost(recipe_id):
             'total_cost': cost
         })
     
+    # Sub-recetas: costo por porción de cada una, con sus propias sub-recetas explotadas
+    for sub_recipe in recipe_sub_recipes(db, recipe_id, current_unit_costs(db)):
+        total_cost += sub_recipe['cost']
+        details.append({
+            'name': sub_recipe['sub_recipe_name'],
+            'quantity': sub_recipe['quantity'],
+            'unit': 'porciones',
+            'unit_cost': sub_recipe['cost_per_serving'],
+            'total_cost': sub_recipe['cost'],
+            'sub_recipe_id': sub_recipe['sub_recipe_id']
+        })
+    
     return jsonify({
         'total_cost': total_cost,
         'details': details
     })
 
+@app.route('/api/recipes/<int:recipe_id>/explode')
+def api_explode_recipe(recipe_id):
+    """Ingredientes crudos por porción de una receta con todas sus sub-recetas explotadas"""
+    db = get_db()
+    
+    recipe = db.execute("SELECT name, servings FROM recipes WHERE id = ?", (recipe_id,)).fetchone()
+    if not recipe:
+        return jsonify({'error': 'Receta no encontrada'}), 404
+    
+    try:
+        per_serving = recipe_bom.explode(db, recipe_id)
+    except CycleError as e:
+        return jsonify({'error': str(e), 'path': e.path}), 400
+    
+    ingredients = {row['id']: row for row in db.execute(f'''
+        SELECT id, name, unit, COALESCE(unit_cost, 0) as unit_cost
+        FROM ingredients
+        WHERE id IN ({','.join('?' * len(per_serving))})
+    ''', list(per_serving)).fetchall()}
+    
+    details = [
+        {
+            'ingredient_id': ingredient_id,
+            'name': ingredients[ingredient_id]['name'],
+            'unit': ingredients[ingredient_id]['unit'],
+            'quantity_per_serving': quantity,
+            'cost_per_serving': quantity * ingredients[ingredient_id]['unit_cost']
+        }
+        for ingredient_id, quantity in per_serving.items() if ingredient_id in ingredients
+    ]
+    
+    return jsonify({
+        'recipe_id': recipe_id,
+        'name': recipe['name'],
+        'servings': recipe['servings'],
+        'cost_per_serving': sum(detail['cost_per_serving'] for detail in details),
+        'ingredients': sorted(details, key=lambda detail: detail['name'])
+    })
+
 # ===== REPORTES DE INVENTARIO =====
 
+@app.route('/api/inventory/valuation')
+def api_inventory_valuation():
+    """Apertura, compras, costo de ventas, ajustes y cierre de un período por promedio ponderado y FIFO"""
+    db = get_db()
+    try:
+        start = datetime.date.fromisoformat(request.args['start_date']) if request.args.get('start_date') else None
+        end = datetime.date.fromisoformat(request.args['end_date']) if request.args.get('end_date') else None
+    except ValueError:
+        return jsonify({'error': 'Fechas inválidas, usar formato YYYY-MM-DD'}), 400
+    if start and end and end < start:
+        return jsonify({'error': 'La fecha final debe ser posterior a la inicial'}), 400
+    
+    # Fecha final inclusiva, como en los demás reportes
+    end = end + datetime.timedelta(days=1) if end else None
+    result = {
+        'start_date': start.isoformat() if start else None,
+        'end_date': request.args.get('end_date') or None,
+        'methods': [inventory_valuation.period(db, start, end, method) for method in VALUATION_METHODS],
+    }
+    if request.args.get('ingredients') == '1':
+        names = dict(db.execute('SELECT id, name FROM ingredients').fetchall())
+        result['ingredients'] = [dict(row, name=names.get(row['ingredient_id']))
+                                 for row in inventory_valuation.ingredients(db)]
+    return jsonify(result)
+
 @app.route('/inventory/reports')
 def inventory_reports():
     """Reportes de inventario"""
@@ -2011,12 +2522,14 @@ def inventory_reports():
         ORDER BY name
     ''').fetchall()
     
-    # Valor total del inventario
-    total_value = db.execute('''
-        SELECT SUM(current_stock * unit_cost) as total
-        FROM ingredients 
-        WHERE active = 1
-    ''').fetchone()['total'] or 0
+    # Valor del inventario y costo de ventas de los últimos 30 días por método de costeo
+    method = request.args.get('method', 'average')
+    if method not in VALUATION_METHODS:
+        method = 'average'
+    today = get_chile_today()
+    valuation = [inventory_valuation.period(db, today - datetime.timedelta(days=29), today + datetime.timedelta(days=1), m)
+                 for m in VALUATION_METHODS]
+    total_value = next(row['closing_value'] for row in valuation if row['method'] == method)
     
     # Movimientos recientes
     recent_movements = db.execute('''
@@ -2043,11 +2556,14 @@ def inventory_reports():
         'total_ingredients': db.execute('SELECT COUNT(*) FROM ingredients WHERE active = 1').fetchone()[0],
         'low_stock_count': len(low_stock),
         'total_value': total_value,
+        'valuation_method': VALUATION_LABELS[method],
         'suppliers_count': db.execute('SELECT COUNT(*) FROM suppliers WHERE active = 1').fetchone()[0]
     }
     
     return render_template('inventory/reports.html', 
                          stats=stats, 
+                         method=method,
+                         valuation=valuation,
                          low_stock=low_stock,
                          recent_movements=recent_movements,
                          top_consumed=top_consumed)
@@ -2057,52 +2573,10 @@ def inventory_reports():
 @app.route('/inventory')
 def inventory_dashboard():
     """Dashboard principal del inventario"""
-    db = get_db()
-    
-    # Estadísticas generales
-    stats = {
-        'total_ingredients': db.execute('SELECT COUNT(*) FROM ingredients WHERE active = 1').fetchone()[0],
-        'low_stock_count': db.execute('SELECT COUNT(*) FROM ingredients WHERE current_stock <= min_stock AND active = 1').fetchone()[0],
-        'total_recipes': db.execute('SELECT COUNT(*) FROM recipes WHERE active = 1').fetchone()[0],
-        'pending_purchases': db.execute('SELECT COUNT(*) FROM purchases WHERE status = "pending"').fetchone()[0],
-        'total_suppliers': db.execute('SELECT COUNT(*) FROM suppliers WHERE active = 1').fetchone()[0]
-    }
-    
-    # Valor total del inventario
-    total_value = db.execute('''
-        SELECT SUM(current_stock * unit_cost) as total
-        FROM ingredients WHERE active = 1
-    ''').fetchone()['total'] or 0
-    
-    stats['inventory_value'] = total_value
-    
-    # Alertas de stock bajo
-    low_stock_alerts = db.execute('''
-        SELECT name, current_stock, min_stock, unit
-        FROM ingredients 
-        WHERE current_stock <= min_stock AND active = 1
-        ORDER BY (current_stock/min_stock) ASC
-        LIMIT 5
-    ''').fetchall()
-    
-    # Compras pendientes
-    pending_purchases = db.execute('''
-        SELECT p.*, s.name as supplier_name
-        FROM purchases p
-        LEFT JOIN suppliers s ON p.supplier_id = s.id
-        WHERE p.status = 'pending'
-        ORDER BY p.expected_date ASC
-        LIMIT 5
-    ''').fetchall()
-    
-    # Movimientos recientes
-    recent_movements = db.execute('''
-        SELECT im.*, i.name as ingredient_name
-        FROM inventory_movements im
-        JOIN ingredients i ON im.ingredient_id = i.id
-        ORDER BY im.created_at DESC
-        LIMIT 10
-    ''').fetchall()
+    # Estadísticas, alertas de stock bajo, compras pendientes y movimientos recientes desde memoria
+    stats, low_stock_alerts, pending_purchases, recent_movements = \
+        get_dashboard_stats().inventory_stats(get_db())
+    stats = dict(stats, inventory_value=inventory_valuation.total_value(get_db()))
     
     return render_template('inventory/dashboard.html',
                          stats=stats,
@@ -2147,96 +2621,53 @@ def save_product_variations(product_id, variation_groups, required_groups):
 
 @app.route('/api/product-variations/<int:product_id>')
 def get_product_variations(product_id):
-    """API para obtener variaciones de un producto"""
-    db = get_db()
-
-    # DEBUG: Verificar si existen relaciones
-    debug_query = db.execute('''
-        SELECT pv.*, vg.name, vg.display_name 
-        FROM product_variations pv
-        JOIN variation_groups vg ON pv.variation_group_id = vg.id
-        WHERE pv.product_id = ?
-    ''', (product_id,)).fetchall()
-    
-    print(f"DEBUG product_id {product_id}: {len(debug_query)} variaciones encontradas")
-    for row in debug_query:
-        print(f"  - Grupo: {row['name']}, Required: {row['required']}")
-    
-    variations = db.execute('''
-        SELECT 
-            vg.id as group_id,
-            vg.name as group_name,
-            vg.display_name as group_display,
-            vg.description as group_description,
-            vg.required as group_required,
-            vg.multiple_selection,
-            vg.min_selections,
-            vg.max_selections,
-            vo.id as option_id,
-            vo.name as option_name,
-            vo.display_name as option_display,
-            vo.price_modifier,
-            vo.sort_order,
-            pv.required as variation_required
-        FROM product_variations pv
-        JOIN variation_groups vg ON pv.variation_group_id = vg.id
-        JOIN variation_options vo ON vg.id = vo.variation_group_id
-        WHERE pv.product_id = ? AND vg.active = 1 AND vo.active = 1
-        ORDER BY pv.sort_order, vg.id, vo.sort_order
-    ''', (product_id,)).fetchall()
-    
-    # Agrupar por grupos de variación
-    grouped_variations = {}
-    for row in variations:
-        group_id = row['group_id']
-        if group_id not in grouped_variations:
-            grouped_variations[group_id] = {
-                'id': row['group_id'],
-                'name': row['group_name'],
-                'display_name': row['group_display'],
-                'description': row['group_description'],
-                'required': bool(row['group_required']) or bool(row['variation_required']),
-                'multiple_selection': bool(row['multiple_selection']),
-                'min_selections': row['min_selections'],
-                'max_selections': row['max_selections'],
-                'options': []
-            }
-        
-        grouped_variations[group_id]['options'].append({
-            'id': row['option_id'],
-            'name': row['option_name'],
-            'display_name': row['option_display'],
-            'price_modifier': row['price_modifier'],
-            'sort_order': row['sort_order']
-        })
-    
-    return jsonify(list(grouped_variations.values()))
+    """API para obtener variaciones de un producto (desde el catálogo en caché)"""
+    return jsonify(get_catalog().variations(product_id))
 
 # ===== REPORTES Y EXPORTACIÓN DE DATOS =====
 
-# Flask example
-@app.route('/api/reports/export-data')
-def export_data():
-    # Parámetros disponibles:
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date') 
-    period = request.args.get('period')
-    include_charts = request.args.get('include_charts')
-    include_details = request.args.get('include_details')
-    template = request.args.get('template')
-    
-    # Tu lógica aquí...
-    return jsonify(response_data)
-
 @app.route('/api/reports/send-email', methods=['POST'])
 def send_email():
-    # Para envío por email
-    pass
+    """Encolar envío de reporte por email (opcionalmente adjuntando una exportación)"""
+    data = request.get_json(silent=True) or request.form
+    
+    recipients = data.get('to')
+    if not recipients:
+        return jsonify({'success': False, 'error': 'Debe indicar al menos un destinatario'}), 400
+    
+    job_id = job_queue.enqueue('send_email', {
+        'to': recipients,
+        'subject': data.get('subject') or 'Reporte Epicuro',
+        'body': data.get('body', ''),
+        'attachment_job_id': data.get('attachment_job_id')
+    })
+    
+    return jsonify({'success': True, 'job_id': job_id,
+                    'status_url': url_for('api_job_status', job_id=job_id)}), 202
 
 @app.route('/api/reports/schedule', methods=['POST']) 
 def schedule_report():
-    # Para programación automática
-    pass
+    """Programar la generación de una exportación para más tarde"""
+    data = request.get_json(silent=True) or request.form
+    
+    try:
+        start_date, end_date, export_format = parse_export_params(data)
+        run_at = data.get('run_at')
+        delay = 0
+        if run_at:
+            run_at = CHILE_TZ.localize(datetime.datetime.fromisoformat(run_at))
+            delay = max(0, (run_at - get_chile_now()).total_seconds())
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    job_id = job_queue.enqueue('export_orders', {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'format': export_format
+    }, delay=delay)
+    
+    return jsonify({'success': True, 'job_id': job_id,
+                    'status_url': url_for('api_job_status', job_id=job_id)}), 202
 
 @app.route('/api/reports/templates', methods=['GET', 'POST'])
 def manage_templates():
@@ -2247,40 +2678,16 @@ def manage_templates():
 def get_report_export_data():
     """API para obtener datos de exportación"""
     try:
-        db = get_db()
+        analytics = get_order_analytics()
         
         # Reutilizar la lógica de la función reports()
         today = get_chile_today()
         week_ago = today - datetime.timedelta(days=7)
-        month_ago = today - datetime.timedelta(days=30)
-        
-        stats = {
-            'today_sales': db.execute(
-                'SELECT COALESCE(SUM(total_amount), 0) FROM orders WHERE DATE(created_at) = ?',
-                (today,)
-            ).fetchone()[0],
-            'week_sales': db.execute(
-                'SELECT COALESCE(SUM(total_amount), 0) FROM orders WHERE DATE(created_at) >= ?',
-                (week_ago,)
-            ).fetchone()[0],
-            'month_sales': db.execute(
-                'SELECT COALESCE(SUM(total_amount), 0) FROM orders WHERE DATE(created_at) >= ?',
-                (month_ago,)
-            ).fetchone()[0],
-            'total_orders': db.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
-        }
         
-        top_products_raw = db.execute('''
-            SELECT product_name, SUM(quantity) as total_quantity, SUM(total_price) as total_revenue
-            FROM order_items oi
-            JOIN orders o ON oi.order_id = o.id
-            WHERE DATE(o.created_at) >= ?
-            GROUP BY product_name
-            ORDER BY total_quantity DESC
-            LIMIT 10
-        ''', (week_ago,)).fetchall()
+        stats = sales_stats(analytics, today)
+        stats['total_orders'] = analytics.totals()['orders']
         
-        top_products = [dict(row) for row in top_products_raw]
+        top_products = top_products_report(analytics, week_ago)
         
         # Estructura de respuesta para la exportación
         response_data = {
@@ -2303,89 +2710,559 @@ def get_report_export_data():
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+def parse_category_sales_params(params):
+    """Período, rango y rango de comparación de ventas por categoría (lanza ValueError)"""
+    period = params.get('period', 'week')
+    compare = params.get('compare', 'previous')
     
-# ===== IMPRESIÓN DE TICKETS =====
-@app.route('/kitchen-ticket/<int:order_id>')
-def print_kitchen_ticket(order_id):
-    """Imprimir ticket para cocina"""
-    from datetime import datetime
+    try:
+        start_date = datetime.date.fromisoformat(params['start_date']) if params.get('start_date') else None
+        end_date = datetime.date.fromisoformat(params['end_date']) if params.get('end_date') else None
+    except ValueError:
+        raise ValueError('Fechas inválidas, usar formato YYYY-MM-DD')
+    
+    start, end = period_range(period, get_chile_today(), start_date, end_date)
+    return period, (start, end), comparison_range(period, start, end, compare)
+
+@app.route('/api/reports/category-sales')
+def api_category_sales():
+    """Ventas por categoría de un período (week, month o custom) comparadas con otro"""
+    try:
+        period, (start, end), (previous_start, previous_end) = parse_category_sales_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    engine = CategorySales(get_order_analytics())
+    rows = engine.compare(get_catalog().categories, start, end, previous_start, previous_end)
+    
+    # Fechas finales inclusivas, como las recibe la API
+    last_day = datetime.timedelta(days=1)
+    return jsonify({
+        'period': period,
+        'start_date': start.isoformat(),
+        'end_date': (end - last_day).isoformat(),
+        'compare_start_date': previous_start.isoformat(),
+        'compare_end_date': (previous_end - last_day).isoformat(),
+        'categories': rows,
+    })
+
+def parse_rollup_params(params):
+    """Medida y categoría (0 = total) de las consultas a sales_hourly (lanza ValueError)"""
+    measure = params.get('measure', 'orders')
+    if measure not in sales_rollup.MEASURES:
+        raise ValueError(f"Medida desconocida: {measure} (usar {', '.join(sales_rollup.MEASURES)})")
+    try:
+        category_id = int(params.get('category_id') or sales_rollup.TOTAL)
+    except ValueError:
+        raise ValueError('category_id debe ser un número')
+    return measure, category_id
+
+@app.route('/api/reports/heatmap')
+def api_sales_heatmap():
+    """Mapa de calor día de la semana × hora de las últimas `weeks` semanas"""
+    try:
+        measure, category_id = parse_rollup_params(request.args)
+        weeks = int(request.args.get('weeks', HEATMAP_WEEKS))
+        if not 1 <= weeks <= 104:
+            raise ValueError('weeks debe estar entre 1 y 104')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    end = get_chile_today() + datetime.timedelta(days=1)
+    start = end - datetime.timedelta(weeks=weeks)
+    result = sales_rollup.heatmap(get_db(), start, end, measure, category_id)
+    result.update({
+        'start_date': start.isoformat(),
+        'end_date': (end - datetime.timedelta(days=1)).isoformat(),
+        'measure': measure,
+        'category_id': category_id,
+    })
+    return jsonify(result)
+
+@app.route('/api/reports/hourly-sales')
+def api_hourly_sales():
+    """Ventas por bucket (hour, weekday, weekday_hour o day) de un período comparadas con otro
+
+    Acepta los mismos period, compare, start_date y end_date que
+    /api/reports/category-sales; incluye el desglose por categoría del período.
+    """
+    bucket = request.args.get('bucket', 'hour')
+    try:
+        measure, category_id = parse_rollup_params(request.args)
+        period, (start, end), (previous_start, previous_end) = parse_category_sales_params(request.args)
+        db = get_db()
+        rows = sales_rollup.compare(db, bucket, start, end, previous_start, previous_end, measure, category_id)
+        categories = sales_rollup.by_category(db, start, end, measure, bucket)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    last_day = datetime.timedelta(days=1)
+    return jsonify({
+        'period': period,
+        'bucket': bucket,
+        'measure': measure,
+        'category_id': category_id,
+        'start_date': start.isoformat(),
+        'end_date': (end - last_day).isoformat(),
+        'compare_start_date': previous_start.isoformat(),
+        'compare_end_date': (previous_end - last_day).isoformat(),
+        'rows': rows,
+        'categories': [
+            {'category_id': cid, 'values': [{'key': list(k) if isinstance(k, tuple) else k, 'value': v}
+                                            for k, v in sorted(values.items())]}
+            for cid, values in sorted(categories.items())
+        ],
+    })
+
+@app.route('/api/reports/basket-pairs')
+def api_basket_pairs():
+    """Pares de productos comprados juntos con support, confidence y lift"""
+    try:
+        try:
+            limit = int(request.args.get('limit', 20))
+            min_orders = int(request.args.get('min_orders', 5))
+            product_id = int(request.args['product_id']) if request.args.get('product_id') else None
+        except ValueError:
+            raise ValueError('limit, min_orders y product_id deben ser números')
+        pairs = basket_analysis.top_pairs(get_db(), limit=min(max(limit, 1), 500),
+                                          sort=request.args.get('sort', 'lift'),
+                                          min_orders=min_orders, product_id=product_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'baskets': basket_analysis.total_baskets(get_db()), 'pairs': pairs})
+
+@app.route('/api/reports/basket-pairs/backfill', methods=['POST'])
+def api_basket_backfill():
+    """Recalcular los conteos de canasta desde order_items en segundo plano"""
+    job_id = job_queue.enqueue('basket_backfill')
+    return jsonify({'success': True, 'job_id': job_id,
+                    'status_url': url_for('api_job_status', job_id=job_id)}), 202
+
+@job_handler('basket_backfill', priority=PRIORITY_EXPORT)
+def run_basket_backfill_job(payload, conn):
+    """Recalcular basket_products y basket_pairs (después de cargas sin la app)"""
+    return basket_analysis.backfill(conn)
+
+@app.route('/api/reports/margins')
+def api_margins():
+    """Ventas, costo y margen por producto, categoría o día de un período (solo lee resúmenes)"""
+    group = request.args.get('group', 'product')
+    try:
+        period, (start, end), _ = parse_category_sales_params(request.args)
+        rows = sales_rollup.margin_report(get_db(), group, start, end)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if group == 'product':
+        names = {row['id']: row['name'] for row in get_db().execute('SELECT id, name FROM products')}
+    elif group == 'category':
+        names = {category['id']: category['name'] for category in get_catalog().categories}
+    else:
+        names = {}
+    for row in rows:
+        row['name'] = names.get(row['key'], row['key'] if group == 'day' else 'Sin categoría' if group == 'category' else None)
+
+    return jsonify({
+        'period': period,
+        'group': group,
+        'start_date': start.isoformat(),
+        'end_date': (end - datetime.timedelta(days=1)).isoformat(),
+        'rows': rows,
+    })
+
+@app.route('/api/reports/margins/recompute', methods=['POST'])
+def api_recompute_margins():
+    """Volver a costear líneas de órdenes (opcionalmente solo start_date..end_date) en segundo plano"""
+    data = request.get_json(silent=True) or request.form
+    payload = {}
+    try:
+        for key in ('start_date', 'end_date'):
+            if data.get(key):
+                payload[key] = datetime.date.fromisoformat(data[key]).isoformat()
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Fechas inválidas, usar formato YYYY-MM-DD'}), 400
+
+    job_id = job_queue.enqueue('recost_order_lines', payload)
+    return jsonify({'success': True, 'job_id': job_id,
+                    'status_url': url_for('api_job_status', job_id=job_id)}), 202
+
+@job_handler('recost_order_lines', priority=PRIORITY_EXPORT)
+def run_recost_order_lines_job(payload, conn):
+    """Costear líneas con el costo histórico de sus ingredientes y rehacer los resúmenes del rango"""
+    start = payload.get('start_date')
+    end = payload.get('end_date')
+    end = (datetime.date.fromisoformat(end) + datetime.timedelta(days=1)).isoformat() if end else None
+    lines = recompute_line_costs(conn, start, end)
+    sales_rollup.backfill(conn, start, end)
+    menu_engineering.forget(conn, start, end)
+    return {'lines': lines, 'start_date': start, 'end_date': payload.get('end_date')}
+
+@app.route('/api/reports/cost-simulation', methods=['POST'])
+def api_cost_simulation():
+    """Costo y margen de recetas y productos con precios de ingredientes simulados (no guarda nada)"""
+    data = request.get_json(silent=True) or {}
+    changes = data.get('changes')
+    if not isinstance(changes, list) or not changes:
+        return jsonify({'error': 'Indicar changes: [{ingredient_id, unit_cost o change_pct}]'}), 400
+    try:
+        days = int(data.get('days', 30))
+        if days < 1:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({'error': 'days debe ser un entero positivo'}), 400
     
     db = get_db()
+    today = get_chile_today()
+    volumes = sales_volumes(db, today - datetime.timedelta(days=days - 1), today + datetime.timedelta(days=1))
+    try:
+        result = cost_simulator.simulate(db, changes, volumes, data.get('sort', 'impact'), bool(data.get('all')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Obtener orden
-    order = db.execute(
-        'SELECT * FROM orders WHERE id = ?', (order_id,)
-    ).fetchone()
+    result['days'] = days
+    return jsonify(result)
+
+@app.route('/api/reports/menu-engineering')
+def api_menu_engineering():
+    """Matriz de ingeniería de menú de un período (por defecto el nocturno); se calcula si no está guardada"""
+    db = get_db()
+    now = get_chile_now()
+    try:
+        if request.args.get('period'):
+            period, (start, end), _ = parse_category_sales_params(request.args)
+        else:
+            period = 'nightly'
+            start, end = menu_engineering.nightly_period(db) or menu_engineering.nightly_range(now.date())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    period_id = None
+    if request.args.get('refresh') != '1':
+        period_id = menu_engineering.cached_period(db, start, end, now)
+    if period_id is None:
+        period_id = menu_engineering.refresh(db, start, end, now, costing_engine.product_costs(db),
+                                             nightly=period == 'nightly')
+        db.commit()
+    
+    report = menu_engineering.report(db, period_id)
+    report['period'] = period
+    return jsonify(report)
+
+@job_handler('menu_engineering', priority=PRIORITY_EXPORT)
+def run_menu_engineering_job(payload, conn):
+    """Recalcular la ingeniería de menú de los últimos días y programar la próxima noche"""
+    now = get_chile_now()
+    start, end = menu_engineering.nightly_range(now.date())
+    period_id = menu_engineering.refresh(conn, start, end, now, costing_engine.product_costs(conn), nightly=True)
+    schedule_menu_engineering(conn)
+    return menu_engineering.report(conn, period_id)['summary']
+
+def schedule_menu_engineering(conn=None):
+    """Dejar encolado un solo cálculo nocturno de ingeniería de menú entre todos los procesos
+
+    Si el período nocturno falta o es de otro día se calcula de inmediato;
+    si no, a las MENU_ENGINEERING_HOUR siguientes. Sin conn abre una
+    transacción propia (BEGIN IMMEDIATE: dos workers que arrancan juntos no
+    encolan dos veces).
+    """
+    own_conn = conn is None
+    if own_conn:
+        # Antes de tomar el lock: al iniciar, la cola recupera trabajos con otra conexión
+        job_queue.start()
+        conn = sqlite3.connect(DATABASE, timeout=30)
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        queued = conn.execute(
+            "SELECT id FROM jobs WHERE kind = 'menu_engineering' AND status = 'queued'"
+        ).fetchone()
+        if queued is None:
+            now = get_chile_now()
+            current = menu_engineering.nightly_period(conn)
+            delay = 0
+            # Desde el trabajo nocturno, o con el período de hoy ya calculado: la próxima noche
+            if not own_conn or (current is not None and current[1] == now.date()):
+                run_at = now.replace(hour=MENU_ENGINEERING_HOUR, minute=0, second=0, microsecond=0)
+                if run_at <= now:
+                    run_at += datetime.timedelta(days=1)
+                delay = (run_at - now).total_seconds()
+            job_queue.enqueue('menu_engineering', delay=delay, conn=conn)
+        if own_conn:
+            conn.commit()
+    finally:
+        if own_conn:
+            conn.close()
+
+def parse_export_params(params):
+    """Validar rango de fechas y formato de exportación (lanza ValueError)"""
+    today = get_chile_today()
+    export_format = (params.get('format') or 'csv').lower()
+    
+    try:
+        start_date = datetime.date.fromisoformat(params.get('start_date') or today.replace(day=1).isoformat())
+        end_date = datetime.date.fromisoformat(params.get('end_date') or today.isoformat())
+    except ValueError:
+        raise ValueError('Fechas inválidas, usar formato YYYY-MM-DD')
+    
+    if end_date < start_date:
+        raise ValueError('La fecha final debe ser posterior a la inicial')
+    
+    if export_format not in ('csv', 'xlsx'):
+        raise ValueError('Formato no soportado, usar csv o xlsx')
+    
+    return start_date, end_date, export_format
+
+def export_filename(start_date, end_date, export_format):
+    """Nombre de archivo de exportación, igual al de los reportes manuales"""
+    return f"Reporte_Ventas_Epicuro_{start_date.strftime('%Y%m%d')}_a_{end_date.strftime('%Y%m%d')}.{export_format}"
+
+def export_chunks(db, start_date, end_date, export_format):
+    """Generador de bloques del archivo de exportación"""
+    # Rango semiabierto [inicio, fin + 1 día) sobre created_at
+    rows = iter_order_lines(db, start_date.isoformat(),
+                            (end_date + datetime.timedelta(days=1)).isoformat())
+    return xlsx_stream(rows) if export_format == 'xlsx' else csv_stream(rows)
+
+@app.route('/api/reports/export-orders')
+def export_orders():
+    """Exportar todas las líneas de órdenes de un rango de fechas (CSV o XLSX)"""
+    try:
+        start_date, end_date, export_format = parse_export_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Con async=1 el archivo se genera en segundo plano y se consulta por /api/jobs
+    if request.args.get('async'):
+        job_id = job_queue.enqueue('export_orders', {
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'format': export_format
+        })
+        return jsonify({'job_id': job_id,
+                        'status_url': url_for('api_job_status', job_id=job_id)}), 202
+    
+    if export_format == 'xlsx':
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        mimetype = 'text/csv; charset=utf-8'
+    
+    filename = export_filename(start_date, end_date, export_format)
+    body = export_chunks(get_db(), start_date, end_date, export_format)
+    
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+# ===== TRABAJOS EN SEGUNDO PLANO =====
+
+@job_handler('export_orders', priority=PRIORITY_EXPORT)
+def run_export_orders_job(payload, conn):
+    """Generar en disco un archivo de exportación de órdenes"""
+    start_date, end_date, export_format = parse_export_params(payload)
+    filename = export_filename(start_date, end_date, export_format)
+    
+    os.makedirs(EXPORTS_DIR, exist_ok=True)
+    path = os.path.join(EXPORTS_DIR, filename)
+    
+    with open(path, 'wb') as f:
+        for chunk in export_chunks(conn, start_date, end_date, export_format):
+            f.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    
+    return {'file': path, 'filename': filename}
+
+@job_handler('send_email', max_attempts=5)
+def run_send_email_job(payload, conn):
+    """Enviar un correo por SMTP (configurado con variables EPICURO_SMTP_*)"""
+    import smtplib
+    from email.message import EmailMessage
+    
+    host = os.environ.get('EPICURO_SMTP_HOST')
+    if not host:
+        raise RuntimeError('SMTP no configurado (EPICURO_SMTP_HOST)')
+    
+    recipients = payload['to']
+    if isinstance(recipients, str):
+        recipients = [r.strip() for r in recipients.split(',') if r.strip()]
+    
+    message = EmailMessage()
+    message['Subject'] = payload.get('subject', 'Reporte Epicuro')
+    message['From'] = os.environ.get('EPICURO_SMTP_FROM', os.environ.get('EPICURO_SMTP_USER', 'epicuro@localhost'))
+    message['To'] = ', '.join(recipients)
+    message.set_content(payload.get('body', ''))
+    
+    # Adjuntar el archivo generado por un trabajo de exportación
+    if payload.get('attachment_job_id'):
+        export_job = conn.execute(
+            "SELECT status, result FROM jobs WHERE id = ?", (payload['attachment_job_id'],)
+        ).fetchone()
+        if not export_job or export_job['status'] != 'done':
+            raise RuntimeError('La exportación adjunta aún no está lista')
+        export_result = json.loads(export_job['result'])
+        with open(export_result['file'], 'rb') as f:
+            message.add_attachment(f.read(), maintype='application', subtype='octet-stream',
+                                   filename=export_result['filename'])
+    
+    with smtplib.SMTP(host, int(os.environ.get('EPICURO_SMTP_PORT', 587)), timeout=30) as smtp:
+        if os.environ.get('EPICURO_SMTP_USER'):
+            smtp.starttls()
+            smtp.login(os.environ['EPICURO_SMTP_USER'], os.environ.get('EPICURO_SMTP_PASSWORD', ''))
+        smtp.send_message(message)
+    
+    return {'sent_to': recipients}
+
+@job_handler('import_sales')
+def run_import_sales_job(payload, conn):
+    """Importar ventas desde un Excel y crear los productos faltantes"""
+    from import_ventas import import_sales_from_excel, create_products_from_import
+    
+    if not import_sales_from_excel(payload['excel_file'], DATABASE):
+        raise RuntimeError('La importación falló, revisar el log del servidor')
+    create_products_from_import(DATABASE)
+    
+    return {'excel_file': payload['excel_file']}
+
+@job_handler('print_ticket', priority=PRIORITY_PRINT, max_attempts=5)
+def run_print_ticket_job(payload, conn):
+    """Enviar un ticket ESC/POS a una impresora configurada"""
+    printer = printers.get(payload['printer'])
+    if printer is None:
+        raise ValueError(f"Impresora no configurada: {payload['printer']}")
+    
+    labels = {'kind': payload['kind'], 'printer': payload['printer']}
+    try:
+        data = render_ticket_bytes(conn, payload['order_id'], payload['kind'], printer.width)
+        printer.send(data)
+    except Exception:
+        metrics.PRINT_JOBS.inc(result='error', **labels)
+        raise
+    metrics.PRINT_JOBS.inc(result='ok', **labels)
+    metrics.PRINT_BYTES.inc(len(data), printer=payload['printer'])
+    
+    return {'order_id': payload['order_id'], 'printer': repr(printer), 'bytes': len(data)}
+
+@job_handler('print_kitchen_ticket', priority=PRIORITY_PRINT)
+def run_kitchen_ticket_job(payload, conn):
+    """Trabajos 'print_kitchen_ticket' encolados antes de la cola ESC/POS: van a la impresora de cocina"""
+    return run_print_ticket_job({'order_id': payload['order_id'], 'kind': 'kitchen', 'printer': 'kitchen'}, conn)
+
+@app.route('/api/imports/sales', methods=['POST'])
+def api_import_sales():
+    """Subir un Excel de ventas e importarlo en segundo plano"""
+    upload = request.files.get('file')
+    if not upload or not upload.filename.lower().endswith('.xlsx'):
+        return jsonify({'success': False, 'error': 'Debe adjuntar un archivo .xlsx'}), 400
+    
+    os.makedirs(IMPORTS_DIR, exist_ok=True)
+    path = os.path.join(IMPORTS_DIR, f"{get_chile_now().strftime('%Y%m%d_%H%M%S')}_{os.path.basename(upload.filename)}")
+    upload.save(path)
+    
+    job_id = job_queue.enqueue('import_sales', {'excel_file': path})
+    return jsonify({'success': True, 'job_id': job_id,
+                    'status_url': url_for('api_job_status', job_id=job_id)}), 202
+
+@app.route('/api/jobs')
+def api_jobs():
+    """API para listar trabajos en segundo plano"""
+    jobs = job_queue.list(status=request.args.get('status'),
+                          kind=request.args.get('kind'),
+                          limit=request.args.get('limit', 50, type=int))
+    return jsonify({'counts': job_queue.counts(), 'jobs': jobs})
+
+@app.route('/api/jobs/<int:job_id>')
+def api_job_status(job_id):
+    """API para consultar el estado de un trabajo"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    
+    if job['kind'] == 'export_orders' and job['status'] == 'done':
+        job['download_url'] = url_for('api_job_download', job_id=job_id)
+    return jsonify(job)
+
+@app.route('/api/jobs/<int:job_id>/download')
+def api_job_download(job_id):
+    """Descargar el archivo generado por un trabajo de exportación"""
+    job = job_queue.get(job_id)
+    if not job or job['kind'] != 'export_orders' or job['status'] != 'done':
+        return jsonify({'error': 'Archivo no disponible'}), 404
+    
+    return send_file(os.path.abspath(job['result']['file']), as_attachment=True,
+                     download_name=job['result']['filename'])
     
+# ===== IMPRESIÓN DE TICKETS =====
+
+def render_ticket_bytes(db, order_id, kind, width):
+    """Bytes ESC/POS de un ticket ('kitchen' o 'bill'), desde la caché si la orden no cambió"""
+    if kind not in RENDERERS:
+        raise ValueError(f'Tipo de ticket desconocido: {kind}')
+    
+    repo = OrderRepository(db)
+    order = repo.get(order_id, with_items=False)
     if not order:
+        raise LookupError(f'Orden {order_id} no encontrada')
+    
+    def load_items():
+        # Los items con sus variaciones solo se leen si el ticket no está en caché
+        repo.attach_items([order])
+        return order.items
+    
+    # Huella de las líneas: una edición en el mismo segundo no reimprime el ticket anterior
+    items_key = items_digest(db.execute(
+        f'SELECT {DIGEST_COLUMNS} FROM order_items WHERE order_id = ? ORDER BY id', (order_id,)))
+    return ticket_cache.get_or_render(kind, order, load_items, width, items_key)
+
+@app.route('/orders/<int:order_id>/print/<kind>', methods=['POST'])
+def queue_ticket_print(order_id, kind):
+    """Encolar la impresión térmica de un ticket de cocina o cuenta"""
+    if kind not in RENDERERS:
+        return jsonify({'success': False, 'error': 'Tipo de ticket desconocido'}), 400
+    
+    printer = request.args.get('printer') or ('kitchen' if kind == 'kitchen' else 'cashier')
+    if printer not in printers:
+        return jsonify({'success': False, 'error': f'Impresora no configurada: {printer}'}), 400
+    
+    job_id = job_queue.enqueue('print_ticket', {'order_id': order_id, 'kind': kind, 'printer': printer})
+    return jsonify({'success': True, 'job_id': job_id,
+                    'status_url': url_for('api_job_status', job_id=job_id)}), 202
+
+@app.route('/orders/<int:order_id>/escpos/<kind>')
+def download_ticket_escpos(order_id, kind):
+    """Descargar los bytes ESC/POS de un ticket (útil para pruebas)"""
+    width = request.args.get('width', 80, type=int)
+    try:
+        data = render_ticket_bytes(get_db(), order_id, kind, width)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return Response(data, mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename=orden_{order_id}_{kind}.bin'})
+
+@app.route('/kitchen-ticket/<int:order_id>')
+def print_kitchen_ticket(order_id):
+    """Imprimir ticket para cocina"""
+    # Obtener orden con sus items
+    record = get_orders().get(order_id)
+    
+    if not record:
         flash('Orden no encontrada', 'error')
         return redirect(url_for('list_orders'))
     
-    # Convertir Row a dict para poder modificar
-    order = dict(order)
+    # Convertir a dict para poder modificar
+    order = record.as_dict()
     
-    # Convertir created_at de string a datetime si es necesario
-    if order.get('created_at'):
-        try:
-            if isinstance(order['created_at'], str):
-                formats = [
-                    '%Y-%m-%d %H:%M:%S',
-                    '%Y-%m-%d %H:%M:%S.%f',
-                    '%Y-%m-%d',
-                    '%d/%m/%Y %H:%M:%S',
-                    '%d/%m/%Y'
-                ]
-                
-                for fmt in formats:
-                    try:
-                        order['created_at'] = datetime.strptime(order['created_at'], fmt)
-                        break
-                    except ValueError:
-                        continue
-                        
-        except (ValueError, TypeError):
-            pass
-    
-    # Convertir updated_at si existe
-    if order.get('updated_at'):
-        try:
-            if isinstance(order['updated_at'], str):
-                formats = [
-                    '%Y-%m-%d %H:%M:%S',
-                    '%Y-%m-%d %H:%M:%S.%f',
-                    '%Y-%m-%d',
-                    '%d/%m/%Y %H:%M:%S',
-                    '%d/%m/%Y'
-                ]
-                
-                for fmt in formats:
-                    try:
-                        order['updated_at'] = datetime.strptime(order['updated_at'], fmt)
-                        break
-                    except ValueError:
-                        continue
-                        
-        except (ValueError, TypeError):
-            pass
-    
-    # Obtener items con sus variaciones Y NOTAS
-    order_items = db.execute('''
-    SELECT oi.*, p.name as product_name, p.description,
-           oi.notes as item_notes,
-           GROUP_CONCAT(
-               CASE WHEN vo.name IS NOT NULL 
-               THEN vg.display_name || ': ' || vo.display_name 
-               END, ' | '
-           ) as selected_variations
-    FROM order_items oi
-    JOIN products p ON oi.product_id = p.id
-    LEFT JOIN order_item_variations oiv ON oi.id = oiv.order_item_id
-    LEFT JOIN variation_options vo ON oiv.variation_option_id = vo.id
-    LEFT JOIN variation_groups vg ON vo.variation_group_id = vg.id
-    WHERE oi.order_id = ?
-    GROUP BY oi.id
-    ORDER BY oi.id
-''', (order_id,)).fetchall()
+    # Convertir fechas a datetime en hora de Chile (parseo en caché, ver timestamps.py)
+    for key in ('created_at', 'updated_at'):
+        order[key] = to_datetime(order[key]) or order[key]
+    
+    # Items con sus variaciones Y NOTAS
+    order_items = []
+    for line in record.items:
+        item = line.as_dict()
+        item['item_notes'] = line.notes
+        item['selected_variations'] = ' | '.join(line.variation_lines) or None
+        order_items.append(item)
     
     # Fecha actual para el template
     current_time = get_chile_now()
@@ -2398,94 +3275,24 @@ def print_kitchen_ticket(order_id):
 @app.route('/customer-bill/<int:order_id>')
 def print_customer_bill(order_id):
     """Imprimir cuenta para cliente"""
-    from datetime import datetime
-    
-    db = get_db()
-    
-    # Obtener orden
-    order = db.execute('SELECT * FROM orders WHERE id = ?', (order_id,)).fetchone()
-    if not order:
+    # Obtener orden con sus items
+    record = get_orders().get(order_id)
+    if not record:
         flash('Orden no encontrada', 'error')
         return redirect(url_for('list_orders'))
     
-    # Convertir Row a dict para poder modificar
-    order = dict(order)
+    # Convertir a dict para poder modificar
+    order = record.as_dict()
     
-    # Convertir created_at de string a datetime si es necesario
-    if order.get('created_at'):
-        try:
-            if isinstance(order['created_at'], str):
-                # Intentar varios formatos comunes
-                formats = [
-                    '%Y-%m-%d %H:%M:%S',
-                    '%Y-%m-%d %H:%M:%S.%f',
-                    '%Y-%m-%d',
-                    '%d/%m/%Y %H:%M:%S',
-                    '%d/%m/%Y'
-                ]
-                
-                for fmt in formats:
-                    try:
-                        order['created_at'] = datetime.strptime(order['created_at'], fmt)
-                        break
-                    except ValueError:
-                        continue
-                        
-        except (ValueError, TypeError):
-            # Si no se puede convertir, mantener como string
-            pass
-    
-    # Convertir updated_at si existe
-    if order.get('updated_at'):
-        try:
-            if isinstance(order['updated_at'], str):
-                formats = [
-                    '%Y-%m-%d %H:%M:%S',
-                    '%Y-%m-%d %H:%M:%S.%f',
-                    '%Y-%m-%d',
-                    '%d/%m/%Y %H:%M:%S',
-                    '%d/%m/%Y'
-                ]
-                
-                for fmt in formats:
-                    try:
-                        order['updated_at'] = datetime.strptime(order['updated_at'], fmt)
-                        break
-                    except ValueError:
-                        continue
-                        
-        except (ValueError, TypeError):
-            pass
-    
-    # Obtener items para facturación (sin variaciones internas)
-    order_items = db.execute('''
-        SELECT oi.*, 
-               p.name as product_name,
-               GROUP_CONCAT(
-                   CASE 
-                       WHEN vo.display_name IS NOT NULL 
-                       THEN vo.display_name 
-                       ELSE NULL 
-                   END, ', '
-               ) as variations
-        FROM order_items oi
-        LEFT JOIN products p ON oi.product_id = p.id
-        LEFT JOIN order_item_variations oiv ON oi.id = oiv.order_item_id
-        LEFT JOIN variation_options vo ON oiv.variation_option_id = vo.id
-        WHERE oi.order_id = ?
-        GROUP BY oi.id
-        ORDER BY oi.id
-    ''', (order_id,)).fetchall()
-    
-    # Convertir order_items a lista de diccionarios para facilitar el manejo
+    # Convertir fechas a datetime en hora de Chile (parseo en caché, ver timestamps.py)
+    for key in ('created_at', 'updated_at'):
+        order[key] = to_datetime(order[key]) or order[key]
+    
+    # Items para facturación (sin variaciones internas)
     items_list = []
-    for item in order_items:
-        item_dict = dict(item)
-        # Limpiar variaciones vacías
-        if item_dict['variations']:
-            item_dict['variations'] = item_dict['variations'].replace('None, ', '').replace(', None', '').strip(', ')
-            if item_dict['variations'] == 'None':
-                item_dict['variations'] = None
+    for line in record.items:
+        item_dict = line.as_dict()
+        item_dict['variations'] = line.variations or None
         items_list.append(item_dict)
     
     # Calcular totales
@@ -2841,5 +3648,10 @@ def new_variation_option(group_id):
 # ===== INICIALIZACIÓN =====
 
 if __name__ == '__main__':
-    init_db()
-    app.run(debug=True, host='0.0.0.0', port=5002)
\ No newline at end of file
+    if '--prepare' in sys.argv:
+        journal_mode, recovered = prepare_production_db()
+        print(f"✅ Base lista para producción (journal_mode={journal_mode}, trabajos recuperados: {recovered})")
+    else:
+        init_db()
+        schedule_menu_engineering()
+        app.run(debug=True, host='0.0.0.0', port=5002)
\ No newline at end of file
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Análisis de canasta (productos que se compran juntos) para el sistema Epicuro
+
+Cada orden es una canasta: el conjunto de productos distintos de sus líneas
+(una línea sin product_id no cuenta). Se guardan dos conteos dispersos:
+
+- basket_products: órdenes que tienen cada producto; product_id = 0 es el
+  total de canastas
+- basket_pairs: órdenes que tienen ambos productos, con product_a < product_b;
+  solo existen los pares que alguna vez se vendieron juntos
+
+Las rutas que crean, editan o eliminan órdenes leen la canasta antes y
+después del cambio y aplican la diferencia en la misma transacción
+(update_basket). Consultar es leer basket_pairs con dos búsquedas por
+clave en basket_products, sin el self-join de order_items que solo hace el
+backfill (init_db al crear las tablas, generate_data.py, el trabajo
+'basket_backfill' o la línea de comandos).
+
+Con N canastas, n(A), n(B) y n(A, B):
+    support = n(A, B) / N
+    confidence(A -> B) = n(A, B) / n(A)
+    lift = n(A, B) * N / (n(A) * n(B))      (> 1: se compran juntos más que por azar)
+
+    python basket_analysis.py --backfill [--db data/sandwich.db]
+    python -m pytest tests/test_basket_analysis.py
+"""
+
+import sqlite3
+import sys
+from itertools import combinations
+
+TOTAL = 0  # product_id de la fila con el total de canastas
+
+SORT_KEYS = ('lift', 'confidence', 'support')
+
+# Orden de top_pairs (N es el mismo para todos los pares)
+_SORT_EXPRESSIONS = {
+    'lift': 'CAST(p.orders AS REAL) / (a.orders * b.orders)',
+    'confidence': 'CAST(p.orders AS REAL) / MIN(a.orders, b.orders)',
+    'support': 'p.orders',
+}
+
+
+# ===== ESQUEMA =====
+
+def create_basket_tables(cursor):
+    """Crear basket_products y basket_pairs; devuelve True si se crearon ahora"""
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'basket_pairs'"
+    ).fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS basket_products (
+            product_id INTEGER PRIMARY KEY,
+            orders INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS basket_pairs (
+            product_a INTEGER NOT NULL,
+            product_b INTEGER NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (product_a, product_b)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_basket_pairs_b ON basket_pairs (product_b)')
+    return exists is None
+
+
+# ===== ESCRITURA =====
+
+def order_basket(conn, order_id):
+    """Productos distintos de una orden (vacío si no existe o no tiene líneas)"""
+    return frozenset(row[0] for row in conn.execute(
+        'SELECT DISTINCT product_id FROM order_items WHERE order_id = ? AND product_id IS NOT NULL',
+        (order_id,)))
+
+
+def _counts(basket, sign, products, pairs):
+    if not basket:
+        return
+    products[TOTAL] = products.get(TOTAL, 0) + sign
+    for product_id in basket:
+        products[product_id] = products.get(product_id, 0) + sign
+    for pair in combinations(sorted(basket), 2):
+        pairs[pair] = pairs.get(pair, 0) + sign
+
+
+def update_basket(conn, before, after):
+    """Aplicar el cambio de una canasta (frozenset antes -> después) en la transacción de conn"""
+    if before == after:
+        return
+    products, pairs = {}, {}
+    _counts(before, -1, products, pairs)
+    _counts(after, 1, products, pairs)
+
+    product_deltas = [(product_id, delta) for product_id, delta in products.items() if delta]
+    pair_deltas = [pair + (delta,) for pair, delta in pairs.items() if delta]
+    conn.executemany('''
+        INSERT INTO basket_products (product_id, orders) VALUES (?, ?)
+        ON CONFLICT (product_id) DO UPDATE SET orders = orders + excluded.orders
+    ''', product_deltas)
+    conn.executemany('''
+        INSERT INTO basket_pairs (product_a, product_b, orders) VALUES (?, ?, ?)
+        ON CONFLICT (product_a, product_b) DO UPDATE SET orders = orders + excluded.orders
+    ''', pair_deltas)
+
+    # Tablas dispersas: fuera los conteos que llegaron a cero
+    if any(delta < 0 for _, delta in product_deltas):
+        conn.executemany('DELETE FROM basket_products WHERE product_id = ? AND orders <= 0',
+                         [(product_id,) for product_id, delta in product_deltas if delta < 0])
+    if any(delta < 0 for *_, delta in pair_deltas):
+        conn.executemany('DELETE FROM basket_pairs WHERE product_a = ? AND product_b = ? AND orders <= 0',
+                         [(a, b) for a, b, delta in pair_deltas if delta < 0])
+
+
+def backfill(conn):
+    """Recalcular ambas tablas desde order_items; devuelve {'baskets': N, 'pairs': pares}"""
+    conn.execute('DELETE FROM basket_products')
+    conn.execute('DELETE FROM basket_pairs')
+    conn.execute('DROP TABLE IF EXISTS temp.basket_lines')
+    conn.execute('''
+        CREATE TEMP TABLE basket_lines AS
+        SELECT DISTINCT order_id, product_id FROM order_items WHERE product_id IS NOT NULL
+    ''')
+    conn.execute('CREATE INDEX temp.idx_basket_lines ON basket_lines (order_id, product_id)')
+
+    conn.execute('''
+        INSERT INTO basket_products (product_id, orders)
+        SELECT 0, COUNT(DISTINCT order_id) FROM temp.basket_lines
+        UNION ALL
+        SELECT product_id, COUNT(*) FROM temp.basket_lines GROUP BY product_id
+    ''')
+    conn.execute('''
+        INSERT INTO basket_pairs (product_a, product_b, orders)
+        SELECT x.product_id, y.product_id, COUNT(*)
+        FROM temp.basket_lines x
+        JOIN temp.basket_lines y ON y.order_id = x.order_id AND y.product_id > x.product_id
+        GROUP BY x.product_id, y.product_id
+    ''')
+    conn.execute('DROP TABLE temp.basket_lines')
+    return {
+        'baskets': total_baskets(conn),
+        'pairs': conn.execute('SELECT COUNT(*) FROM basket_pairs').fetchone()[0],
+    }
+
+
+# ===== LECTURA =====
+
+def total_baskets(conn):
+    row = conn.execute('SELECT orders FROM basket_products WHERE product_id = 0').fetchone()
+    return row[0] if row else 0
+
+
+def top_pairs(conn, limit=20, sort='lift', min_orders=5, product_id=None):
+    """Pares con support, confidence y lift, ordenados por `sort`
+
+    min_orders descarta pares vistos muy pocas veces (su lift es ruido). Con
+    product_id solo salen los pares de ese producto, orientados desde él
+    (confidence = de quien lleva product_id, cuántos llevan el otro).
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Orden desconocido: {sort} (usar {', '.join(SORT_KEYS)})")
+    baskets = total_baskets(conn)
+    if not baskets:
+        return []
+
+    where, params = 'p.orders >= ?', [min_orders]
+    order = _SORT_EXPRESSIONS[sort]
+    if product_id is not None:
+        where += ' AND (p.product_a = ? OR p.product_b = ?)'
+        params += [product_id, product_id]
+        if sort == 'confidence':
+            order = 'p.orders'  # n(product_id) es el mismo para todos
+    rows = conn.execute(f'''
+        SELECT p.product_a, p.product_b, p.orders, a.orders, b.orders
+        FROM basket_pairs p
+        JOIN basket_products a ON a.product_id = p.product_a
+        JOIN basket_products b ON b.product_id = p.product_b
+        WHERE {where}
+        ORDER BY {order} DESC, p.orders DESC
+        LIMIT ?
+    ''', params + [limit]).fetchall()
+
+    ids = {row[0] for row in rows} | {row[1] for row in rows}
+    names = {}
+    if ids:
+        placeholders = ','.join('?' * len(ids))
+        names = dict(conn.execute(f'SELECT id, name FROM products WHERE id IN ({placeholders})',
+                                  sorted(ids)).fetchall())
+
+    pairs = []
+    for a, b, together, count_a, count_b in rows:
+        if product_id is not None and b == product_id:
+            a, b, count_a, count_b = b, a, count_b, count_a
+        pairs.append({
+            'product_a': a,
+            'product_a_name': names.get(a),
+            'product_b': b,
+            'product_b_name': names.get(b),
+            'orders': together,
+            'support': round(together / baskets, 4),
+            'confidence_a_b': round(together / count_a, 4),
+            'confidence_b_a': round(together / count_b, 4),
+            'lift': round(together * baskets / (count_a * count_b), 3),
+        })
+    return pairs
+
+
+if __name__ == "__main__":
+    if '--backfill' in sys.argv:
+        path = sys.argv[sys.argv.index('--db') + 1] if '--db' in sys.argv else 'data/sandwich.db'
+        conn = sqlite3.connect(path)
+        create_basket_tables(conn.cursor())
+        counts = backfill(conn)
+        conn.commit()
+        conn.close()
+        print(f"✅ {counts['baskets']:,} canastas y {counts['pairs']:,} pares en {path}")
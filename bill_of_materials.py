@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Recetas con sub-recetas (preparaciones) para el sistema Epicuro
+
+Una línea de recipe_ingredients apunta a un ingrediente (ingredient_id) o a
+otra receta (sub_recipe_id, con quantity en porciones de esa receta): la
+mayo casera, el pebre o la mechada son recetas que se usan dentro de los
+sándwiches. Las recetas forman un grafo dirigido sin ciclos.
+
+BillOfMaterials explota ese grafo: el vector de una receta son los
+ingredientes crudos por porción (arreglos NumPy de ids y cantidades), sus
+líneas directas más las de cada sub-receta multiplicadas por las porciones
+que usa, todo dividido por sus porciones. El vector de cada receta queda
+memorizado, así una preparación usada en veinte sándwiches se explota una
+sola vez. Un ciclo (A usa B, B usa A) lanza CycleError con el camino.
+
+Cuando change_log muestra un cambio de inventario se vuelven a leer las
+definiciones (porciones y líneas) y solo se descarta el vector de las
+recetas que cambiaron y de las que las usan, directa o indirectamente; el
+resto de la memoria sigue valiendo. Los precios no están en los vectores:
+cambiar el costo de un ingrediente no descarta nada.
+
+Lo usan el costo por producto (recipe_costing.py), la simulación de precios
+(cost_simulation.py) y el consumo de inventario al preparar una receta.
+
+    python -m pytest tests/test_bill_of_materials.py
+    python bill_of_materials.py --explode RECIPE_ID [--db data/sandwich.db]
+"""
+
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+
+from cache_coherence import domain_version
+
+_EMPTY = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=float))
+
+
+class CycleError(ValueError):
+    """Una receta se usa a sí misma a través de sus sub-recetas"""
+
+    def __init__(self, path, names=None):
+        self.path = list(path)
+        names = names or {}
+        super().__init__('Ciclo de sub-recetas: ' + ' → '.join(str(names.get(r, r)) for r in self.path))
+
+
+# ===== ESQUEMA =====
+
+def add_sub_recipe_column(cursor):
+    """Agregar recipe_ingredients.sub_recipe_id; devuelve True si se creó ahora"""
+    existing = {row[1] for row in cursor.execute('PRAGMA table_info(recipe_ingredients)').fetchall()}
+    if 'sub_recipe_id' in existing:
+        return False
+    cursor.execute('ALTER TABLE recipe_ingredients ADD COLUMN sub_recipe_id INTEGER REFERENCES recipes (id)')
+    return True
+
+
+def load_definitions(conn):
+    """{recipe_id: (porciones, ((ingredient_id, cantidad), ...), ((sub_recipe_id, porciones), ...))}"""
+    definitions = {recipe_id: [servings or 1, [], []]
+                   for recipe_id, servings in conn.execute('SELECT id, servings FROM recipes')}
+    for recipe_id, ingredient_id, sub_recipe_id, quantity in conn.execute('''
+        SELECT recipe_id, ingredient_id, sub_recipe_id, COALESCE(quantity, 0)
+        FROM recipe_ingredients
+        ORDER BY recipe_id, id
+    '''):
+        definition = definitions.get(recipe_id)
+        if definition is None:
+            continue
+        if sub_recipe_id is not None:
+            definition[2].append((sub_recipe_id, quantity))
+        elif ingredient_id is not None:
+            definition[1].append((ingredient_id, quantity))
+    return {recipe_id: (servings, tuple(lines), tuple(components))
+            for recipe_id, (servings, lines, components) in definitions.items()}
+
+
+def _combine(ids, quantities):
+    """Sumar cantidades del mismo ingrediente: (ids únicos ordenados, cantidades)"""
+    if not ids:
+        return _EMPTY
+    ids = np.concatenate(ids)
+    if len(ids) == 0:
+        return _EMPTY
+    unique, position = np.unique(ids, return_inverse=True)
+    return unique, np.bincount(position, weights=np.concatenate(quantities), minlength=len(unique))
+
+
+# ===== MOTOR =====
+
+class BillOfMaterials:
+    """Grafo de recetas con el vector de ingredientes por porción memorizado"""
+
+    def __init__(self, definitions=None):
+        self._lock = threading.RLock()
+        self._definitions = {}
+        self._parents = {}
+        self._memo = {}
+        self._loaded = -1      # versión de inventario de las definiciones
+        self._required = 0
+        self.exploded = 0      # recetas explotadas (no leídas de la memoria)
+        if definitions is not None:
+            self.update(definitions)
+            self._loaded = 0
+
+    def watch(self, tracker):
+        """Revisar las definiciones en la próxima consulta cuando cambie el inventario"""
+        tracker.on_change('inventory', lambda version, conn: self.require(version))
+
+    def require(self, version):
+        with self._lock:
+            self._required = max(self._required, version)
+
+    def sync(self, conn):
+        """Leer las definiciones si cambió el inventario; devuelve las recetas descartadas"""
+        with self._lock:
+            if self._loaded >= 0 and self._loaded >= self._required:
+                return set()
+            version = domain_version(conn, 'inventory')
+            invalidated = self.update(load_definitions(conn))
+            self._loaded = max(version, 0)
+            return invalidated
+
+    def update(self, definitions):
+        """Reemplazar las definiciones y descartar solo los caminos afectados"""
+        with self._lock:
+            changed = {recipe_id for recipe_id in set(definitions) | set(self._definitions)
+                       if definitions.get(recipe_id) != self._definitions.get(recipe_id)}
+            # Los padres de antes y de ahora: una receta que dejó de usar otra también cambia
+            invalidated = self._ancestors(changed)
+            self._definitions = dict(definitions)
+            self._parents = {}
+            for recipe_id, (_, _, components) in self._definitions.items():
+                for sub_recipe_id, _ in components:
+                    self._parents.setdefault(sub_recipe_id, set()).add(recipe_id)
+            invalidated |= self._ancestors(changed)
+            for recipe_id in invalidated:
+                self._memo.pop(recipe_id, None)
+            return invalidated
+
+    def _ancestors(self, recipe_ids):
+        """Las recetas dadas y todas las que las usan"""
+        seen = set()
+        stack = list(recipe_ids)
+        while stack:
+            recipe_id = stack.pop()
+            if recipe_id in seen:
+                continue
+            seen.add(recipe_id)
+            stack.extend(self._parents.get(recipe_id, ()))
+        return seen
+
+    # ===== EXPLOSIÓN =====
+
+    def vector(self, conn, recipe_id):
+        """(ingredient_ids, cantidades por porción) de una receta; lanza CycleError"""
+        if conn is not None:
+            self.sync(conn)
+        with self._lock:
+            return self._explode(recipe_id, [])
+
+    def _explode(self, recipe_id, path):
+        vector = self._memo.get(recipe_id)
+        if vector is not None:
+            return vector
+        if recipe_id in path:
+            raise CycleError(path[path.index(recipe_id):] + [recipe_id])
+        definition = self._definitions.get(recipe_id)
+        if definition is None:
+            return _EMPTY  # sub-receta eliminada
+        servings, lines, components = definition
+
+        ids = [np.array([ingredient_id for ingredient_id, _ in lines], dtype=np.int64)]
+        quantities = [np.array([quantity for _, quantity in lines], dtype=float)]
+        path.append(recipe_id)
+        for sub_recipe_id, portions in components:
+            sub_ids, sub_quantities = self._explode(sub_recipe_id, path)
+            ids.append(sub_ids)
+            quantities.append(sub_quantities * portions)
+        path.pop()
+
+        unique, total = _combine(ids, quantities)
+        vector = (unique, total / servings)
+        self._memo[recipe_id] = vector
+        self.exploded += 1
+        return vector
+
+    def explode(self, conn, recipe_id):
+        """{ingredient_id: cantidad por porción} de una receta"""
+        ids, quantities = self.vector(conn, recipe_id)
+        return dict(zip(ids.tolist(), quantities.tolist()))
+
+    def components(self, conn, recipe_id):
+        """Sub-recetas directas de una receta [(sub_recipe_id, porciones)]"""
+        self.sync(conn)
+        with self._lock:
+            definition = self._definitions.get(recipe_id)
+            return list(definition[2]) if definition else []
+
+    def check_components(self, conn, recipe_id, sub_recipe_ids, names=None):
+        """Lanzar CycleError si recipe_id (nueva: None) no puede usar esas sub-recetas"""
+        self.sync(conn)
+        with self._lock:
+            for sub_recipe_id in sub_recipe_ids:
+                if sub_recipe_id not in self._definitions:
+                    raise ValueError(f'Sub-receta desconocida: {sub_recipe_id}')
+                if recipe_id is None:
+                    continue
+                path = self._path(sub_recipe_id, recipe_id)
+                if path is not None:
+                    raise CycleError([recipe_id] + path, names)
+
+    def _path(self, start, target):
+        """Camino start → ... → target por las sub-recetas, o None"""
+        stack, seen = [(start, [start])], set()
+        while stack:
+            recipe_id, path = stack.pop()
+            if recipe_id == target:
+                return path
+            if recipe_id in seen:
+                continue
+            seen.add(recipe_id)
+            definition = self._definitions.get(recipe_id)
+            for sub_recipe_id, _ in (definition[2] if definition else ()):
+                stack.append((sub_recipe_id, path + [sub_recipe_id]))
+        return None
+
+    @property
+    def memoized(self):
+        return set(self._memo)
+
+
+def _arg(name, default=None):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+
+if __name__ == "__main__":
+    if '--explode' in sys.argv:
+        path = _arg('--db', 'data/sandwich.db')
+        conn = sqlite3.connect(path)
+        recipe_id = int(_arg('--explode'))
+        names = dict(conn.execute('SELECT id, name FROM ingredients').fetchall())
+        for ingredient_id, quantity in sorted(BillOfMaterials().explode(conn, recipe_id).items()):
+            print(f'  {names.get(ingredient_id, ingredient_id):<30} {quantity:>12,.4f}')
+        conn.close()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Coherencia de cachés en memoria para el sistema Epicuro
+
+La tabla change_log guarda un número de versión por dominio (menu,
+inventory, orders) que suben triggers en cada INSERT, UPDATE o DELETE de las
+tablas del dominio. Así cuenta cualquier escritura: una ruta de este
+worker, otro worker de gunicorn o un script como insert_products.py.
+
+ChangeTracker recuerda la última versión vista de cada dominio y, al
+revisar, llama solo a los callbacks de los dominios que subieron: un cambio
+de inventario no bota el catálogo del menú ni el tablero de cocina.
+
+Revisar es barato para poder hacerlo en cada petición:
+- conexión ya revisada: PRAGMA data_version (cambia cuando otra conexión
+  confirmó algo) y conn.total_changes (cambia cuando esta misma escribió);
+  si ninguno se movió no se lee nada más
+- si no: una sola consulta trae data_version y las versiones de change_log
+
+    python -m pytest tests/test_cache_coherence.py    # escrituras de otra conexión y de la propia
+"""
+
+import sqlite3
+import threading
+import weakref
+
+# Tablas que suben la versión de cada dominio
+DOMAIN_TABLES = {
+    'menu': ('categories', 'products', 'variation_groups', 'variation_options', 'product_variations'),
+    'inventory': ('ingredients', 'inventory_movements', 'suppliers', 'purchases', 'purchase_items',
+                  'recipes', 'recipe_ingredients'),
+    'orders': ('orders', 'order_items', 'order_item_variations'),
+}
+
+TRIGGER_OPERATIONS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+# ===== ESQUEMA =====
+
+def create_change_log(cursor):
+    """Crear change_log y los triggers de las tablas existentes (idempotente)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            domain TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.executemany('INSERT OR IGNORE INTO change_log (domain, version) VALUES (?, 0)',
+                       [(domain,) for domain in DOMAIN_TABLES])
+
+    existing = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for domain, tables in DOMAIN_TABLES.items():
+        for table in tables:
+            if table not in existing:
+                continue
+            for operation in TRIGGER_OPERATIONS:
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {_trigger_name(table, operation)}
+                    AFTER {operation} ON {table}
+                    BEGIN
+                        UPDATE change_log SET version = version + 1 WHERE domain = '{domain}';
+                    END
+                ''')
+
+
+def drop_change_triggers(cursor):
+    """Quitar los triggers (cargas masivas); create_change_log los vuelve a crear"""
+    for tables in DOMAIN_TABLES.values():
+        for table in tables:
+            for operation in TRIGGER_OPERATIONS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {_trigger_name(table, operation)}')
+
+
+def bump_domains(cursor, domains):
+    """Subir la versión a mano (después de una carga sin triggers)"""
+    cursor.executemany('UPDATE change_log SET version = version + 1 WHERE domain = ?',
+                       [(domain,) for domain in domains])
+
+
+def _trigger_name(table, operation):
+    return f'trg_{table}_{operation.lower()}_changes'
+
+
+def domain_version(conn, domain):
+    """Versión actual de un dominio (0 si la base aún no tiene change_log)"""
+    try:
+        row = conn.execute('SELECT version FROM change_log WHERE domain = ?', (domain,)).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+# ===== SEGUIMIENTO =====
+
+class ChangeTracker:
+    """Versiones vistas por dominio y callbacks a llamar cuando suben"""
+
+    def __init__(self):
+        self.versions = {}
+        self._callbacks = {}
+        self._seen = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._poller = None
+
+    def on_change(self, domain, callback=None):
+        """Registrar callback(version, conn) para un dominio (también como decorador)"""
+        if domain not in DOMAIN_TABLES:
+            raise ValueError(f'Dominio desconocido: {domain}')
+
+        def register(func):
+            self._callbacks.setdefault(domain, []).append(func)
+            return func
+
+        return register(callback) if callback is not None else register
+
+    def version(self, domain):
+        return self.versions.get(domain, 0)
+
+    def check(self, conn):
+        """Revisar change_log con conn; devuelve los dominios que cambiaron"""
+        state = self._connection_state(conn)
+        if state is not None and state == (self._data_version(conn), conn.total_changes):
+            return []
+
+        try:
+            rows = conn.execute('''
+                SELECT d.data_version, c.domain, c.version
+                FROM change_log c, pragma_data_version d
+            ''').fetchall()
+        except sqlite3.OperationalError:
+            return []  # Base sin change_log (init_db aún no corrió)
+        if not rows:
+            return []
+
+        changed = []
+        with self._lock:
+            for _, domain, version in rows:
+                seen = self.versions.get(domain)
+                if seen is None or version > seen:
+                    self.versions[domain] = version
+                    # La primera lectura solo fija el punto de partida
+                    if seen is not None:
+                        changed.append((domain, version))
+        self._remember(conn, (rows[0][0], conn.total_changes))
+
+        for domain, version in changed:
+            for callback in self._callbacks.get(domain, ()):
+                try:
+                    callback(version, conn)
+                except Exception as e:
+                    print(f'Error actualizando caché de {domain}: {e}')
+        return [domain for domain, _ in changed]
+
+    def _data_version(self, conn):
+        return conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _connection_state(self, conn):
+        try:
+            return self._seen.get(conn)
+        except TypeError:
+            return None  # sqlite3.Connection base no admite weakref: siempre consulta completa
+
+    def _remember(self, conn, state):
+        try:
+            self._seen[conn] = state
+        except TypeError:
+            pass
+
+    # ===== REVISIÓN PERIÓDICA =====
+
+    def start_polling(self, db_path, interval=1.0):
+        """Revisar cada `interval` segundos en un hilo propio (idempotente)
+
+        Con varios workers sirve para lo que no espera a una petición, como
+        el stream SSE de cocina: un cambio hecho en otro worker llega en a lo
+        más `interval` segundos.
+        """
+        with self._lock:
+            if self._poller is not None and self._poller.is_alive():
+                return
+            self._poller = threading.Thread(target=self._poll, args=(db_path, interval),
+                                            name='change-tracker', daemon=True)
+            self._poller.start()
+
+    def _poll(self, db_path, interval):
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        stop = threading.Event()
+        while not stop.wait(interval):
+            try:
+                self.check(conn)
+            except sqlite3.Error as e:
+                print(f'Error revisando change_log: {e}')
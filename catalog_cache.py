@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Catálogo de menú y variaciones compartido entre procesos
+
+Las pantallas de toma de pedidos (/orders/new, /orders/<id>/edit) y la API
+de variaciones por producto leen siempre lo mismo: categorías activas,
+productos disponibles y los grupos de variaciones de cada producto. Ese
+catálogo se arma una vez, se serializa y:
+
+- con un solo proceso (servidor de desarrollo) queda en memoria
+- con gunicorn (ver gunicorn.conf.py) se publica en un bloque de memoria
+  compartida (multiprocessing.shared_memory) que leen todos los workers
+
+El bloque compartido usa un seqlock: el encabezado lleva un contador de
+secuencia que el escritor deja impar mientras copia los datos y par al
+terminar; el lector copia los datos y los descarta si la secuencia cambió
+en medio. Los escritores se excluyen entre sí con flock sobre un archivo de
+lock. La generación es la versión del dominio 'menu' en change_log (ver
+cache_coherence.py): cuando ChangeTracker ve que subió, llama a require() y
+el catálogo se vuelve a armar aunque el cambio lo haya hecho otro proceso.
+Cada worker guarda el catálogo ya decodificado junto a su generación, así
+el camino normal de una petición solo lee 24 bytes.
+
+    python -m pytest tests/test_catalog_cache.py    # publicar y leer desde otro proceso
+"""
+
+import json
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory
+
+from cache_coherence import domain_version
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin gunicorn, solo caché por proceso
+    fcntl = None
+
+# Encabezado: secuencia, generación, largo de los datos (0 = vacío, hay que armarlo)
+HEADER = struct.Struct('<QQQ')
+DEFAULT_SIZE = 8 * 1024 * 1024
+
+# Lecturas a reintentar si un escritor está copiando
+READ_RETRIES = 200
+
+# Variables de entorno que gunicorn.conf.py pasa a los workers
+ENV_NAME = 'EPICURO_CATALOG_SHM'
+ENV_SIZE = 'EPICURO_CATALOG_SHM_SIZE'
+
+
+# ===== CARGA DESDE LA BASE =====
+
+def load_catalog(conn):
+    """Catálogo como datos simples (serializable a JSON)"""
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    categories = [dict(row) for row in cursor.execute('''
+        SELECT * FROM categories WHERE active = 1 ORDER BY name
+    ''')]
+    products = [dict(row) for row in cursor.execute('''
+        SELECT p.*, c.name as category_name
+        FROM products p
+        JOIN categories c ON p.category_id = c.id
+        WHERE c.active = 1 AND p.available = 1
+        ORDER BY p.name
+    ''')]
+
+    # Mismo formato que /api/product-variations/<id>, para todos los productos
+    variations = {}
+    for row in cursor.execute('''
+        SELECT
+            pv.product_id,
+            vg.id as group_id, vg.name as group_name, vg.display_name as group_display,
+            vg.description as group_description, vg.required as group_required,
+            vg.multiple_selection, vg.min_selections, vg.max_selections,
+            vo.id as option_id, vo.name as option_name, vo.display_name as option_display,
+            vo.price_modifier, vo.sort_order,
+            pv.required as variation_required
+        FROM product_variations pv
+        JOIN variation_groups vg ON pv.variation_group_id = vg.id
+        JOIN variation_options vo ON vg.id = vo.variation_group_id
+        WHERE vg.active = 1 AND vo.active = 1
+        ORDER BY pv.product_id, pv.sort_order, vg.id, vo.sort_order
+    '''):
+        groups = variations.setdefault(str(row['product_id']), {})
+        group = groups.get(row['group_id'])
+        if group is None:
+            group = groups[row['group_id']] = {
+                'id': row['group_id'],
+                'name': row['group_name'],
+                'display_name': row['group_display'],
+                'description': row['group_description'],
+                'required': bool(row['group_required']) or bool(row['variation_required']),
+                'multiple_selection': bool(row['multiple_selection']),
+                'min_selections': row['min_selections'],
+                'max_selections': row['max_selections'],
+                'options': [],
+            }
+        group['options'].append({
+            'id': row['option_id'],
+            'name': row['option_name'],
+            'display_name': row['option_display'],
+            'price_modifier': row['price_modifier'],
+            'sort_order': row['sort_order'],
+        })
+
+    return {
+        'categories': categories,
+        'products': products,
+        'variations': {pid: list(groups.values()) for pid, groups in variations.items()},
+    }
+
+
+class Catalog:
+    """Catálogo decodificado, listo para las plantillas"""
+
+    __slots__ = ('generation', 'categories', 'products_by_category', '_variations')
+
+    def __init__(self, data, generation):
+        self.generation = generation
+        self.categories = data['categories']
+        self.products_by_category = {category['id']: [] for category in self.categories}
+        for product in data['products']:
+            self.products_by_category.setdefault(product['category_id'], []).append(product)
+        self._variations = data['variations']
+
+    def variations(self, product_id):
+        """Grupos de variaciones de un producto (lista vacía si no tiene)"""
+        return self._variations.get(str(product_id), [])
+
+
+def encode_catalog(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+# ===== MEMORIA COMPARTIDA =====
+
+def _open(name, create=False, size=0):
+    """SharedMemory cuya vida manejamos nosotros (create/unlink explícitos)
+
+    Sin esto el resource_tracker de multiprocessing borra el bloque cuando
+    termina el proceso que lo abrió, por ejemplo un worker reciclado.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    from multiprocessing import resource_tracker
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _unlink(shm):
+    if sys.version_info < (3, 13):
+        # unlink() también avisa al resource_tracker: registrar antes para que cuadre
+        from multiprocessing import resource_tracker
+        resource_tracker.register(shm._name, 'shared_memory')
+    shm.unlink()
+
+
+class SharedSnapshot:
+    """Bytes versionados en memoria compartida, protegidos con un seqlock"""
+
+    def __init__(self, shm, lock_path):
+        self.shm = shm
+        self.buf = shm.buf
+        self.capacity = shm.size - HEADER.size
+        self.lock_path = lock_path
+
+    @classmethod
+    def create(cls, name, size=DEFAULT_SIZE):
+        """Crear el bloque (proceso maestro); queda vacío"""
+        try:
+            stale = _open(name)
+            stale.close()
+            _unlink(stale)  # Bloque de una ejecución anterior que no terminó bien
+        except FileNotFoundError:
+            pass
+        shm = _open(name, create=True, size=HEADER.size + size)
+        HEADER.pack_into(shm.buf, 0, 0, 0, 0)
+        return cls(shm, _lock_path(name))
+
+    @classmethod
+    def attach(cls, name):
+        return cls(_open(name), _lock_path(name))
+
+    # ===== LECTURA =====
+
+    def header(self):
+        """(secuencia, generación, largo)"""
+        return HEADER.unpack_from(self.buf, 0)
+
+    def sequence(self):
+        return struct.unpack_from('<Q', self.buf, 0)[0]
+
+    def read(self):
+        """(generación, bytes o None si está vacío); None si no se logró una lectura estable"""
+        for attempt in range(READ_RETRIES):
+            seq, generation, length = self.header()
+            if seq & 1:
+                time.sleep(0 if attempt < 20 else 0.001)
+                continue
+            data = bytes(self.buf[HEADER.size:HEADER.size + length]) if length else None
+            if self.sequence() == seq:
+                return generation, data
+        return None
+
+    # ===== ESCRITURA =====
+
+    def write(self, data, generation=None):
+        """Publicar datos de una generación (por omisión la actual + 1); devuelve la publicada
+
+        No reemplaza datos de una generación más nueva que otro proceso ya
+        publicó: en ese caso devuelve esa generación.
+        """
+        if len(data) > self.capacity:
+            raise ValueError(f'Catálogo de {len(data)} bytes no cabe en {self.capacity} bytes '
+                             f'(aumente {ENV_SIZE})')
+        with self._exclusive():
+            seq, current, length = self.header()
+            if generation is None:
+                generation = current + 1
+            elif length and current > generation:
+                return current
+            struct.pack_into('<Q', self.buf, 0, seq + 1)
+            self.buf[HEADER.size:HEADER.size + len(data)] = data
+            HEADER.pack_into(self.buf, 0, seq + 1, generation, len(data))
+            struct.pack_into('<Q', self.buf, 0, seq + 2)
+            return generation
+
+    def clear(self):
+        """Marcar vacío: el próximo lector arma el catálogo desde la base"""
+        with self._exclusive():
+            seq, generation, _ = self.header()
+            HEADER.pack_into(self.buf, 0, seq + 1, generation, 0)
+            struct.pack_into('<Q', self.buf, 0, seq + 2)
+
+    def _exclusive(self):
+        return _FileLock(self.lock_path)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        _unlink(self.shm)
+        try:
+            os.remove(self.lock_path)
+        except OSError:
+            pass
+
+
+def _lock_path(name):
+    return os.path.join(tempfile.gettempdir(), f'{name}.lock')
+
+
+class _FileLock:
+    """flock exclusivo entre procesos (y un lock entre hilos del mismo proceso)"""
+
+    _thread_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self._thread_lock.release()
+
+
+# ===== CACHÉ =====
+
+class CatalogCache:
+    """Catálogo por proceso, respaldado por memoria compartida si está configurada"""
+
+    def __init__(self, shared=None):
+        self.shared = shared
+        self.required = 0
+        self._catalog = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Caché compartida si gunicorn.conf.py creó el bloque, si no local"""
+        name = os.environ.get(ENV_NAME)
+        if name and fcntl is not None:
+            try:
+                return cls(SharedSnapshot.attach(name))
+            except FileNotFoundError:
+                print(f'⚠️  Bloque de catálogo {name} no existe; se usa caché local')
+        return cls()
+
+    def require(self, version):
+        """Versión del menú que ya existe en la base: las anteriores quedan obsoletas"""
+        if version > self.required:
+            self.required = version
+
+    def get(self, conn):
+        """Catálogo vigente (lo arma desde conn si hace falta)"""
+        if self.shared is None:
+            catalog = self._catalog
+            if catalog is None or catalog.generation < self.required:
+                with self._lock:
+                    catalog = self._catalog
+                    if catalog is None or catalog.generation < self.required:
+                        catalog = self._catalog = Catalog(*self._load(conn))
+            return catalog
+        return self._get_shared(conn)
+
+    def _load(self, conn):
+        """(datos, generación) desde la base"""
+        # La versión se lee antes: si cambia en medio, el catálogo queda marcado como viejo
+        generation = domain_version(conn, 'menu')
+        return load_catalog(conn), generation
+
+    def _get_shared(self, conn):
+        catalog = self._catalog
+        required = self.required
+        seq, generation, length = self.shared.header()
+        if (catalog is not None and catalog.generation == generation and generation >= required
+                and not seq & 1 and length):
+            return catalog
+
+        snapshot = self.shared.read()
+        if snapshot is not None and snapshot[1] is not None and snapshot[0] >= required:
+            generation, data = snapshot
+            catalog = Catalog(json.loads(data), generation)
+        else:
+            # Vacío, ilegible u obsoleto: armarlo, publicarlo y usarlo
+            catalog = self._publish(*self._load(conn))
+        self._catalog = catalog
+        return catalog
+
+    def _publish(self, data, generation):
+        try:
+            self.shared.write(encode_catalog(data), generation)
+        except ValueError as e:
+            print(f'⚠️  {e}')
+            self.shared.clear()
+        return Catalog(data, generation)
+
+    def invalidate(self, conn=None):
+        """Descartar el catálogo aunque la versión del menú no haya cambiado
+
+        Con conn se publica de inmediato el catálogo nuevo; sin conn lo arma el
+        próximo lector. Los cambios normales llegan por require().
+        """
+        if self.shared is None:
+            with self._lock:
+                self._catalog = None
+            return
+        if conn is None:
+            self.shared.clear()
+            self._catalog = None
+            return
+        self._catalog = self._publish(*self._load(conn))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Ventas por categoría con comparación de períodos para el sistema Epicuro
+
+Cada línea de orden llega a su categoría por product_id con el arreglo
+product_id -> category_id de OrderAnalytics (order_analytics.py), y solo se
+suman las líneas del rango pedido: el rango es un searchsorted sobre las
+líneas ordenadas por fecha, así el costo depende del período y no de toda
+la historia.
+
+Períodos (fin exclusivo):
+- week: los últimos 7 días, hoy incluido
+- month: el mes en curso hasta hoy
+- custom: start..end, ambos incluidos
+
+La comparación es contra el período anterior del mismo largo ('previous';
+para month, los mismos días del mes anterior) o contra las mismas fechas
+del año anterior ('year').
+"""
+
+import calendar
+import datetime
+
+PERIODS = ('week', 'month', 'custom')
+COMPARISONS = ('previous', 'year')
+
+DAY = datetime.timedelta(days=1)
+
+
+def period_range(period, today, start=None, end=None):
+    """(inicio, fin exclusivo) de un período; lanza ValueError si no es válido"""
+    if period == 'week':
+        return today - 6 * DAY, today + DAY
+    if period == 'month':
+        return today.replace(day=1), today + DAY
+    if period == 'custom':
+        if start is None or end is None:
+            raise ValueError('El período custom necesita start_date y end_date')
+        if end < start:
+            raise ValueError('La fecha final debe ser posterior a la inicial')
+        return start, end + DAY
+    raise ValueError(f"Período desconocido: {period} (usar {', '.join(PERIODS)})")
+
+
+def comparison_range(period, start, end, compare='previous'):
+    """Rango con el que se compara [start, end)"""
+    if compare == 'year':
+        return _years_before(start), _years_before(end)
+    if compare != 'previous':
+        raise ValueError(f"Comparación desconocida: {compare} (usar {', '.join(COMPARISONS)})")
+    if period == 'month':
+        # Mes anterior, mismos días transcurridos (sin pasarse de su último día)
+        previous_start = (start - DAY).replace(day=1)
+        days = min((end - start).days, calendar.monthrange(previous_start.year, previous_start.month)[1])
+        return previous_start, previous_start + days * DAY
+    length = end - start
+    return start - length, start
+
+
+def _years_before(day, years=1):
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:  # 29 de febrero
+        return day.replace(year=day.year - years, day=28)
+
+
+class CategorySales:
+    """Ventas por categoría sobre la caché columnar de líneas de órdenes"""
+
+    def __init__(self, analytics):
+        self.analytics = analytics
+
+    def totals(self, start=None, end=None):
+        """{category_id: ventas} de las líneas con start <= fecha < end"""
+        return {group['key']: group['revenue']
+                for group in self.analytics.group_by('category_id', start, end)
+                if group['key'] is not None and group['key'] >= 0}
+
+    def report(self, categories, start=None, end=None):
+        """Filas {category_name, color, total_sales} de las categorías dadas (incluye las sin ventas)"""
+        totals = self.totals(start, end)
+        rows = [{
+            'category_id': category['id'],
+            'category_name': category['name'],
+            'color': category.get('color'),
+            'total_sales': totals.get(category['id'], 0),
+        } for category in categories]
+        rows.sort(key=lambda row: -row['total_sales'])
+        return rows
+
+    def compare(self, categories, start, end, previous_start, previous_end):
+        """Filas del período con las ventas del período de comparación y la variación"""
+        previous = self.totals(previous_start, previous_end)
+        rows = self.report(categories, start, end)
+        for row in rows:
+            before = previous.get(row['category_id'], 0)
+            row['previous_sales'] = before
+            row['change'] = row['total_sales'] - before
+            row['change_pct'] = round(row['change'] / before * 100, 1) if before else None
+        return rows
@@ -1,6 +1,7 @@
 import pandas as pd
 import sqlite3
 import os
+from product_matcher import ProductMatcher
 
 def check_missing_products(excel_file, db_path='data/sandwich.db'):
     """
@@ -54,15 +55,17 @@ def check_missing_products(excel_file, db_path='data/sandwich.db'):
         ''', conn)
         categorias_bd = set(df_categorias['categoria'].str.upper())
         
+        # Índice difuso para tolerar tildes y errores de escritura
+        matcher = ProductMatcher.from_db(conn, available_only=True)
+        
         conn.close()
         
         # Comparar productos
-        productos_bd = set(df_bd['producto'].str.upper())
         productos_excel_set = set(productos_excel['Producto'].str.upper())
         
         # Productos que faltan
-        productos_faltantes = productos_excel_set - productos_bd
-        productos_existentes = productos_excel_set & productos_bd
+        productos_existentes = {p for p in productos_excel_set if matcher.best_match(p)}
+        productos_faltantes = productos_excel_set - productos_existentes
         
         print(f"\n=== RESULTADOS ===")
         print(f"✅ Productos que YA EXISTEN: {len(productos_existentes)}")
@@ -146,16 +149,15 @@ def create_missing_products_sql(excel_file, db_path='data/sandwich.db'):
         
         # Conectar a BD
         conn = sqlite3.connect(db_path)
-        df_bd = pd.read_sql_query('SELECT name FROM products WHERE available = 1', conn)
+        matcher = ProductMatcher.from_db(conn, available_only=True)
         df_categorias = pd.read_sql_query('SELECT name FROM categories WHERE active = 1', conn)
         conn.close()
         
-        productos_bd = set(df_bd['name'].str.upper())
         categorias_bd = set(df_categorias['name'].str.upper())
         
         # Productos faltantes
         productos_faltantes = productos_excel[
-            ~productos_excel['Producto'].str.upper().isin(productos_bd)
+            productos_excel['Producto'].map(lambda p: matcher.best_match(p) is None)
         ]
         
         if productos_faltantes.empty:
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Simulación de cambios de precio de ingredientes para el sistema Epicuro
+
+"¿Qué pasa si el queso sube 15%?": con los precios simulados se recalcula el
+costo de todas las recetas y productos sin escribir en la base.
+
+recipe_ingredients se guarda en memoria como una matriz dispersa en
+coordenadas (fila = receta, columna = ingrediente, valor = cantidad por
+porción, con las sub-recetas ya explotadas por bill_of_materials.py). El
+costo de todas las recetas es un solo producto matriz-vector:
+
+    costo_receta = np.bincount(fila, weights=valor * precio[columna])
+
+y como el producto es lineal, el cambio de costo sale de aplicar lo mismo a
+la diferencia de precios. Cada producto toma la fila de su receta
+(products.recipe_id) o products.cost si no tiene receta (ese costo no
+cambia). La matriz se arma una vez y se vuelve a armar cuando change_log
+muestra un cambio de menú o de inventario (ver cache_coherence.py).
+
+El impacto de un producto es la variación de margen por unidad
+multiplicada por las unidades vendidas en los últimos días
+(product_sales_daily, ver sales_rollup.py): así primero aparece lo que más
+margen hace perder en la práctica.
+
+    python -m pytest tests/test_cost_simulation.py
+    python cost_simulation.py --bench [--db data/sandwich.db]
+"""
+
+import datetime
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+
+from bill_of_materials import BillOfMaterials, CycleError
+from cache_coherence import domain_version
+from recipe_costing import load_fallback_costs
+from sales_rollup import plain_number
+
+SORT_KEYS = ('impact', 'unit', 'pct')
+
+
+class CostMatrix:
+    """Recetas × ingredientes en arreglos NumPy, con precios y productos actuales"""
+
+    def __init__(self, conn, bom=None):
+        if bom is None:
+            bom = BillOfMaterials()
+        ingredients = conn.execute('SELECT id, name, COALESCE(unit_cost, 0) FROM ingredients ORDER BY id').fetchall()
+        self.ingredient_ids = np.array([row[0] for row in ingredients], dtype=np.int64)
+        self.ingredient_names = [row[1] for row in ingredients]
+        self.prices = np.array([row[2] for row in ingredients], dtype=float)
+
+        recipes = conn.execute('SELECT id, name FROM recipes ORDER BY id').fetchall()
+        self.recipe_ids = np.array([row[0] for row in recipes], dtype=np.int64)
+        self.recipe_names = [row[1] for row in recipes]
+
+        # Una fila por receta con su vector explotado (ya por porción); una
+        # receta con ciclo queda sin líneas
+        rows, ingredient_id, quantity = [], [], []
+        bom.sync(conn)
+        for row, recipe_id in enumerate(self.recipe_ids.tolist()):
+            try:
+                ids, quantities = bom.vector(None, recipe_id)
+            except CycleError:
+                continue
+            rows.append(np.full(len(ids), row, dtype=np.int64))
+            ingredient_id.append(ids)
+            quantity.append(quantities)
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        ingredient_id = np.concatenate(ingredient_id).astype(np.int64) if ingredient_id else np.zeros(0, dtype=np.int64)
+        quantity = np.concatenate(quantity) if quantity else np.zeros(0)
+        # Solo los ingredientes que existen
+        cols, known = self._index(self.ingredient_ids, ingredient_id)
+        self.rows, self.cols, self.values = rows[known], cols[known], quantity[known]
+
+        fallback = load_fallback_costs(conn)
+        products = conn.execute('SELECT id, name, price, recipe_id FROM products ORDER BY id').fetchall()
+        self.product_ids = np.array([row[0] for row in products], dtype=np.int64)
+        self.product_names = [row[1] for row in products]
+        self.product_prices = np.array([row[2] or 0 for row in products], dtype=float)
+        index, known = self._index(self.recipe_ids, np.array([row[3] or 0 for row in products], dtype=np.int64))
+        self.product_recipe = np.where(known, index, -1)
+        self.product_fallback = np.array([fallback.get(row[0], np.nan) for row in products], dtype=float)
+
+    @staticmethod
+    def _index(sorted_ids, ids):
+        """(posición en sorted_ids, existe) de cada id"""
+        if len(sorted_ids) == 0:
+            return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+        position = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return position, sorted_ids[position] == ids
+
+    def recipe_costs(self, prices):
+        """Costo por porción de cada receta con un vector de precios (el producto disperso)"""
+        return np.bincount(self.rows, weights=self.values * prices[self.cols], minlength=len(self.recipe_ids))
+
+    def product_costs(self, recipe_costs):
+        """Costo de cada producto: su receta, products.cost, o NaN si no tiene costo"""
+        has_recipe = self.product_recipe >= 0
+        return np.where(has_recipe, recipe_costs[np.maximum(self.product_recipe, 0)], self.product_fallback)
+
+    def simulated_prices(self, changes):
+        """Precios con los cambios [{ingredient_id, unit_cost | change_pct}] (lanza ValueError)"""
+        prices = self.prices.copy()
+        for change in changes:
+            try:
+                ingredient_id = int(change['ingredient_id'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError('Cada cambio necesita ingredient_id')
+            position, known = self._index(self.ingredient_ids, np.array([ingredient_id]))
+            if not known[0]:
+                raise ValueError(f'Ingrediente desconocido: {ingredient_id}')
+            try:
+                if change.get('unit_cost') is not None:
+                    price = float(change['unit_cost'])
+                elif change.get('change_pct') is not None:
+                    price = self.prices[position[0]] * (1 + float(change['change_pct']) / 100)
+                else:
+                    raise ValueError
+            except (TypeError, ValueError):
+                raise ValueError(f'Cambio inválido para el ingrediente {ingredient_id}: usar unit_cost o change_pct')
+            if price < 0:
+                raise ValueError(f'El costo del ingrediente {ingredient_id} no puede ser negativo')
+            prices[position[0]] = price
+        return prices
+
+
+class CostSimulator:
+    """CostMatrix en memoria, al día con change_log"""
+
+    DOMAINS = ('menu', 'inventory')
+
+    def __init__(self, bom=None):
+        self.bom = bom        # BillOfMaterials compartido (memoria de sub-recetas)
+        self._matrix = None
+        self._loaded = {}     # versiones de change_log con que se armó
+        self._required = {}   # versiones vistas por el tracker
+        self._lock = threading.Lock()
+
+    def watch(self, tracker):
+        """Rearmar la matriz en la próxima simulación cuando cambie el menú o el inventario"""
+        for domain in self.DOMAINS:
+            tracker.on_change(domain, lambda version, conn, domain=domain: self.require(domain, version))
+
+    def require(self, domain, version):
+        with self._lock:
+            self._required[domain] = max(version, self._required.get(domain, 0))
+
+    def matrix(self, conn):
+        with self._lock:
+            if self._matrix is not None and all(
+                    self._loaded.get(domain, 0) >= version for domain, version in self._required.items()):
+                return self._matrix
+        loaded = {domain: domain_version(conn, domain) for domain in self.DOMAINS}
+        matrix = CostMatrix(conn, self.bom)
+        with self._lock:
+            self._matrix, self._loaded = matrix, loaded
+        return matrix
+
+    def simulate(self, conn, changes, volumes=None, sort='impact', include_all=False):
+        """Tabla de impacto de los cambios de precio; no escribe en la base"""
+        return simulate(self.matrix(conn), changes, volumes, sort, include_all)
+
+
+def sales_volumes(conn, start, end):
+    """{product_id: unidades vendidas} de start <= día < end según product_sales_daily"""
+    return dict(conn.execute('''
+        SELECT product_id, SUM(quantity) FROM product_sales_daily
+        WHERE day >= ? AND day < ? AND product_id >= 0
+        GROUP BY product_id
+    ''', (str(start), str(end))).fetchall())
+
+
+def simulate(matrix, changes, volumes=None, sort='impact', include_all=False):
+    """Costo y margen antes y después de cada producto y receta afectados, ordenados por pérdida"""
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Orden desconocido: {sort} (usar {', '.join(SORT_KEYS)})")
+    prices = matrix.simulated_prices(changes)
+
+    recipe_before = matrix.recipe_costs(matrix.prices)
+    recipe_delta = matrix.recipe_costs(prices - matrix.prices)
+    before = matrix.product_costs(recipe_before)
+    delta = np.where(matrix.product_recipe >= 0, recipe_delta[np.maximum(matrix.product_recipe, 0)], 0.0)
+    after = before + delta
+
+    price = matrix.product_prices
+    margin_before, margin_after = price - before, price - after
+    volumes = volumes or {}
+    units = np.array([volumes.get(product_id, 0) for product_id in matrix.product_ids.tolist()], dtype=float)
+    impact = -delta * units
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_before = np.where(price > 0, margin_before / price * 100, np.nan)
+        pct_after = np.where(price > 0, margin_after / price * 100, np.nan)
+
+    selected = np.flatnonzero(~np.isnan(before) & (include_all | (np.abs(delta) > 1e-9)))
+    order_key = {'impact': impact, 'unit': -delta, 'pct': pct_after - pct_before}[sort]
+    selected = selected[np.lexsort((-delta[selected], np.nan_to_num(order_key[selected])))]
+
+    products = [{
+        'product_id': int(matrix.product_ids[i]),
+        'name': matrix.product_names[i],
+        'price': plain_number(price[i]),
+        'cost_before': round(float(before[i]), 2),
+        'cost_after': round(float(after[i]), 2),
+        'cost_change': round(float(delta[i]), 2),
+        'margin_before': round(float(margin_before[i]), 2),
+        'margin_after': round(float(margin_after[i]), 2),
+        'margin_pct_before': None if np.isnan(pct_before[i]) else round(float(pct_before[i]), 1),
+        'margin_pct_after': None if np.isnan(pct_after[i]) else round(float(pct_after[i]), 1),
+        'units': plain_number(units[i]),
+        'impact': round(float(impact[i]), 2),
+    } for i in selected.tolist()]
+
+    changed = np.flatnonzero(np.abs(recipe_delta) > 1e-9)
+    changed = changed[np.argsort(-recipe_delta[changed], kind='stable')]
+    recipes = [{
+        'recipe_id': int(matrix.recipe_ids[i]),
+        'name': matrix.recipe_names[i],
+        'cost_before': round(float(recipe_before[i]), 2),
+        'cost_after': round(float(recipe_before[i] + recipe_delta[i]), 2),
+        'cost_change': round(float(recipe_delta[i]), 2),
+    } for i in changed.tolist()]
+
+    moved = np.flatnonzero(prices != matrix.prices)
+    return {
+        'ingredients': [{
+            'ingredient_id': int(matrix.ingredient_ids[i]),
+            'name': matrix.ingredient_names[i],
+            'unit_cost_before': plain_number(matrix.prices[i]),
+            'unit_cost_after': round(float(prices[i]), 4),
+        } for i in moved.tolist()],
+        'recipes': recipes,
+        'products': products,
+        'total_impact': round(float(impact[selected].sum()), 2) if len(selected) else 0,
+    }
+
+
+def _arg(name, default=None):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+
+if __name__ == "__main__":
+    if '--bench' in sys.argv:
+        import time
+
+        path = _arg('--db', 'data/sandwich.db')
+        conn = sqlite3.connect(path)
+        started = time.perf_counter()
+        matrix = CostMatrix(conn)
+        built = time.perf_counter() - started
+        today = datetime.date.today()
+        volumes = sales_volumes(conn, today - datetime.timedelta(days=30), today + datetime.timedelta(days=1))
+        changes = [{'ingredient_id': int(i), 'change_pct': 15} for i in matrix.ingredient_ids[:10]]
+        started = time.perf_counter()
+        for _ in range(100):
+            result = simulate(matrix, changes, volumes)
+        each = (time.perf_counter() - started) / 100
+        print(f'✅ {len(matrix.recipe_ids):,} recetas, {len(matrix.rows):,} líneas: matriz {built * 1000:.1f} ms, '
+              f'simulación {each * 1000:.2f} ms ({len(result["products"])} productos afectados)')
+        conn.close()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Estadísticas de los dashboards en memoria para el sistema Epicuro
+
+El dashboard principal (cada pantalla lo recarga cada 30 s) y el de
+inventario (cada 2 minutos) leen sus cifras de aquí, sin consultar la base:
+
+- orders: órdenes e ingresos del día, total de órdenes y las más recientes
+- menu: productos disponibles y categorías activas
+- inventory: ingredientes activos (de ahí stock bajo, valor y alertas),
+  compras pendientes, recetas, proveedores y últimos movimientos
+
+Cada sección es un dominio de change_log (ver cache_coherence.py):
+
+- las escrituras de órdenes de la app se aplican al confirmar
+  (order_saved) con la versión de 'orders' leída al tomar el lock de
+  escritura y la leída antes del commit: si la primera es la que ya tenía
+  la sección, todo lo que subió es de esa transacción y el aviso de
+  ChangeTracker no recarga nada; si no, otro proceso confirmó algo entre
+  medio y la sección se recarga
+- las de inventario corrigen de inmediato ingredientes y compras
+  (ingredient_saved, purchase_saved) y el resto de la sección se recarga
+- lo que escriben otros procesos o el menú marca la sección y un hilo la
+  recarga en segundo plano
+
+Cada `reconcile_interval` segundos el mismo hilo recalcula todo; si una
+sección que decía estar al día no cuadra con la base se cuenta en
+epicuro_dashboard_stats_drift_total.
+
+    python -m pytest tests/test_dashboard_stats.py
+"""
+
+import datetime
+import sqlite3
+import threading
+import time
+
+import metrics
+from cache_coherence import domain_version
+
+RECENT_ORDERS = 5
+LOW_STOCK_ALERTS = 5
+PENDING_PURCHASES = 5
+RECENT_MOVEMENTS = 10
+
+DEFAULT_RECONCILE_INTERVAL = 300
+
+ORDER_COLUMNS = 'id, order_number, customer_name, total_amount, status, created_at'
+INGREDIENT_COLUMNS = 'id, name, current_stock, min_stock, unit, unit_cost, active'
+
+
+# ===== CARGA DESDE LA BASE =====
+
+def load_orders(conn, day):
+    next_day = (datetime.date.fromisoformat(day) + datetime.timedelta(days=1)).isoformat()
+    # Rango sobre created_at canónico (usa idx_orders_created_at, date() no)
+    orders_today, revenue_today = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(total_amount), 0)
+        FROM orders WHERE created_at >= ? AND created_at < ?
+    ''', (day, next_day)).fetchone()
+    recent = conn.execute(f'''
+        SELECT {ORDER_COLUMNS} FROM orders
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    ''', (RECENT_ORDERS,)).fetchall()
+    return {
+        'day': day,
+        'orders_today': orders_today,
+        'revenue_today': revenue_today,
+        'total_orders': conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0],
+        'recent_orders': [_row(order) for order in recent],
+    }
+
+
+def load_menu(conn, day=None):
+    return {
+        'total_products': conn.execute('SELECT COUNT(*) FROM products WHERE available = 1').fetchone()[0],
+        'total_categories': conn.execute('SELECT COUNT(*) FROM categories WHERE active = 1').fetchone()[0],
+    }
+
+
+def load_inventory(conn, day=None):
+    ingredients = conn.execute(f'SELECT {INGREDIENT_COLUMNS} FROM ingredients WHERE active = 1').fetchall()
+    pending = conn.execute('''
+        SELECT p.*, s.name as supplier_name
+        FROM purchases p
+        LEFT JOIN suppliers s ON p.supplier_id = s.id
+        WHERE p.status = 'pending'
+    ''').fetchall()
+    movements = conn.execute('''
+        SELECT im.*, i.name as ingredient_name
+        FROM inventory_movements im
+        JOIN ingredients i ON im.ingredient_id = i.id
+        ORDER BY im.created_at DESC
+        LIMIT ?
+    ''', (RECENT_MOVEMENTS,)).fetchall()
+    return {
+        'ingredients': {row['id']: _row(row) for row in ingredients},
+        'pending_purchases': {row['id']: _row(row) for row in pending},
+        'total_recipes': conn.execute('SELECT COUNT(*) FROM recipes WHERE active = 1').fetchone()[0],
+        'total_suppliers': conn.execute('SELECT COUNT(*) FROM suppliers WHERE active = 1').fetchone()[0],
+        'recent_movements': [_row(row) for row in movements],
+    }
+
+
+LOADERS = {'orders': load_orders, 'menu': load_menu, 'inventory': load_inventory}
+
+
+def _row(row):
+    return dict(zip(row.keys(), row))
+
+
+# ===== CIFRAS DERIVADAS =====
+
+def _is_low_stock(ingredient):
+    stock, minimum = ingredient['current_stock'], ingredient['min_stock']
+    return stock is not None and minimum is not None and stock <= minimum
+
+
+def _stock_ratio(ingredient):
+    # Igual que ORDER BY current_stock/min_stock: la división por cero (NULL) va primero
+    if not ingredient['min_stock']:
+        return (0, 0)
+    return (1, ingredient['current_stock'] / ingredient['min_stock'])
+
+
+def _expected_date(purchase):
+    # ORDER BY expected_date ASC: NULL primero
+    return (purchase['expected_date'] is not None, purchase['expected_date'] or '')
+
+
+def summarize(domain, data):
+    """Contadores de una sección (para comparar con la base)"""
+    if domain == 'orders':
+        return (data['orders_today'], round(data['revenue_today'], 2), data['total_orders'],
+                tuple(order['id'] for order in data['recent_orders']))
+    if domain == 'menu':
+        return (data['total_products'], data['total_categories'])
+    ingredients = data['ingredients'].values()
+    return (len(data['ingredients']), sum(1 for i in ingredients if _is_low_stock(i)),
+            round(sum((i['current_stock'] or 0) * (i['unit_cost'] or 0) for i in ingredients), 2),
+            tuple(sorted(data['pending_purchases'])), data['total_recipes'], data['total_suppliers'])
+
+
+# ===== SERVICIO =====
+
+class DashboardStats:
+    """Cifras de los dashboards por proceso, al día por write-through y reconciliación"""
+
+    def __init__(self, today=None, reconcile_interval=DEFAULT_RECONCILE_INTERVAL):
+        self._today = today or (lambda: datetime.date.today().isoformat())
+        self.reconcile_interval = reconcile_interval
+        self._sections = {}
+        self._versions = {}
+        self._stale = set()
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def watch(self, tracker):
+        """Recibir de un ChangeTracker los cambios de cada dominio"""
+        for domain in LOADERS:
+            tracker.on_change(domain, lambda version, conn, domain=domain: self.domain_changed(domain, version))
+
+    def start(self, db_path):
+        """Hilo de recarga y reconciliación (idempotente)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, args=(db_path,),
+                                            name='dashboard-stats', daemon=True)
+            self._thread.start()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # ===== LECTURA =====
+
+    def index_stats(self, conn):
+        """(stats, recent_orders) del dashboard principal; conn solo se usa la primera vez"""
+        orders = self._section('orders', conn)
+        menu = self._section('menu', conn)
+        with self._lock:
+            stats = {
+                'orders_today': orders['orders_today'],
+                'revenue_today': orders['revenue_today'],
+                'total_orders': orders['total_orders'],
+                'total_products': menu['total_products'],
+                'total_categories': menu['total_categories'],
+            }
+            return stats, [dict(order) for order in orders['recent_orders']]
+
+    def inventory_stats(self, conn):
+        """(stats, low_stock_alerts, pending_purchases, recent_movements) del dashboard de inventario"""
+        inventory = self._section('inventory', conn)
+        with self._lock:
+            ingredients = list(inventory['ingredients'].values())
+            low_stock = [dict(i) for i in ingredients if _is_low_stock(i)]
+            pending = [dict(p) for p in inventory['pending_purchases'].values()]
+            stats = {
+                'total_ingredients': len(ingredients),
+                'low_stock_count': len(low_stock),
+                'total_recipes': inventory['total_recipes'],
+                'pending_purchases': len(pending),
+                'total_suppliers': inventory['total_suppliers'],
+                'inventory_value': sum((i['current_stock'] or 0) * (i['unit_cost'] or 0) for i in ingredients),
+            }
+            movements = [dict(m) for m in inventory['recent_movements']]
+        low_stock.sort(key=_stock_ratio)
+        pending.sort(key=_expected_date)
+        return stats, low_stock[:LOW_STOCK_ALERTS], pending[:PENDING_PURCHASES], movements
+
+    def _section(self, domain, conn):
+        with self._lock:
+            data = self._sections.get(domain)
+            if data is not None and domain == 'orders' and data['day'] != self._today():
+                # Cambio de día: el día nuevo parte en cero y se confirma en segundo plano
+                data['day'] = self._today()
+                data['orders_today'] = 0
+                data['revenue_today'] = 0
+                self._stale.add(domain)
+                self._wake.set()
+            stale = domain in self._stale
+        if data is None or (stale and not self.running):
+            data = self.reload(domain, conn)
+        return data
+
+    # ===== WRITE-THROUGH =====
+
+    def order_saved(self, before, after, version=None, base_version=None):
+        """Aplicar una orden confirmada: before/after con ORDER_COLUMNS (None al crear/eliminar)
+
+        base_version y version son las de 'orders' leídas en la misma
+        transacción: al tomar el lock de escritura (BEGIN IMMEDIATE) y antes
+        del commit.
+        """
+        with self._lock:
+            data = self._sections.get('orders')
+            if data is None:
+                return
+            seen = self._versions.get('orders', 0)
+            if version is not None and seen >= version:
+                return  # Una recarga posterior al commit ya trae esta orden
+            for row, sign in ((before, -1), (after, 1)):
+                if row is None:
+                    continue
+                data['total_orders'] += sign
+                if str(row['created_at'])[:10] == data['day']:
+                    data['orders_today'] += sign
+                    data['revenue_today'] += sign * (row['total_amount'] or 0)
+
+            order_id = (after or before or {'id': None})['id']
+            recent = [order for order in data['recent_orders'] if order['id'] != order_id]
+            if after is not None:
+                recent.append(_row(after))
+                recent.sort(key=lambda order: (str(order['created_at']), order['id']), reverse=True)
+            elif len(recent) < len(data['recent_orders']) and data['total_orders'] >= RECENT_ORDERS:
+                # Se eliminó una de las recientes: hay que traer la siguiente desde la base
+                self._stale.add('orders')
+                self._wake.set()
+            data['recent_orders'] = recent[:RECENT_ORDERS]
+
+            if version is not None and base_version == seen:
+                # Entre seen y version solo escribió esta transacción
+                self._versions['orders'] = version
+            else:
+                # Otro proceso confirmó órdenes que la sección no tiene
+                self._stale.add('orders')
+                self._wake.set()
+
+    def ingredient_saved(self, ingredient_id, row):
+        """Ingrediente confirmado (row con INGREDIENT_COLUMNS, None si se eliminó)"""
+        with self._lock:
+            data = self._sections.get('inventory')
+            if data is None:
+                return
+            if row is None or not row['active']:
+                data['ingredients'].pop(ingredient_id, None)
+            else:
+                data['ingredients'][ingredient_id] = _row(row)
+
+    def purchase_saved(self, purchase_id, row):
+        """Compra confirmada (row de purchases con supplier_name)"""
+        with self._lock:
+            data = self._sections.get('inventory')
+            if data is None:
+                return
+            if row is None or row['status'] != 'pending':
+                data['pending_purchases'].pop(purchase_id, None)
+            else:
+                data['pending_purchases'][purchase_id] = _row(row)
+
+    # ===== RECARGA =====
+
+    def domain_changed(self, domain, version):
+        """Aviso de ChangeTracker: recargar si la versión no viene de un write-through"""
+        with self._lock:
+            if domain not in self._sections or version <= self._versions.get(domain, 0):
+                return
+            self._stale.add(domain)
+        self._wake.set()
+
+    def reload(self, domain, conn, count_drift=False):
+        """Recalcular una sección desde la base; devuelve sus datos"""
+        version = domain_version(conn, domain)
+        data = LOADERS[domain](conn, self._today())
+        with self._lock:
+            current = self._sections.get(domain)
+            seen = self._versions.get(domain, 0)
+            if current is not None and seen > version:
+                # Un write-through más nuevo llegó mientras se cargaba: volver a cargar
+                self._stale.add(domain)
+                self._wake.set()
+                return current
+            if count_drift and current is not None and seen == version \
+                    and summarize(domain, current) != summarize(domain, data):
+                metrics.DASHBOARD_STATS_DRIFT.inc(section=domain)
+            self._sections[domain] = data
+            self._versions[domain] = version
+            self._stale.discard(domain)
+            return data
+
+    def _run(self, db_path):
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        next_full = time.monotonic() + self.reconcile_interval
+        while True:
+            self._wake.wait(max(0.0, next_full - time.monotonic()))
+            self._wake.clear()
+            full = time.monotonic() >= next_full
+            with self._lock:
+                domains = list(self._sections) if full else list(self._stale)
+            if full:
+                next_full = time.monotonic() + self.reconcile_interval
+            for domain in domains:
+                try:
+                    self.reload(domain, conn, count_drift=full)
+                except sqlite3.Error as e:
+                    print(f'Error recargando estadísticas de {domain}: {e}')
@@ -0,0 +1,210 @@
+"""
+Exportación en streaming de las líneas de órdenes (CSV / XLSX)
+
+Recorre las órdenes con un cursor del lado del servidor y escribe cada lote
+de filas a medida que se lee, de modo que la memoria usada no depende de la
+cantidad de filas exportadas. El XLSX se arma a mano (ZIP + XML) sin
+dependencias externas, con las mismas columnas que el reporte
+"Detalle de Ventas" que lee import_ventas.py.
+"""
+
+import csv
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+# Filas leídas desde SQLite por cada lote
+BATCH_SIZE = 500
+
+EXPORT_COLUMNS = [
+    'ID', 'Orden', 'Fecha', 'Cliente', 'Producto', 'Categoría', 'Variaciones',
+    'Cantidad', 'Precio', 'Total', 'Notas', 'Método de Pago', 'Tipo', 'Estado'
+]
+
+# Columnas numéricas (se escriben como número en el XLSX)
+NUMERIC_COLUMNS = {'ID', 'Cantidad', 'Precio', 'Total'}
+
+_EXPORT_QUERY = '''
+    SELECT o.id, o.order_number, o.created_at, o.customer_name,
+           oi.product_name, c.name AS category_name, oi.variations_display,
+           oi.quantity, oi.unit_price, oi.total_price, oi.notes,
+           o.payment_method, o.order_type, o.status
+    FROM orders o
+    JOIN order_items oi ON oi.order_id = o.id
+    LEFT JOIN products p ON oi.product_id = p.id
+    LEFT JOIN categories c ON p.category_id = c.id
+    WHERE o.created_at >= ? AND o.created_at < ?
+    ORDER BY o.created_at, o.id, oi.id
+'''
+
+# Caracteres de control no permitidos en XML
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def iter_order_lines(db, start, end):
+    """Iterar las líneas de órdenes entre start (inclusive) y end (exclusivo)
+
+    start y end son strings 'YYYY-MM-DD' comparables con created_at. Las
+    variaciones salen de la copia guardada en cada línea (variations_display).
+    """
+    cursor = db.execute(_EXPORT_QUERY, (start, end))
+    while True:
+        batch = cursor.fetchmany(BATCH_SIZE)
+        if not batch:
+            break
+        for row in batch:
+            yield _order_line(row)
+
+
+def _order_line(row):
+    """Construir la fila de exportación en el orden de EXPORT_COLUMNS"""
+    return (
+        row['id'],
+        row['order_number'],
+        row['created_at'],
+        row['customer_name'] or '',
+        row['product_name'],
+        row['category_name'] or 'Sin categoría',
+        row['variations_display'] or '',
+        row['quantity'],
+        row['unit_price'],
+        row['total_price'],
+        row['notes'] or '',
+        row['payment_method'] or '',
+        row['order_type'] or '',
+        row['status'] or '',
+    )
+
+
+def csv_stream(rows, columns=EXPORT_COLUMNS):
+    """Generar el CSV por bloques de texto"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # BOM para que Excel reconozca UTF-8 (tildes y ñ)
+    buffer.write('\ufeff')
+    writer.writerow(columns)
+
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+class _ChunkBuffer:
+    """Destino de escritura no posicionable para zipfile: acumula bytes hasta drenarlos"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _column_letter(index):
+    """Letra de columna de Excel para un índice base 0"""
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _xlsx_row(row_number, values, letters, numeric):
+    """XML de una fila con celdas en línea (sin sharedStrings)"""
+    cells = []
+    for col, value in enumerate(values):
+        ref = f'{letters[col]}{row_number}'
+        if value is None or value == '':
+            continue
+        if numeric[col] and isinstance(value, (int, float)):
+            cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+        else:
+            text = escape(_INVALID_XML.sub('', str(value)))
+            cells.append(f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return f'<row r="{row_number}">{"".join(cells)}</row>'
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _workbook_xml(sheet_name):
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def xlsx_stream(rows, columns=EXPORT_COLUMNS, sheet_name='Detalle de Ventas'):
+    """Generar el XLSX por bloques de bytes a medida que se escriben las filas"""
+    buffer = _ChunkBuffer()
+    letters = [_column_letter(i) for i in range(len(columns))]
+    numeric = [column in NUMERIC_COLUMNS for column in columns]
+
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _workbook_xml(sheet_name))
+        archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        yield buffer.drain()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                b'<sheetData>'
+            )
+            sheet.write(_xlsx_row(1, columns, letters, [False] * len(columns)).encode('utf-8'))
+
+            pending = []
+            for row_number, row in enumerate(rows, 2):
+                pending.append(_xlsx_row(row_number, row, letters, numeric))
+                if len(pending) >= BATCH_SIZE:
+                    sheet.write(''.join(pending).encode('utf-8'))
+                    pending.clear()
+                    yield buffer.drain()
+
+            sheet.write(''.join(pending).encode('utf-8'))
+            sheet.write(b'</sheetData></worksheet>')
+
+    yield buffer.drain()
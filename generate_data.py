@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+Generador de datos sintéticos para pruebas de carga del sistema Epicuro
+
+Crea una base de datos desechable con el esquema de init_db() y la llena
+con volúmenes realistas: órdenes con sus líneas y variaciones (con la copia
+de variation_snapshot.py), ingredientes, recetas por producto, proveedores,
+compras y movimientos de inventario. Los productos son los reales de
+insert_products.py / limpieza.py.
+
+Las órdenes se reparten por día con más movimiento el viernes y el sábado y
+por hora con el peak de almuerzo; cada una tiene ~3 líneas. Todo se inserta
+con executemany en lotes y sin journal (la base es de prueba).
+
+    python generate_data.py --db data/bench.db                     # 1M órdenes, 365 días
+    python generate_data.py --db data/bench.db --orders 20000 --days 30 --overwrite
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import sys
+import time
+from itertools import accumulate
+
+import app as epicuro
+from cache_coherence import DOMAIN_TABLES, bump_domains, create_change_log, drop_change_triggers
+from insert_products import products_data
+from limpieza import products_to_remove
+from sales_rollup import backfill as backfill_sales_rollup
+from basket_analysis import backfill as backfill_baskets
+from recipe_costing import backfill_cost_history, load_product_costs, recompute_line_costs
+from menu_engineering import nightly_range, refresh as refresh_menu_engineering
+from timestamps import from_epoch, parse_timestamp
+from variation_snapshot import encode_snapshot
+
+DEFAULT_ORDERS = 1_000_000
+DEFAULT_DAYS = 365
+BATCH_SIZE = 50_000
+
+# Peso de cada hora local del día (apertura 8:00, cierre 21:00)
+HOUR_WEIGHTS = {
+    8: 4, 9: 6, 10: 5, 11: 7, 12: 14, 13: 18, 14: 14, 15: 7,
+    16: 5, 17: 6, 18: 7, 19: 5, 20: 2,
+}
+
+# Peso por día de la semana (lunes = 0)
+WEEKDAY_WEIGHTS = (0.9, 0.95, 1.0, 1.0, 1.25, 1.3, 0.6)
+
+# Líneas por orden (promedio ~3) y unidades por línea
+ITEMS_PER_ORDER = {1: 15, 2: 25, 3: 25, 4: 17, 5: 10, 6: 8}
+QUANTITIES = {1: 80, 2: 15, 3: 5}
+
+STATUSES = {'completed': 95, 'cancelled': 3, 'ready': 2}
+PAYMENT_METHODS = {'efectivo': 45, 'tarjeta': 45, 'transferencia': 10}
+ORDER_TYPES = {'dine_in': 60, 'takeaway': 35, 'delivery': 5}
+
+CATEGORY_COLORS = {
+    'BEBIDAS': '#3498db', 'CAFETERIA': '#8e5a2b', 'SANDWICH': '#e67e22',
+    'DESAYUNOS': '#f1c40f', 'JUGOS': '#2ecc71', 'COMPLETOS': '#e74c3c',
+    'ENSALADAS': '#27ae60', 'PAPAS FRITAS': '#d35400', 'ENERGETICAS': '#9b59b6',
+    'SOPAS': '#16a085',
+}
+
+# Categorías cuyos productos llevan proteína y extras
+VARIATION_CATEGORIES = ('SANDWICH', 'COMPLETOS', 'DESAYUNOS')
+
+# (grupo, nombre visible, obligatorio, múltiple, [(opción, recargo)])
+VARIATION_GROUPS = (
+    ('proteina', 'Proteína', 1, 0, [('Churrasco', 0), ('Lomito', 0), ('Pollo', 0)]),
+    ('extras', 'Extras', 0, 1, [('Queso', 300), ('Palta', 400), ('Tocino', 500),
+                                ('Tomate', 200), ('Lechuga', 100)]),
+)
+
+# Probabilidad de que una línea con variaciones lleve extras
+EXTRAS_PROBABILITY = 0.3
+
+# (nombre, unidad, costo unitario CLP) - se combinan con PRESENTATIONS hasta 200
+INGREDIENT_BASES = (
+    ('PAN FRICA', 'un', 180), ('PAN MARRAQUETA', 'un', 120), ('PAN MOLDE', 'un', 60),
+    ('PAN HOT DOG', 'un', 110), ('CHURRASCO', 'gr', 14), ('LOMITO', 'gr', 12),
+    ('POLLO', 'gr', 8), ('VIENESA', 'un', 250), ('QUESO LAMINADO', 'gr', 10),
+    ('JAMÓN', 'gr', 9), ('PALTA', 'gr', 6), ('TOMATE', 'gr', 2), ('LECHUGA', 'gr', 3),
+    ('TOCINO', 'gr', 15), ('MAYONESA', 'gr', 4), ('KETCHUP', 'gr', 3), ('MOSTAZA', 'gr', 3),
+    ('CHUCRUT', 'gr', 4), ('HUEVO', 'un', 150), ('PAPAS', 'gr', 2), ('ACEITE', 'ml', 3),
+    ('SAL', 'gr', 1), ('CAFÉ GRANO', 'gr', 25), ('LECHE', 'ml', 1), ('AZÚCAR', 'gr', 1),
+    ('CHOCOLATE', 'gr', 12), ('VAINILLA', 'ml', 20), ('CREMA', 'ml', 5), ('NARANJA', 'un', 200),
+    ('FRUTILLA', 'gr', 5), ('PIÑA', 'gr', 3), ('MANGO', 'gr', 4), ('HIELO', 'gr', 1),
+    ('VASO MEDIANO', 'un', 90), ('VASO GRANDE', 'un', 110), ('TAPA', 'un', 30),
+    ('SERVILLETA', 'un', 5), ('BOLSA', 'un', 40), ('CAJA SANDWICH', 'un', 150),
+    ('ZAPALLO', 'gr', 2), ('ZANAHORIA', 'gr', 2), ('CEBOLLA', 'gr', 2), ('AJO', 'gr', 6),
+    ('CILANTRO', 'gr', 8), ('ACEITUNA', 'gr', 9), ('ATÚN', 'gr', 11), ('CHOCLO', 'gr', 4),
+    ('PEPINO', 'gr', 2), ('AGUA', 'ml', 1), ('BEBIDA LATA', 'un', 360),
+)
+PRESENTATIONS = ('', ' PREMIUM', ' ORGÁNICO', ' MAYORISTA')
+INGREDIENT_COUNT = 200
+
+SUPPLIER_NAMES = (
+    'Distribuidora Central', 'Panadería El Trigal', 'Carnes del Sur', 'Lácteos Colún',
+    'Verduras La Vega', 'Café Importado', 'Envases Chile', 'Bebidas CCU',
+)
+
+
+def _weighted(table):
+    """(valores, pesos acumulados) para random.choices"""
+    values = list(table)
+    return values, list(accumulate(table[value] for value in values))
+
+
+def _product_names():
+    """Productos reales (nombre, categoría, precio, costo), sin repetir"""
+    products = list(products_data)
+    known = {name for name, _, _, _ in products}
+    # limpieza.py lista algún nombre que insert_products.py ya no tiene
+    for name in products_to_remove:
+        if name not in known:
+            category = name.split(' - ')[0] + 'S' if ' - ' in name else 'SANDWICH'
+            products.append((name, category, 3500, 1500))
+            known.add(name)
+    return products
+
+
+class DataGenerator:
+    """Llena una base de datos recién creada con init_db()"""
+
+    def __init__(self, conn, orders=DEFAULT_ORDERS, days=DEFAULT_DAYS, seed=42, end_date=None):
+        self.conn = conn
+        self.orders = orders
+        self.days = days
+        self.random = random.Random(seed)
+        self.end_date = end_date or time.strftime('%Y-%m-%d')
+        self.counts = {}
+
+    def run(self):
+        started = time.perf_counter()
+        # Sin triggers de change_log durante la carga: una fila de versión por cada insert sobra
+        drop_change_triggers(self.conn.cursor())
+        for step in (self.catalog, self.variations, self.inventory, self.order_history,
+                     self.inventory_movements, self.line_costs, self.sales_rollup, self.baskets,
+                     self.menu_engineering):
+            step_start = time.perf_counter()
+            step()
+            self.conn.commit()
+            print(f'  {step.__name__:<20} {time.perf_counter() - step_start:8.1f} s')
+        create_change_log(self.conn.cursor())
+        bump_domains(self.conn.cursor(), DOMAIN_TABLES)
+        self.conn.execute('ANALYZE')
+        self.conn.commit()
+        self.counts['seconds'] = round(time.perf_counter() - started, 1)
+        return self.counts
+
+    # ===== CATÁLOGO =====
+
+    def catalog(self):
+        products = _product_names()
+        categories = {}
+        for name, category, _, _ in products:
+            if category not in categories:
+                categories[category] = len(categories) + 1
+        self.conn.executemany('INSERT INTO categories (id, name, color) VALUES (?, ?, ?)',
+                              [(cid, name, CATEGORY_COLORS.get(name, '#3498db'))
+                               for name, cid in categories.items()])
+
+        # (id, nombre, precio, categoría, costo)
+        self.products = [(pid, name, price, category, cost)
+                         for pid, (name, category, price, cost) in enumerate(products, start=1)]
+        self.conn.executemany('''
+            INSERT INTO products (id, name, price, category_id, available) VALUES (?, ?, ?, ?, 1)
+        ''', [(pid, name, price, categories[category]) for pid, name, price, category, _ in self.products])
+
+        # Popularidad tipo Zipf sobre un orden al azar de los productos
+        ranking = list(range(len(self.products)))
+        self.random.shuffle(ranking)
+        weights = [0.0] * len(self.products)
+        for rank, index in enumerate(ranking, start=1):
+            weights[index] = 1.0 / rank ** 0.8
+        self.product_choices = (self.products, list(accumulate(weights)))
+        self.counts['products'] = len(self.products)
+
+    # ===== VARIACIONES =====
+
+    def variations(self):
+        self.options = {}  # grupo -> [(option_id, group_display, name, price_modifier)]
+        option_id = 0
+        for group_id, (name, display, required, multiple, options) in enumerate(VARIATION_GROUPS, start=1):
+            self.conn.execute('''
+                INSERT INTO variation_groups (id, name, display_name, required, multiple_selection,
+                                              min_selections, max_selections, sort_order)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (group_id, name, display, required, multiple, required, None if multiple else 1, group_id))
+            for sort_order, (option, modifier) in enumerate(options):
+                option_id += 1
+                self.conn.execute('''
+                    INSERT INTO variation_options (id, variation_group_id, name, display_name,
+                                                   price_modifier, sort_order)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (option_id, group_id, option, option, modifier, sort_order))
+                self.options.setdefault(name, []).append((option_id, display, option, modifier))
+
+        self.variable_products = {pid for pid, _, _, category, _ in self.products
+                                  if category in VARIATION_CATEGORIES}
+        self.conn.executemany('''
+            INSERT INTO product_variations (product_id, variation_group_id, required, sort_order)
+            VALUES (?, ?, ?, ?)
+        ''', [(pid, group_id, group[2], group_id)
+              for pid in sorted(self.variable_products)
+              for group_id, group in enumerate(VARIATION_GROUPS, start=1)])
+
+    # ===== INVENTARIO =====
+
+    def inventory(self):
+        rnd = self.random
+        self.conn.executemany('INSERT INTO suppliers (id, name, phone) VALUES (?, ?, ?)',
+                              [(sid, name, f'+5692{rnd.randrange(1000000, 9999999)}')
+                               for sid, name in enumerate(SUPPLIER_NAMES, start=1)])
+
+        self.ingredients = []  # (id, unidad, costo, proveedor)
+        rows = []
+        for index in range(INGREDIENT_COUNT):
+            base_name, unit, cost = INGREDIENT_BASES[index % len(INGREDIENT_BASES)]
+            presentation = PRESENTATIONS[index // len(INGREDIENT_BASES) % len(PRESENTATIONS)]
+            cost = round(cost * (1 + 0.25 * (index // len(INGREDIENT_BASES))), 2)
+            supplier_id = index % len(SUPPLIER_NAMES) + 1
+            ingredient_id = index + 1
+            self.ingredients.append((ingredient_id, unit, cost, supplier_id))
+            rows.append((ingredient_id, base_name + presentation, unit, cost, supplier_id))
+        self.conn.executemany('''
+            INSERT INTO ingredients (id, name, unit, unit_cost, preferred_supplier_id, min_stock, max_stock)
+            VALUES (?, ?, ?, ?, ?, 0, 0)
+        ''', rows)
+
+        # Una receta por producto con 2 a 6 ingredientes
+        self.recipe_usage = {}  # product_id -> [(ingredient_id, cantidad)]
+        recipe_rows, line_rows = [], []
+        for pid, name, _, category, _ in self.products:
+            chosen = rnd.sample(self.ingredients, rnd.randint(2, 6))
+            usage = []
+            for ingredient_id, unit, _, _ in chosen:
+                quantity = 1 if unit == 'un' else rnd.choice((10, 20, 30, 50, 80, 120))
+                usage.append((ingredient_id, quantity))
+                line_rows.append((pid, ingredient_id, quantity, unit))
+            self.recipe_usage[pid] = usage
+            recipe_rows.append((pid, name, category))
+        self.conn.executemany('INSERT INTO recipes (id, name, category, servings) VALUES (?, ?, ?, 1)',
+                              recipe_rows)
+        self.conn.execute('UPDATE products SET recipe_id = id')
+        self.conn.executemany('''
+            INSERT INTO recipe_ingredients (recipe_id, ingredient_id, quantity, unit) VALUES (?, ?, ?, ?)
+        ''', line_rows)
+        self.counts['ingredients'] = len(self.ingredients)
+        self.counts['recipes'] = len(recipe_rows)
+
+    # ===== ÓRDENES =====
+
+    def _day_starts(self):
+        """epoch de la medianoche local de cada día simulado, del más antiguo al más reciente"""
+        end_epoch = parse_timestamp(self.end_date + ' 00:00:00')[0]
+        starts = []
+        for back in range(self.days - 1, -1, -1):
+            # Aproximar con 24 h y corregir con el texto local (cambios de horario)
+            approx_text, _ = from_epoch(end_epoch - back * 86400 + 12 * 3600)
+            starts.append(parse_timestamp(approx_text[:10] + ' 00:00:00')[0])
+        return starts
+
+    def _orders_per_day(self, starts):
+        weights = [WEEKDAY_WEIGHTS[time.gmtime(start + 12 * 3600).tm_wday] * self.random.uniform(0.85, 1.15)
+                   for start in starts]
+        total = sum(weights)
+        counts = [int(self.orders * weight / total) for weight in weights]
+        for index in range(self.orders - sum(counts)):
+            counts[index % len(counts)] += 1
+        return counts
+
+    def order_history(self):
+        rnd = self.random
+        hours, hour_weights = _weighted(HOUR_WEIGHTS)
+        item_counts, item_weights = _weighted(ITEMS_PER_ORDER)
+        quantities, quantity_weights = _weighted(QUANTITIES)
+        statuses, status_weights = _weighted(STATUSES)
+        payments, payment_weights = _weighted(PAYMENT_METHODS)
+        order_types, type_weights = _weighted(ORDER_TYPES)
+        products, product_weights = self.product_choices
+        proteins = self.options.get('proteina', [])
+        extras = self.options.get('extras', [])
+
+        order_rows, item_rows, variation_rows = [], [], []
+        order_id = item_id = 0
+        totals = {'orders': 0, 'order_items': 0, 'order_item_variations': 0}
+
+        def flush(force=False):
+            if force or len(item_rows) >= BATCH_SIZE:
+                self.conn.executemany('''
+                    INSERT INTO orders (id, order_number, customer_name, subtotal, discount, total_amount,
+                                        status, payment_method, order_type, created_at, updated_at,
+                                        created_epoch, utc_offset)
+                    VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', order_rows)
+                self.conn.executemany('''
+                    INSERT INTO order_items (id, order_id, product_id, product_name, quantity, unit_price,
+                                             total_price, notes, variations_json, variations_display)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, '', ?, ?)
+                ''', item_rows)
+                self.conn.executemany('''
+                    INSERT INTO order_item_variations (order_item_id, variation_option_id, price_modifier)
+                    VALUES (?, ?, ?)
+                ''', variation_rows)
+                totals['orders'] += len(order_rows)
+                totals['order_items'] += len(item_rows)
+                totals['order_item_variations'] += len(variation_rows)
+                order_rows.clear()
+                item_rows.clear()
+                variation_rows.clear()
+
+        starts = self._day_starts()
+        for day_start, day_orders in zip(starts, self._orders_per_day(starts)):
+            offsets = sorted(h * 3600 + rnd.randrange(3600)
+                             for h in rnd.choices(hours, cum_weights=hour_weights, k=day_orders))
+            for offset in offsets:
+                order_id += 1
+                epoch = day_start + offset
+                created_at, utc_offset = from_epoch(epoch)
+                subtotal = 0
+                lines = rnd.choices(item_counts, cum_weights=item_weights)[0]
+                for product in rnd.choices(products, cum_weights=product_weights, k=lines):
+                    item_id += 1
+                    pid, name, price = product[0], product[1], product[2]
+                    quantity = rnd.choices(quantities, cum_weights=quantity_weights)[0]
+                    variations_json, variations_display = None, ''
+                    if pid in self.variable_products and proteins:
+                        chosen = [rnd.choice(proteins)]
+                        if extras and rnd.random() < EXTRAS_PROBABILITY:
+                            chosen.extend(rnd.sample(extras, rnd.randint(1, 2)))
+                        entries = [{'option_id': oid, 'group': group, 'name': option,
+                                    'price_modifier': modifier}
+                                   for oid, group, option, modifier in chosen]
+                        variations_json, variations_display = encode_snapshot(entries)
+                        price = price + sum(entry['price_modifier'] for entry in entries)
+                        variation_rows.extend((item_id, oid, modifier) for oid, _, _, modifier in chosen)
+                    total_price = quantity * price
+                    subtotal += total_price
+                    item_rows.append((item_id, order_id, pid, name, quantity, price, total_price,
+                                      variations_json, variations_display))
+
+                # El id en el número evita choques entre órdenes del mismo segundo
+                order_rows.append((
+                    order_id, f'ORD-{created_at[:10].replace("-", "")}-{order_id:07d}', '',
+                    subtotal, subtotal,
+                    rnd.choices(statuses, cum_weights=status_weights)[0],
+                    rnd.choices(payments, cum_weights=payment_weights)[0],
+                    rnd.choices(order_types, cum_weights=type_weights)[0],
+                    created_at, created_at, epoch, utc_offset,
+                ))
+            flush()
+        flush(force=True)
+        self.counts.update(totals)
+        self.day_starts = starts
+
+    def line_costs(self):
+        """Historia de costos desde las compras y costo de cada línea con los de su día (ver recipe_costing.py)"""
+        self.counts['cost_history'] = backfill_cost_history(self.conn)
+        self.counts['costed_lines'] = recompute_line_costs(self.conn)
+
+    def sales_rollup(self):
+        """sales_hourly desde las órdenes generadas (ver sales_rollup.py)"""
+        self.counts['sales_hourly'] = backfill_sales_rollup(self.conn)
+
+    def baskets(self):
+        """basket_products y basket_pairs desde las órdenes generadas (ver basket_analysis.py)"""
+        self.counts['basket_pairs'] = backfill_baskets(self.conn)['pairs']
+
+    def menu_engineering(self):
+        """Período nocturno de ingeniería de menú hasta end_date (ver menu_engineering.py)"""
+        today = datetime.date.fromisoformat(self.end_date) + datetime.timedelta(days=1)
+        now = datetime.datetime.combine(today, datetime.time(epicuro.MENU_ENGINEERING_HOUR))
+        start, end = nightly_range(today)
+        refresh_menu_engineering(self.conn, start, end, now, load_product_costs(self.conn), nightly=True)
+        self.counts['menu_products'] = self.conn.execute('SELECT COUNT(*) FROM menu_engineering').fetchone()[0]
+
+    # ===== MOVIMIENTOS =====
+
+    def inventory_movements(self):
+        """Compras semanales por proveedor y consumo diario según las recetas vendidas"""
+        daily = {}  # (día, ingrediente) -> cantidad consumida
+        day_index = {}
+        starts = self.day_starts
+        for index, start in enumerate(starts):
+            day_index[from_epoch(start)[0][:10]] = index
+        usage = self.recipe_usage
+        for day, product_id, quantity in self.conn.execute('''
+            SELECT substr(o.created_at, 1, 10), oi.product_id, SUM(oi.quantity)
+            FROM order_items oi JOIN orders o ON o.id = oi.order_id
+            WHERE o.status != 'cancelled'
+            GROUP BY 1, 2
+        '''):
+            index = day_index.get(day)
+            if index is None:
+                continue
+            for ingredient_id, amount in usage.get(product_id, ()):
+                key = (index, ingredient_id)
+                daily[key] = daily.get(key, 0) + amount * quantity
+
+        costs = {ingredient_id: cost for ingredient_id, _, cost, _ in self.ingredients}
+        by_supplier = {}
+        for ingredient_id, unit, cost, supplier_id in self.ingredients:
+            by_supplier.setdefault(supplier_id, []).append((ingredient_id, unit, cost))
+
+        movements, purchases, purchase_items = [], [], []
+        purchase_id = 0
+        for week_start in range(0, len(starts), 7):
+            week = range(week_start, min(week_start + 7, len(starts)))
+            received_at, _ = from_epoch(starts[week_start] + 7 * 3600)
+            for supplier_id, supplied in by_supplier.items():
+                purchase_id += 1
+                total = 0
+                for ingredient_id, unit, cost in supplied:
+                    needed = sum(daily.get((day, ingredient_id), 0) for day in week)
+                    quantity = round(needed * 1.1) or (10 if unit == 'un' else 1000)
+                    price = round(cost * self.random.uniform(0.9, 1.1), 2)
+                    total += quantity * price
+                    purchase_items.append((purchase_id, ingredient_id, quantity, unit, price,
+                                           round(quantity * price, 2), quantity))
+                    movements.append((ingredient_id, 'purchase', quantity, price, 'purchase',
+                                      purchase_id, received_at))
+                purchases.append((purchase_id, f'COMP-{received_at[:10].replace("-", "")}-{purchase_id:05d}',
+                                  supplier_id, round(total, 2), 'received', received_at[:10],
+                                  received_at[:10], received_at[:10], received_at))
+            for day in week:
+                consumed_at, _ = from_epoch(starts[day] + 21 * 3600)
+                for ingredient_id, _, _, _ in self.ingredients:
+                    quantity = daily.get((day, ingredient_id))
+                    if quantity:
+                        movements.append((ingredient_id, 'consumption', -quantity, costs[ingredient_id],
+                                          'sales', None, consumed_at))
+
+        self.conn.executemany('''
+            INSERT INTO purchases (id, purchase_number, supplier_id, total_amount, status,
+                                   purchase_date, expected_date, received_date, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', purchases)
+        self.conn.executemany('''
+            INSERT INTO purchase_items (purchase_id, ingredient_id, quantity, unit, unit_price,
+                                        total_price, received_quantity)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', purchase_items)
+        movements.sort(key=lambda row: row[6])
+        for start in range(0, len(movements), BATCH_SIZE):
+            self.conn.executemany('''
+                INSERT INTO inventory_movements (ingredient_id, movement_type, quantity, unit_cost,
+                                                 reference_type, reference_id, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', movements[start:start + BATCH_SIZE])
+
+        self.conn.execute('''
+            UPDATE ingredients SET current_stock = COALESCE(
+                (SELECT SUM(quantity) FROM inventory_movements m WHERE m.ingredient_id = ingredients.id), 0)
+        ''')
+        self.counts['purchases'] = len(purchases)
+        self.counts['inventory_movements'] = len(movements)
+
+
+def create_database(path, overwrite=False):
+    """Base vacía con el esquema de init_db() en `path`"""
+    if os.path.abspath(path) == os.path.abspath(epicuro.DATABASE):
+        raise SystemExit(f'❌ {path} es la base de datos de producción; use otra ruta')
+    if os.path.exists(path):
+        if not overwrite:
+            raise SystemExit(f'❌ {path} ya existe (use --overwrite para reemplazarla)')
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    production = epicuro.DATABASE
+    epicuro.DATABASE = path
+    try:
+        epicuro.init_db()
+    finally:
+        epicuro.DATABASE = production
+
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -200000')
+    return conn
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generar datos sintéticos en una base de prueba')
+    parser.add_argument('--db', default='data/bench.db', help='base de datos a crear (no la de producción)')
+    parser.add_argument('--orders', type=int, default=DEFAULT_ORDERS)
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--end-date', help='último día simulado (YYYY-MM-DD, por defecto hoy)')
+    parser.add_argument('--overwrite', action='store_true', help='reemplazar --db si ya existe')
+    args = parser.parse_args(argv)
+
+    conn = create_database(args.db, overwrite=args.overwrite)
+    print(f'🧪 Generando {args.orders:,} órdenes en {args.days} días en {args.db}')
+    generator = DataGenerator(conn, orders=args.orders, days=args.days, seed=args.seed,
+                              end_date=args.end_date)
+    counts = generator.run()
+    conn.close()
+
+    print('✅ Datos generados:')
+    for name, value in counts.items():
+        print(f'  {name:<22} {value:>12,}' if isinstance(value, int) else f'  {name:<22} {value:>12}')
+    return counts
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
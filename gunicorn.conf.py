@@ -0,0 +1,94 @@
+"""
+Configuración de gunicorn para producción del sistema Epicuro
+
+    gunicorn -c gunicorn.conf.py app:app
+    kill -HUP $(cat data/gunicorn.pid)     # recarga sin cortar: workers nuevos con el código nuevo
+    kill -TERM $(cat data/gunicorn.pid)    # apagado ordenado (espera las peticiones en curso)
+
+El maestro prepara la base una sola vez en un proceso aparte
+(`python app.py --prepare`: init_db, WAL, trabajos interrumpidos) y crea el
+bloque de memoria compartida del catálogo (catalog_cache.py). No importa
+app.py, así un HUP carga el código nuevo en los workers; solo cambios en
+catalog_cache.py o en este archivo necesitan reinicio completo. Cada worker,
+ya con la app cargada, inicia la cola de trabajos y deja programada la
+ingeniería de menú nocturna (post_worker_init).
+
+Cada worker atiende con hilos (gthread), usa una conexión SQLite por hilo y
+se recicla después de max_requests peticiones. Cada pantalla de cocina
+abierta mantiene un stream SSE que ocupa un hilo de algún worker mientras
+dure, y el reparto entre workers no es parejo: todas pueden caer en el
+mismo. Por eso cada worker tiene EPICURO_KITCHEN_SCREENS hilos más
+WEB_THREADS_FREE para las demás peticiones; con más pantallas que eso, las
+páginas de ese worker esperan a que se cierre un stream. El tablero de cocina en memoria y las
+métricas de /metrics son por worker; el catálogo y el tablero se ponen al
+día con lo que escriben los demás workers mediante change_log (ver
+cache_coherence.py).
+
+Variables: EPICURO_BIND, EPICURO_WEB_WORKERS, EPICURO_KITCHEN_SCREENS,
+EPICURO_WEB_THREADS (reemplaza el cálculo de hilos), EPICURO_MAX_REQUESTS, EPICURO_CATALOG_SHM_SIZE, EPICURO_CHANGE_POLL
+"""
+
+import multiprocessing
+import os
+import subprocess
+import sys
+
+import catalog_cache
+
+bind = os.environ.get('EPICURO_BIND', '0.0.0.0:5002')
+
+# SQLite acepta un escritor a la vez: más workers reparten el render, no las escrituras
+workers = int(os.environ.get('EPICURO_WEB_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+
+# Un hilo por pantalla de cocina (stream SSE) y los demás para las páginas
+KITCHEN_SCREENS = int(os.environ.get('EPICURO_KITCHEN_SCREENS', 4))
+WEB_THREADS_FREE = 4
+threads = int(os.environ.get('EPICURO_WEB_THREADS', KITCHEN_SCREENS + WEB_THREADS_FREE))
+
+# Reciclar workers (con jitter para que no se reinicien todos juntos)
+max_requests = int(os.environ.get('EPICURO_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+# Cada worker importa app.py después del fork: hilos y conexiones propios
+preload_app = False
+
+os.makedirs('data', exist_ok=True)
+pidfile = 'data/gunicorn.pid'
+accesslog = '-'
+
+# Heredado por los workers (ver PREFORK en app.py y CatalogCache.from_env)
+os.environ['EPICURO_PREFORK'] = '1'
+os.environ.setdefault(catalog_cache.ENV_NAME, f'epicuro_catalog_{os.getpid()}')
+
+
+def on_starting(server):
+    subprocess.run([sys.executable, 'app.py', '--prepare'], check=True)
+    size = int(os.environ.get(catalog_cache.ENV_SIZE, catalog_cache.DEFAULT_SIZE))
+    # En el árbitro (no en el módulo): este archivo se vuelve a ejecutar en cada HUP
+    server.catalog_snapshot = catalog_cache.SharedSnapshot.create(os.environ[catalog_cache.ENV_NAME], size)
+
+
+def post_worker_init(worker):
+    # Con la app ya cargada en el worker y la base preparada por el maestro
+    # (nunca al importar app.py: `--prepare` también lo importa con PREFORK)
+    from app import schedule_menu_engineering
+    schedule_menu_engineering()
+
+
+def on_reload(server):
+    # El primer worker nuevo vuelve a armar el catálogo desde la base
+    snapshot = getattr(server, 'catalog_snapshot', None)
+    if snapshot is not None:
+        snapshot.clear()
+
+
+def on_exit(server):
+    snapshot = getattr(server, 'catalog_snapshot', None)
+    if snapshot is not None:
+        snapshot.close()
+        snapshot.unlink()
@@ -4,6 +4,10 @@ import datetime
 from pytz import timezone
 import os
 import json
+from product_matcher import ProductMatcher
+from timestamps import add_timestamp_columns, migrate_timestamps
+from sales_rollup import create_sales_rollup, backfill as backfill_sales_rollup
+from basket_analysis import create_basket_tables, order_basket, update_basket, backfill as backfill_baskets
 
 def import_sales_from_excel(excel_file_path, db_path='data/sandwich.db'):
     """
@@ -25,6 +29,12 @@ def import_sales_from_excel(excel_file_path, db_path='data/sandwich.db'):
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
         
+        # Índice difuso de productos para reconocer variantes de escritura
+        matcher = ProductMatcher.from_db(conn)
+        
+        # Conteos de canasta: cada orden importada suma la suya
+        baskets_created = create_basket_tables(cursor)
+        
         # Crear backup antes de importar
         backup_orders = pd.read_sql_query("SELECT * FROM orders", conn)
         backup_items = pd.read_sql_query("SELECT * FROM order_items", conn)
@@ -47,7 +57,9 @@ def import_sales_from_excel(excel_file_path, db_path='data/sandwich.db'):
         
         orders_imported = 0
         items_imported = 0
+        imported_days = set()
         errors = []
+        ambiguous = {}  # nombre -> candidatos demasiado parecidos entre sí
         
         # Procesar cada orden
         for _, order_row in orders_data.iterrows():
@@ -105,6 +117,7 @@ def import_sales_from_excel(excel_file_path, db_path='data/sandwich.db'):
                 
                 new_order_id = cursor.lastrowid
                 orders_imported += 1
+                imported_days.add(fecha_dt.date())
                 
                 # Obtener items de esta orden
                 order_items = df[df['ID'] == order_id_excel]
@@ -117,13 +130,10 @@ def import_sales_from_excel(excel_file_path, db_path='data/sandwich.db'):
                     precio_unitario = float(item_row['Precio']) if pd.notna(item_row['Precio']) else 0
                     total_item = float(item_row['Total']) if pd.notna(item_row['Total']) else 0
                     
-                    # Buscar si el producto existe en la BD
-                    product_id = cursor.execute(
-                        "SELECT id FROM products WHERE UPPER(name) = UPPER(?)", 
-                        (producto,)
-                    ).fetchone()
-                    
-                    product_id = product_id[0] if product_id else None
+                    # Buscar si el producto existe en la BD (tolerando errores de escritura)
+                    product_id, candidates = matcher.resolve(producto)
+                    if product_id is None and candidates:
+                        ambiguous[producto] = candidates
                     
                     cursor.execute('''
                         INSERT INTO order_items (
@@ -142,6 +152,8 @@ def import_sales_from_excel(excel_file_path, db_path='data/sandwich.db'):
                     
                     items_imported += 1
                 
+                update_basket(cursor, frozenset(), order_basket(cursor, new_order_id))
+                
                 if orders_imported % 10 == 0:
                     print(f"Progreso: {orders_imported} órdenes importadas...")
                     
@@ -151,6 +163,18 @@ def import_sales_from_excel(excel_file_path, db_path='data/sandwich.db'):
                 print(error_msg)
                 continue
         
+        # Epoch y desfase UTC de las órdenes importadas
+        add_timestamp_columns(cursor)
+        migrate_timestamps(conn)
+        
+        # Resumen por hora de los días importados
+        if create_sales_rollup(cursor):
+            backfill_sales_rollup(conn)
+        elif imported_days:
+            backfill_sales_rollup(conn, min(imported_days), max(imported_days) + datetime.timedelta(days=1))
+        if baskets_created:
+            backfill_baskets(conn)
+        
         # Confirmar cambios
         conn.commit()
         
@@ -171,6 +195,11 @@ def import_sales_from_excel(excel_file_path, db_path='data/sandwich.db'):
             if len(errors) > 5:
                 print(f"  ... y {len(errors) - 5} errores más")
         
+        if ambiguous:
+            print(f"\nProductos con más de un candidato parecido ({len(ambiguous)}), quedan sin asignar:")
+            for producto, candidates in ambiguous.items():
+                print(f"  - {producto}: " + ', '.join(f'{name} ({score:.2f})' for _, name, score in candidates))
+        
         # Análisis de productos no encontrados
         print("\n=== VERIFICACIÓN DE PRODUCTOS ===")
         cursor.execute('''
@@ -227,6 +256,8 @@ def create_products_from_import(db_path='data/sandwich.db'):
         print("No hay productos para crear")
         return
     
+    matcher = ProductMatcher.from_db(conn)
+    
     # Crear/obtener categorías
     categorias_map = {}
     for _, categoria, _, _ in productos_importados:
@@ -251,13 +282,12 @@ def create_products_from_import(db_path='data/sandwich.db'):
     # Crear productos
     productos_creados = 0
     for producto, categoria, precio, veces in productos_importados:
-        # Verificar si el producto ya existe
-        exists = cursor.execute(
-            "SELECT id FROM products WHERE UPPER(name) = UPPER(?)", 
-            (producto,)
-        ).fetchone()
-        
-        if exists:
+        # Verificar si el producto ya existe (o uno con nombre casi igual)
+        product_id, candidates = matcher.resolve(producto)
+        if product_id is None and candidates:
+            print(f"Revisar a mano: {producto} se parece a " +
+                  ', '.join(f'{name} ({score:.2f})' for _, name, score in candidates))
+        if candidates:
             continue
         
         category_id = categorias_map.get(categoria)
@@ -273,18 +303,31 @@ def create_products_from_import(db_path='data/sandwich.db'):
             1
         ))
         
+        matcher.add(cursor.lastrowid, producto)
         productos_creados += 1
         print(f"Producto creado: {producto} - ${precio:.0f} ({categoria})")
     
     # Actualizar product_id en order_items
-    cursor.execute('''
-        UPDATE order_items 
-        SET product_id = (
-            SELECT p.id FROM products p 
-            WHERE UPPER(p.name) = UPPER(order_items.product_name)
-        )
-        WHERE product_id IS NULL
-    ''')
+    nombres_sin_producto = cursor.execute('''
+        SELECT DISTINCT product_name FROM order_items WHERE product_id IS NULL
+    ''').fetchall()
+    
+    referencias = 0
+    for (nombre,) in nombres_sin_producto:
+        product_id = matcher.best_match(nombre)
+        if product_id:
+            cursor.execute('''
+                UPDATE order_items SET product_id = ?
+                WHERE product_id IS NULL AND product_name = ?
+            ''', (product_id, nombre))
+            referencias += cursor.rowcount
+    
+    # Las líneas con producto nuevo cambian de categoría y de canasta
+    if referencias:
+        create_sales_rollup(cursor)
+        backfill_sales_rollup(conn)
+        create_basket_tables(cursor)
+        backfill_baskets(conn)
     
     conn.commit()
     conn.close()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Valorización de inventario por promedio ponderado y FIFO para el sistema Epicuro
+
+InventoryValuation recorre inventory_movements una sola vez y después solo
+lee los movimientos nuevos (id mayor al último aplicado) cuando change_log
+muestra un cambio de inventario. Por ingrediente guarda:
+
+- promedio ponderado: cantidad y valor; una salida se valoriza al costo
+  promedio del momento
+- FIFO: capas [cantidad, costo] en un deque; una salida consume las capas
+  más antiguas primero
+
+Una entrada (compra, o ajuste positivo) usa el unit_cost del movimiento o,
+si no tiene, el último costo conocido del ingrediente. Una salida mayor al
+stock deja un faltante valorizado al último costo; la compra siguiente lo
+cubre primero y la diferencia de precio va al costo de ventas.
+
+Por día se acumulan compras, costo de ventas (movimientos 'consumption'),
+otros ajustes (mermas, conteos) y el valor al cierre de cada método, así
+cualquier período se responde con dos búsquedas binarias sobre los días:
+
+    cierre = apertura + compras - costo de ventas - ajustes
+
+Un movimiento nuevo con fecha anterior al último día aplicado obliga a
+recorrer todo de nuevo (no pasa con los movimientos que escribe la app).
+
+    python inventory_valuation.py --report [--db data/sandwich.db] [--start YYYY-MM-DD --end YYYY-MM-DD]
+    python -m pytest tests/test_inventory_valuation.py
+"""
+
+import bisect
+import sqlite3
+import sys
+import threading
+from collections import deque
+
+from cache_coherence import domain_version
+
+METHODS = ('average', 'fifo')
+METHOD_LABELS = {'average': 'Promedio ponderado', 'fifo': 'FIFO'}
+
+_MOVEMENTS_QUERY = '''
+    SELECT id, ingredient_id, movement_type, quantity, unit_cost, created_at
+    FROM inventory_movements
+    WHERE created_at IS NOT NULL AND ingredient_id IS NOT NULL AND {where}
+    ORDER BY {order}
+'''
+
+
+class _Stock:
+    """Estado de un ingrediente en ambos métodos"""
+
+    __slots__ = ('quantity', 'average_value', 'layers', 'fifo_value', 'deficit', 'deficit_value', 'last_cost')
+
+    def __init__(self):
+        self.quantity = 0.0
+        self.average_value = 0.0
+        self.layers = deque()      # [cantidad, costo], la más antigua a la izquierda
+        self.fifo_value = 0.0      # valor de las capas, menos el faltante
+        self.deficit = 0.0         # unidades salidas sin capas que las cubran
+        self.deficit_value = 0.0
+        self.last_cost = 0.0
+
+    def average_cost(self):
+        return self.average_value / self.quantity if self.quantity > 0 else self.last_cost
+
+    def receive(self, quantity, cost):
+        """Entrada: devuelve la diferencia de precio del faltante cubierto {método: monto}"""
+        variance = {'average': 0.0, 'fifo': 0.0}
+
+        # Promedio: con stock negativo el saldo queda al costo nuevo
+        if self.quantity < 0:
+            before = self.average_value + quantity * cost
+            self.quantity += quantity
+            self.average_value = self.quantity * cost
+            variance['average'] = before - self.average_value
+        else:
+            self.quantity += quantity
+            self.average_value += quantity * cost
+
+        # FIFO: primero se cubre el faltante, el resto es una capa nueva
+        if self.deficit > 0:
+            covered = min(self.deficit, quantity)
+            expensed = self.deficit_value * covered / self.deficit
+            variance['fifo'] = covered * cost - expensed
+            self.deficit -= covered
+            self.deficit_value -= expensed
+            self.fifo_value += expensed
+            quantity -= covered
+        if quantity > 0:
+            self.layers.append([quantity, cost])
+            self.fifo_value += quantity * cost
+        return variance
+
+    def issue(self, quantity):
+        """Salida de `quantity` unidades (positivo): devuelve su costo {método: monto}"""
+        average_cost = self.average_cost()
+        self.quantity -= quantity
+        self.average_value -= quantity * average_cost
+
+        fifo_cost = 0.0
+        remaining = quantity
+        layers = self.layers
+        while remaining > 0 and layers:
+            layer = layers[0]
+            taken = min(layer[0], remaining)
+            fifo_cost += taken * layer[1]
+            remaining -= taken
+            layer[0] -= taken
+            if layer[0] <= 1e-9:
+                layers.popleft()
+        if remaining > 0:
+            missing = remaining * self.last_cost
+            self.deficit += remaining
+            self.deficit_value += missing
+            fifo_cost += missing
+        self.fifo_value -= fifo_cost
+        return {'average': quantity * average_cost, 'fifo': fifo_cost}
+
+
+class InventoryValuation:
+    """Valor del inventario y costo de ventas por período, al día con change_log"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._required = 0
+        self._reset()
+
+    def _reset(self):
+        self.loaded_version = -1
+        self.last_id = 0
+        self.stock = {}
+        self.days = []
+        self.purchases = []                                  # acumulados por día
+        self.cogs = {method: [] for method in METHODS}       # acumulados por día
+        self.adjustments = {method: [] for method in METHODS}
+        self.closing = {method: [] for method in METHODS}    # valor al cierre de cada día
+        self.value = {method: 0.0 for method in METHODS}
+
+    def watch(self, tracker):
+        """Leer los movimientos nuevos en la próxima consulta cuando cambie el inventario"""
+        tracker.on_change('inventory', lambda version, conn: self.require(version))
+
+    def require(self, version):
+        with self._lock:
+            self._required = max(self._required, version)
+
+    def invalidate(self):
+        with self._lock:
+            self._reset()
+
+    # ===== CARGA =====
+
+    def refresh(self, conn):
+        """Aplicar los movimientos nuevos (todos la primera vez); devuelve cuántos se aplicaron"""
+        with self._lock:
+            if self.loaded_version >= 0 and self.loaded_version >= self._required:
+                return 0
+            # Versión primero: un movimiento escrito durante la lectura vuelve a marcarla vieja
+            version = domain_version(conn, 'inventory')
+            if self.loaded_version < 0:
+                rows = conn.execute(_MOVEMENTS_QUERY.format(where='1', order='created_at, id')).fetchall()
+            else:
+                rows = conn.execute(_MOVEMENTS_QUERY.format(where='id > ?', order='id'),
+                                    (self.last_id,)).fetchall()
+                if rows and self.days and min(row[5][:10] for row in rows) < self.days[-1]:
+                    self._reset()
+                    return self.refresh(conn)
+            for row in rows:
+                self._apply(*row)
+            self.loaded_version = max(version, 0)
+            return len(rows)
+
+    def _apply(self, movement_id, ingredient_id, movement_type, quantity, unit_cost, created_at):
+        stock = self.stock.get(ingredient_id)
+        if stock is None:
+            stock = self.stock[ingredient_id] = _Stock()
+        self._open_day(created_at[:10])
+        self.last_id = max(self.last_id, movement_id)
+        quantity = quantity or 0
+
+        if quantity > 0:
+            cost = unit_cost if unit_cost and unit_cost > 0 else stock.average_cost()
+            if movement_type == 'purchase':
+                stock.last_cost = cost
+                self.purchases[-1] += quantity * cost
+            else:
+                for method in METHODS:
+                    self.adjustments[method][-1] -= quantity * cost
+            for method, variance in stock.receive(quantity, cost).items():
+                self.cogs[method][-1] += variance
+                self.value[method] += quantity * cost - variance
+        elif quantity < 0:
+            target = self.cogs if movement_type == 'consumption' else self.adjustments
+            for method, cost in stock.issue(-quantity).items():
+                target[method][-1] += cost
+                self.value[method] -= cost
+
+        for method in METHODS:
+            self.closing[method][-1] = self.value[method]
+
+    def _open_day(self, day):
+        if self.days and self.days[-1] == day:
+            return
+        self.days.append(day)
+        self.purchases.append(self.purchases[-1] if self.purchases else 0.0)
+        for method in METHODS:
+            for series in (self.cogs[method], self.adjustments[method]):
+                series.append(series[-1] if series else 0.0)
+            self.closing[method].append(self.value[method])
+
+    # ===== CONSULTAS =====
+
+    def _before(self, series, day):
+        """Valor acumulado al cierre del último día anterior a `day` (0 si no hay)"""
+        index = bisect.bisect_left(self.days, day) if day is not None else len(self.days)
+        return series[index - 1] if index else 0.0
+
+    def period(self, conn, start=None, end=None, method='average'):
+        """Apertura, compras, costo de ventas, ajustes y cierre de start <= día < end"""
+        if method not in METHODS:
+            raise ValueError(f"Método desconocido: {method} (usar {', '.join(METHODS)})")
+        self.refresh(conn)
+        start = str(start) if start else None
+        end = str(end) if end else None
+        with self._lock:
+            row = {'method': method, 'method_label': METHOD_LABELS[method]}
+            row['opening_value'] = self._before(self.closing[method], start) if start else 0.0
+            for key, series in (('purchases', self.purchases), ('cogs', self.cogs[method]),
+                                ('adjustments', self.adjustments[method])):
+                row[key] = self._before(series, end) - (self._before(series, start) if start else 0.0)
+            row['closing_value'] = self._before(self.closing[method], end)
+        return {key: round(value, 2) if isinstance(value, float) else value for key, value in row.items()}
+
+    def total_value(self, conn, method='average'):
+        """Valor actual del inventario con un método"""
+        self.refresh(conn)
+        with self._lock:
+            return round(self.value[method], 2)
+
+    def ingredients(self, conn):
+        """Cantidad y valor actual por ingrediente en ambos métodos"""
+        self.refresh(conn)
+        with self._lock:
+            return [{
+                'ingredient_id': ingredient_id,
+                'quantity': round(stock.quantity, 4),
+                'average_value': round(stock.average_value, 2),
+                'average_cost': round(stock.average_cost(), 4),
+                'fifo_value': round(stock.fifo_value, 2),
+                'layers': len(stock.layers),
+            } for ingredient_id, stock in sorted(self.stock.items())]
+
+
+def _arg(name, default=None):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+
+if __name__ == "__main__":
+    if '--report' in sys.argv:
+        import time
+
+        path = _arg('--db', 'data/sandwich.db')
+        conn = sqlite3.connect(path)
+        engine = InventoryValuation()
+        started = time.perf_counter()
+        movements = engine.refresh(conn)
+        print(f'📦 {movements:,} movimientos en {time.perf_counter() - started:.2f} s ({path})')
+        for method in METHODS:
+            row = engine.period(conn, _arg('--start'), _arg('--end'), method)
+            print(f"  {row['method_label']:<20} apertura {row['opening_value']:>14,.0f}  compras {row['purchases']:>14,.0f}"
+                  f"  costo de ventas {row['cogs']:>14,.0f}  ajustes {row['adjustments']:>12,.0f}"
+                  f"  cierre {row['closing_value']:>14,.0f}")
+        conn.close()
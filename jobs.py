@@ -0,0 +1,301 @@
+"""
+Cola de trabajos en segundo plano para el sistema Epicuro
+
+Los trabajos lentos (impresión, exportaciones, importaciones, correos) se
+guardan en la tabla `jobs` y los ejecuta un grupo acotado de hilos, para que
+los hilos de las peticiones queden libres para tomar órdenes.
+
+- Prioridad: número menor se ejecuta primero (impresión antes que exportaciones)
+- Reintentos: backoff exponencial hasta max_attempts
+- Persistencia: los trabajos sobreviven a un reinicio; los que quedaron
+  'running' al caerse el proceso vuelven a la cola al iniciar
+"""
+
+import datetime
+import json
+import sqlite3
+import threading
+import time
+import traceback
+
+from pytz import timezone
+
+CHILE_TZ = timezone('America/Santiago')
+
+# Prioridades (menor = más urgente)
+PRIORITY_PRINT = 0
+PRIORITY_HIGH = 10
+PRIORITY_DEFAULT = 50
+PRIORITY_EXPORT = 80
+
+JOBS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT,
+        priority INTEGER DEFAULT 50,
+        status TEXT DEFAULT 'queued',
+        attempts INTEGER DEFAULT 0,
+        max_attempts INTEGER DEFAULT 3,
+        run_after REAL NOT NULL,
+        result TEXT,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+'''
+
+JOBS_INDEX = '''
+    CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority, run_after)
+'''
+
+# Registro de manejadores: kind -> (función, prioridad, max_attempts)
+_handlers = {}
+
+
+def job_handler(kind, priority=PRIORITY_DEFAULT, max_attempts=3):
+    """Registrar una función como manejador de un tipo de trabajo
+
+    La función recibe (payload, conn) y devuelve un resultado serializable a JSON.
+    """
+    def decorator(func):
+        _handlers[kind] = (func, priority, max_attempts)
+        return func
+    return decorator
+
+
+def create_jobs_table(cursor):
+    """Crear la tabla de trabajos (usada por init_db y por la cola)"""
+    cursor.execute(JOBS_SCHEMA)
+    cursor.execute(JOBS_INDEX)
+
+
+def _chile_timestamp():
+    return datetime.datetime.now(CHILE_TZ).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _row_to_dict(row):
+    """Convertir una fila de jobs a dict con payload/result decodificados"""
+    job = dict(row)
+    for key in ('payload', 'result'):
+        if job.get(key):
+            try:
+                job[key] = json.loads(job[key])
+            except ValueError:
+                pass
+    return job
+
+
+class JobQueue:
+    """Cola persistente con un grupo acotado de hilos trabajadores"""
+
+    def __init__(self, db_path, workers=2, poll_interval=5.0, base_backoff=2.0, recover_on_start=True):
+        self.db_path = db_path
+        self.workers = workers
+        # Con varios procesos la recuperación la hace uno solo, antes de iniciar los demás
+        self.recover_on_start = recover_on_start
+        self.poll_interval = poll_interval
+        self.base_backoff = base_backoff
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # ===== CICLO DE VIDA =====
+
+    def start(self):
+        """Iniciar los hilos trabajadores (idempotente)"""
+        with self._lock:
+            if self._threads:
+                return
+
+            if self.recover_on_start:
+                self.recover_interrupted()
+
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f'epicuro-job-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def recover_interrupted(self):
+        """Devolver a la cola los trabajos que quedaron 'running' por un reinicio"""
+        conn = self._connect()
+        try:
+            create_jobs_table(conn)
+            recovered = conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return recovered
+
+    def stop(self, timeout=5.0):
+        """Detener los hilos trabajadores al terminar el trabajo en curso"""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    # ===== API PÚBLICA =====
+
+    def enqueue(self, kind, payload=None, priority=None, delay=0, max_attempts=None, conn=None):
+        """Encolar un trabajo y devolver su ID
+
+        Si se entrega conn, el INSERT participa de la transacción del llamador
+        (el trabajo queda visible al hacer commit).
+        """
+        if kind not in _handlers:
+            raise ValueError(f'Tipo de trabajo desconocido: {kind}')
+
+        _, default_priority, default_attempts = _handlers[kind]
+        own_conn = conn is None
+        if own_conn:
+            conn = self._connect()
+
+        try:
+            cursor = conn.execute('''
+                INSERT INTO jobs (kind, payload, priority, max_attempts, run_after, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (kind, json.dumps(payload or {}),
+                  default_priority if priority is None else priority,
+                  default_attempts if max_attempts is None else max_attempts,
+                  time.time() + delay, _chile_timestamp()))
+            job_id = cursor.lastrowid
+            if own_conn:
+                conn.commit()
+        finally:
+            if own_conn:
+                conn.close()
+
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        """Estado de un trabajo como dict, o None"""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            return _row_to_dict(row) if row else None
+        finally:
+            conn.close()
+
+    def list(self, status=None, kind=None, limit=50):
+        """Últimos trabajos, opcionalmente filtrados por estado y tipo"""
+        query = 'SELECT * FROM jobs WHERE 1=1'
+        params = []
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        if kind:
+            query += ' AND kind = ?'
+            params.append(kind)
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+
+        conn = self._connect()
+        try:
+            return [_row_to_dict(row) for row in conn.execute(query, params).fetchall()]
+        finally:
+            conn.close()
+
+    def counts(self):
+        """Cantidad de trabajos por estado"""
+        conn = self._connect()
+        try:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        finally:
+            conn.close()
+
+    # ===== EJECUCIÓN =====
+
+    def _claim(self, conn):
+        """Tomar el siguiente trabajo listo; seguro entre hilos y procesos"""
+        while True:
+            row = conn.execute('''
+                SELECT * FROM jobs
+                WHERE status = 'queued' AND run_after <= ?
+                ORDER BY priority, run_after, id
+                LIMIT 1
+            ''', (time.time(),)).fetchone()
+            if row is None:
+                return None
+
+            claimed = conn.execute('''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?
+                WHERE id = ? AND status = 'queued'
+            ''', (_chile_timestamp(), row['id'])).rowcount
+            conn.commit()
+            if claimed:
+                return row
+
+    def _next_wait(self, conn):
+        """Segundos hasta el próximo trabajo programado (acotado por poll_interval)"""
+        row = conn.execute("SELECT MIN(run_after) FROM jobs WHERE status = 'queued'").fetchone()
+        if row[0] is None:
+            return self.poll_interval
+        return max(0.05, min(self.poll_interval, row[0] - time.time()))
+
+    def _worker_loop(self):
+        conn = self._connect()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    job = self._claim(conn)
+                except sqlite3.OperationalError:
+                    # Base bloqueada por otra escritura: reintentar en breve
+                    conn.rollback()
+                    job = None
+
+                if job is None:
+                    with self._wakeup:
+                        self._wakeup.wait(self._next_wait(conn))
+                    continue
+
+                self._run(conn, job)
+        finally:
+            conn.close()
+
+    def _run(self, conn, job):
+        handler = _handlers.get(job['kind'])
+        attempts = job['attempts'] + 1
+
+        try:
+            if handler is None:
+                raise RuntimeError(f"Sin manejador para '{job['kind']}'")
+            payload = json.loads(job['payload'] or '{}')
+            result = handler[0](payload, conn)
+            conn.commit()
+
+            conn.execute('''
+                UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = ?
+                WHERE id = ?
+            ''', (json.dumps(result), _chile_timestamp(), job['id']))
+            conn.commit()
+
+        except Exception as e:
+            conn.rollback()
+            error = f'{e}\n{traceback.format_exc(limit=5)}'
+
+            if attempts < job['max_attempts']:
+                # Backoff exponencial: 2s, 4s, 8s, ...
+                retry_at = time.time() + self.base_backoff * (2 ** (attempts - 1))
+                conn.execute('''
+                    UPDATE jobs SET status = 'queued', error = ?, run_after = ?
+                    WHERE id = ?
+                ''', (error, retry_at, job['id']))
+            else:
+                conn.execute('''
+                    UPDATE jobs SET status = 'failed', error = ?, finished_at = ?
+                    WHERE id = ?
+                ''', (error, _chile_timestamp(), job['id']))
+            conn.commit()
@@ -0,0 +1,289 @@
+"""
+Pantalla de cocina (KDS) para el sistema Epicuro
+
+Mantiene en memoria las órdenes pendientes y en preparación, con sus items
+repartidos por estación (plancha, bar, freidora) según la categoría del
+producto. Cada cambio genera un evento numerado que las pantallas reciben
+como delta por Server-Sent Events, sin recargar la página.
+
+Los items marcados como listos quedan en order_items.bumped_at, así todas
+las pantallas (de cualquier worker) los ven igual y sobreviven a un
+reinicio.
+
+Los cambios hechos en este proceso llegan con sync_order; los de otros
+procesos (otros workers, scripts) con reconcile, que compara una marca
+(estado, updated_at, total e items listos) de cada orden activa y solo
+relee las que difieren.
+"""
+
+import threading
+import unicodedata
+from collections import deque
+
+STATIONS = ('grill', 'bar', 'fryer')
+STATION_LABELS = {'grill': 'Plancha', 'bar': 'Bar', 'fryer': 'Freidora'}
+DEFAULT_STATION = 'grill'
+
+# Palabra clave en el nombre de la categoría -> estación
+CATEGORY_KEYWORDS = {
+    'CAFE': 'bar', 'BEBIDA': 'bar', 'JUGO': 'bar', 'TE': 'bar', 'GASEOSA': 'bar',
+    'PAPA': 'fryer', 'FRITURA': 'fryer', 'EMPANADA': 'fryer',
+    'SANDWICH': 'grill', 'COMPLETO': 'grill', 'DESAYUNO': 'grill',
+}
+
+# Estados que se muestran en cocina y transición al "despachar"
+ACTIVE_STATUSES = ('pending', 'preparing')
+NEXT_STATUS = {'pending': 'preparing', 'preparing': 'ready'}
+
+# Eventos guardados para clientes que se reconectan
+EVENT_BACKLOG = 500
+
+# Órdenes por consulta al leer items (SQLite limita los parámetros de IN)
+FETCH_BATCH = 500
+
+
+def add_bump_column(cursor):
+    """Agregar order_items.bumped_at; devuelve True si se creó ahora"""
+    existing = {row[1] for row in cursor.execute('PRAGMA table_info(order_items)').fetchall()}
+    if 'bumped_at' in existing:
+        return False
+    cursor.execute('ALTER TABLE order_items ADD COLUMN bumped_at TIMESTAMP')
+    return True
+
+
+def _fold(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(ch for ch in text if not unicodedata.combining(ch)).upper()
+
+
+class KitchenBoard:
+    """Estado en memoria de la cocina con un registro de eventos incrementales"""
+
+    def __init__(self, station_map=None):
+        # Asignación explícita nombre de categoría -> estación (tiene prioridad)
+        self.station_map = {_fold(k): v for k, v in (station_map or {}).items()}
+        self._orders = {}
+        self._stamps = {}
+        self._events = deque(maxlen=EVENT_BACKLOG)
+        self._version = 0
+        self._loaded = False
+        self._cond = threading.Condition()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def version(self):
+        return self._version
+
+    def station_for_category(self, category_name):
+        """Estación que prepara los productos de una categoría"""
+        folded = _fold(category_name)
+        if folded in self.station_map:
+            return self.station_map[folded]
+        for word in folded.replace('-', ' ').split():
+            if word in CATEGORY_KEYWORDS:
+                return CATEGORY_KEYWORDS[word]
+        return DEFAULT_STATION
+
+    # ===== CARGA Y ACTUALIZACIÓN =====
+
+    def load(self, conn):
+        """Reconstruir el tablero desde la base de datos"""
+        placeholders = ','.join('?' * len(ACTIVE_STATUSES))
+        orders = conn.execute(f'''
+            SELECT id, order_number, customer_name, order_type, status, notes, created_at,
+                   updated_at, total_amount
+            FROM orders WHERE status IN ({placeholders})
+            ORDER BY created_at
+        ''', ACTIVE_STATUSES).fetchall()
+
+        items = fetch_board_items(conn, [order['id'] for order in orders])
+
+        with self._cond:
+            self._orders = {}
+            self._stamps = {}
+            for order in orders:
+                order_items = items.get(order['id'], [])
+                self._orders[order['id']] = self._build_order(order, order_items)
+                self._stamps[order['id']] = _stamp(order, _bumped(order_items))
+            self._loaded = True
+            self._emit({'type': 'reset'})
+
+    def sync_order(self, conn, order_id):
+        """Actualizar una orden del tablero después de escribirla en la BD"""
+        order = conn.execute('''
+            SELECT id, order_number, customer_name, order_type, status, notes, created_at,
+                   updated_at, total_amount
+            FROM orders WHERE id = ?
+        ''', (order_id,)).fetchone()
+
+        if order is None or order['status'] not in ACTIVE_STATUSES:
+            self.remove_order(order_id)
+            return
+
+        items = fetch_board_items(conn, [order_id]).get(order_id, [])
+        with self._cond:
+            board_order = self._build_order(order, items)
+            self._orders[order_id] = board_order
+            self._stamps[order_id] = _stamp(order, _bumped(items))
+            self._emit({'type': 'order', 'order': board_order})
+
+    def remove_order(self, order_id):
+        with self._cond:
+            self._stamps.pop(order_id, None)
+            if self._orders.pop(order_id, None) is not None:
+                self._emit({'type': 'remove', 'order_id': order_id})
+
+    def reconcile(self, conn):
+        """Alinear el tablero con la base; devuelve cuántas órdenes cambiaron"""
+        placeholders = ','.join('?' * len(ACTIVE_STATUSES))
+        rows = conn.execute(f'''
+            SELECT id, status, updated_at, total_amount
+            FROM orders WHERE status IN ({placeholders})
+        ''', ACTIVE_STATUSES).fetchall()
+        bumped = {}
+        for order_id, item_id in conn.execute(f'''
+            SELECT oi.order_id, oi.id
+            FROM order_items oi
+            JOIN orders o ON oi.order_id = o.id
+            WHERE o.status IN ({placeholders}) AND oi.bumped_at IS NOT NULL
+            ORDER BY oi.order_id, oi.id
+        ''', ACTIVE_STATUSES).fetchall():
+            bumped.setdefault(order_id, []).append(item_id)
+        active = {row[0]: _stamp(row, tuple(bumped.get(row[0], ()))) for row in rows}
+
+        with self._cond:
+            stale = [order_id for order_id, stamp in active.items() if self._stamps.get(order_id) != stamp]
+            gone = [order_id for order_id in self._orders if order_id not in active]
+        for order_id in gone:
+            self.remove_order(order_id)
+        for order_id in stale:
+            self.sync_order(conn, order_id)
+        return len(gone) + len(stale)
+
+    def set_status(self, order_id, status, updated_at):
+        """Cambiar el estado de una orden en el tablero (sin tocar la BD)
+
+        updated_at es el que se guardó junto con el estado: la marca queda
+        igual a la de la base y reconcile no vuelve a leer la orden.
+        """
+        with self._cond:
+            order = self._orders.get(order_id)
+            if order is None:
+                return
+            if status not in ACTIVE_STATUSES:
+                del self._orders[order_id]
+                self._stamps.pop(order_id, None)
+                self._emit({'type': 'remove', 'order_id': order_id})
+            else:
+                order['status'] = status
+                stamp = self._stamps.get(order_id)
+                if stamp is not None:
+                    self._stamps[order_id] = (status, updated_at) + stamp[2:]
+                self._emit({'type': 'order', 'order': order})
+
+    def _build_order(self, order, items):
+        board_items = []
+        for item in items:
+            board_items.append({
+                'id': item['id'],
+                'product_name': item['product_name'],
+                'quantity': item['quantity'],
+                'notes': item['notes'],
+                'variations': item['variations'],
+                'station': self.station_for_category(item['category_name']),
+                'done': item['done'],
+            })
+        return {
+            'id': order['id'],
+            'order_number': order['order_number'],
+            'customer_name': order['customer_name'],
+            'order_type': order['order_type'],
+            'status': order['status'],
+            'notes': order['notes'],
+            'created_at': order['created_at'],
+            'items': board_items,
+        }
+
+    def _emit(self, event):
+        """Registrar un evento (llamar con el lock tomado) y despertar a los clientes"""
+        self._version += 1
+        event['version'] = self._version
+        if 'order' in event:
+            # Copia: el evento no debe cambiar cuando la orden se modifique después
+            event['order'] = filter_station(event['order'], None)
+            event['order']['items'] = [dict(item) for item in event['order']['items']]
+        self._events.append(event)
+        self._cond.notify_all()
+
+    # ===== LECTURA =====
+
+    def snapshot(self, station=None):
+        """Órdenes activas; con station, solo las que tienen items de esa estación"""
+        with self._cond:
+            orders = [filter_station(order, station) for order in self._orders.values()]
+            return {
+                'version': self._version,
+                'orders': [order for order in orders if order['items']],
+            }
+
+    def wait_for_events(self, since, timeout=15.0):
+        """Eventos posteriores a `since` (bloquea hasta timeout si no hay)
+
+        Si el cliente quedó demasiado atrás devuelve un único evento 'reset'.
+        """
+        with self._cond:
+            if self._version <= since:
+                self._cond.wait(timeout)
+            if self._version <= since:
+                return []
+            if not self._events or self._events[0]['version'] > since + 1:
+                return [{'type': 'reset', 'version': self._version}]
+            return [event for event in self._events if event['version'] > since]
+
+
+def _stamp(order, bumped):
+    """Marca para saber si una orden cambió desde que se leyó (bumped: ids de items listos)"""
+    return (order['status'], order['updated_at'], order['total_amount'], bumped)
+
+
+def _bumped(items):
+    return tuple(item['id'] for item in items if item['done'])
+
+
+def filter_station(order, station):
+    """Copia de la orden con solo los items de una estación"""
+    if not station:
+        return dict(order, items=list(order['items']))
+    return dict(order, items=[item for item in order['items'] if item['station'] == station])
+
+
+def fetch_board_items(conn, order_ids):
+    """Items de varias órdenes con categoría y variaciones: {order_id: [item]}"""
+    by_order = {}
+    for start in range(0, len(order_ids), FETCH_BATCH):
+        ids = order_ids[start:start + FETCH_BATCH]
+        placeholders = ','.join('?' * len(ids))
+        rows = conn.execute(f'''
+            SELECT oi.id, oi.order_id, oi.product_name, oi.quantity, oi.notes,
+                   oi.variations_display, oi.bumped_at, c.name as category_name
+            FROM order_items oi
+            LEFT JOIN products p ON oi.product_id = p.id
+            LEFT JOIN categories c ON p.category_id = c.id
+            WHERE oi.order_id IN ({placeholders})
+            ORDER BY oi.order_id, oi.id
+        ''', ids).fetchall()
+
+        for row in rows:
+            by_order.setdefault(row['order_id'], []).append({
+                'id': row['id'],
+                'product_name': row['product_name'],
+                'quantity': row['quantity'],
+                'notes': row['notes'],
+                'category_name': row['category_name'],
+                'variations': row['variations_display'] or '',
+                'done': row['bumped_at'] is not None,
+            })
+    return by_order
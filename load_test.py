@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de extremo a extremo del sistema Epicuro
+
+Simula N terminales (cajas y cocina) que repiten las acciones del día a día
+con los pesos de ACTIONS: crear órdenes, verlas, editarlas, cambiar su
+estado y recargar el dashboard, la lista del día y el tablero de cocina.
+Al terminar informa el throughput total y, por ruta, peticiones, errores y
+latencias p50/p95/p99.
+
+Por defecto usa la app en el mismo proceso (cliente de pruebas de Flask)
+contra una base de prueba, por ejemplo la de generate_data.py. Con --url se
+prueba un servidor ya levantado por HTTP.
+
+    python generate_data.py --db data/bench.db --orders 100000 --days 90
+    python load_test.py --db data/bench.db --terminals 8 --duration 60
+    python load_test.py --url http://localhost:5002 --terminals 4 --duration 30 --json resultado.json
+
+Las órdenes que no se crean (la app redirige de vuelta a /orders/new, por
+ejemplo por número de orden repetido dentro del mismo segundo) cuentan como
+error de create_order.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# Peso de cada acción de una terminal
+ACTIONS = {
+    'create_order': 30,
+    'view_order': 15,
+    'edit_order': 10,
+    'update_status': 15,
+    'dashboard': 15,
+    'orders_list': 10,
+    'kitchen_board': 5,
+}
+
+# Avance de estados que aplica update_status
+STATUS_FLOW = {'pending': 'preparing', 'preparing': 'ready', 'ready': 'completed'}
+
+PERCENTILES = (50, 95, 99)
+
+
+# ===== CLIENTES =====
+
+class InProcessClient:
+    """Peticiones a la app de Flask en el mismo proceso"""
+
+    def __init__(self, flask_app):
+        # Sin cookies: los flash() no se leen y la sesión crecería sin límite
+        self.client = flask_app.test_client(use_cookies=False)
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        body = response.get_data()
+        return response.status_code, response.headers.get('Location', ''), body
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """Peticiones HTTP a un servidor en ejecución (sin seguir redirecciones)"""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(_NoRedirect)
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.headers.get('Location', ''), response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('Location', ''), e.read()
+
+
+# ===== RESULTADOS =====
+
+def percentile(sorted_values, pct):
+    """Percentil por rango más cercano de una lista ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Results:
+    """Latencias y errores por ruta, compartidos entre terminales"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.error_samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, ok, detail=None):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+                samples = self.error_samples.setdefault(route, [])
+                if detail and len(samples) < 5:
+                    samples.append(detail)
+
+    def report(self, elapsed, terminals):
+        routes = {}
+        total = 0
+        for route, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            total += len(values)
+            routes[route] = {
+                'requests': len(values),
+                'errors': self.errors.get(route, 0),
+                'throughput': round(len(values) / elapsed, 2),
+                **{f'p{pct}_ms': round(percentile(values, pct) * 1000, 1) for pct in PERCENTILES},
+                'max_ms': round(values[-1] * 1000, 1),
+                'error_samples': self.error_samples.get(route, []),
+            }
+        return {
+            'terminals': terminals,
+            'seconds': round(elapsed, 1),
+            'requests': total,
+            'errors': sum(self.errors.values()),
+            'throughput': round(total / elapsed, 2) if elapsed else 0,
+            'routes': routes,
+        }
+
+
+def print_report(report):
+    print(f"\n📊 {report['requests']:,} peticiones en {report['seconds']} s con "
+          f"{report['terminals']} terminales: {report['throughput']} pet/s, {report['errors']} errores")
+    print(f"{'Ruta':<16}{'Pet.':>8}{'Err.':>7}{'pet/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'máx ms':>9}")
+    for route, row in report['routes'].items():
+        print(f"{route:<16}{row['requests']:>8}{row['errors']:>7}{row['throughput']:>9}"
+              f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{row['max_ms']:>9}")
+    for route, row in report['routes'].items():
+        for sample in row['error_samples']:
+            print(f'  ⚠️  {route}: {sample}')
+
+
+# ===== TERMINALES =====
+
+class Catalog:
+    """Productos y variaciones disponibles, leídos una vez por la API"""
+
+    def __init__(self, client):
+        status, _, body = client.request('GET', '/api/products')
+        if status != 200:
+            raise SystemExit(f'❌ /api/products respondió {status}')
+        self.products = json.loads(body)
+        if not self.products:
+            raise SystemExit('❌ No hay productos disponibles (genere datos con generate_data.py)')
+        self.groups = {}
+        for product in self.products:
+            status, _, body = client.request('GET', f"/api/product-variations/{product['id']}")
+            self.groups[product['id']] = json.loads(body) if status == 200 else []
+
+    def cart(self, rnd):
+        """Carrito al azar con el formato que envía new_order.html"""
+        items = []
+        for product in rnd.sample(self.products, min(len(self.products), rnd.randint(1, 5))):
+            variations = []
+            for group in self.groups.get(product['id'], []):
+                if not group['options'] or not (group['required'] or rnd.random() < 0.3):
+                    continue
+                chosen = rnd.sample(group['options'], 2 if group['multiple_selection'] and
+                                    len(group['options']) > 1 and rnd.random() < 0.3 else 1)
+                variations.extend({'option_id': o['id'], 'name': o['name'],
+                                   'price_modifier': o['price_modifier']} for o in chosen)
+            items.append({
+                'id': product['id'],
+                'name': product['name'],
+                'price': product['price'] + sum(v['price_modifier'] or 0 for v in variations),
+                'quantity': rnd.choice((1, 1, 1, 2)),
+                'notes': '',
+                'variations': variations,
+            })
+        return items
+
+
+class Terminal(threading.Thread):
+    """Una caja que repite acciones al azar hasta `deadline`"""
+
+    def __init__(self, number, client, catalog, results, shared, deadline, think=0.0, seed=None):
+        super().__init__(name=f'terminal-{number}', daemon=True)
+        self.client = client
+        self.catalog = catalog
+        self.results = results
+        self.shared = shared
+        self.deadline = deadline
+        self.think = think
+        self.random = random.Random(seed)
+        self.actions = list(ACTIONS)
+        self.weights = [ACTIONS[name] for name in self.actions]
+
+    def run(self):
+        while time.time() < self.deadline:
+            action = self.random.choices(self.actions, weights=self.weights)[0]
+            order = self.shared.pick(self.random)
+            if order is None and action in ('view_order', 'edit_order', 'update_status'):
+                action = 'create_order'
+            getattr(self, action)(order)
+            if self.think:
+                time.sleep(self.random.uniform(0, 2 * self.think))
+
+    def _call(self, route, method, path, data=None, check=None):
+        start = time.perf_counter()
+        try:
+            status, location, body = self.client.request(method, path, data)
+        except Exception as e:  # conexión rechazada, timeout, excepción de la app
+            self.results.record(route, time.perf_counter() - start, False, str(e)[:200])
+            return None, ''
+        elapsed = time.perf_counter() - start
+        ok = status < 400 and (check is None or check(location))
+        self.results.record(route, elapsed, ok, None if ok else f'{status} {location}'.strip())
+        return (status if ok else None), location
+
+    # ===== ACCIONES =====
+
+    def create_order(self, _order=None):
+        cart = self.catalog.cart(self.random)
+        data = {
+            'customer_name': f'Cliente {self.random.randint(1, 9999)}',
+            'payment_method': self.random.choice(('efectivo', 'tarjeta', 'transferencia')),
+            'order_type': self.random.choice(('dine_in', 'dine_in', 'takeaway')),
+            'notes': '',
+            'cart_items': json.dumps(cart),
+        }
+        status, location = self._call('create_order', 'POST', '/orders/create', data,
+                                      check=lambda loc: '/orders/new' not in loc and '/orders/' in loc)
+        if status:
+            try:
+                order_id = int(location.rstrip('/').rsplit('/', 1)[1])
+            except ValueError:
+                return
+            self.shared.add(order_id, cart)
+
+    def view_order(self, order):
+        self._call('view_order', 'GET', f'/orders/{order[0]}')
+
+    def edit_order(self, order):
+        order_id, cart, status = order
+        if not self._call('edit_order', 'GET', f'/orders/{order_id}/edit')[0]:
+            return
+        # Cambiar la cantidad de una línea y guardar
+        cart = [dict(item) for item in cart]
+        self.random.choice(cart)['quantity'] += 1
+        data = {'customer_name': 'Cliente editado', 'payment_method': 'efectivo', 'notes': '',
+                'status': status, 'cart_items': json.dumps(cart)}
+        if self._call('update_order', 'POST', f'/orders/{order_id}/update', data,
+                      check=lambda loc: '/edit' not in loc)[0]:
+            self.shared.update(order_id, cart=cart)
+
+    def update_status(self, order):
+        order_id, _, status = order
+        new_status = STATUS_FLOW.get(status, 'pending')
+        if self._call('update_status', 'POST', f'/orders/{order_id}/update_status',
+                      {'status': new_status})[0]:
+            self.shared.update(order_id, status=new_status)
+
+    def dashboard(self, _order=None):
+        self._call('dashboard', 'GET', '/')
+
+    def orders_list(self, _order=None):
+        self._call('orders_list', 'GET', '/orders?date=' + time.strftime('%Y-%m-%d'))
+
+    def kitchen_board(self, _order=None):
+        self._call('kitchen_board', 'GET', '/api/kitchen/board')
+
+
+class SharedOrders:
+    """Órdenes creadas durante la prueba: id -> (carrito, estado)"""
+
+    def __init__(self):
+        self._orders = {}
+        self._ids = []
+        self._lock = threading.Lock()
+
+    def add(self, order_id, cart):
+        with self._lock:
+            if order_id not in self._orders:
+                self._ids.append(order_id)
+            self._orders[order_id] = (cart, 'pending')
+
+    def update(self, order_id, cart=None, status=None):
+        with self._lock:
+            old_cart, old_status = self._orders[order_id]
+            self._orders[order_id] = (cart or old_cart, status or old_status)
+
+    def pick(self, rnd):
+        """(id, carrito, estado) de una orden reciente, o None"""
+        with self._lock:
+            if not self._ids:
+                return None
+            # Las terminales trabajan sobre todo con las últimas 50 órdenes
+            order_id = self._ids[-1 - min(int(rnd.expovariate(1 / 10)), len(self._ids) - 1, 49)]
+            return (order_id,) + self._orders[order_id]
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def run_load_test(make_client, terminals=4, duration=30.0, think=0.0, seed=1):
+    """Ejecutar la prueba; make_client() entrega un cliente por terminal"""
+    catalog = Catalog(make_client())
+    results = Results()
+    shared = SharedOrders()
+    deadline = time.time() + duration
+    threads = [Terminal(n, make_client(), catalog, results, shared, deadline, think, seed + n)
+               for n in range(terminals)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report = results.report(time.perf_counter() - start, terminals)
+    report['orders_created'] = len(shared)
+    return report
+
+
+def _in_process_factory(db_path):
+    """Cliente de la app apuntando a una base de prueba"""
+    import app as epicuro
+
+    if os.path.abspath(db_path) == os.path.abspath(epicuro.DATABASE):
+        raise SystemExit('❌ La prueba escribe órdenes: use una copia (--db) y no la base de producción')
+    if not os.path.exists(db_path):
+        raise SystemExit(f'❌ {db_path} no existe (créela con generate_data.py)')
+    epicuro.DATABASE = db_path
+    epicuro.job_queue.db_path = db_path
+    epicuro.app.config['AUTO_PRINT_KITCHEN'] = False
+    return lambda: InProcessClient(epicuro.app)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Prueba de carga con terminales simuladas')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--db', default='data/bench.db', help='base de prueba para la app en proceso')
+    target.add_argument('--url', help='servidor en ejecución (ej. http://localhost:5002)')
+    parser.add_argument('--terminals', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30.0, help='segundos')
+    parser.add_argument('--think', type=float, default=0.0, help='pausa media entre acciones (s)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='guardar el resultado en este archivo')
+    args = parser.parse_args(argv)
+
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+        target_name = args.url
+    else:
+        make_client = _in_process_factory(args.db)
+        target_name = args.db
+
+    print(f'🚦 {args.terminals} terminales durante {args.duration:g} s contra {target_name}')
+    report = run_load_test(make_client, args.terminals, args.duration, args.think, args.seed)
+    print_report(report)
+    print(f"🧾 Órdenes creadas: {report['orders_created']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'💾 Resultado guardado en {args.json}')
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Ingeniería de menú (popularidad vs. margen de contribución) para el sistema Epicuro
+
+Cada producto de una categoría (la sección del menú) cae en uno de cuatro
+cuadrantes según dos preguntas:
+
+- ¿Es popular? Su participación en las unidades vendidas de la categoría es
+  al menos el 70% de la participación pareja (0.7 / productos de la categoría)
+- ¿Es rentable? Su margen por unidad es al menos el margen promedio
+  ponderado de la categoría (margen total / unidades)
+
+    star       popular y rentable
+    plowhorse  popular, margen bajo
+    puzzle     poco vendido, margen alto
+    dog        poco vendido, margen bajo
+
+Unidades, ventas y costo salen de product_sales_daily (sales_rollup.py), así
+el cálculo es una consulta agrupada más una pasada de NumPy sobre arreglos
+por producto: np.bincount da los totales de cada categoría y la
+clasificación se hace sobre todos los productos a la vez. Los productos
+disponibles sin ventas entran con cero unidades y el margen de su precio
+menos el costo actual de la receta.
+
+El resultado se guarda por período (menu_engineering_periods y
+menu_engineering) para que todos los workers lo compartan. El trabajo
+'menu_engineering' recalcula cada noche los últimos NIGHTLY_DAYS días
+completos (el período que muestra la lista de productos) y descarta los
+demás períodos guardados; un período que incluía el día en que se calculó
+se vuelve a calcular pasados OPEN_PERIOD_MAX_AGE segundos.
+
+    python menu_engineering.py --refresh [--db data/sandwich.db] [--start YYYY-MM-DD --end YYYY-MM-DD]
+    python -m pytest tests/test_menu_engineering.py
+"""
+
+import datetime
+import sqlite3
+import sys
+
+import numpy as np
+
+from sales_rollup import plain_number
+
+CLASSES = ('star', 'plowhorse', 'puzzle', 'dog')
+CLASS_LABELS = {
+    'star': 'Estrella',
+    'plowhorse': 'Caballo de batalla',
+    'puzzle': 'Enigma',
+    'dog': 'Perro',
+}
+
+POPULARITY_FACTOR = 0.7
+NIGHTLY_DAYS = 30
+OPEN_PERIOD_MAX_AGE = 15 * 60
+
+NO_CATEGORY = -1  # grupo de los productos sin categoría
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+# ===== ESQUEMA =====
+
+def create_menu_engineering_tables(cursor):
+    """Crear las tablas de períodos calculados y su clasificación por producto"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS menu_engineering_periods (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            start_day TEXT NOT NULL,
+            end_day TEXT NOT NULL,
+            nightly INTEGER NOT NULL DEFAULT 0,
+            computed_at TEXT NOT NULL,
+            UNIQUE (start_day, end_day)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS menu_engineering (
+            period_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            quantity REAL NOT NULL,
+            revenue REAL NOT NULL,
+            cost REAL NOT NULL,
+            unit_margin REAL NOT NULL,
+            mix_share REAL NOT NULL,
+            class TEXT NOT NULL,
+            PRIMARY KEY (period_id, product_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+# ===== CÁLCULO =====
+
+def _day(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def nightly_range(today, days=NIGHTLY_DAYS):
+    """(inicio, fin exclusivo) de los últimos `days` días completos antes de today"""
+    return today - datetime.timedelta(days=days), today
+
+
+def classify(quantity, margin, unit_margin, groups):
+    """Índices de CLASSES, participación y margen promedio de su grupo, por producto
+
+    quantity y margin son los totales vendidos del período; unit_margin el
+    margen por unidad (también para los que no se vendieron); groups la
+    categoría de cada producto. Todo son arreglos del mismo largo.
+    """
+    quantity = np.asarray(quantity, dtype=float)
+    margin = np.asarray(margin, dtype=float)
+    unit_margin = np.asarray(unit_margin, dtype=float)
+    _, group = np.unique(np.asarray(groups), return_inverse=True)
+
+    items = np.bincount(group)
+    group_quantity = np.bincount(group, weights=quantity)[group]
+    group_margin = np.bincount(group, weights=margin)[group]
+
+    sold = group_quantity > 0
+    share = np.divide(quantity, group_quantity, out=np.zeros_like(quantity), where=sold)
+    average = np.divide(group_margin, group_quantity, out=np.zeros_like(quantity), where=sold)
+
+    popular = share >= POPULARITY_FACTOR / items[group]
+    profitable = unit_margin >= average
+    codes = (~popular).astype(np.int8) * 2 + (~profitable).astype(np.int8)
+    return codes, share, average
+
+
+def compute(conn, start, end, unit_costs=None):
+    """Clasificación de start <= día < end como dict de arreglos por producto
+
+    unit_costs ({product_id: costo}, ver recipe_costing.load_product_costs)
+    da el margen de los productos sin ventas en el período.
+    """
+    rows = conn.execute('''
+        SELECT p.id, COALESCE(p.category_id, ?), p.price,
+               COALESCE(s.quantity, 0), COALESCE(s.revenue, 0), COALESCE(s.cost, 0)
+        FROM products p
+        LEFT JOIN (
+            SELECT product_id, SUM(quantity) AS quantity, SUM(revenue) AS revenue, SUM(cost) AS cost
+            FROM product_sales_daily
+            WHERE day >= ? AND day < ?
+            GROUP BY product_id
+        ) s ON s.product_id = p.id
+        WHERE p.available = 1 OR s.quantity > 0
+    ''', (NO_CATEGORY, _day(start), _day(end))).fetchall()
+
+    unit_costs = unit_costs or {}
+    product_id = np.array([row[0] for row in rows], dtype=np.int64)
+    category_id = np.array([row[1] for row in rows], dtype=np.int64)
+    price, quantity, revenue, cost = (np.array([row[i] or 0 for row in rows], dtype=float) for i in range(2, 6))
+    current_cost = np.array([unit_costs.get(pid, 0) for pid in product_id.tolist()], dtype=float)
+
+    margin = revenue - cost
+    unit_margin = np.where(quantity > 0,
+                           np.divide(margin, quantity, out=np.zeros_like(margin), where=quantity > 0),
+                           price - current_cost)
+    codes, share, _ = classify(quantity, margin, unit_margin, category_id)
+    return {
+        'product_id': product_id,
+        'category_id': category_id,
+        'quantity': quantity,
+        'revenue': revenue,
+        'cost': cost,
+        'unit_margin': unit_margin,
+        'mix_share': share,
+        'class': np.array(CLASSES)[codes] if len(codes) else np.array([], dtype=str),
+    }
+
+
+# ===== CACHÉ POR PERÍODO =====
+
+def refresh(conn, start, end, now, unit_costs=None, nightly=False):
+    """Calcular y guardar un período; devuelve su id
+
+    now es la hora local del cálculo (datetime). Con nightly=True queda como
+    el período de la lista de productos y se descartan los demás guardados.
+    """
+    start, end = _day(start), _day(end)
+    result = compute(conn, start, end, unit_costs)
+    computed_at = now.strftime(TIMESTAMP_FORMAT)
+
+    if nightly:
+        conn.execute('DELETE FROM menu_engineering WHERE period_id IN '
+                     '(SELECT id FROM menu_engineering_periods WHERE start_day <> ? OR end_day <> ?)', (start, end))
+        conn.execute('DELETE FROM menu_engineering_periods WHERE start_day <> ? OR end_day <> ?', (start, end))
+    conn.execute('''
+        INSERT INTO menu_engineering_periods (start_day, end_day, nightly, computed_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (start_day, end_day) DO UPDATE
+        SET computed_at = excluded.computed_at, nightly = MAX(nightly, excluded.nightly)
+    ''', (start, end, int(nightly), computed_at))
+    period_id = conn.execute('SELECT id FROM menu_engineering_periods WHERE start_day = ? AND end_day = ?',
+                             (start, end)).fetchone()[0]
+
+    conn.execute('DELETE FROM menu_engineering WHERE period_id = ?', (period_id,))
+    conn.executemany('''
+        INSERT INTO menu_engineering
+            (period_id, product_id, category_id, quantity, revenue, cost, unit_margin, mix_share, class)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', zip([period_id] * len(result['product_id']),
+             *(result[key].tolist() for key in ('product_id', 'category_id', 'quantity', 'revenue',
+                                                'cost', 'unit_margin', 'mix_share', 'class'))))
+    return period_id
+
+
+def cached_period(conn, start, end, now, max_age=OPEN_PERIOD_MAX_AGE):
+    """id del período guardado si sigue vigente, o None
+
+    Un período que ya había terminado cuando se calculó vale hasta la
+    próxima noche; uno abierto (incluía ese día) vale max_age segundos.
+    """
+    row = conn.execute('SELECT id, computed_at FROM menu_engineering_periods WHERE start_day = ? AND end_day = ?',
+                       (_day(start), _day(end))).fetchone()
+    if row is None:
+        return None
+    computed_at = datetime.datetime.strptime(row[1], TIMESTAMP_FORMAT)
+    if _day(end) <= computed_at.date().isoformat():
+        return row[0]
+    age = (now.replace(tzinfo=None) - computed_at).total_seconds()
+    return row[0] if age < max_age else None
+
+
+def forget(conn, start=None, end=None):
+    """Descartar los períodos guardados (no el nocturno) que se cruzan con start <= día < end"""
+    where, params = 'nightly = 0', []
+    if end is not None:
+        where += ' AND start_day < ?'
+        params.append(_day(end))
+    if start is not None:
+        where += ' AND end_day > ?'
+        params.append(_day(start))
+    conn.execute(f'DELETE FROM menu_engineering WHERE period_id IN '
+                 f'(SELECT id FROM menu_engineering_periods WHERE {where})', params)
+    return conn.execute(f'DELETE FROM menu_engineering_periods WHERE {where}', params).rowcount
+
+
+def nightly_period(conn):
+    """(inicio, fin exclusivo) del período nocturno vigente, o None"""
+    row = conn.execute('SELECT start_day, end_day FROM menu_engineering_periods WHERE nightly = 1').fetchone()
+    return tuple(datetime.date.fromisoformat(day) for day in row) if row else None
+
+
+def report(conn, period_id):
+    """Período guardado con sus filas (ordenadas por margen total) y cantidad por clase"""
+    period = conn.execute('SELECT start_day, end_day, nightly, computed_at FROM menu_engineering_periods WHERE id = ?',
+                          (period_id,)).fetchone()
+    rows = []
+    for (product_id, name, category_id, category_name, quantity, revenue, cost,
+         unit_margin, share, menu_class) in conn.execute('''
+            SELECT m.product_id, p.name, m.category_id, c.name, m.quantity, m.revenue, m.cost,
+                   m.unit_margin, m.mix_share, m.class
+            FROM menu_engineering m
+            LEFT JOIN products p ON p.id = m.product_id
+            LEFT JOIN categories c ON c.id = m.category_id
+            WHERE m.period_id = ?
+            ORDER BY m.revenue - m.cost DESC, m.quantity DESC
+         ''', (period_id,)):
+        rows.append({
+            'product_id': product_id,
+            'name': name,
+            'category_id': None if category_id == NO_CATEGORY else category_id,
+            'category_name': category_name or 'Sin categoría',
+            'quantity': plain_number(quantity),
+            'revenue': plain_number(revenue),
+            'cost': plain_number(cost),
+            'margin': plain_number(revenue - cost),
+            'unit_margin': plain_number(unit_margin),
+            'mix_share': round(share, 4),
+            'class': menu_class,
+            'class_label': CLASS_LABELS[menu_class],
+        })
+    summary = {menu_class: 0 for menu_class in CLASSES}
+    for row in rows:
+        summary[row['class']] += 1
+    return {
+        'start_date': period[0],
+        'end_date': (datetime.date.fromisoformat(period[1]) - datetime.timedelta(days=1)).isoformat(),
+        'nightly': bool(period[2]),
+        'computed_at': period[3],
+        'summary': summary,
+        'rows': rows,
+    }
+
+
+def _arg(name, default=None):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+
+if __name__ == "__main__":
+    if '--refresh' in sys.argv:
+        from recipe_costing import load_product_costs
+
+        path = _arg('--db', 'data/sandwich.db')
+        conn = sqlite3.connect(path)
+        create_menu_engineering_tables(conn.cursor())
+        now = datetime.datetime.now()
+        if _arg('--start') and _arg('--end'):
+            start = datetime.date.fromisoformat(_arg('--start'))
+            end = datetime.date.fromisoformat(_arg('--end')) + datetime.timedelta(days=1)
+            nightly = False
+        else:
+            (start, end), nightly = nightly_range(now.date()), True
+        period_id = refresh(conn, start, end, now, load_product_costs(conn), nightly=nightly)
+        conn.commit()
+        summary = report(conn, period_id)['summary']
+        conn.close()
+        print(f'✅ {start}..{end - datetime.timedelta(days=1)} en {path}: '
+              + ', '.join(f'{CLASS_LABELS[key]} {value}' for key, value in summary.items()))
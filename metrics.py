@@ -0,0 +1,241 @@
+"""
+Métricas en formato de texto de Prometheus para el sistema Epicuro
+
+Contadores, gauges e histogramas en memoria del proceso, protegidos por un
+lock y sin dependencias externas. /metrics los expone en el formato de
+exposición de texto (version 0.0.4) para que Prometheus los recolecte y se
+puedan definir alertas, por ejemplo de latencia en la hora de almuerzo.
+
+Con varios procesos (gunicorn) cada worker expone sus propios valores.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Límites (segundos) de los histogramas de latencia
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOCK_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels_text(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f'{self.name} espera las etiquetas {self.labelnames}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Valor que solo aumenta"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels_text(self.labelnames, key)} {_number(value)}')
+        return lines
+
+
+class Gauge(Counter):
+    """Valor que sube y baja"""
+
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Distribución acumulada por límites fijos (+ suma y cantidad)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [conteo por límite (no acumulado) ..., +Inf, suma]
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), state[:-1]):
+                    cumulative += count
+                    le = 'le="' + _number(float(bound)) + '"'
+                    lines.append(f'{self.name}_bucket{_labels_text(self.labelnames, key, le)} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels_text(self.labelnames, key)} {_number(state[-1])}')
+                lines.append(f'{self.name}_count{_labels_text(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas del proceso"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# ===== HTTP =====
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    'epicuro_http_request_duration_seconds', 'Duración de las peticiones HTTP por ruta',
+    ('method', 'endpoint', 'status'))
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    'epicuro_http_requests_in_flight', 'Peticiones HTTP en curso')
+
+# ===== SQLITE =====
+
+DB_CONNECTIONS_OPEN = REGISTRY.gauge(
+    'epicuro_db_connections_open', 'Conexiones SQLite abiertas por peticiones')
+DB_CONNECTIONS_TOTAL = REGISTRY.counter(
+    'epicuro_db_connections_opened_total', 'Conexiones SQLite abiertas desde el inicio')
+DB_LOCK_WAIT = REGISTRY.histogram(
+    'epicuro_sqlite_lock_wait_seconds',
+    'Duración de la primera escritura de cada transacción (incluye la espera del lock de escritura)',
+    buckets=LOCK_BUCKETS)
+DB_LOCKED_ERRORS = REGISTRY.counter(
+    'epicuro_sqlite_locked_errors_total', 'Errores "database is locked"')
+
+# ===== NEGOCIO =====
+
+ORDERS_CREATED = REGISTRY.counter(
+    'epicuro_orders_created_total', 'Órdenes creadas', ('order_type',))
+ORDER_REVENUE = REGISTRY.counter(
+    'epicuro_order_revenue_total', 'Monto total de las órdenes creadas (CLP)')
+ITEMS_SOLD = REGISTRY.counter(
+    'epicuro_items_sold_total', 'Unidades de productos vendidas')
+STOCK_MOVEMENTS = REGISTRY.counter(
+    'epicuro_stock_movements_total', 'Movimientos de inventario registrados', ('movement_type',))
+PRINT_JOBS = REGISTRY.counter(
+    'epicuro_print_jobs_total', 'Tickets enviados a impresoras', ('kind', 'printer', 'result'))
+PRINT_BYTES = REGISTRY.counter(
+    'epicuro_print_bytes_total', 'Bytes ESC/POS enviados a impresoras', ('printer',))
+DASHBOARD_STATS_DRIFT = REGISTRY.counter(
+    'epicuro_dashboard_stats_drift_total',
+    'Reconciliaciones en que las cifras en memoria de los dashboards no cuadraban con la base', ('section',))
+
+PROCESS_START = REGISTRY.gauge(
+    'epicuro_process_start_time_seconds', 'Inicio del proceso (epoch)')
+PROCESS_START.set(time.time())
+
+
+class LockWaitObserver:
+    """Receptor de sql_profiler para la espera de locks de SQLite"""
+
+    def __call__(self, seconds):
+        DB_LOCK_WAIT.observe(seconds)
+
+    def locked(self):
+        DB_LOCKED_ERRORS.inc()
+
+
+class RequestMetrics:
+    """Middleware de Flask: latencia por ruta y peticiones en curso"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    def _start(self):
+        from flask import g
+        g.metrics_start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    def _finish(self, response):
+        from flask import g, request
+        start = g.get('metrics_start')
+        if start is not None:
+            REQUEST_LATENCY.observe(time.perf_counter() - start, method=request.method,
+                                    endpoint=request.endpoint or 'not_found',
+                                    status=response.status_code)
+        return response
+
+    def _teardown(self, error=None):
+        from flask import g
+        if g.pop('metrics_start', None) is not None:
+            REQUESTS_IN_FLIGHT.dec()
@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+Caché columnar de líneas de órdenes para reportes (NumPy)
+
+Los reportes son agregaciones sobre orders ⋈ order_items por rango de
+fechas. Aquí cada línea de orden es una fila de varios arreglos NumPy:
+
+    order_id, local_ts (segundos en hora local de Chile), product_id, name
+    (código del nombre del producto), quantity, revenue, order_total (solo
+    en la primera línea de cada orden), payment (código), order_type
+    (código), head (primera línea de su orden), is_line, alive
+
+Las filas están ordenadas por local_ts, así un rango de fechas es un
+np.searchsorted y las agregaciones (group-by, buckets de tiempo, top-N) son
+np.bincount / np.argsort sobre el tramo, sin tocar SQLite. Las líneas que
+llegan fuera de orden (ediciones de órdenes antiguas, importaciones) van a
+una cola sin ordenar que se recorre con una máscara y se funde con el resto
+al crecer; las filas de órdenes editadas o eliminadas se marcan muertas.
+
+Al día:
+- las escrituras de órdenes de la app llaman a sync_order al confirmar con
+  la versión de 'orders' leída al tomar el lock de escritura y la leída
+  antes del commit (ver cache_coherence.py); si la primera no es la que ya
+  tenía la caché, otro proceso escribió entre medio y la próxima consulta
+  se pone al día
+- si change_log muestra cambios de otro proceso, la siguiente consulta trae
+  las órdenes nuevas (id) y las modificadas (updated_at); si el total de
+  órdenes no cuadra (eliminaciones ajenas) se vuelve a cargar todo
+- la categoría de cada producto se busca al consultar en un arreglo
+  product_id -> category_id que se recarga cuando cambia el menú
+
+Una orden sin items queda como una fila con is_line = False: cuenta como
+orden pero no como línea.
+
+    python order_analytics.py --bench [--db data/bench.db]
+"""
+
+import datetime
+import sys
+import threading
+import time
+
+import numpy as np
+
+from sales_rollup import plain_number
+
+# Filas por lote al cargar desde SQLite
+LOAD_BATCH = 100000
+
+# Filas fuera de orden (o muertas) que se toleran antes de reordenar todo
+COMPACT_ROWS = 65536
+
+# Ids por consulta IN al sincronizar órdenes
+SYNC_BATCH = 500
+
+DAY = 86400
+
+COLUMNS = (
+    ('order_id', np.int64),
+    ('local_ts', np.int64),
+    ('product_id', np.int64),
+    ('name', np.int32),
+    ('quantity', np.float64),
+    ('revenue', np.float64),
+    ('order_total', np.float64),
+    ('payment', np.int16),
+    ('order_type', np.int16),
+    ('head', np.bool_),
+    ('is_line', np.bool_),
+    ('alive', np.bool_),
+)
+
+# Claves de agrupación -> columna (category se obtiene de product_id)
+GROUP_KEYS = ('product_id', 'product_name', 'category_id', 'payment_method', 'order_type')
+
+_LINES_QUERY = '''
+    SELECT o.id, o.created_epoch + COALESCE(o.utc_offset, 0), COALESCE(oi.product_id, -1),
+           COALESCE(oi.product_name, ''), COALESCE(oi.quantity, 0), COALESCE(oi.total_price, 0),
+           COALESCE(o.total_amount, 0), COALESCE(o.payment_method, ''), COALESCE(o.order_type, ''),
+           oi.id IS NOT NULL, COALESCE(o.updated_at, '')
+    FROM orders o
+    LEFT JOIN order_items oi ON oi.order_id = o.id
+    WHERE o.created_epoch IS NOT NULL {where}
+    ORDER BY o.created_at, o.id, oi.id
+'''
+
+
+def day_ts(value):
+    """Segundos locales al inicio de un día (date o 'YYYY-MM-DD'); None queda None"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value[:10])
+    if isinstance(value, datetime.datetime):
+        return int((value - datetime.datetime(1970, 1, 1)).total_seconds())
+    return (value - datetime.date(1970, 1, 1)).days * DAY
+
+
+class Codes:
+    """Diccionario texto <-> código entero para columnas categóricas"""
+
+    def __init__(self):
+        self.values = []
+        self._index = {}
+
+    def codes(self, values):
+        """Códigos de una secuencia de textos (los nuevos se agregan al diccionario)"""
+        for value in set(values).difference(self._index):
+            self._index[value] = len(self.values)
+            self.values.append(value)
+        return np.fromiter(map(self._index.__getitem__, values), dtype=np.int32, count=len(values))
+
+
+class OrderAnalytics:
+    """Líneas de órdenes en columnas NumPy con consultas por rango de fechas"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._cols = None
+        self.n = 0
+        self.sorted_n = 0
+        self.dead = 0
+        self.names = Codes()
+        self.payments = Codes()
+        self.order_types = Codes()
+        self.category_of = np.zeros(0, dtype=np.int64)
+        self.category_names = {}
+        self.version = 0
+        self._pending_version = 0
+        self._menu_stale = True
+        self._max_order_id = 0
+        self._max_updated = ''
+
+    @property
+    def loaded(self):
+        return self._cols is not None
+
+    def watch(self, tracker):
+        """Recibir de un ChangeTracker los cambios de órdenes y de menú"""
+        tracker.on_change('orders', lambda version, conn: self.domain_changed('orders', version))
+        tracker.on_change('menu', lambda version, conn: self.domain_changed('menu', version))
+
+    # ===== CARGA =====
+
+    def load(self, conn):
+        """Cargar todas las líneas desde la base (reemplaza lo anterior)"""
+        from cache_coherence import domain_version
+
+        version = domain_version(conn, 'orders')
+        with self._lock:
+            self._cols = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS}
+            self.n = self.sorted_n = self.dead = 0
+            self._max_order_id = 0
+            self._max_updated = ''
+            cursor = conn.execute(_LINES_QUERY.format(where=''))
+            previous = None
+            while True:
+                batch = cursor.fetchmany(LOAD_BATCH)
+                if not batch:
+                    break
+                self._append(batch, previous)
+                previous = batch[-1][0]
+            self._compact()
+            self.version = max(self.version, version)
+            self._load_categories(conn)
+        return self.n
+
+    def _load_categories(self, conn):
+        rows = conn.execute('SELECT id, category_id FROM products').fetchall()
+        size = max((row[0] for row in rows), default=0) + 1
+        category_of = np.full(size, -1, dtype=np.int64)
+        for product_id, category_id in rows:
+            category_of[product_id] = category_id if category_id is not None else -1
+        self.category_of = category_of
+        self.category_names = {row[0]: row[1] for row in conn.execute('SELECT id, name FROM categories')}
+        self._menu_stale = False
+
+    def _append(self, rows, previous_order=None):
+        """Agregar filas de _LINES_QUERY (ordenadas por orden y línea)
+
+        previous_order: orden de la última fila del lote anterior, si el lote
+        continúa la misma consulta (para no marcar dos veces la primera línea).
+        """
+        if not rows:
+            return
+        k = len(rows)
+        (order_id, local_ts, product_id, name, quantity, revenue, order_total,
+         payment, order_type, is_line, updated) = zip(*rows)
+        order_ids = np.array(order_id, dtype=np.int64)
+        head = np.ones(k, dtype=np.bool_)
+        head[1:] = order_ids[1:] != order_ids[:-1]
+        head[0] = order_id[0] != previous_order
+        new = {
+            'order_id': order_ids,
+            'local_ts': np.array(local_ts, dtype=np.int64),
+            'product_id': np.array(product_id, dtype=np.int64),
+            'name': self.names.codes(name),
+            'quantity': np.array(quantity, dtype=np.float64),
+            'revenue': np.array(revenue, dtype=np.float64),
+            'order_total': np.where(head, np.array(order_total, dtype=np.float64), 0.0),
+            'payment': self.payments.codes(payment).astype(np.int16),
+            'order_type': self.order_types.codes(order_type).astype(np.int16),
+            'head': head,
+            'is_line': np.array(is_line, dtype=np.bool_),
+            'alive': np.ones(k, dtype=np.bool_),
+        }
+
+        self._reserve(self.n + k)
+        for name, column in new.items():
+            self._cols[name][self.n:self.n + k] = column
+        # Sigue ordenado si no hay cola y lo nuevo viene después de lo anterior
+        ts = new['local_ts']
+        in_order = self.sorted_n == self.n and bool(np.all(ts[1:] >= ts[:-1])) and \
+            (self.n == 0 or ts[0] >= self._cols['local_ts'][self.n - 1])
+        self.n += k
+        if in_order:
+            self.sorted_n = self.n
+
+        self._max_order_id = max(self._max_order_id, int(order_ids.max()))
+        self._max_updated = max(self._max_updated, max(updated))
+
+    def _reserve(self, size):
+        capacity = len(self._cols['order_id'])
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 3 // 2, 1024)
+        for name, column in self._cols.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.n] = column[:self.n]
+            self._cols[name] = grown
+
+    def _compact(self):
+        """Ordenar por local_ts, sin filas muertas (la cola pasa al tramo ordenado)"""
+        n = self.n
+        alive = np.flatnonzero(self._cols['alive'][:n])
+        order = alive[np.argsort(self._cols['local_ts'][alive], kind='stable')]
+        for name, column in self._cols.items():
+            self._cols[name] = column[order].copy()
+        self.n = self.sorted_n = len(order)
+        self.dead = 0
+
+    # ===== SINCRONIZACIÓN =====
+
+    def sync_order(self, conn, order_id, version=None, base_version=None):
+        """Volver a leer una orden (creada, editada o eliminada) después de confirmarla"""
+        if not self.loaded:
+            return
+        self.sync_orders(conn, [order_id])
+        if version is not None:
+            self.advance(version, base_version)
+
+    def advance(self, version, base_version=None):
+        """Versión confirmada por una escritura propia de órdenes
+
+        base_version es la leída al tomar el lock de escritura: si es la que
+        ya tenía la caché, todo lo que subió es de esta escritura; si no,
+        otro proceso confirmó órdenes entre medio y queda pendiente ponerse
+        al día.
+        """
+        with self._lock:
+            if base_version == self.version:
+                self.version = max(self.version, version)
+            elif version > self.version:
+                self._pending_version = max(self._pending_version, version)
+
+    def sync_orders(self, conn, order_ids):
+        for start in range(0, len(order_ids), SYNC_BATCH):
+            ids = [int(i) for i in order_ids[start:start + SYNC_BATCH]]
+            placeholders = ','.join('?' * len(ids))
+            rows = conn.execute(_LINES_QUERY.format(where=f'AND o.id IN ({placeholders})'), ids).fetchall()
+            with self._lock:
+                self._kill(ids)
+                self._append(rows)
+                if self.n - self.sorted_n + self.dead > COMPACT_ROWS:
+                    self._compact()
+
+    def _kill(self, order_ids):
+        n = self.n
+        rows = np.flatnonzero(np.isin(self._cols['order_id'][:n], order_ids) & self._cols['alive'][:n])
+        self._cols['alive'][rows] = False
+        self.dead += len(rows)
+
+    def domain_changed(self, domain, version):
+        """Aviso de ChangeTracker: la próxima consulta se pone al día"""
+        if domain == 'menu':
+            self._menu_stale = True
+        elif version > self.version:
+            self._pending_version = max(self._pending_version, version)
+
+    def refresh(self, conn):
+        """Cargar la primera vez o ponerse al día con cambios de otros procesos"""
+        from cache_coherence import domain_version
+
+        if not self.loaded:
+            self.load(conn)
+            return
+        if self._menu_stale:
+            with self._lock:
+                self._load_categories(conn)
+        if self._pending_version <= self.version:
+            return
+
+        version = domain_version(conn, 'orders')
+        changed = [row[0] for row in conn.execute(
+            'SELECT id FROM orders WHERE id > ? OR updated_at >= ?',
+            (self._max_order_id, self._max_updated))]
+        self.sync_orders(conn, changed)
+        total = conn.execute('SELECT COUNT(*) FROM orders WHERE created_epoch IS NOT NULL').fetchone()[0]
+        with self._lock:
+            live = int(np.count_nonzero(self._cols['head'][:self.n] & self._cols['alive'][:self.n]))
+        if total != live:
+            self.load(conn)  # Órdenes eliminadas por otro proceso
+        with self._lock:
+            self.version = max(self.version, version)
+
+    # ===== CONSULTAS =====
+
+    def _select(self, start=None, end=None, columns=('alive',)):
+        """Columnas de las filas vivas con start <= fecha < end (date, 'YYYY-MM-DD' o datetime)"""
+        cols, n, sorted_n = self._cols, self.n, self.sorted_n
+        ts = cols['local_ts']
+        start_ts, end_ts = day_ts(start), day_ts(end)
+        lo = 0 if start_ts is None else int(np.searchsorted(ts[:sorted_n], start_ts, 'left'))
+        hi = sorted_n if end_ts is None else int(np.searchsorted(ts[:sorted_n], end_ts, 'left'))
+
+        if sorted_n < n:
+            tail = ts[sorted_n:n]
+            mask = np.ones(len(tail), dtype=np.bool_)
+            if start_ts is not None:
+                mask &= tail >= start_ts
+            if end_ts is not None:
+                mask &= tail < end_ts
+            rows = np.concatenate((np.arange(lo, hi), sorted_n + np.flatnonzero(mask)))
+            picked = {name: cols[name][rows] for name in set(columns) | {'alive'}}
+        else:
+            picked = {name: cols[name][lo:hi] for name in set(columns) | {'alive'}}
+
+        alive = picked['alive']
+        if not alive.all():
+            picked = {name: column[alive] for name, column in picked.items()}
+        return picked
+
+    def totals(self, start=None, end=None):
+        """{'orders', 'sales' (total de órdenes), 'quantity', 'revenue' (suma de líneas)}"""
+        with self._lock:
+            cols = self._select(start, end, ('head', 'is_line', 'quantity', 'revenue', 'order_total'))
+        lines = cols['is_line']
+        return {
+            'orders': int(np.count_nonzero(cols['head'])),
+            'sales': float(cols['order_total'].sum()),
+            'quantity': float(cols['quantity'][lines].sum()),
+            'revenue': float(cols['revenue'][lines].sum()),
+        }
+
+    def group_by(self, key, start=None, end=None):
+        """[{key, quantity, revenue, lines}] por product_id, product_name, category_id,
+        payment_method u order_type; solo grupos con líneas"""
+        if key not in GROUP_KEYS:
+            raise ValueError(f'Clave de agrupación desconocida: {key}')
+        column, labels = self._key_column(key)
+        with self._lock:
+            cols = self._select(start, end, (column, 'is_line', 'quantity', 'revenue'))
+            values = cols[column][cols['is_line']]
+            if key == 'category_id':
+                values = self._categories_of(values)
+            quantity = cols['quantity'][cols['is_line']]
+            revenue = cols['revenue'][cols['is_line']]
+
+        if not len(values):
+            return []
+        # Claves negativas (sin producto / sin categoría) se corren para usar bincount
+        offset = int(min(values.min(), 0))
+        shifted = values - offset
+        counts = np.bincount(shifted)
+        present = np.flatnonzero(counts)
+        sums_q = np.bincount(shifted, weights=quantity)[present]
+        sums_r = np.bincount(shifted, weights=revenue)[present]
+        keys = present + offset
+        return [
+            {'key': labels(int(k)), 'quantity': plain_number(q), 'revenue': float(r), 'lines': int(c)}
+            for k, q, r, c in zip(keys, sums_q, sums_r, counts[present])
+        ]
+
+    def top_n(self, key, n=10, start=None, end=None, by='quantity'):
+        """Los n grupos con más `by` (quantity o revenue); empates por clave"""
+        groups = self.group_by(key, start, end)
+        groups.sort(key=lambda group: (-group[by], str(group['key'])))
+        return groups[:n]
+
+    def time_buckets(self, bucket, start=None, end=None, measure='orders'):
+        """{bucket: valor} con bucket day, week, month, hour, weekday o weekday_hour
+
+        measure: orders, sales, quantity o revenue. Las claves son date (day,
+        week = lunes, month = día 1), hora 0-23, día 0-6 (lunes = 0) o (día, hora).
+        """
+        with self._lock:
+            cols = self._select(start, end, ('local_ts', 'head', 'is_line', 'quantity', 'revenue', 'order_total'))
+        if measure in ('orders', 'sales'):
+            mask = cols['head']
+            weights = None if measure == 'orders' else cols['order_total'][mask]
+        else:
+            mask = cols['is_line']
+            weights = cols[measure][mask]
+        ts = cols['local_ts'][mask]
+        if not len(ts):
+            return {}
+
+        days = ts // DAY
+        if bucket == 'hour':
+            codes, decode = (ts // 3600) % 24, int
+        elif bucket == 'weekday':
+            codes, decode = (days + 3) % 7, int  # 1970-01-01 fue jueves
+        elif bucket == 'weekday_hour':
+            codes = ((days + 3) % 7) * 24 + (ts // 3600) % 24
+            decode = lambda c: divmod(c, 24)
+        elif bucket in ('day', 'week', 'month'):
+            if bucket == 'week':
+                days = days - (days + 3) % 7
+            elif bucket == 'month':
+                days = days.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+            base = int(days.min())
+            codes = days - base
+            decode = lambda c: datetime.date(1970, 1, 1) + datetime.timedelta(days=base + c)
+        else:
+            raise ValueError(f'Bucket desconocido: {bucket}')
+
+        counts = np.bincount(codes)
+        present = np.flatnonzero(counts)
+        values = counts[present] if weights is None else np.bincount(codes, weights=weights)[present]
+        return {decode(int(c)): (int(v) if weights is None else float(v)) for c, v in zip(present, values)}
+
+    def _key_column(self, key):
+        if key == 'product_name':
+            return 'name', lambda code: self.names.values[code]
+        if key == 'payment_method':
+            return 'payment', lambda code: self.payments.values[code]
+        if key == 'order_type':
+            return 'order_type', lambda code: self.order_types.values[code]
+        return 'product_id', (lambda value: None if value < 0 else value)
+
+    def _categories_of(self, product_ids):
+        category_of = self.category_of
+        known = (product_ids >= 0) & (product_ids < len(category_of))
+        categories = np.full(len(product_ids), -1, dtype=np.int64)
+        categories[known] = category_of[product_ids[known]]
+        return categories
+
+
+# ===== BENCHMARK =====
+
+def benchmark(path):
+    """Carga y consultas sobre una base generada (ver generate_data.py)"""
+    import sqlite3
+
+    conn = sqlite3.connect(path)
+    analytics = OrderAnalytics()
+    started = time.perf_counter()
+    rows = analytics.load(conn)
+    print(f'Carga: {rows:,} filas en {time.perf_counter() - started:.1f} s '
+          f'({sum(c.nbytes for c in analytics._cols.values()) / 1e6:.0f} MB)')
+
+    last = datetime.date.fromtimestamp(0) + datetime.timedelta(
+        days=int(analytics._cols['local_ts'][analytics.n - 1] // DAY))
+    year_ago = last - datetime.timedelta(days=365)
+    checks = [
+        ('totales del año', lambda: analytics.totals(year_ago)),
+        ('top 10 productos', lambda: analytics.top_n('product_name', 10, year_ago)),
+        ('ventas por categoría', lambda: analytics.group_by('category_id', year_ago)),
+        ('ventas por mes', lambda: analytics.time_buckets('month', year_ago, measure='sales')),
+        ('día × hora', lambda: analytics.time_buckets('weekday_hour', year_ago)),
+    ]
+    for label, query in checks:
+        started = time.perf_counter()
+        for _ in range(10):
+            query()
+        print(f'  {label:<22} {(time.perf_counter() - started) * 100:7.1f} ms')
+
+    started = time.perf_counter()
+    sql = conn.execute('''
+        SELECT oi.product_name, SUM(oi.quantity) FROM order_items oi JOIN orders o ON oi.order_id = o.id
+        WHERE o.created_at >= ? GROUP BY oi.product_name ORDER BY 2 DESC LIMIT 10
+    ''', (year_ago.isoformat(),)).fetchall()
+    print(f'  {"top 10 en SQLite":<22} {(time.perf_counter() - started) * 1000:7.1f} ms')
+    top = analytics.top_n('product_name', 10, year_ago)
+    assert [(t['key'], t['quantity']) for t in top[:3]] == [(r[0], r[1]) for r in sql[:3]]
+    conn.close()
+
+
+if __name__ == "__main__":
+    if '--bench' in sys.argv:
+        db = sys.argv[sys.argv.index('--db') + 1] if '--db' in sys.argv else 'data/bench.db'
+        benchmark(db)
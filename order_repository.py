@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Carga de órdenes con sus items en un número fijo de consultas
+
+OrderRepository reemplaza el patrón "una consulta por orden + una por sus
+items" de las páginas de órdenes: carga N órdenes con todas sus líneas
+(incluida la copia de variaciones de variation_snapshot.py) y la categoría
+de cada producto en 3 consultas con `WHERE ... IN (...)`, sin importar N.
+
+Los objetos devueltos usan __slots__ y aceptan tanto `order.total_amount`
+(plantillas) como `order['total_amount']` (código que antes recibía Rows).
+
+    python -m pytest tests/test_order_repository.py    # 100 órdenes = 3 consultas
+"""
+
+from variation_snapshot import decode_snapshot, variation_lines
+
+# Máximo de parámetros por consulta IN (límite clásico de SQLite: 999)
+IN_CHUNK = 900
+
+ORDER_COLUMNS = (
+    'id', 'order_number', 'customer_name', 'customer_phone', 'subtotal', 'discount',
+    'total_amount', 'status', 'payment_method', 'notes', 'order_type',
+    'created_at', 'updated_at', 'created_epoch', 'utc_offset',
+)
+
+LINE_COLUMNS = (
+    'id', 'order_id', 'product_id', 'product_name', 'quantity', 'unit_price',
+    'total_price', 'notes', 'variations_json', 'variations_display',
+)
+
+
+class _Record:
+    """Acceso por atributo y por clave sobre __slots__"""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self._fields
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self._fields}
+
+
+class OrderLine(_Record):
+    """Línea de una orden"""
+
+    __slots__ = LINE_COLUMNS + ('category_name',)
+    _fields = __slots__
+
+    def __init__(self, row, category_name=None):
+        for name, value in zip(LINE_COLUMNS, row):
+            setattr(self, name, value)
+        self.category_name = category_name
+
+    @property
+    def variations(self):
+        """Texto de las variaciones ("Pollo, Palta")"""
+        return self.variations_display or ''
+
+    @property
+    def variation_list(self):
+        return decode_snapshot(self.variations_json)
+
+    @property
+    def variation_lines(self):
+        """Líneas 'Grupo: Opción' para cocina"""
+        return variation_lines(self.variations_json)
+
+    def as_dict(self):
+        data = super().as_dict()
+        data['variations'] = self.variations
+        data['variation_lines'] = self.variation_lines
+        return data
+
+
+class Order(_Record):
+    """Orden con sus líneas (vacía si se cargó sin items)"""
+
+    __slots__ = ORDER_COLUMNS + ('items',)
+    _fields = ORDER_COLUMNS
+
+    def __init__(self, row):
+        for name, value in zip(ORDER_COLUMNS, row):
+            setattr(self, name, value)
+        self.items = []
+
+
+def _chunks(values):
+    for start in range(0, len(values), IN_CHUNK):
+        yield values[start:start + IN_CHUNK]
+
+
+class OrderRepository:
+    """Lectura de órdenes en lote sobre una conexión sqlite3"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def get(self, order_id, with_items=True):
+        """Una orden con sus items, o None"""
+        orders = self.get_many([order_id], with_items=with_items)
+        return orders[0] if orders else None
+
+    def get_many(self, order_ids, with_items=True):
+        """Órdenes en el mismo orden de order_ids (las inexistentes se omiten)"""
+        ids = list(dict.fromkeys(order_ids))
+        by_id = {}
+        for chunk in _chunks(ids):
+            placeholders = ','.join('?' * len(chunk))
+            for row in self.conn.execute(
+                    f'SELECT {", ".join(ORDER_COLUMNS)} FROM orders WHERE id IN ({placeholders})', chunk):
+                by_id[row[0]] = Order(row)
+
+        orders = [by_id[i] for i in ids if i in by_id]
+        if with_items:
+            self.attach_items(orders)
+        return orders
+
+    def find(self, status=None, date=None, start=None, end=None, limit=None, with_items=False):
+        """Órdenes filtradas, más recientes primero
+
+        date filtra un día ('YYYY-MM-DD'); start/end un rango [start, end).
+        """
+        query = f'SELECT {", ".join(ORDER_COLUMNS)} FROM orders WHERE 1=1'
+        params = []
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        if date:
+            query += " AND created_at >= ? AND created_at < date(?, '+1 day')"
+            params.extend([date, date])
+        if start:
+            query += ' AND created_at >= ?'
+            params.append(start)
+        if end:
+            query += ' AND created_at < ?'
+            params.append(end)
+        query += ' ORDER BY created_at DESC'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        orders = [Order(row) for row in self.conn.execute(query, params)]
+        if with_items:
+            self.attach_items(orders)
+        return orders
+
+    def attach_items(self, orders):
+        """Cargar las líneas y categorías de todas las órdenes (2 consultas)"""
+        if not orders:
+            return
+        by_id = {order.id: order for order in orders}
+
+        rows = []
+        for chunk in _chunks(list(by_id)):
+            placeholders = ','.join('?' * len(chunk))
+            rows.extend(self.conn.execute(f'''
+                SELECT {", ".join(LINE_COLUMNS)} FROM order_items
+                WHERE order_id IN ({placeholders})
+                ORDER BY order_id, id
+            ''', chunk).fetchall())
+
+        categories = {}
+        product_ids = sorted({row[2] for row in rows if row[2] is not None})
+        for chunk in _chunks(product_ids):
+            placeholders = ','.join('?' * len(chunk))
+            categories.update(self.conn.execute(f'''
+                SELECT p.id, c.name FROM products p
+                LEFT JOIN categories c ON p.category_id = c.id
+                WHERE p.id IN ({placeholders})
+            ''', chunk).fetchall())
+
+        for row in rows:
+            by_id[row[1]].items.append(OrderLine(row, categories.get(row[2])))
+
+
+class QueryCounter:
+    """Contar las sentencias que ejecuta una conexión (con `with`)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.statements = []
+
+    def __enter__(self):
+        self.conn.set_trace_callback(self.statements.append)
+        return self
+
+    def __exit__(self, *exc):
+        self.conn.set_trace_callback(None)
+
+    @property
+    def count(self):
+        return len(self.statements)
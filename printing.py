@@ -0,0 +1,334 @@
+"""
+Impresión térmica ESC/POS para el sistema Epicuro
+
+Genera los tickets de cocina y las cuentas de cliente directamente como
+bytes ESC/POS (58 u 80 mm), los guarda en caché por versión de la orden y
+los envía a impresoras de red (TCP, puerto 9100) o a archivos para pruebas
+locales.
+
+Impresoras configurables con la variable EPICURO_PRINTERS:
+
+    EPICURO_PRINTERS="kitchen=tcp://192.168.1.50:9100,cashier=tcp://192.168.1.51:9100?width=58"
+"""
+
+import hashlib
+import os
+import socket
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+# Columnas por línea con la fuente A según el ancho del papel
+PAPER_COLUMNS = {58: 32, 80: 48}
+DEFAULT_WIDTH = 80
+
+# Página de códigos PC850 (tildes y ñ)
+CODEPAGE = 'cp850'
+CODEPAGE_ID = 2
+
+DEFAULT_PRINTERS = {
+    'kitchen': 'file:data/prints/kitchen.bin',
+    'cashier': 'file:data/prints/cashier.bin',
+}
+
+ORDER_TYPE_LABELS = {
+    'dine_in': 'PARA SERVIR',
+    'takeaway': 'PARA LLEVAR',
+    'delivery': 'DELIVERY',
+}
+
+# Comandos ESC/POS
+ESC = b'\x1b'
+GS = b'\x1d'
+INIT = ESC + b'@'
+ALIGN_LEFT = ESC + b'a\x00'
+ALIGN_CENTER = ESC + b'a\x01'
+BOLD_ON = ESC + b'E\x01'
+BOLD_OFF = ESC + b'E\x00'
+SIZE_NORMAL = GS + b'!\x00'
+SIZE_DOUBLE = GS + b'!\x11'
+SIZE_TALL = GS + b'!\x01'
+CUT = GS + b'V\x42\x03'
+
+
+class TicketBuilder:
+    """Acumulador de comandos y texto ESC/POS con ancho fijo de columnas"""
+
+    def __init__(self, width=DEFAULT_WIDTH):
+        if width not in PAPER_COLUMNS:
+            raise ValueError(f'Ancho de papel no soportado: {width} mm')
+        self.columns = PAPER_COLUMNS[width]
+        self._parts = [INIT, ESC + b't' + bytes([CODEPAGE_ID])]
+
+    def raw(self, data):
+        self._parts.append(data)
+        return self
+
+    def text(self, value='', align=ALIGN_LEFT, bold=False, size=SIZE_NORMAL):
+        """Agregar una línea (se corta en varias si excede el ancho)"""
+        columns = self.columns // 2 if size == SIZE_DOUBLE else self.columns
+        self._parts.append(align + size + (BOLD_ON if bold else BOLD_OFF))
+        for line in _wrap(str(value), columns):
+            self._parts.append(line.encode(CODEPAGE, errors='replace') + b'\n')
+        self._parts.append(SIZE_NORMAL + BOLD_OFF + ALIGN_LEFT)
+        return self
+
+    def pair(self, left, right, bold=False):
+        """Línea con texto a la izquierda y monto a la derecha"""
+        right = str(right)
+        space = self.columns - len(right) - 1
+        lines = _wrap(str(left), space)
+        self._parts.append(BOLD_ON if bold else BOLD_OFF)
+        for line in lines[:-1]:
+            self._parts.append(line.encode(CODEPAGE, errors='replace') + b'\n')
+        last = lines[-1].ljust(space) + ' ' + right
+        self._parts.append(last.encode(CODEPAGE, errors='replace') + b'\n' + BOLD_OFF)
+        return self
+
+    def separator(self, char='-'):
+        self._parts.append((char * self.columns).encode('ascii') + b'\n')
+        return self
+
+    def feed(self, lines=1):
+        self._parts.append(b'\n' * lines)
+        return self
+
+    def cut(self):
+        self._parts.append(CUT)
+        return self
+
+    def build(self):
+        return b''.join(self._parts)
+
+
+def _wrap(text, columns):
+    """Cortar texto en líneas de a lo más `columns` caracteres respetando palabras
+
+    La sangría de cada párrafo ('   > variación', '   * notas') se repite en
+    sus líneas siguientes; los espacios seguidos cuentan como uno.
+    """
+    lines = []
+    for paragraph in text.split('\n'):
+        body = paragraph.lstrip(' ')
+        indent = paragraph[:len(paragraph) - len(body)]
+        if len(indent) > columns // 2:
+            indent = ''
+        width = columns - len(indent)
+        current = ''
+        for word in body.split():
+            while len(word) > width:
+                if current:
+                    lines.append(indent + current)
+                    current = ''
+                lines.append(indent + word[:width])
+                word = word[width:]
+            candidate = f'{current} {word}' if current else word
+            if len(candidate) > width:
+                lines.append(indent + current)
+                current = word
+            else:
+                current = candidate
+        lines.append(indent + current if current else '')
+    return lines or ['']
+
+
+def _money(value):
+    """Formato de pesos chilenos: $12.500"""
+    return '$' + f'{float(value or 0):,.0f}'.replace(',', '.')
+
+
+def _short_time(value):
+    """'YYYY-MM-DD HH:MM:SS' -> 'DD/MM/YYYY HH:MM' sin parsear fechas"""
+    value = str(value or '')
+    if len(value) >= 16 and value[4] == '-' and value[10] in ' T':
+        return f'{value[8:10]}/{value[5:7]}/{value[0:4]} {value[11:16]}'
+    return value
+
+
+def render_kitchen_ticket(order, items, width=DEFAULT_WIDTH):
+    """Ticket de cocina: productos, variaciones y notas en letra grande"""
+    ticket = TicketBuilder(width)
+    ticket.text('COCINA', align=ALIGN_CENTER, bold=True, size=SIZE_DOUBLE)
+    ticket.text(f"#{order['order_number']}", align=ALIGN_CENTER, bold=True, size=SIZE_TALL)
+    ticket.text(ORDER_TYPE_LABELS.get(order.get('order_type'), order.get('order_type') or ''), align=ALIGN_CENTER, bold=True)
+    ticket.text(_short_time(order.get('created_at')), align=ALIGN_CENTER)
+    if order.get('customer_name'):
+        ticket.text(f"Cliente: {order['customer_name']}")
+    ticket.separator('=')
+
+    for item in items:
+        ticket.text(f"{item['quantity']} x {item['product_name']}", bold=True, size=SIZE_TALL)
+        for variation in item.get('variation_lines') or []:
+            ticket.text(f'   > {variation}')
+        if item.get('notes'):
+            ticket.text(f"   * {item['notes']}", bold=True)
+        ticket.separator()
+
+    if order.get('notes'):
+        ticket.text('NOTAS:', bold=True)
+        ticket.text(order['notes'])
+        ticket.separator('=')
+
+    return ticket.feed(3).cut().build()
+
+
+def render_customer_bill(order, items, width=DEFAULT_WIDTH, tip_rate=0.10):
+    """Cuenta para el cliente: subtotal, descuento, total a pagar y propina sugerida aparte"""
+    ticket = TicketBuilder(width)
+    ticket.text('EPICURO', align=ALIGN_CENTER, bold=True, size=SIZE_DOUBLE)
+    ticket.text(f"Orden #{order['order_number']}", align=ALIGN_CENTER)
+    ticket.text(_short_time(order.get('created_at')), align=ALIGN_CENTER)
+    if order.get('customer_name'):
+        ticket.text(f"Cliente: {order['customer_name']}")
+    ticket.separator()
+
+    subtotal = 0
+    for item in items:
+        subtotal += item['total_price'] or 0
+        ticket.pair(f"{item['quantity']} x {item['product_name']}", _money(item['total_price']))
+        if item.get('variations'):
+            ticket.text(f"   {item['variations']}")
+
+    discount = order.get('discount') or 0
+    total = order.get('total_amount')
+    if total is None:
+        total = subtotal - discount
+    tip = total * tip_rate
+    ticket.separator()
+    ticket.pair('Subtotal', _money(subtotal))
+    if discount:
+        ticket.pair('Descuento', '-' + _money(discount))
+    ticket.pair('TOTAL A PAGAR', _money(total), bold=True)
+    ticket.separator()
+    ticket.pair(f'Propina sugerida ({tip_rate:.0%})', _money(tip))
+    ticket.pair('Total con propina', _money(total + tip))
+    ticket.separator()
+    ticket.text(f"Pago: {order.get('payment_method') or ''}")
+    ticket.feed()
+    ticket.text('¡Gracias por su visita!', align=ALIGN_CENTER)
+
+    return ticket.feed(3).cut().build()
+
+
+RENDERERS = {
+    'kitchen': render_kitchen_ticket,
+    'bill': render_customer_bill,
+}
+
+
+class TicketCache:
+    """Caché LRU de tickets ya renderizados, por (tipo, orden, versión, ancho)"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, kind, order, items_loader, width=DEFAULT_WIDTH, items_key=None):
+        """Devolver los bytes del ticket; items_loader solo se llama si no está en caché
+
+        items_key es la huella de las líneas de la orden (ver items_digest).
+        """
+        key = (kind, order['id'], order_version(order, items_key), width)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+
+        data = RENDERERS[kind](order, items_loader(), width)
+
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return data
+
+    def invalidate(self, order_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == order_id]:
+                del self._entries[key]
+
+
+# Columnas de order_items que cambian lo impreso (ver items_digest)
+DIGEST_COLUMNS = 'id, product_id, product_name, quantity, unit_price, total_price, notes, variations_json'
+
+
+def items_digest(rows):
+    """Huella de las líneas de una orden (filas con DIGEST_COLUMNS, ordenadas por id)"""
+    digest = hashlib.blake2b(digest_size=16)
+    for row in rows:
+        digest.update(repr(tuple(row)).encode())
+    return digest.hexdigest()
+
+
+def order_version(order, items_key=None):
+    """Versión de una orden: cambia con cada actualización de la orden o de sus líneas
+
+    updated_at tiene resolución de un segundo: dos ediciones en el mismo
+    segundo solo se distinguen por items_key.
+    """
+    fields = ('updated_at', 'total_amount', 'discount', 'notes', 'customer_name', 'payment_method', 'order_type')
+    return '|'.join(str(order.get(field)) for field in fields) + f'|{items_key}'
+
+
+# ===== IMPRESORAS =====
+
+class TcpPrinter:
+    """Impresora de red (RAW, normalmente puerto 9100)"""
+
+    def __init__(self, host, port=9100, width=DEFAULT_WIDTH, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.width = width
+        self.timeout = timeout
+
+    def send(self, data):
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as conn:
+            conn.sendall(data)
+
+    def __repr__(self):
+        return f'tcp://{self.host}:{self.port}'
+
+
+class FilePrinter:
+    """Impresora simulada: agrega los bytes a un archivo (pruebas locales)"""
+
+    def __init__(self, path, width=DEFAULT_WIDTH):
+        self.path = path
+        self.width = width
+        self._lock = threading.Lock()
+
+    def send(self, data):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock, open(self.path, 'ab') as f:
+            f.write(data)
+
+    def __repr__(self):
+        return f'file:{self.path}'
+
+
+def printer_from_uri(uri):
+    """Crear impresora desde 'tcp://host:puerto?width=58' o 'file:ruta?width=80'"""
+    parts = urlsplit(uri)
+    width = int(parse_qs(parts.query).get('width', [DEFAULT_WIDTH])[0])
+
+    if parts.scheme == 'tcp':
+        return TcpPrinter(parts.hostname, parts.port or 9100, width=width)
+    if parts.scheme == 'file':
+        return FilePrinter((parts.netloc + parts.path) or parts.path, width=width)
+    raise ValueError(f'Impresora no soportada: {uri}')
+
+
+def load_printers(config=None):
+    """Impresoras configuradas: nombre -> endpoint"""
+    config = config if config is not None else os.environ.get('EPICURO_PRINTERS', '')
+    uris = dict(DEFAULT_PRINTERS)
+    for entry in config.split(','):
+        if '=' in entry:
+            name, uri = entry.split('=', 1)
+            uris[name.strip()] = uri.strip()
+    return {name: printer_from_uri(uri) for name, uri in uris.items()}
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Búsqueda difusa de productos por nombre para el sistema Epicuro
+
+Mantiene en memoria un índice de trigramas sobre los nombres normalizados
+(mayúsculas, sin tildes ni signos) para que "CAPUCCINO VAINILLA MEDIANO" y
+"CAPPUCCINO VAINILLA MEDIANO" se reconozcan como el mismo producto.
+
+Un error de escritura cambia letras, no palabras: un tamaño presente en un
+solo nombre o distinto en ambos descarta al candidato, y cada palabra que
+está en un solo nombre ("SANDWICH CHACARERO POLLO" frente a "SANDWICH
+CHACARERO") resta puntaje. Si los dos mejores candidatos quedan muy cerca
+no se elige ninguno: resolve los devuelve para revisarlos a mano.
+
+Se usa desde los scripts de importación y como herramienta para fusionar
+productos duplicados. Los resúmenes agrupados por producto (ventas por hora
+y por día, canastas, ingeniería de menú) se recalculan al fusionar:
+
+    python product_matcher.py            # listar posibles duplicados
+    python product_matcher.py --merge    # fusionar duplicados en la BD
+"""
+
+import datetime
+import sqlite3
+import re
+import sys
+import unicodedata
+from collections import defaultdict
+
+import menu_engineering
+from basket_analysis import create_basket_tables, backfill as backfill_baskets
+from menu_engineering import create_menu_engineering_tables
+from recipe_costing import load_product_costs
+from sales_rollup import create_sales_rollup, backfill as backfill_sales_rollup
+
+DATABASE = 'data/sandwich.db'
+
+# Puntaje mínimo (coeficiente de Dice sobre trigramas) para considerar
+# que dos nombres corresponden al mismo producto
+MATCH_THRESHOLD = 0.8
+
+# Diferencia mínima entre el mejor candidato y el segundo para elegirlo solo
+MATCH_MARGIN = 0.05
+
+# Puntaje que resta cada palabra presente en un solo nombre
+EXTRA_WORD_PENALTY = 0.15
+
+# Dos palabras son la misma (con errores de escritura) desde este Dice de trigramas
+WORD_MATCH = 0.5
+
+# Palabras que no distinguen productos
+FILLER_WORDS = frozenset({'DE', 'DEL', 'LA', 'EL', 'LOS', 'LAS', 'CON', 'Y', 'AL', 'EN'})
+
+# Palabras de tamaño: si difieren o solo un nombre la tiene, son productos distintos
+SIZE_WORDS = {
+    'CHICO': 'CHICO', 'CHICA': 'CHICO',
+    'MEDIANO': 'MEDIANO', 'MEDIANA': 'MEDIANO',
+    'GRANDE': 'GRANDE',
+}
+
+_NON_ALNUM = re.compile(r'[^A-Z0-9]+')
+
+
+def normalize_name(name):
+    """Normalizar nombre: sin tildes, mayúsculas y espacios simples"""
+    if not name:
+        return ''
+    folded = unicodedata.normalize('NFKD', str(name))
+    folded = ''.join(ch for ch in folded if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(' ', folded.upper()).strip()
+
+
+def trigrams(normalized):
+    """Conjunto de trigramas de un nombre ya normalizado"""
+    padded = f'  {normalized} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _dice(a, b):
+    return 2.0 * len(a & b) / (len(a) + len(b)) if a or b else 1.0
+
+
+def _words(normalized):
+    """Palabras que distinguen productos, con sus trigramas"""
+    return tuple((word, trigrams(word)) for word in normalized.split()
+                 if word not in FILLER_WORDS and word not in SIZE_WORDS)
+
+
+def _extra_words(words, others):
+    """Cuántas palabras de words no tienen una parecida en others"""
+    return sum(1 for word, grams in words
+               if not any(word == other or _dice(grams, other_grams) >= WORD_MATCH
+                          for other, other_grams in others))
+
+
+def _size_of(normalized):
+    """Tamaño declarado en el nombre (CHICO/MEDIANO/GRANDE) o None"""
+    for word in normalized.split():
+        if word in SIZE_WORDS:
+            return SIZE_WORDS[word]
+    return None
+
+
+class ProductMatcher:
+    """Índice invertido de trigramas sobre los nombres de productos"""
+
+    def __init__(self):
+        self._names = {}        # product_id -> nombre original
+        self._normalized = {}   # product_id -> nombre normalizado
+        self._grams = {}        # product_id -> trigramas
+        self._words = {}        # product_id -> palabras con sus trigramas
+        self._exact = {}        # nombre normalizado -> product_id
+        self._index = defaultdict(set)
+
+    @classmethod
+    def from_db(cls, conn, available_only=False):
+        """Construir el índice con los productos de la base de datos"""
+        query = 'SELECT id, name FROM products'
+        if available_only:
+            query += ' WHERE available = 1'
+        query += ' ORDER BY id'
+
+        matcher = cls()
+        for product_id, name in conn.execute(query).fetchall():
+            matcher.add(product_id, name)
+        return matcher
+
+    def __len__(self):
+        return len(self._names)
+
+    def name(self, product_id):
+        """Nombre original de un producto indexado"""
+        return self._names.get(product_id)
+
+    def add(self, product_id, name):
+        """Agregar (o reemplazar) un producto en el índice"""
+        if product_id in self._names:
+            self.remove(product_id)
+
+        normalized = normalize_name(name)
+        grams = trigrams(normalized)
+
+        self._names[product_id] = name
+        self._normalized[product_id] = normalized
+        self._grams[product_id] = grams
+        self._words[product_id] = _words(normalized)
+        # Ante nombres idénticos se conserva el primero (id más bajo)
+        self._exact.setdefault(normalized, product_id)
+        for gram in grams:
+            self._index[gram].add(product_id)
+
+    def remove(self, product_id):
+        """Quitar un producto del índice"""
+        normalized = self._normalized.pop(product_id, None)
+        if normalized is None:
+            return
+        self._names.pop(product_id)
+        self._words.pop(product_id)
+        for gram in self._grams.pop(product_id):
+            bucket = self._index.get(gram)
+            if bucket:
+                bucket.discard(product_id)
+                if not bucket:
+                    del self._index[gram]
+        if self._exact.get(normalized) == product_id:
+            del self._exact[normalized]
+            for other_id, other in self._normalized.items():
+                if other == normalized:
+                    self._exact[normalized] = other_id
+                    break
+
+    def match(self, name, limit=5, min_score=0.5):
+        """Candidatos ordenados por puntaje: [(product_id, nombre, puntaje)]"""
+        normalized = normalize_name(name)
+        if not normalized:
+            return []
+
+        exact_id = self._exact.get(normalized)
+        grams = trigrams(normalized)
+        words = _words(normalized)
+        size = _size_of(normalized)
+
+        # Contar trigramas compartidos solo con los productos que tienen alguno
+        shared = defaultdict(int)
+        for gram in grams:
+            for product_id in self._index.get(gram, ()):
+                shared[product_id] += 1
+
+        total = len(grams)
+        results = []
+        for product_id, common in shared.items():
+            if product_id == exact_id:
+                score = 1.0
+            else:
+                if size != _size_of(self._normalized[product_id]):
+                    continue
+                other_words = self._words[product_id]
+                extra = _extra_words(words, other_words) + _extra_words(other_words, words)
+                score = 2.0 * common / (total + len(self._grams[product_id])) - EXTRA_WORD_PENALTY * extra
+            if score >= min_score:
+                results.append((product_id, self._names[product_id], round(score, 4)))
+
+        results.sort(key=lambda r: (-r[2], r[0]))
+        return results[:limit]
+
+    def resolve(self, name, threshold=MATCH_THRESHOLD, margin=MATCH_MARGIN):
+        """(product_id, candidatos): el producto si la coincidencia es clara
+
+        Si hay candidatos sobre el umbral pero los dos mejores quedan a menos
+        de margin, product_id es None y los candidatos quedan para revisión.
+        """
+        candidates = self.match(name, limit=5, min_score=threshold)
+        if not candidates:
+            return None, []
+        top = candidates[0]
+        if top[2] >= 1.0 or len(candidates) == 1 or top[2] - candidates[1][2] >= margin:
+            return top[0], candidates
+        return None, candidates
+
+    def best_match(self, name, threshold=MATCH_THRESHOLD):
+        """ID del mejor candidato si supera el umbral sin empate cercano, o None"""
+        return self.resolve(name, threshold)[0]
+
+    def duplicate_groups(self, threshold=MATCH_THRESHOLD):
+        """Agrupar productos cuyos nombres coinciden sobre el umbral
+
+        La coincidencia no es transitiva (A puede parecerse a B y B a C sin
+        que A se parezca a C): un producto entra a un grupo solo si coincide
+        con todos sus miembros, empezando por el de menor id y sus candidatos
+        de mayor puntaje.
+        """
+        similar = {
+            product_id: [other_id for other_id, _, _ in self.match(name, limit=10, min_score=threshold)
+                         if other_id != product_id]
+            for product_id, name in self._names.items()
+        }
+
+        grouped = set()
+        groups = []
+        for product_id in sorted(self._names):
+            if product_id in grouped:
+                continue
+            group = [product_id]
+            for other_id in similar[product_id]:
+                if other_id not in grouped and all(other_id in similar[member] for member in group):
+                    group.append(other_id)
+            if len(group) > 1:
+                grouped.update(group)
+                groups.append(sorted(group))
+        return groups
+
+
+def merge_products(conn, keep_id, duplicate_ids):
+    """Fusionar productos duplicados en keep_id
+
+    Reapunta order_items.product_id y las variaciones asignadas al producto
+    conservado, y desactiva los duplicados. No hace commit.
+    """
+    duplicate_ids = [pid for pid in duplicate_ids if pid != keep_id]
+    if not duplicate_ids:
+        return 0
+
+    placeholders = ','.join('?' * len(duplicate_ids))
+
+    moved = conn.execute(f'''
+        UPDATE order_items SET product_id = ?
+        WHERE product_id IN ({placeholders})
+    ''', (keep_id, *duplicate_ids)).rowcount
+
+    # Grupos de variación que el producto conservado aún no tiene
+    conn.execute(f'''
+        INSERT INTO product_variations (product_id, variation_group_id, required, sort_order)
+        SELECT ?, variation_group_id, MAX(required), MIN(sort_order)
+        FROM product_variations
+        WHERE product_id IN ({placeholders})
+        AND variation_group_id NOT IN (
+            SELECT variation_group_id FROM product_variations WHERE product_id = ?
+        )
+        GROUP BY variation_group_id
+    ''', (keep_id, *duplicate_ids, keep_id))
+
+    conn.execute(f'DELETE FROM product_variations WHERE product_id IN ({placeholders})', duplicate_ids)
+    conn.execute(f'UPDATE products SET available = 0 WHERE id IN ({placeholders})', duplicate_ids)
+
+    return moved
+
+
+def rebuild_product_summaries(conn):
+    """Recalcular lo que se agrupa por product_id después de fusionar (sin commit)
+
+    Igual que al importar ventas: resumen por hora y por día, canastas y la
+    ingeniería de menú (se descartan los períodos guardados y el nocturno se
+    vuelve a calcular con el mismo rango).
+    """
+    cursor = conn.cursor()
+    create_sales_rollup(cursor)
+    backfill_sales_rollup(conn)
+    create_basket_tables(cursor)
+    backfill_baskets(conn)
+
+    create_menu_engineering_tables(cursor)
+    menu_engineering.forget(conn)
+    nightly = menu_engineering.nightly_period(conn)
+    if nightly is not None:
+        menu_engineering.refresh(conn, *nightly, datetime.datetime.now(), load_product_costs(conn), nightly=True)
+
+
+def merge_duplicates(db_path=DATABASE, threshold=MATCH_THRESHOLD, dry_run=True):
+    """Detectar y (opcionalmente) fusionar productos duplicados"""
+    conn = sqlite3.connect(db_path)
+
+    try:
+        matcher = ProductMatcher.from_db(conn)
+        groups = matcher.duplicate_groups(threshold)
+
+        if not groups:
+            print("✅ No se encontraron productos duplicados")
+            return []
+
+        # Conservar el producto más vendido de cada grupo (ante empate, el más antiguo)
+        sales = dict(conn.execute('''
+            SELECT product_id, COUNT(*) FROM order_items
+            WHERE product_id IS NOT NULL
+            GROUP BY product_id
+        ''').fetchall())
+
+        merges = []
+        for ids in groups:
+            keep_id = min(ids, key=lambda pid: (-sales.get(pid, 0), pid))
+            merges.append((keep_id, [pid for pid in ids if pid != keep_id]))
+
+        print(f"=== {len(merges)} GRUPOS DE PRODUCTOS DUPLICADOS ===")
+        for keep_id, duplicate_ids in merges:
+            print(f"  ✅ Conservar [{keep_id}] {matcher.name(keep_id)} ({sales.get(keep_id, 0)} ventas)")
+            for pid in duplicate_ids:
+                print(f"     ↳ [{pid}] {matcher.name(pid)} ({sales.get(pid, 0)} ventas)")
+
+        if dry_run:
+            print("\nModo simulación: ejecutar con --merge para aplicar los cambios")
+            return merges
+
+        moved = 0
+        for keep_id, duplicate_ids in merges:
+            moved += merge_products(conn, keep_id, duplicate_ids)
+        rebuild_product_summaries(conn)
+        conn.commit()
+
+        print(f"\n✅ {sum(len(d) for _, d in merges)} productos fusionados")
+        print(f"✅ {moved} items de órdenes reasignados")
+        return merges
+
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Error fusionando productos: {str(e)}")
+        return None
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    merge_duplicates(dry_run='--merge' not in sys.argv)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Costo de receta por producto y copia del costo en cada línea de orden
+
+Cada producto apunta a su receta con products.recipe_id; el costo unitario
+es la suma de cantidad × costo de sus ingredientes dividida por las
+porciones de la receta, con las sub-recetas ya explotadas en ingredientes
+(ver bill_of_materials.py). Un producto sin receta usa products.cost si la base
+tiene esa columna (insert_products.py) y si no queda sin costo (NULL).
+
+Al vender, la línea guarda el costo de ese momento en order_items.unit_cost,
+igual que guarda el precio: cambiar un ingrediente después no altera los
+márgenes ya registrados. CostingEngine mantiene los costos por producto en
+memoria y los vuelve a calcular (una consulta) cuando change_log muestra un
+cambio de menú o de inventario (ver cache_coherence.py).
+
+Cada compra recibida (y cada cambio manual del costo de un ingrediente)
+queda en ingredient_cost_history con su fecha de vigencia; ingredients.unit_cost
+es solo el costo vigente. Las líneas antiguas, o las de cargas sin la app,
+se recalculan con recompute_line_costs usando el costo que tenía cada
+ingrediente ese día según esa historia (CostHistory); después hay que
+reconstruir sales_hourly y product_sales_daily del mismo rango (ver
+sales_rollup.py).
+
+    python recipe_costing.py --recompute [--db data/sandwich.db] [--start 2025-01-01 --end 2025-02-01]
+    python -m pytest tests/test_recipe_costing.py
+"""
+
+import bisect
+import sqlite3
+import sys
+import threading
+
+from bill_of_materials import BillOfMaterials, CycleError
+from cache_coherence import domain_version
+
+COST_COLUMNS = (
+    ('products', 'recipe_id', 'INTEGER'),
+    ('order_items', 'unit_cost', 'REAL'),
+)
+
+
+# ===== ESQUEMA =====
+
+def add_cost_columns(cursor):
+    """Agregar products.recipe_id y order_items.unit_cost; True si unit_cost se creó ahora"""
+    added = set()
+    for table, name, column_type in COST_COLUMNS:
+        existing = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})').fetchall()}
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+            added.add(name)
+    return 'unit_cost' in added
+
+
+def create_cost_history(cursor):
+    """Crear ingredient_cost_history; devuelve True si se creó ahora (hay que llenarla)"""
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ingredient_cost_history'"
+    ).fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingredient_cost_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ingredient_id INTEGER NOT NULL,
+            unit_cost REAL NOT NULL,
+            effective_at TEXT NOT NULL,
+            source TEXT NOT NULL DEFAULT 'purchase',
+            reference_id INTEGER
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ingredient_cost_history
+        ON ingredient_cost_history (ingredient_id, effective_at)
+    ''')
+    return exists is None
+
+
+def _has_column(conn, table, name):
+    return any(row[1] == name for row in conn.execute(f'PRAGMA table_info({table})').fetchall())
+
+
+# ===== RECETAS =====
+
+def load_recipes(conn, bom=None):
+    """{product_id: (1, [(ingredient_id, cantidad por porción)])} de los productos con receta
+
+    Las sub-recetas vienen explotadas con bom (un BillOfMaterials; uno nuevo
+    si falta). Un producto cuya receta tiene un ciclo queda sin costo.
+    """
+    if bom is None:
+        bom = BillOfMaterials()
+    recipes = {}
+    for product_id, recipe_id in conn.execute('''
+        SELECT p.id, p.recipe_id FROM products p
+        JOIN recipes r ON r.id = p.recipe_id
+        ORDER BY p.id
+    ''').fetchall():
+        try:
+            ingredient_ids, quantities = bom.vector(conn, recipe_id)
+        except CycleError:
+            continue
+        recipes[product_id] = (1, list(zip(ingredient_ids.tolist(), quantities.tolist())))
+    return recipes
+
+
+def load_fallback_costs(conn):
+    """{product_id: products.cost} de los productos sin receta (vacío si no hay columna cost)"""
+    if not _has_column(conn, 'products', 'cost'):
+        return {}
+    return dict(conn.execute(
+        'SELECT id, cost FROM products WHERE recipe_id IS NULL AND cost IS NOT NULL').fetchall())
+
+
+def recipe_cost(recipe, ingredient_cost):
+    """Costo unitario de una receta (porciones, líneas) con ingredient_cost(ingredient_id)"""
+    servings, lines = recipe
+    return round(sum(quantity * ingredient_cost(ingredient_id) for ingredient_id, quantity in lines) / servings, 4)
+
+
+def load_product_costs(conn, bom=None):
+    """{product_id: costo unitario} con los costos actuales de los ingredientes"""
+    current = dict(conn.execute('SELECT id, COALESCE(unit_cost, 0) FROM ingredients').fetchall())
+    costs = load_fallback_costs(conn)
+    for product_id, recipe in load_recipes(conn, bom).items():
+        costs[product_id] = recipe_cost(recipe, lambda ingredient_id: current.get(ingredient_id, 0))
+    return costs
+
+
+class CostingEngine:
+    """Costo unitario por producto en memoria, al día con change_log"""
+
+    DOMAINS = ('menu', 'inventory')
+
+    def __init__(self, bom=None):
+        self.bom = bom        # BillOfMaterials compartido (memoria de sub-recetas)
+        self._costs = None
+        self._loaded = {}     # versiones de change_log con que se calculó
+        self._required = {}   # versiones vistas por el tracker
+        self._lock = threading.Lock()
+
+    def watch(self, tracker):
+        """Recalcular en la próxima consulta cuando cambie el menú o el inventario"""
+        for domain in self.DOMAINS:
+            tracker.on_change(domain, lambda version, conn, domain=domain: self.require(domain, version))
+
+    def require(self, domain, version):
+        with self._lock:
+            self._required[domain] = max(version, self._required.get(domain, 0))
+
+    def invalidate(self):
+        with self._lock:
+            self._costs = None
+
+    def _stale(self):
+        return self._costs is None or any(
+            self._loaded.get(domain, 0) < version for domain, version in self._required.items())
+
+    def product_costs(self, conn):
+        """{product_id: costo unitario}; recalcula si hay cambios desde la última carga"""
+        with self._lock:
+            if not self._stale():
+                return self._costs
+        # Versiones primero: un cambio durante la carga vuelve a marcarla vieja
+        loaded = {domain: domain_version(conn, domain) for domain in self.DOMAINS}
+        costs = load_product_costs(conn, self.bom)
+        with self._lock:
+            self._costs, self._loaded = costs, loaded
+        return costs
+
+    def cost_cart(self, conn, cart_items):
+        """Costo unitario de cada item del carrito (None si el producto no tiene costo)"""
+        costs = self.product_costs(conn)
+        return [costs.get(_product_id(item)) for item in cart_items]
+
+    def cost_edited_cart(self, conn, cart_items, recorded):
+        """Como cost_cart al editar una orden: las líneas que no cambian conservan su costo
+
+        recorded es {line_key: [unit_cost, ...]} de las líneas que tenía la
+        orden; solo las líneas nuevas o cambiadas se costean con los costos
+        de hoy, así editar el cliente o una nota no reescribe el margen.
+        """
+        recorded = {key: list(costs) for key, costs in recorded.items()}
+        keys = [line_key(item.get('id'), [v.get('option_id') for v in item.get('variations') or []])
+                for item in cart_items]
+        costs = [recorded[key].pop(0) if recorded.get(key) else _MISSING for key in keys]
+        changed = [i for i, cost in enumerate(costs) if cost is _MISSING]
+        if changed:
+            current = self.cost_cart(conn, [cart_items[i] for i in changed])
+            for i, cost in zip(changed, current):
+                costs[i] = cost
+        return costs
+
+
+_MISSING = object()
+
+
+def line_key(product_id, option_ids):
+    """(producto, opciones) de una línea de orden: la misma línea antes y después de editar"""
+    return _as_int(product_id), tuple(sorted(filter(None, map(_as_int, option_ids))))
+
+
+def recorded_line_costs(conn, order_id):
+    """{line_key: [unit_cost, ...]} de las líneas guardadas de una orden"""
+    options = {}
+    for item_id, option_id in conn.execute('''
+        SELECT order_item_id, variation_option_id FROM order_item_variations
+        WHERE order_item_id IN (SELECT id FROM order_items WHERE order_id = ?)
+    ''', (order_id,)):
+        options.setdefault(item_id, []).append(option_id)
+    recorded = {}
+    for item_id, product_id, unit_cost in conn.execute(
+            'SELECT id, product_id, unit_cost FROM order_items WHERE order_id = ? ORDER BY id', (order_id,)):
+        recorded.setdefault(line_key(product_id, options.get(item_id, ())), []).append(unit_cost)
+    return recorded
+
+
+def _product_id(item):
+    return _as_int(item.get('id'))
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# ===== HISTORIA =====
+
+def record_cost(conn, ingredient_id, unit_cost, effective_at, source='purchase', reference_id=None):
+    """Agregar un costo vigente desde effective_at ('purchase': compra recibida, 'manual': edición)"""
+    conn.execute('''
+        INSERT INTO ingredient_cost_history (ingredient_id, unit_cost, effective_at, source, reference_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (ingredient_id, unit_cost, effective_at, source, reference_id))
+
+
+def backfill_cost_history(conn):
+    """Rehacer las filas 'purchase' desde las compras de inventory_movements; devuelve cuántas"""
+    conn.execute("DELETE FROM ingredient_cost_history WHERE source = 'purchase'")
+    return conn.execute('''
+        INSERT INTO ingredient_cost_history (ingredient_id, unit_cost, effective_at, source, reference_id)
+        SELECT ingredient_id, unit_cost, created_at, 'purchase',
+               CASE WHEN reference_type = 'purchase' THEN reference_id END
+        FROM inventory_movements
+        WHERE movement_type = 'purchase' AND unit_cost > 0 AND created_at IS NOT NULL
+        ORDER BY created_at, id
+    ''').rowcount
+
+
+class CostHistory:
+    """Costo de cada ingrediente en el tiempo, desde ingredient_cost_history
+
+    Por ingrediente, fechas de vigencia ordenadas y el costo de cada una: el
+    costo a una fecha es el del último cambio hasta esa fecha (bisect). Antes
+    del primer cambio vale ese primer costo, y un ingrediente sin historia
+    usa ingredients.unit_cost.
+    """
+
+    def __init__(self, changes, current=None):
+        self.times = {}
+        self.costs = {}
+        for ingredient_id, when, cost in changes:
+            self.times.setdefault(ingredient_id, []).append(when)
+            self.costs.setdefault(ingredient_id, []).append(cost)
+        self.current = current or {}
+
+    @classmethod
+    def load(cls, conn):
+        changes = conn.execute('''
+            SELECT ingredient_id, effective_at, unit_cost
+            FROM ingredient_cost_history
+            ORDER BY ingredient_id, effective_at, id
+        ''').fetchall()
+        current = dict(conn.execute('SELECT id, COALESCE(unit_cost, 0) FROM ingredients').fetchall())
+        return cls(changes, current)
+
+    def cost_at(self, ingredient_id, when):
+        times = self.times.get(ingredient_id)
+        if not times:
+            return self.current.get(ingredient_id, 0)
+        index = bisect.bisect_right(times, when) - 1
+        return self.costs[ingredient_id][max(index, 0)]
+
+
+def recompute_line_costs(conn, start=None, end=None):
+    """Volver a costear las líneas de órdenes con start <= día < end (todas si faltan)
+
+    Una línea toma el costo de su producto con los precios de los
+    ingredientes al cierre del día de la orden. Devuelve las líneas escritas.
+    """
+    start, end = str(start) if start else '', str(end) if end else '9999-12-31'
+    recipes = load_recipes(conn)
+    fallback = load_fallback_costs(conn)
+    history = CostHistory.load(conn)
+
+    days = [row[0] for row in conn.execute('''
+        SELECT DISTINCT substr(created_at, 1, 10) FROM orders
+        WHERE created_at >= ? AND created_at < ? ORDER BY 1
+    ''', (start, end))]
+    rows = []
+    for day in days:
+        closing = f'{day} 23:59:59'
+        for product_id, recipe in recipes.items():
+            rows.append((product_id, day, recipe_cost(
+                recipe, lambda ingredient_id: history.cost_at(ingredient_id, closing))))
+        rows.extend((product_id, day, cost) for product_id, cost in fallback.items())
+
+    conn.execute('DROP TABLE IF EXISTS temp.line_costs')
+    conn.execute('''
+        CREATE TEMP TABLE line_costs (
+            product_id INTEGER, day TEXT, unit_cost REAL, PRIMARY KEY (product_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.executemany('INSERT OR REPLACE INTO temp.line_costs VALUES (?, ?, ?)', rows)
+    written = conn.execute('''
+        UPDATE order_items SET unit_cost = (
+            SELECT lc.unit_cost FROM temp.line_costs lc
+            WHERE lc.product_id = order_items.product_id
+              AND lc.day = (SELECT substr(o.created_at, 1, 10) FROM orders o WHERE o.id = order_items.order_id)
+        )
+        WHERE order_id IN (SELECT id FROM orders WHERE created_at >= ? AND created_at < ?)
+    ''', (start, end)).rowcount
+    conn.execute('DROP TABLE temp.line_costs')
+    return written
+
+
+def _arg(name, default=None):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+
+if __name__ == "__main__":
+    if '--recompute' in sys.argv:
+        from sales_rollup import create_sales_rollup, backfill as backfill_sales_rollup
+
+        path = _arg('--db', 'data/sandwich.db')
+        conn = sqlite3.connect(path)
+        add_cost_columns(conn.cursor())
+        if create_cost_history(conn.cursor()):
+            backfill_cost_history(conn)
+        start, end = _arg('--start'), _arg('--end')
+        written = recompute_line_costs(conn, start, end)
+        if create_sales_rollup(conn.cursor()):
+            backfill_sales_rollup(conn)  # resumen nuevo: completo, no solo el rango
+        else:
+            backfill_sales_rollup(conn, start, end)
+        conn.commit()
+        conn.close()
+        print(f'✅ {written:,} líneas de órdenes costeadas en {path}')
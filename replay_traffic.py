@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Reproducción del tráfico histórico de órdenes contra una base desechable
+
+Lee las órdenes reales (tablas orders/order_items de una base, o la hoja
+"Detalle de Ventas" de un Reporte_Ventas exportado) y vuelve a enviar cada
+una como el POST a /orders/create que hizo la caja, respetando el tiempo
+entre llegadas original dividido por la velocidad (1x, 5x, 20x...).
+
+Cada velocidad corre sobre una base nueva creada con init_db() y con el
+catálogo copiado de la base de origen, así la de producción nunca se toca.
+Por velocidad se informa latencia p50/p95/p99, órdenes fallidas (la app
+redirige de vuelta a /orders/new), errores "database is locked" y espera
+del lock de escritura (leídos de /metrics), y la concurrencia máxima, para
+ver en qué punto el diseño de una sola base SQLite deja de dar abasto.
+
+    python replay_traffic.py                                   # hora más cargada, 1x 5x 20x
+    python replay_traffic.py --source data/sandwich.db --date 2025-09-12 --speeds 10
+    python replay_traffic.py --source Reporte_Ventas_Epicuro_20250822_a_20250921.xlsx
+    python replay_traffic.py --start "2025-09-12 12:00" --end "2025-09-12 15:00" --max-gap 60
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from load_test import HttpClient, InProcessClient, percentile
+from order_repository import OrderRepository
+from timestamps import from_epoch, parse_timestamp
+from variation_snapshot import decode_snapshot
+
+DEFAULT_SOURCE = 'data/sandwich.db'
+DEFAULT_SPEEDS = (1, 5, 20)
+
+# Tablas que se copian de la base de origen a la base desechable
+CATALOG_TABLES = (
+    'categories', 'products', 'variation_groups', 'variation_options', 'product_variations',
+    'suppliers', 'ingredients', 'recipes', 'recipe_ingredients',
+)
+
+# Pausa máxima entre dos órdenes (noches y tardes vacías no se esperan)
+DEFAULT_MAX_GAP = 300
+
+
+class ReplayOrder:
+    """Una orden histórica lista para reenviar"""
+
+    __slots__ = ('epoch', 'form')
+
+    def __init__(self, epoch, form):
+        self.epoch = epoch
+        self.form = form
+
+
+def _cart_item(product_id, name, quantity, price, notes='', variations=None):
+    return {'id': product_id, 'name': name, 'quantity': int(quantity or 1),
+            'price': float(price or 0), 'notes': notes or '', 'variations': variations or []}
+
+
+def _order_form(customer, payment_method, order_type, cart):
+    return {
+        'customer_name': customer or '',
+        'customer_phone': '',
+        'payment_method': payment_method or 'efectivo',
+        'order_type': order_type or 'dine_in',
+        'notes': '',
+        'cart_items': json.dumps(cart, ensure_ascii=False),
+    }
+
+
+# ===== FUENTES =====
+
+def orders_from_db(path, start=None, end=None):
+    """Órdenes de una base (más antiguas primero) entre start y end"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        orders = OrderRepository(conn).find(start=start, end=end, with_items=True)
+    finally:
+        conn.close()
+
+    replay = []
+    for order in reversed(orders):
+        parsed = (order.created_epoch, None) if order.created_epoch else parse_timestamp(order.created_at)
+        if parsed is None or not order.items:
+            continue
+        cart = [_cart_item(line.product_id, line.product_name, line.quantity, line.unit_price, line.notes,
+                           [{'option_id': v.get('option_id'), 'name': v.get('name'),
+                             'price_modifier': v.get('price_modifier', 0)}
+                            for v in decode_snapshot(line.variations_json)])
+                for line in order.items]
+        replay.append(ReplayOrder(parsed[0], _order_form(order.customer_name, order.payment_method,
+                                                         order.order_type, cart)))
+    replay.sort(key=lambda order: order.epoch)
+    return replay
+
+
+def orders_from_excel(path, catalog_path, start=None, end=None):
+    """Órdenes de un Reporte_Ventas (hoja "Detalle de Ventas", como import_ventas.py)"""
+    import pandas as pd
+    from product_matcher import ProductMatcher
+
+    conn = sqlite3.connect(f'file:{catalog_path}?mode=ro', uri=True)
+    try:
+        matcher = ProductMatcher.from_db(conn)
+    finally:
+        conn.close()
+
+    df = pd.read_excel(path, sheet_name='Detalle de Ventas')
+    replay = []
+    for order_id, rows in df.groupby('ID', sort=False):
+        first = rows.iloc[0]
+        parsed = parse_timestamp(str(first['Fecha']).replace('T', ' '))
+        if parsed is None:
+            continue
+        cart = []
+        for _, row in rows.iterrows():
+            name = row['Producto']
+            quantity = int(row['Cantidad']) if pd.notna(row['Cantidad']) else 1
+            price = float(row['Precio']) if pd.notna(row['Precio']) else 0
+            cart.append(_cart_item(matcher.best_match(name), name, quantity, price))
+        customer = first['Cliente'] if pd.notna(first['Cliente']) else ''
+        replay.append(ReplayOrder(parsed[0], _order_form(customer, 'efectivo', 'dine_in', cart)))
+
+    replay.sort(key=lambda order: order.epoch)
+    if start:
+        replay = [o for o in replay if o.epoch >= parse_timestamp(start)[0]]
+    if end:
+        replay = [o for o in replay if o.epoch < parse_timestamp(end)[0]]
+    return replay
+
+
+def busiest_hour(orders):
+    """(inicio, fin) en epoch de la hora de reloj con más órdenes"""
+    counts = {}
+    for order in orders:
+        hour = order.epoch - order.epoch % 3600
+        counts[hour] = counts.get(hour, 0) + 1
+    if not counts:
+        return None
+    hour = max(counts, key=counts.get)
+    return hour, hour + 3600
+
+
+def schedule(orders, speed, max_gap=DEFAULT_MAX_GAP):
+    """Segundos desde el inicio en que se envía cada orden a `speed`x"""
+    offsets = []
+    elapsed = 0.0
+    previous = None
+    for order in orders:
+        if previous is not None:
+            elapsed += min(order.epoch - previous, max_gap) / speed
+        offsets.append(elapsed)
+        previous = order.epoch
+    return offsets
+
+
+# ===== BASE DESECHABLE =====
+
+def create_scratch_db(path, catalog_path):
+    """Base con el esquema de init_db() y el catálogo de catalog_path"""
+    import app as epicuro
+
+    production = epicuro.DATABASE
+    epicuro.DATABASE = path
+    try:
+        epicuro.init_db()
+    finally:
+        epicuro.DATABASE = production
+
+    conn = sqlite3.connect(path)
+    conn.execute('ATTACH DATABASE ? AS src', (catalog_path,))
+    for table in CATALOG_TABLES:
+        source_columns = {row[1] for row in conn.execute(f'PRAGMA src.table_info({table})')}
+        columns = [row[1] for row in conn.execute(f'PRAGMA main.table_info({table})')
+                   if row[1] in source_columns]
+        if columns:
+            names = ', '.join(columns)
+            conn.execute(f'INSERT INTO main.{table} ({names}) SELECT {names} FROM src.{table}')
+    conn.commit()
+    conn.execute('DETACH DATABASE src')
+    conn.close()
+
+
+_METRIC_LINE = re.compile(r'^(epicuro_sqlite_locked_errors_total|epicuro_sqlite_lock_wait_seconds_sum'
+                          r'|epicuro_sqlite_lock_wait_seconds_count)(?:\{[^}]*\})?\s+(\S+)$', re.MULTILINE)
+
+
+def read_lock_metrics(client):
+    """Contadores de locks de SQLite desde /metrics (None si no responde)"""
+    try:
+        status, _, body = client.request('GET', '/metrics')
+    except Exception:
+        return None
+    if status != 200:
+        return None
+    return {name: float(value) for name, value in _METRIC_LINE.findall(body.decode('utf-8', 'replace'))}
+
+
+# ===== REPRODUCCIÓN =====
+
+class ReplayRun:
+    """Envío de las órdenes a una velocidad, con un cliente por hilo"""
+
+    def __init__(self, make_client, orders, speed, max_gap=DEFAULT_MAX_GAP, workers=64):
+        self.make_client = make_client
+        self.orders = orders
+        self.speed = speed
+        self.offsets = schedule(orders, speed, max_gap)
+        self.workers = workers
+        self.latencies = []
+        self.lags = []
+        self.failed = 0
+        self.failure_samples = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.make_client()
+        return client
+
+    def _send(self, order, due):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        start = time.perf_counter()
+        try:
+            status, location, _ = self._client().request('POST', '/orders/create', order.form)
+            ok = status < 400 and '/orders/new' not in location
+            detail = f'{status} {location}'.strip()
+        except Exception as e:
+            ok, detail = False, str(e)[:200]
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.in_flight -= 1
+            self.latencies.append(elapsed)
+            self.lags.append(max(0.0, start - due))
+            if not ok:
+                self.failed += 1
+                if len(self.failure_samples) < 5:
+                    self.failure_samples.append(detail)
+
+    def run(self):
+        metrics_client = self.make_client()
+        before = read_lock_metrics(metrics_client)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for order, offset in zip(self.orders, self.offsets):
+                due = started + offset
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                pool.submit(self._send, order, due)
+        elapsed = time.perf_counter() - started
+        after = read_lock_metrics(metrics_client)
+        return self.report(elapsed, before, after)
+
+    def report(self, elapsed, before, after):
+        latencies = sorted(self.latencies)
+        span = self.offsets[-1] if self.offsets else 0
+
+        def delta(name):
+            # Los contadores en cero todavía no aparecen en /metrics
+            if before is None or after is None:
+                return None
+            return after.get(name, 0) - before.get(name, 0)
+
+        lock_waits = delta('epicuro_sqlite_lock_wait_seconds_count')
+        lock_wait_sum = delta('epicuro_sqlite_lock_wait_seconds_sum')
+        locked = delta('epicuro_sqlite_locked_errors_total')
+        return {
+            'speed': self.speed,
+            'orders': len(self.orders),
+            'failed': self.failed,
+            'lock_errors': int(locked) if locked is not None else None,
+            'avg_lock_wait_ms': round(lock_wait_sum / lock_waits * 1000, 2) if lock_waits else None,
+            'seconds': round(elapsed, 1),
+            'offered_rate': round(len(self.orders) / span, 2) if span else None,
+            'max_in_flight': self.max_in_flight,
+            **{f'p{pct}_ms': round(percentile(latencies, pct) * 1000, 1) for pct in (50, 95, 99)},
+            'max_ms': round(latencies[-1] * 1000, 1) if latencies else 0,
+            'max_lag_ms': round(max(self.lags) * 1000, 1) if self.lags else 0,
+            'failure_samples': self.failure_samples,
+        }
+
+
+def print_reports(reports):
+    print(f"\n{'Vel.':>5}{'Órdenes':>9}{'Fallidas':>10}{'Locks':>7}{'Espera ms':>11}{'ord/s':>8}"
+          f"{'Concurr.':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'máx ms':>9}")
+    for r in reports:
+        print(f"{str(r['speed']) + 'x':>5}{r['orders']:>9}{r['failed']:>10}"
+              f"{'-' if r['lock_errors'] is None else r['lock_errors']:>7}"
+              f"{'-' if r['avg_lock_wait_ms'] is None else r['avg_lock_wait_ms']:>11}"
+              f"{r['offered_rate'] or '-':>8}{r['max_in_flight']:>10}"
+              f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}")
+    for r in reports:
+        for sample in r['failure_samples']:
+            print(f"  ⚠️  {r['speed']}x: {sample}")
+
+
+def _window(args):
+    if args.date:
+        return f'{args.date} 00:00:00', f'{args.date} 23:59:59'
+    return args.start, args.end
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reproducir órdenes históricas a distintas velocidades')
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='base .db o Reporte_Ventas .xlsx')
+    parser.add_argument('--catalog', default=DEFAULT_SOURCE,
+                        help='base de la que se copia el catálogo (con --source .xlsx)')
+    parser.add_argument('--date', help='reproducir un día completo (YYYY-MM-DD)')
+    parser.add_argument('--start', help="desde (ej. '2025-09-12 12:00')")
+    parser.add_argument('--end', help='hasta (sin incluir)')
+    parser.add_argument('--limit', type=int, help='máximo de órdenes')
+    parser.add_argument('--speeds', default=','.join(map(str, DEFAULT_SPEEDS)), help='ej. 1,5,20')
+    parser.add_argument('--max-gap', type=float, default=DEFAULT_MAX_GAP,
+                        help='pausa máxima entre órdenes en segundos de historia')
+    parser.add_argument('--workers', type=int, default=64, help='peticiones simultáneas como máximo')
+    parser.add_argument('--url', help='servidor en ejecución (debe usar una base desechable)')
+    parser.add_argument('--json', help='guardar el resultado en este archivo')
+    args = parser.parse_args(argv)
+
+    start, end = _window(args)
+    if args.source.lower().endswith(('.xlsx', '.xls')):
+        catalog_path = args.catalog
+        orders = orders_from_excel(args.source, catalog_path, start, end)
+    else:
+        catalog_path = args.source
+        orders = orders_from_db(args.source, start, end)
+
+    if not (start or end):
+        window = busiest_hour(orders)
+        if window:
+            orders = [o for o in orders if window[0] <= o.epoch < window[1]]
+            print(f'⏱️  Hora con más órdenes: {from_epoch(window[0])[0][:16]}')
+    if args.limit:
+        orders = orders[:args.limit]
+    if not orders:
+        raise SystemExit('❌ No hay órdenes para reproducir en ese rango')
+
+    speeds = [float(s) if '.' in s else int(s) for s in args.speeds.split(',') if s.strip()]
+    history = orders[-1].epoch - orders[0].epoch
+    print(f'🔁 {len(orders)} órdenes en {history / 60:.1f} min de historia desde {args.source}')
+
+    reports = []
+    for speed in speeds:
+        if args.url:
+            make_client = lambda: HttpClient(args.url)
+            reports.append(ReplayRun(make_client, orders, speed, args.max_gap, args.workers).run())
+            continue
+
+        import app as epicuro
+
+        with tempfile.TemporaryDirectory(prefix='epicuro-replay-') as directory:
+            scratch = os.path.join(directory, 'replay.db')
+            create_scratch_db(scratch, catalog_path)
+            production = epicuro.DATABASE, epicuro.job_queue.db_path, epicuro.app.config['AUTO_PRINT_KITCHEN']
+            epicuro.DATABASE = epicuro.job_queue.db_path = scratch
+            epicuro.app.config['AUTO_PRINT_KITCHEN'] = False
+            try:
+                make_client = lambda: InProcessClient(epicuro.app)
+                print(f'▶️  {speed}x ...')
+                reports.append(ReplayRun(make_client, orders, speed, args.max_gap, args.workers).run())
+            finally:
+                epicuro.DATABASE, epicuro.job_queue.db_path, epicuro.app.config['AUTO_PRINT_KITCHEN'] = production
+
+    print_reports(reports)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+        print(f'💾 Resultado guardado en {args.json}')
+    return reports
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Resumen de ventas por hora para el sistema Epicuro
+
+La tabla sales_hourly guarda una fila por (día, hora, categoría) con las
+órdenes, unidades y ventas de esa hora; category_id = 0 es el total de la
+hora y -1 las líneas sin producto o sin categoría. Así un mapa de calor de
+12 semanas (día de la semana × hora) o una comparación entre períodos lee a
+lo más días × 24 × categorías filas, sin recorrer orders.
+
+- orders: órdenes creadas en la hora (en una categoría, las que tienen al
+  menos una línea de ella)
+- quantity: unidades vendidas
+- revenue: total de las órdenes (fila total) o de sus líneas (categorías)
+- cost: costo de las líneas (order_items.unit_cost, ver recipe_costing.py);
+  una línea sin costo suma 0
+
+product_sales_daily lleva unidades, ventas y costo por (día, producto) para
+los márgenes por producto; margin_report lee cualquiera de las dos tablas.
+
+Al día: las rutas que crean, editan o eliminan órdenes llaman a
+refresh_hours con la hora de la orden antes de confirmar, que vuelve a
+sumar solo esa hora (y el día en product_sales_daily) desde orders (usa
+idx_orders_created_at). Como la hora
+se recalcula completa, una diferencia previa (órdenes escritas por otro
+script, un producto que cambió de categoría) se corrige sola la próxima vez
+que se escribe en esa hora. Las cargas masivas (generate_data.py,
+import_ventas.py) llaman a backfill al terminar.
+
+    python sales_rollup.py --backfill [--db data/sandwich.db] [--start 2025-01-01 --end 2025-02-01]
+    python -m pytest tests/test_sales_rollup.py
+"""
+
+import datetime
+import sqlite3
+import sys
+
+TOTAL = 0           # category_id de la fila total de cada hora
+UNCATEGORIZED = -1  # líneas sin producto o con producto sin categoría
+
+# Medida -> suma sobre las filas del resumen
+MEASURES = {
+    'orders': 'SUM(orders)',
+    'quantity': 'SUM(quantity)',
+    'revenue': 'SUM(revenue)',
+    'cost': 'SUM(cost)',
+    'margin': 'SUM(revenue - cost)',
+}
+MARGIN_GROUPS = ('product', 'category', 'day')
+BUCKETS = ('hour', 'weekday', 'weekday_hour', 'day')
+
+WEEKDAY_NAMES = ('Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo')
+
+# Clave de cada bucket sobre (day, hour); strftime('%w') cuenta desde el domingo
+_BUCKET_COLUMNS = {
+    'hour': ('hour',),
+    'weekday': ("(CAST(strftime('%w', day) AS INTEGER) + 6) % 7",),
+    'weekday_hour': ("(CAST(strftime('%w', day) AS INTEGER) + 6) % 7", 'hour'),
+    'day': ('day',),
+}
+
+# created_at es texto local canónico 'YYYY-MM-DD HH:MM:SS' (ver timestamps.py)
+_TOTALS_QUERY = '''
+    INSERT INTO sales_hourly (day, hour, category_id, orders, quantity, revenue, cost)
+    SELECT substr(o.created_at, 1, 10), CAST(substr(o.created_at, 12, 2) AS INTEGER), 0,
+           COUNT(*),
+           COALESCE(SUM((SELECT SUM(oi.quantity) FROM order_items oi WHERE oi.order_id = o.id)), 0),
+           COALESCE(SUM(o.total_amount), 0),
+           COALESCE(SUM((SELECT SUM(oi.quantity * oi.unit_cost) FROM order_items oi WHERE oi.order_id = o.id)), 0)
+    FROM orders o
+    WHERE o.created_at >= ? AND o.created_at < ?
+    GROUP BY 1, 2
+'''
+
+_CATEGORIES_QUERY = '''
+    INSERT INTO sales_hourly (day, hour, category_id, orders, quantity, revenue, cost)
+    SELECT substr(o.created_at, 1, 10), CAST(substr(o.created_at, 12, 2) AS INTEGER),
+           COALESCE(p.category_id, -1),
+           COUNT(DISTINCT o.id), COALESCE(SUM(oi.quantity), 0), COALESCE(SUM(oi.total_price), 0),
+           COALESCE(SUM(oi.quantity * oi.unit_cost), 0)
+    FROM orders o
+    JOIN order_items oi ON oi.order_id = o.id
+    LEFT JOIN products p ON p.id = oi.product_id
+    WHERE o.created_at >= ? AND o.created_at < ?
+    GROUP BY 1, 2, 3
+'''
+
+# Las líneas sin producto van a product_id -1
+_PRODUCTS_QUERY = '''
+    INSERT INTO product_sales_daily (day, product_id, quantity, revenue, cost)
+    SELECT substr(o.created_at, 1, 10), COALESCE(oi.product_id, -1),
+           COALESCE(SUM(oi.quantity), 0), COALESCE(SUM(oi.total_price), 0),
+           COALESCE(SUM(oi.quantity * oi.unit_cost), 0)
+    FROM orders o
+    JOIN order_items oi ON oi.order_id = o.id
+    WHERE o.created_at >= ? AND o.created_at < ?
+    GROUP BY 1, 2
+'''
+
+
+# ===== ESQUEMA =====
+
+def create_sales_rollup(cursor):
+    """Crear sales_hourly y product_sales_daily; True si hay que llenarlas (nuevas o sin cost)"""
+    existing = {row[0] for row in cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('sales_hourly', 'product_sales_daily')"
+    ).fetchall()}
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sales_hourly (
+            day TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            quantity REAL NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, hour, category_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS product_sales_daily (
+            day TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity REAL NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, product_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Bases con el resumen anterior a los costos por línea
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(sales_hourly)').fetchall()}
+    cost_added = 'cost' not in columns
+    if cost_added:
+        cursor.execute('ALTER TABLE sales_hourly ADD COLUMN cost REAL NOT NULL DEFAULT 0')
+    return cost_added or len(existing) < 2
+
+
+# ===== ESCRITURA =====
+
+def _day(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def _next_day(day):
+    return (datetime.date.fromisoformat(day) + datetime.timedelta(days=1)).isoformat()
+
+
+def _hour_range(day, hour):
+    start = f'{day} {hour:02d}:00:00'
+    end = f'{day} {hour + 1:02d}:00:00' if hour < 23 else f'{_next_day(day)} 00:00:00'
+    return start, end
+
+
+def order_hour(conn, order_id):
+    """(día, hora) de una orden, o None si no existe"""
+    row = conn.execute('SELECT created_at FROM orders WHERE id = ?', (order_id,)).fetchone()
+    if not row or not row[0]:
+        return None
+    return row[0][:10], int(row[0][11:13])
+
+
+def refresh_hours(conn, hours):
+    """Volver a sumar las horas dadas [(día, hora)] y sus días desde orders (en la transacción de conn)"""
+    hours = {h for h in hours if h is not None}
+    for day, hour in hours:
+        conn.execute('DELETE FROM sales_hourly WHERE day = ? AND hour = ?', (day, hour))
+        bounds = _hour_range(day, hour)
+        conn.execute(_TOTALS_QUERY, bounds)
+        conn.execute(_CATEGORIES_QUERY, bounds)
+    for day in {day for day, _ in hours}:
+        conn.execute('DELETE FROM product_sales_daily WHERE day = ?', (day,))
+        conn.execute(_PRODUCTS_QUERY, (day, _next_day(day)))
+
+
+def backfill(conn, start=None, end=None):
+    """Reconstruir los días start <= día < end (todo si faltan); devuelve las filas escritas"""
+    start, end = _day(start) if start else '', _day(end) if end else '9999-12-31'
+    conn.execute('DELETE FROM sales_hourly WHERE day >= ? AND day < ?', (start, end))
+    conn.execute('DELETE FROM product_sales_daily WHERE day >= ? AND day < ?', (start, end))
+    written = 0
+    for query in (_TOTALS_QUERY, _CATEGORIES_QUERY):
+        written += conn.execute(query, (start, end)).rowcount
+    conn.execute(_PRODUCTS_QUERY, (start, end))
+    return written
+
+
+# ===== LECTURA =====
+
+def _check(bucket, measure):
+    if bucket not in BUCKETS:
+        raise ValueError(f"Bucket desconocido: {bucket} (usar {', '.join(BUCKETS)})")
+    if measure not in MEASURES:
+        raise ValueError(f"Medida desconocida: {measure} (usar {', '.join(MEASURES)})")
+
+
+def plain_number(value):
+    """Número para JSON: int si es entero, si no redondeado a 2 decimales"""
+    return int(value) if float(value).is_integer() else round(float(value), 2)
+
+
+def buckets(conn, bucket, start, end, measure='orders', category_id=TOTAL):
+    """{clave: valor} de start <= día < end para una categoría (0 = total)
+
+    Claves: hora 0-23, día de la semana 0-6 (lunes = 0), (día, hora) o el
+    día 'YYYY-MM-DD'.
+    """
+    _check(bucket, measure)
+    columns = _BUCKET_COLUMNS[bucket]
+    keys = ', '.join(columns)
+    rows = conn.execute(f'''
+        SELECT {keys}, {MEASURES[measure]}
+        FROM sales_hourly
+        WHERE day >= ? AND day < ? AND category_id = ?
+        GROUP BY {keys}
+    ''', (_day(start), _day(end), category_id)).fetchall()
+    if len(columns) == 1:
+        return {row[0]: plain_number(row[1]) for row in rows}
+    return {(row[0], row[1]): plain_number(row[2]) for row in rows}
+
+
+def by_category(conn, start, end, measure='revenue', bucket='hour'):
+    """{category_id: {clave: valor}} de todas las categorías (sin la fila total)"""
+    _check(bucket, measure)
+    columns = _BUCKET_COLUMNS[bucket]
+    keys = ', '.join(columns)
+    rows = conn.execute(f'''
+        SELECT category_id, {keys}, {MEASURES[measure]}
+        FROM sales_hourly
+        WHERE day >= ? AND day < ? AND category_id <> 0
+        GROUP BY category_id, {keys}
+    ''', (_day(start), _day(end))).fetchall()
+    result = {}
+    for row in rows:
+        key = row[1] if len(columns) == 1 else (row[1], row[2])
+        result.setdefault(row[0], {})[key] = plain_number(row[-1])
+    return result
+
+
+def heatmap(conn, start, end, measure='orders', category_id=TOTAL):
+    """Matriz 7 × 24 (lunes = fila 0) con el total y el promedio por día de cada celda"""
+    cells = buckets(conn, 'weekday_hour', start, end, measure, category_id)
+    start_day = datetime.date.fromisoformat(_day(start))
+    days = (datetime.date.fromisoformat(_day(end)) - start_day).days
+
+    # Cuántas veces aparece cada día de la semana en el rango
+    occurrences = [0] * 7
+    for offset in range(min(days, 7)):
+        occurrences[(start_day.weekday() + offset) % 7] = (days - offset + 6) // 7
+
+    totals = [[cells.get((weekday, hour), 0) for hour in range(24)] for weekday in range(7)]
+    averages = [[round(value / occurrences[weekday], 2) if occurrences[weekday] else 0 for value in row]
+                for weekday, row in enumerate(totals)]
+    return {
+        'weekdays': list(WEEKDAY_NAMES),
+        'hours': list(range(24)),
+        'totals': totals,
+        'averages': averages,
+        'days': occurrences,
+    }
+
+
+def compare(conn, bucket, start, end, previous_start, previous_end, measure='orders', category_id=TOTAL):
+    """Filas por bucket del período con el valor del período de comparación y la variación
+
+    Con bucket 'day' las claves de ambos períodos no coinciden: se alinean
+    por posición (primer día con primer día).
+    """
+    current = buckets(conn, bucket, start, end, measure, category_id)
+    previous = buckets(conn, bucket, previous_start, previous_end, measure, category_id)
+    if bucket == 'day':
+        first, previous_first = datetime.date.fromisoformat(_day(start)), datetime.date.fromisoformat(_day(previous_start))
+        length = (datetime.date.fromisoformat(_day(end)) - first).days
+        keys = [(first + datetime.timedelta(days=n)).isoformat() for n in range(length)]
+        previous = {(first + (datetime.date.fromisoformat(day) - previous_first)).isoformat(): value
+                    for day, value in previous.items()}
+    else:
+        keys = sorted(set(current) | set(previous))
+
+    rows = []
+    for key in keys:
+        value, before = current.get(key, 0), previous.get(key, 0)
+        change = value - before
+        rows.append({
+            'key': list(key) if isinstance(key, tuple) else key,
+            'value': value,
+            'previous': before,
+            'change': plain_number(change),
+            'change_pct': round(change / before * 100, 1) if before else None,
+        })
+    return rows
+
+
+def margin_report(conn, group, start, end):
+    """Unidades, ventas, costo y margen de start <= día < end por producto, categoría o día
+
+    Lee solo los resúmenes: product_sales_daily (product) o sales_hourly
+    (category: filas de categoría; day: fila total de cada hora).
+    """
+    if group not in MARGIN_GROUPS:
+        raise ValueError(f"Agrupación desconocida: {group} (usar {', '.join(MARGIN_GROUPS)})")
+    if group == 'product':
+        query = '''
+            SELECT product_id, SUM(quantity), SUM(revenue), SUM(cost) FROM product_sales_daily
+            WHERE day >= ? AND day < ? GROUP BY product_id
+        '''
+    else:
+        key, where = ('category_id', 'category_id <> 0') if group == 'category' else ('day', 'category_id = 0')
+        query = f'''
+            SELECT {key}, SUM(quantity), SUM(revenue), SUM(cost) FROM sales_hourly
+            WHERE day >= ? AND day < ? AND {where} GROUP BY {key}
+        '''
+    rows = []
+    for key, quantity, revenue, cost in conn.execute(query, (_day(start), _day(end))).fetchall():
+        margin = revenue - cost
+        rows.append({
+            'key': key,
+            'quantity': plain_number(quantity),
+            'revenue': plain_number(revenue),
+            'cost': plain_number(cost),
+            'margin': plain_number(margin),
+            'margin_pct': round(margin / revenue * 100, 1) if revenue else None,
+        })
+    if group == 'day':
+        rows.sort(key=lambda row: row['key'])
+    else:
+        rows.sort(key=lambda row: -row['margin'])
+    return rows
+
+
+def hourly_sales(conn, start, end):
+    """Órdenes por hora con las columnas de reports.html (hour '09', order_count)"""
+    return [{'hour': f'{hour:02d}', 'order_count': count}
+            for hour, count in sorted(buckets(conn, 'hour', start, end).items())]
+
+
+def _arg(name, default=None):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+
+if __name__ == "__main__":
+    if '--backfill' in sys.argv:
+        path = _arg('--db', 'data/sandwich.db')
+        conn = sqlite3.connect(path)
+        create_sales_rollup(conn.cursor())
+        written = backfill(conn, _arg('--start'), _arg('--end'))
+        conn.commit()
+        conn.close()
+        print(f'✅ {written:,} filas de sales_hourly reconstruidas en {path}')
@@ -0,0 +1,378 @@
+"""
+Perfilado de SQL por petición para el sistema Epicuro
+
+La conexión que entrega get_db() se crea con ProfilingConnection: cada
+sentencia mide con perf_counter su ejecución y la lectura de sus filas
+(fetchone/fetchall/fetchmany o iterando el cursor) y se acumula por texto SQL
+en el perfil de la petición en curso (sin normalizar ni copiar parámetros en
+el camino caliente). Al terminar la petición:
+
+- se agregan las estadísticas por endpoint (visibles en /debug/profile)
+- las sentencias idénticas repetidas muchas veces (un SELECT dentro de un
+  for) se marcan como N+1
+- si la petición fue lenta se escribe una línea JSON en un log rotativo
+
+El perfilado es opcional y /debug/profile solo responde con él activo, a
+peticiones desde la propia máquina o con el token configurado (cabecera
+X-Profile-Token o ?token=). Configuración por variables de entorno:
+
+    EPICURO_PROFILE=1               # activar (por omisión desactivado)
+    EPICURO_PROFILE_TOKEN=...       # permitir /debug/profile desde otras máquinas
+    EPICURO_SLOW_REQUEST_MS=500     # umbral de petición lenta
+    EPICURO_SLOW_LOG=data/logs/slow_requests.log
+"""
+
+import hmac
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from logging.handlers import RotatingFileHandler
+
+# Repeticiones de una misma sentencia en una petición para marcarla como N+1
+N_PLUS_ONE_THRESHOLD = 5
+
+# Sentencias más lentas guardadas por petición y por endpoint
+TOP_STATEMENTS = 5
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+# Direcciones que pueden consultar /debug/profile sin token
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+# Perfil de la petición que atiende cada hilo
+_local = threading.local()
+
+
+def current_profile():
+    """Perfil de la petición en curso en este hilo (o None)"""
+    return getattr(_local, 'profile', None)
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    """Texto SQL comparable: literales como ?, listas IN colapsadas, espacios simples"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class RequestProfile:
+    """Sentencias ejecutadas durante una petición"""
+
+    __slots__ = ('statements', 'sql_time', 'by_sql', 'started')
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_time = 0.0
+        # sql -> [veces, tiempo total, tiempo máximo]
+        self.by_sql = {}
+        self.started = time.perf_counter()
+
+    def record(self, sql, elapsed):
+        self.statements += 1
+        self.sql_time += elapsed
+        entry = self.by_sql.get(sql)
+        if entry is None:
+            self.by_sql[sql] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+
+    def record_fetch(self, sql, elapsed):
+        """Lectura de filas de una sentencia ya contada: solo suma tiempo"""
+        self.sql_time += elapsed
+        entry = self.by_sql.get(sql)
+        if entry is None:
+            self.by_sql[sql] = [1, elapsed, elapsed]
+        else:
+            entry[1] += elapsed
+
+    def summary(self):
+        """Resumen con texto normalizado (se calcula una vez, al final)"""
+        grouped = {}
+        for sql, (count, total, slowest) in self.by_sql.items():
+            key = normalize_sql(sql)
+            entry = grouped.setdefault(key, [0, 0.0, 0.0])
+            entry[0] += count
+            entry[1] += total
+            entry[2] = max(entry[2], slowest)
+
+        slowest = sorted(grouped.items(), key=lambda item: item[1][2], reverse=True)[:TOP_STATEMENTS]
+        n_plus_one = [(sql, entry[0]) for sql, entry in grouped.items() if entry[0] >= N_PLUS_ONE_THRESHOLD]
+        return {
+            'statements': self.statements,
+            'sql_ms': round(self.sql_time * 1000, 2),
+            'slowest': [{'sql': sql, 'count': e[0], 'total_ms': round(e[1] * 1000, 2),
+                         'max_ms': round(e[2] * 1000, 2)} for sql, e in slowest],
+            'n_plus_one': [{'sql': sql, 'count': count} for sql, count in n_plus_one],
+        }
+
+
+def set_lock_observer(observer):
+    """Registrar quién recibe la espera de locks de escritura
+
+    observer(segundos) recibe la duración de la primera escritura de cada
+    transacción (ahí SQLite espera el lock) y observer.locked() se llama
+    con cada error "database is locked".
+    """
+    global _lock_observer
+    _lock_observer = observer
+
+
+_lock_observer = None
+_WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE', 'REPLAC')
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """Cursor que informa cada sentencia al perfil de la petición"""
+
+    def _run(self, method, sql, *args):
+        profile = current_profile()
+        observer = _lock_observer
+        first_write = (observer is not None and not self.connection.in_transaction
+                       and sql.lstrip()[:6].upper() in _WRITE_PREFIXES)
+        if profile is None and not first_write:
+            return method(sql, *args)
+
+        start = time.perf_counter()
+        try:
+            return method(sql, *args)
+        except sqlite3.OperationalError as e:
+            if observer is not None and 'locked' in str(e):
+                observer.locked()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.record(sql, elapsed)
+            if first_write:
+                observer(elapsed)
+
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._run(super().executescript, sql_script)
+
+
+class FetchTimingCursor(ProfilingCursor):
+    """Cursor que además mide la lectura de filas (solo con perfil activo)
+
+    SQLite ejecuta el SELECT a medida que se piden filas: sin medir los
+    fetch, una consulta que recorre media tabla parecería instantánea.
+    El tiempo se suma a la última sentencia ejecutada por el cursor.
+    """
+
+    _profiled_sql = None
+
+    def _run(self, method, sql, *args):
+        self._profiled_sql = sql
+        return super()._run(method, sql, *args)
+
+    def _fetch(self, method, *args):
+        profile = current_profile()
+        if profile is None or self._profiled_sql is None:
+            return method(*args)
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            profile.record_fetch(self._profiled_sql, time.perf_counter() - start)
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._fetch(super().fetchmany)
+        return self._fetch(super().fetchmany, size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def __next__(self):
+        return self._fetch(super().__next__)
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """Conexión cuyos cursores (incluido conn.execute) se perfilan si hay perfil activo"""
+
+    def cursor(self, factory=None):
+        if factory is None:
+            # Sin perfil en curso no se paga la medición de cada fila
+            factory = FetchTimingCursor if current_profile() is not None else ProfilingCursor
+        return super().cursor(factory)
+
+    # conn.execute(...) en C no pasa por cursor(): se redirige aquí
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+class EndpointStats:
+    """Acumulado de un endpoint"""
+
+    __slots__ = ('requests', 'total_time', 'max_time', 'statements', 'sql_time',
+                 'slow_requests', 'n_plus_one', 'slowest')
+
+    def __init__(self):
+        self.requests = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.statements = 0
+        self.sql_time = 0.0
+        self.slow_requests = 0
+        # sql normalizado -> máximo de repeticiones visto en una petición
+        self.n_plus_one = {}
+        # sql normalizado -> tiempo máximo (ms)
+        self.slowest = {}
+
+    def as_dict(self, endpoint):
+        requests = self.requests or 1
+        return {
+            'endpoint': endpoint,
+            'requests': self.requests,
+            'avg_ms': round(self.total_time / requests * 1000, 2),
+            'max_ms': round(self.max_time * 1000, 2),
+            'avg_statements': round(self.statements / requests, 1),
+            'avg_sql_ms': round(self.sql_time / requests * 1000, 2),
+            'slow_requests': self.slow_requests,
+            'n_plus_one': [{'sql': sql, 'count': count}
+                           for sql, count in sorted(self.n_plus_one.items(), key=lambda i: -i[1])],
+            'slowest': [{'sql': sql, 'max_ms': ms}
+                        for sql, ms in sorted(self.slowest.items(), key=lambda i: -i[1])[:TOP_STATEMENTS]],
+        }
+
+
+class SqlProfiler:
+    """Middleware de Flask: perfil por petición, agregados por endpoint y log de lentas"""
+
+    def __init__(self, app=None, slow_ms=None, log_path=None, enabled=None):
+        self.enabled = enabled if enabled is not None else os.environ.get('EPICURO_PROFILE', '0') == '1'
+        self.token = os.environ.get('EPICURO_PROFILE_TOKEN') or None
+        self.slow_ms = slow_ms if slow_ms is not None else float(os.environ.get('EPICURO_SLOW_REQUEST_MS', 500))
+        self.log_path = log_path or os.environ.get('EPICURO_SLOW_LOG', 'data/logs/slow_requests.log')
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._logger = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.extensions['sql_profiler'] = self
+
+    # ===== CICLO DE LA PETICIÓN =====
+
+    def _start(self):
+        _local.profile = RequestProfile() if self.enabled else None
+
+    def _finish(self, response):
+        from flask import request
+
+        profile = current_profile()
+        _local.profile = None
+        if profile is None:
+            return response
+
+        elapsed = time.perf_counter() - profile.started
+        endpoint = request.endpoint or request.path
+        slow = elapsed * 1000 >= self.slow_ms
+
+        # La normalización queda en caché por texto SQL: el resumen es barato
+        summary = profile.summary() if profile.by_sql else None
+
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                stats = self._stats[endpoint] = EndpointStats()
+            stats.requests += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            stats.statements += profile.statements
+            stats.sql_time += profile.sql_time
+            if slow:
+                stats.slow_requests += 1
+            if summary:
+                for item in summary['n_plus_one']:
+                    stats.n_plus_one[item['sql']] = max(stats.n_plus_one.get(item['sql'], 0), item['count'])
+                for item in summary['slowest']:
+                    if item['max_ms'] > stats.slowest.get(item['sql'], 0):
+                        stats.slowest[item['sql']] = item['max_ms']
+
+        if slow:
+            self._log_slow(request, endpoint, elapsed, summary)
+
+        response.headers['Server-Timing'] = (f'sql;dur={profile.sql_time * 1000:.1f};desc="{profile.statements} sentencias", '
+                                             f'total;dur={elapsed * 1000:.1f}')
+        return response
+
+    def _log_slow(self, request, endpoint, elapsed, summary):
+        logger = self._get_logger()
+        logger.warning(json.dumps({
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': endpoint,
+            'total_ms': round(elapsed * 1000, 2),
+            **(summary or {}),
+        }, ensure_ascii=False))
+
+    def _get_logger(self):
+        if self._logger is None:
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            logger = logging.getLogger('epicuro.slow_requests')
+            logger.setLevel(logging.WARNING)
+            logger.propagate = False
+            handler = RotatingFileHandler(self.log_path, maxBytes=5 * 1024 * 1024, backupCount=5, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    # ===== CONSULTA =====
+
+    def allows(self, request):
+        """¿Puede esta petición ver o reiniciar el perfil?
+
+        Solo con el perfilado activo, y desde la propia máquina o con el token
+        de EPICURO_PROFILE_TOKEN (las rutas y sentencias revelan el esquema).
+        """
+        if not self.enabled:
+            return False
+        if request.remote_addr in LOCAL_ADDRESSES:
+            return True
+        supplied = request.headers.get('X-Profile-Token') or request.args.get('token') or ''
+        return self.token is not None and hmac.compare_digest(supplied, self.token)
+
+    def stats(self):
+        """Agregados por endpoint, del más costoso (tiempo total) al menos"""
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: item[1].total_time, reverse=True)
+            return [stats.as_dict(endpoint) for endpoint, stats in items]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
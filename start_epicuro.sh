@@ -22,7 +22,10 @@ init_db()
 print('✅ Base de datos lista')
 " 2>/dev/null || echo "⚠️  Ejecutar después de crear app.py"
 
-# Iniciar servidor
+# Iniciar servidor (./start_epicuro.sh --prod para gunicorn con varios workers)
 echo "🌐 Abriendo http://localhost:5002"
 echo "🛑 Presiona Ctrl+C para detener"
+if [[ "$1" == "--prod" ]]; then
+    exec gunicorn -c gunicorn.conf.py app:app
+fi
 python3 app.py
@@ -0,0 +1,55 @@
+"""
+Fixtures compartidas de las pruebas del sistema Epicuro
+
+Todas las pruebas usan el esquema real: init_db() de app.py crea una base
+una sola vez por sesión y cada prueba recibe su propia copia (tablas,
+columnas agregadas por migraciones y triggers de change_log incluidos).
+
+    python -m pytest tests
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def schema_path(tmp_path_factory):
+    """Base vacía creada con app.init_db()"""
+    import app
+
+    directory = tmp_path_factory.mktemp('schema')
+    path = str(directory / 'schema.db')
+    production, cwd = app.DATABASE, os.getcwd()
+    app.DATABASE = path
+    # init_db crea data/ en el directorio actual
+    os.chdir(directory)
+    try:
+        app.init_db()
+    finally:
+        os.chdir(cwd)
+        app.DATABASE = production
+    return path
+
+
+@pytest.fixture
+def db_path(schema_path, tmp_path):
+    """Ruta a una copia de la base de la sesión, propia de cada prueba"""
+    path = str(tmp_path / 'test.db')
+    shutil.copy(schema_path, path)
+    return path
+
+
+@pytest.fixture
+def db(db_path):
+    """Conexión a la copia de la prueba (filas como tuplas)"""
+    conn = sqlite3.connect(db_path)
+    yield conn
+    conn.close()
@@ -0,0 +1,50 @@
+"""Conteos de canasta por diferencias (basket_analysis.py)"""
+
+from basket_analysis import backfill, create_basket_tables, order_basket, top_pairs, update_basket
+
+
+def _snapshot(conn):
+    return (sorted(conn.execute('SELECT * FROM basket_products').fetchall()),
+            sorted(conn.execute('SELECT * FROM basket_pairs').fetchall()))
+
+
+def _write(conn, order_id, product_ids):
+    """Guardar las líneas de una orden y aplicar la diferencia de su canasta"""
+    before = order_basket(conn, order_id)
+    conn.execute('DELETE FROM order_items WHERE order_id = ?', (order_id,))
+    conn.execute('INSERT OR IGNORE INTO orders (id, order_number, subtotal, total_amount) VALUES (?, ?, 0, 0)',
+                 (order_id, f'ORD-{order_id}'))
+    conn.executemany('''
+        INSERT INTO order_items (order_id, product_id, product_name, quantity, unit_price, total_price)
+        VALUES (?, ?, 'PRODUCTO', 1, 0, 0)
+    ''', [(order_id, product_id) for product_id in product_ids])
+    update_basket(conn, before, order_basket(conn, order_id))
+
+
+def test_incremental_counts_match_backfill(db):
+    db.execute("INSERT INTO products (id, name, price) VALUES (1, 'Café', 0), (2, 'Sándwich', 0), "
+               "(3, 'Jugo', 0), (4, 'Kuchen', 0)")
+    assert not create_basket_tables(db.cursor())  # ya las creó init_db
+
+    _write(db, 1, [1, 2, 2])       # producto repetido: cuenta una vez
+    _write(db, 2, [1, 2, 3])
+    _write(db, 3, [1, 2, None])    # línea sin producto
+    _write(db, 4, [3])
+    _write(db, 5, [4, 1])
+    _write(db, 5, [4])             # edición
+    _write(db, 4, [])              # eliminación
+
+    incremental = _snapshot(db)
+    assert incremental == ([(0, 4), (1, 3), (2, 3), (3, 1), (4, 1)],
+                           [(1, 2, 3), (1, 3, 1), (2, 3, 1)])
+    backfill(db)
+    assert _snapshot(db) == incremental
+
+    # Mismo lift (4/3) en los tres pares: desempata el que se vendió más veces
+    best = top_pairs(db, min_orders=1)[0]
+    assert (best['product_a'], best['product_b']) == (1, 2) and best['lift'] == round(4 / 3, 3)
+    coffee = top_pairs(db, sort='support', min_orders=1)[0]
+    assert coffee['orders'] == 3 and coffee['support'] == 0.75 and coffee['confidence_a_b'] == 1.0
+    juice = top_pairs(db, min_orders=1, product_id=3)
+    assert {pair['product_a'] for pair in juice} == {3} and juice[0]['confidence_a_b'] == 1.0
+    assert top_pairs(db, min_orders=5) == []
@@ -0,0 +1,82 @@
+"""Explosión de sub-recetas, memoria por caminos y ciclos (bill_of_materials.py)"""
+
+import pytest
+
+from bill_of_materials import BillOfMaterials, CycleError, add_sub_recipe_column
+from cache_coherence import ChangeTracker
+
+
+@pytest.fixture
+def recipes(db):
+    """Mayo casera rinde 10 porciones; el italiano usa 1 de mayo, el chacarero 2; el combo usa 1 italiano"""
+    db.executescript('''
+        INSERT INTO recipes (id, name, servings) VALUES (1, 'Mayo casera', 10), (2, 'Italiano', 1),
+            (3, 'Chacarero', 1), (4, 'Combo italiano', 1), (5, 'Pebre', 4);
+        INSERT INTO recipe_ingredients (recipe_id, ingredient_id, sub_recipe_id, quantity) VALUES
+            (1, 10, NULL, 500), (1, 11, NULL, 3),
+            (2, 20, NULL, 1), (2, 21, NULL, 0.1), (2, NULL, 1, 1),
+            (3, 20, NULL, 1), (3, NULL, 1, 2), (3, NULL, 5, 1),
+            (4, NULL, 2, 1), (4, 30, NULL, 1),
+            (5, 40, NULL, 8);
+    ''')
+    db.commit()
+    tracker, bom = ChangeTracker(), BillOfMaterials()
+    bom.watch(tracker)
+    tracker.check(db)
+    return tracker, bom
+
+
+def test_column_already_added(db):
+    assert not add_sub_recipe_column(db.cursor())
+
+
+def test_explode_and_memoize(db, recipes):
+    _, bom = recipes
+    assert bom.explode(db, 4) == {10: 50.0, 11: 0.3, 20: 1.0, 21: 0.1, 30: 1.0}
+    assert bom.explode(db, 3) == {10: 100.0, 11: 0.6, 20: 1.0, 40: 2.0}
+    assert bom.exploded == 5 and bom.memoized == {1, 2, 3, 4, 5}
+    bom.explode(db, 4)
+    assert bom.exploded == 5  # desde la memoria
+
+
+def test_change_discards_only_dependent_paths(db, recipes):
+    tracker, bom = recipes
+    bom.explode(db, 4)
+    bom.explode(db, 3)
+
+    # La mayo cambia: se descartan ella y quienes la usan, el pebre sigue memorizado
+    db.execute('UPDATE recipe_ingredients SET quantity = 1000 WHERE recipe_id = 1 AND ingredient_id = 10')
+    db.commit()
+    tracker.check(db)
+    assert bom.sync(db) == {1, 2, 3, 4} and bom.memoized == {5}
+    assert bom.explode(db, 4)[10] == 100.0
+
+    # Un cambio en algo que nadie usa no descarta nada más
+    db.execute("INSERT INTO recipes (id, name, servings) VALUES (6, 'Nueva', 1)")
+    db.commit()
+    tracker.check(db)
+    assert bom.sync(db) == {6} and {1, 2, 4, 5} <= bom.memoized
+
+
+def test_cycles(db, recipes):
+    tracker, bom = recipes
+
+    # Al validar un formulario
+    bom.check_components(db, 4, [1, 5])
+    bom.check_components(db, None, [4])
+    for recipe_id, components in ((1, [4]), (2, [2])):
+        with pytest.raises(CycleError) as error:
+            bom.check_components(db, recipe_id, components)
+        assert error.value.path[0] == recipe_id and error.value.path[-1] == recipe_id
+    with pytest.raises(ValueError) as error:
+        bom.check_components(db, 1, [99])
+    assert not isinstance(error.value, CycleError)  # desconocida no es ciclo
+
+    # Al explotar datos ya cíclicos
+    db.execute('INSERT INTO recipe_ingredients (recipe_id, sub_recipe_id, quantity) VALUES (1, 4, 1)')
+    db.commit()
+    tracker.check(db)
+    with pytest.raises(CycleError) as error:
+        bom.explode(db, 3)
+    assert error.value.path == [1, 4, 2, 1]
+    assert bom.explode(db, 5) == {40: 2.0}
@@ -0,0 +1,45 @@
+"""Versiones por dominio e invalidación selectiva (cache_coherence.py)"""
+
+import sqlite3
+
+from cache_coherence import ChangeTracker, bump_domains, create_change_log, domain_version, drop_change_triggers
+
+
+class _Conn(sqlite3.Connection):
+    pass
+
+
+def test_tracker_sees_own_and_foreign_writes(db, db_path):
+    reader = sqlite3.connect(db_path, factory=_Conn)
+    tracker = ChangeTracker()
+    calls = []
+    tracker.on_change('menu', lambda version, conn: calls.append(('menu', version)))
+    tracker.on_change('orders', lambda version, conn: calls.append(('orders', version)))
+    menu, orders, inventory = (domain_version(reader, domain) for domain in ('menu', 'orders', 'inventory'))
+
+    assert tracker.check(reader) == []
+    assert tracker.check(reader) == []
+
+    # Otra conexión: data_version cambia
+    db.execute("INSERT INTO categories (name) VALUES ('CAFE')")
+    db.commit()
+    assert tracker.check(reader) == ['menu'] and calls == [('menu', menu + 1)]
+
+    # La misma conexión: total_changes cambia
+    reader.execute("UPDATE orders SET status = 'ready'")  # sin filas: no sube
+    reader.execute("INSERT INTO orders (order_number, subtotal, total_amount) VALUES ('A', 0, 0)")
+    reader.execute("INSERT INTO ingredients (name) VALUES ('Pan')")
+    reader.commit()
+    assert sorted(tracker.check(reader)) == ['inventory', 'orders']
+    assert calls[-1] == ('orders', orders + 1) and tracker.version('inventory') == inventory + 1
+
+    # Carga sin triggers
+    drop_change_triggers(db.cursor())
+    db.execute("INSERT INTO orders (order_number, subtotal, total_amount) VALUES ('B', 0, 0)")
+    db.commit()
+    assert tracker.check(reader) == []
+    create_change_log(db.cursor())
+    bump_domains(db.cursor(), ['orders'])
+    db.commit()
+    assert tracker.check(reader) == ['orders'] and domain_version(reader, 'orders') == orders + 2
+    reader.close()
@@ -0,0 +1,62 @@
+"""Catálogo publicado en memoria compartida y leído desde otro proceso (catalog_cache.py)"""
+
+import multiprocessing
+import os
+
+import pytest
+
+from cache_coherence import ChangeTracker, domain_version
+from catalog_cache import CatalogCache, SharedSnapshot
+
+
+def _read_categories(name, queue):
+    cache = CatalogCache(SharedSnapshot.attach(name))
+    catalog = cache.get(None)
+    queue.put((catalog.generation, [category['name'] for category in catalog.categories]))
+
+
+@pytest.fixture
+def shared():
+    """(nombre, bloque) de memoria compartida para la prueba"""
+    name = f'epicuro_test_{os.getpid()}'
+    snapshot = SharedSnapshot.create(name, 64 * 1024)
+    yield name, snapshot
+    snapshot.close()
+    snapshot.unlink()
+
+
+def _read_from_other_process(name):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_read_categories, args=(name, queue))
+    process.start()
+    result = queue.get(timeout=30)
+    process.join()
+    return result
+
+
+def test_publish_and_read_from_other_process(db, shared):
+    name, snapshot = shared
+    db.executescript('''
+        INSERT INTO categories (id, name) VALUES (1, 'SANDWICH'), (2, 'CAFE');
+        INSERT INTO products (id, name, price, category_id) VALUES (1, 'ITALIANO', 4500, 1);
+        INSERT INTO variation_groups (id, name, display_name, required, multiple_selection, min_selections,
+                                      max_selections) VALUES (1, 'proteina', 'Proteína', 1, 0, 1, 1);
+        INSERT INTO variation_options (id, variation_group_id, name, display_name) VALUES (1, 1, 'Pollo', 'Pollo');
+        INSERT INTO product_variations (id, product_id, variation_group_id, required) VALUES (1, 1, 1, 1);
+    ''')
+
+    tracker = ChangeTracker()
+    writer = CatalogCache(snapshot)
+    tracker.on_change('menu', lambda version, _: writer.require(version))
+    tracker.check(db)
+    version = domain_version(db, 'menu')
+    first = writer.get(db)
+    assert first.generation == version > 0 and first.variations(1)[0]['options'][0]['name'] == 'Pollo'
+    assert writer.get(db) is first
+    assert _read_from_other_process(name) == (version, ['CAFE', 'SANDWICH'])
+
+    # Cambio de menú: el tracker marca la versión nueva y el siguiente get la publica
+    db.execute("INSERT INTO categories (id, name) VALUES (3, 'BEBIDAS')")
+    assert tracker.check(db) == ['menu'] and writer.get(db).generation == version + 1
+    assert _read_from_other_process(name) == (version + 1, ['BEBIDAS', 'CAFE', 'SANDWICH'])
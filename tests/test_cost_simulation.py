@@ -0,0 +1,55 @@
+"""Simulación de cambios de precio contra el costo por receta (cost_simulation.py)"""
+
+import pytest
+
+from cost_simulation import CostMatrix, sales_volumes, simulate
+from recipe_costing import load_product_costs
+
+
+@pytest.fixture
+def matrix(db):
+    # Bases antiguas: costo fijo en products.cost para lo que no tiene receta
+    db.execute('ALTER TABLE products ADD COLUMN cost REAL')
+    db.executescript('''
+        INSERT INTO ingredients (id, name, unit_cost) VALUES (1, 'Pan', 200), (2, 'Queso', 8), (3, 'Jamón', 10),
+                                                             (4, 'Palta', 3000);
+        INSERT INTO recipes (id, name, servings) VALUES (1, 'Barros Luco', 1), (2, 'Aliado', 1), (3, 'Palta x2', 2);
+        INSERT INTO recipe_ingredients (recipe_id, ingredient_id, quantity) VALUES
+            (1, 1, 1), (1, 2, 60), (2, 1, 1), (2, 2, 40), (2, 3, 50), (3, 4, 1), (3, 99, 5);
+        INSERT INTO products (id, name, price, recipe_id, cost) VALUES
+            (1, 'Barros Luco', 5000, 1, NULL), (2, 'Aliado', 3500, 2, NULL),
+            (3, 'Media palta', 2000, 3, NULL), (4, 'Bebida', 1500, NULL, 600);
+        INSERT INTO product_sales_daily VALUES ('2025-03-01', 1, 10, 50000, 0), ('2025-03-01', 2, 100, 350000, 0);
+    ''')
+    return CostMatrix(db)
+
+
+def test_matrix_matches_recipe_costs(db, matrix):
+    costs = matrix.product_costs(matrix.recipe_costs(matrix.prices))
+    assert {int(p): round(float(c), 4) for p, c in zip(matrix.product_ids, costs)} == load_product_costs(db)
+
+
+def test_simulate(db, matrix):
+    # Queso +50%: el Aliado pierde menos por unidad pero vende más
+    result = simulate(matrix, [{'ingredient_id': 2, 'change_pct': 50}],
+                      sales_volumes(db, '2025-03-01', '2025-03-02'))
+    assert [row['product_id'] for row in result['products']] == [2, 1]
+    assert (result['products'][0]['cost_change'], result['products'][0]['impact']) == (160, -16000)
+    assert result['products'][1]['cost_before'] == 680 and result['products'][1]['cost_after'] == 920
+    assert [row['recipe_id'] for row in result['recipes']] == [1, 2] and result['total_impact'] == -18400
+
+    by_unit = simulate(matrix, [{'ingredient_id': 2, 'unit_cost': 12}], sort='unit')
+    assert [row['product_id'] for row in by_unit['products']] == [1, 2]
+    assert len(simulate(matrix, [], include_all=True)['products']) == 4
+    assert matrix.prices[1] == 8  # la simulación no cambia los precios guardados
+
+
+@pytest.mark.parametrize('changes', [
+    [{'ingredient_id': 42, 'unit_cost': 1}],
+    [{'ingredient_id': 1}],
+    [{'unit_cost': 5}],
+    [{'ingredient_id': 1, 'unit_cost': -1}],
+])
+def test_invalid_changes(matrix, changes):
+    with pytest.raises(ValueError):
+        simulate(matrix, changes)
@@ -0,0 +1,106 @@
+"""Write-through, avisos de otros procesos y reconciliación (dashboard_stats.py)"""
+
+import sqlite3
+
+import pytest
+
+import metrics
+from cache_coherence import ChangeTracker, domain_version
+from dashboard_stats import ORDER_COLUMNS, DashboardStats
+
+
+def _connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _insert_order(db, number, total):
+    """Inserta una orden como la app: (fila, versión al confirmar, versión al tomar el lock)"""
+    db.execute('BEGIN IMMEDIATE')
+    base_version = domain_version(db, 'orders')
+    cursor = db.execute("INSERT INTO orders (order_number, subtotal, total_amount, created_at) "
+                        "VALUES (?, ?, ?, '2026-01-02 10:00:00')", (number, total, total))
+    after = db.execute(f'SELECT {ORDER_COLUMNS} FROM orders WHERE id = ?', (cursor.lastrowid,)).fetchone()
+    version = domain_version(db, 'orders')
+    db.commit()
+    return after, version, base_version
+
+
+@pytest.fixture
+def conn(db_path):
+    conn = _connect(db_path)
+    conn.executescript('''
+        INSERT INTO categories (name) VALUES ('SANDWICH');
+        INSERT INTO products (name, price) VALUES ('ITALIANO', 4500), ('CHURRASCO', 6000);
+        INSERT INTO orders (order_number, subtotal, total_amount, created_at) VALUES
+            ('A', 1000, 1000, '2026-01-01 12:00:00'), ('B', 2500, 2500, '2026-01-02 09:30:00');
+        INSERT INTO ingredients (name, current_stock, min_stock, unit, unit_cost) VALUES
+            ('Pan', 5, 10, 'un', 100), ('Palta', 20, 5, 'kg', 3000);
+        INSERT INTO purchases (purchase_number, total_amount) VALUES ('PUR-1', 5000);
+    ''')
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def stats(conn):
+    """(tracker, stats) al día con la base"""
+    tracker = ChangeTracker()
+    stats = DashboardStats(today=lambda: '2026-01-02')
+    stats.watch(tracker)
+    tracker.check(conn)
+    return tracker, stats
+
+
+def test_index_stats(conn, stats):
+    _, stats = stats
+    index, recent = stats.index_stats(conn)
+    assert (index['orders_today'], index['revenue_today'], index['total_orders']) == (1, 2500, 2)
+    assert [order['order_number'] for order in recent] == ['B', 'A'] and index['total_products'] == 2
+
+
+def test_write_through(conn, db_path, stats):
+    tracker, stats = stats
+
+    # Orden nueva propia: la versión propia no provoca recarga
+    stats.order_saved(None, *_insert_order(conn, 'C', 4000))
+    tracker.check(conn)
+    assert 'orders' not in stats._stale
+    index, recent = stats.index_stats(conn)
+    assert (index['orders_today'], index['revenue_today'], recent[0]['order_number']) == (2, 6500, 'C')
+
+    # Otro worker confirma una orden antes que la propia: no se la traga el write-through
+    worker = _connect(db_path)
+    _insert_order(worker, 'W', 500)
+    worker.close()
+    stats.order_saved(None, *_insert_order(conn, 'D', 1000))
+    tracker.check(conn)
+    assert 'orders' in stats._stale
+    index, _ = stats.index_stats(conn)
+    assert (index['orders_today'], index['revenue_today'], index['total_orders']) == (4, 8000, 5)
+
+
+def test_other_process_and_drift(conn, db_path, stats):
+    tracker, stats = stats
+
+    # Escritura de otro proceso: se marca y se recarga
+    other = sqlite3.connect(db_path)
+    other.execute("UPDATE orders SET total_amount = 3000 WHERE order_number = 'B'")
+    other.execute("UPDATE ingredients SET current_stock = 50 WHERE name = 'Pan'")
+    other.commit()
+    assert sorted(tracker.check(conn)) == ['inventory', 'orders']
+    inventory, alerts, pending, _ = stats.inventory_stats(conn)
+    assert inventory['low_stock_count'] == 0 and not alerts and len(pending) == 1
+    assert stats.index_stats(conn)[0]['revenue_today'] == 3000
+
+    # Deriva (escritura sin triggers): la reconciliación la corrige y la cuenta
+    other.execute('DROP TRIGGER trg_orders_update_changes')
+    other.execute("UPDATE orders SET total_amount = 0 WHERE order_number = 'B'")
+    other.commit()
+    other.close()
+    before = metrics.DASHBOARD_STATS_DRIFT.value(section='orders')
+    stats.reload('orders', conn, count_drift=True)
+    assert stats.index_stats(conn)[0]['revenue_today'] == 0
+    assert metrics.DASHBOARD_STATS_DRIFT.value(section='orders') == before + 1
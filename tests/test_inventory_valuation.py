@@ -0,0 +1,70 @@
+"""Valorización por promedio y FIFO, faltantes y lectura incremental (inventory_valuation.py)"""
+
+import pytest
+
+from cache_coherence import ChangeTracker
+from inventory_valuation import METHODS, InventoryValuation
+
+
+def _move(db, rows):
+    db.executemany('INSERT INTO inventory_movements (ingredient_id, movement_type, quantity, unit_cost, created_at) '
+                   'VALUES (?, ?, ?, ?, ?)', rows)
+    db.commit()
+
+
+@pytest.fixture
+def valuation(db):
+    """(tracker, motor) al día con 20 compradas, 15 vendidas y 1 de merma"""
+    db.executescript("INSERT INTO ingredients (id, name) VALUES (1, 'Pan'), (2, 'Palta');")
+    _move(db, [
+        (1, 'purchase', 10, 100, '2025-03-01 07:00:00'),
+        (1, 'purchase', 10, 200, '2025-03-02 07:00:00'),
+        (1, 'consumption', -15, 0, '2025-03-03 21:00:00'),
+        (1, 'adjustment', -1, 0, '2025-03-03 22:00:00'),
+    ])
+    tracker, engine = ChangeTracker(), InventoryValuation()
+    engine.watch(tracker)
+    tracker.check(db)
+    return tracker, engine
+
+
+def test_average_and_fifo(db, valuation):
+    _, engine = valuation
+    # Promedio 150: 15 vendidas = 2250, 1 merma = 150, quedan 4 = 600
+    # FIFO: 10×100 + 5×200 = 2000, merma 200, quedan 4×200 = 800
+    assert engine.period(db, method='average') == {
+        'method': 'average', 'method_label': 'Promedio ponderado', 'opening_value': 0.0,
+        'purchases': 3000.0, 'cogs': 2250.0, 'adjustments': 150.0, 'closing_value': 600.0}
+    fifo = engine.period(db, method='fifo')
+    assert (fifo['cogs'], fifo['adjustments'], fifo['closing_value']) == (2000.0, 200.0, 800.0)
+    march_2 = engine.period(db, '2025-03-02', '2025-03-03', 'fifo')
+    assert (march_2['opening_value'], march_2['purchases'], march_2['closing_value']) == (1000.0, 2000.0, 3000.0)
+
+
+def test_incremental_with_deficit(db, valuation):
+    tracker, engine = valuation
+    engine.period(db, method='fifo')
+    # Se vende más de lo que hay y la compra siguiente cubre el faltante
+    _move(db, [
+        (1, 'consumption', -6, 0, '2025-03-04 21:00:00'),
+        (1, 'purchase', 10, 300, '2025-03-05 07:00:00'),
+        (2, 'adjustment', 5, 50, '2025-03-05 08:00:00'),
+    ])
+    assert engine.period(db, method='fifo')['closing_value'] == 800.0  # aún sin ver el cambio
+    tracker.check(db)
+    for method in METHODS:
+        row = engine.period(db, method=method)
+        assert round(row['opening_value'] + row['purchases'] - row['cogs'] - row['adjustments'], 2) == row['closing_value']
+        # Quedan 8 del ingrediente 1 a 300 y 5 del ingrediente 2 a 50
+        assert row['closing_value'] == 8 * 300 + 5 * 50, method
+    assert engine.last_id == 7 and engine.stock[1].deficit == 0
+
+
+def test_backdated_movement_reloads(db, valuation):
+    tracker, engine = valuation
+    engine.period(db, method='fifo')
+    # Un movimiento con fecha anterior al último día aplicado recarga todo
+    _move(db, [(2, 'purchase', 5, 70, '2025-03-01 06:00:00')])
+    tracker.check(db)
+    assert engine.period(db, method='fifo') == InventoryValuation().period(db, method='fifo')
+    assert engine.period(db, '2025-03-01', '2025-03-02', 'average')['purchases'] == 1350.0
@@ -0,0 +1,55 @@
+"""Clasificación popularidad/margen y caché por período (menu_engineering.py)"""
+
+import datetime
+
+import numpy as np
+
+from menu_engineering import (CLASSES, POPULARITY_FACTOR, cached_period, classify, forget, nightly_period, refresh,
+                              report)
+
+
+def test_classify_matches_row_by_row():
+    rng = np.random.default_rng(7)
+    size = 500
+    groups = rng.integers(0, 12, size)
+    quantity = rng.integers(0, 200, size).astype(float)
+    unit_margin = rng.uniform(-500, 4000, size).round(0)
+    margin = quantity * unit_margin
+    codes, _, _ = classify(quantity, margin, unit_margin, groups)
+
+    for i in range(size):
+        same = groups == groups[i]
+        total = quantity[same].sum()
+        popular = total > 0 and quantity[i] / total >= POPULARITY_FACTOR / same.sum()
+        profitable = unit_margin[i] >= (margin[same].sum() / total if total else 0)
+        expected = CLASSES.index({(True, True): 'star', (True, False): 'plowhorse',
+                                  (False, True): 'puzzle', (False, False): 'dog'}[(bool(popular), bool(profitable))])
+        assert codes[i] == expected, i
+
+
+def test_period_cache(db):
+    db.executescript('''
+        INSERT INTO categories (id, name) VALUES (1, 'Sándwiches');
+        INSERT INTO products (id, name, category_id, price, available) VALUES
+            (1, 'Barros Luco', 1, 5000, 1), (2, 'Churrasco', 1, 4000, 1), (3, 'Lomito', 1, 9000, 1),
+            (4, 'Ave mayo', 1, 3000, 1), (5, 'Nuevo', NULL, 2500, 1), (6, 'Retirado', 1, 3500, 0);
+        INSERT INTO product_sales_daily (day, product_id, quantity, revenue, cost) VALUES
+            ('2026-03-01', 1, 50, 250000, 100000),
+            ('2026-03-02', 2, 60, 240000, 180000),
+            ('2026-03-01', 3, 5, 45000, 15000),
+            ('2026-03-02', 4, 5, 15000, 12000),
+            ('2026-02-01', 4, 500, 1500000, 1200000);
+    ''')
+    now = datetime.datetime(2026, 3, 10, 3, 0)
+    period_id = refresh(db, '2026-03-01', '2026-03-08', now, unit_costs={5: 1000}, nightly=True)
+    result = report(db, period_id)
+    # El producto sin categoría forma su propio grupo; el no disponible sin ventas queda fuera
+    assert {row['product_id']: row['class'] for row in result['rows']} == {
+        1: 'star', 2: 'plowhorse', 3: 'puzzle', 4: 'dog', 5: 'puzzle'}
+    assert result['summary'] == {'star': 1, 'plowhorse': 1, 'puzzle': 2, 'dog': 1}
+
+    assert cached_period(db, '2026-03-01', '2026-03-08', now) == period_id
+    open_id = refresh(db, '2026-03-08', '2026-03-11', now)
+    assert cached_period(db, '2026-03-08', '2026-03-11', now + datetime.timedelta(minutes=5)) == open_id
+    assert cached_period(db, '2026-03-08', '2026-03-11', now + datetime.timedelta(hours=1)) is None
+    assert forget(db) == 1 and nightly_period(db) == (datetime.date(2026, 3, 1), datetime.date(2026, 3, 8))
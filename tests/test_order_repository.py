@@ -0,0 +1,28 @@
+"""Carga de órdenes en un número fijo de consultas (order_repository.py)"""
+
+from order_repository import OrderRepository, QueryCounter
+
+
+def test_get_many_uses_three_queries(db, orders=100, items_per_order=3):
+    """100 órdenes con sus items y la categoría de cada producto = 3 consultas"""
+    db.execute("INSERT INTO categories (id, name) VALUES (1, 'SANDWICH')")
+    db.executemany('INSERT INTO products (id, name, price, category_id) VALUES (?, ?, 1000, 1)',
+                   [(i, f'PRODUCTO {i}') for i in range(1, 11)])
+    db.executemany('''
+        INSERT INTO orders (id, order_number, subtotal, total_amount, status, created_at)
+        VALUES (?, ?, 1000, 1000, 'pending', '2025-01-01 12:00:00')
+    ''', [(i, f'ORD-{i}') for i in range(1, orders + 1)])
+    db.executemany('''
+        INSERT INTO order_items (order_id, product_id, product_name, quantity, unit_price, total_price, unit_cost)
+        VALUES (?, ?, 'PRODUCTO', 1, 1000, 1000, 400)
+    ''', [(o, (o + k) % 10 + 1) for o in range(1, orders + 1) for k in range(items_per_order)])
+    db.commit()
+
+    repo = OrderRepository(db)
+    with QueryCounter(db) as counter:
+        loaded = repo.get_many(range(1, orders + 1))
+
+    assert len(loaded) == orders
+    assert all(len(order.items) == items_per_order for order in loaded)
+    assert all(line.category_name == 'SANDWICH' for order in loaded for line in order.items)
+    assert counter.count == 3, counter.statements
@@ -0,0 +1,77 @@
+"""Costo por receta, caché por versión e historia de costos (recipe_costing.py)"""
+
+import pytest
+
+from cache_coherence import ChangeTracker
+from recipe_costing import (CostHistory, CostingEngine, add_cost_columns, backfill_cost_history,
+                            create_cost_history, line_key, record_cost, recompute_line_costs)
+
+
+@pytest.fixture
+def costing(db):
+    """Motor al día con dos recetas, un producto con costo fijo y uno sin costo"""
+    # Bases antiguas: costo fijo en products.cost para lo que no tiene receta
+    db.execute('ALTER TABLE products ADD COLUMN cost REAL')
+    db.executescript('''
+        INSERT INTO ingredients (id, name, unit_cost) VALUES (1, 'Pan', 200), (2, 'Palta', 3000);
+        INSERT INTO recipes (id, name, servings) VALUES (1, 'Italiano', 1), (2, 'Palta x2', 2);
+        INSERT INTO recipe_ingredients (recipe_id, ingredient_id, quantity) VALUES (1, 1, 1), (1, 2, 0.1), (2, 2, 1);
+        INSERT INTO products (id, name, price, cost, recipe_id) VALUES
+            (1, 'Italiano', 4500, NULL, 1), (2, 'Media palta', 2000, NULL, 2), (3, 'Bebida', 1500, 600, NULL),
+            (4, 'Sin costo', 1000, NULL, NULL);
+    ''')
+    db.commit()
+    tracker, engine = ChangeTracker(), CostingEngine()
+    engine.watch(tracker)
+    tracker.check(db)
+    return tracker, engine
+
+
+def test_schema_already_added(db):
+    assert not add_cost_columns(db.cursor())
+    assert not create_cost_history(db.cursor())
+
+
+def test_cost_cart_and_version_cache(db, costing):
+    tracker, engine = costing
+    assert engine.cost_cart(db, [{'id': 1}, {'id': '2'}, {'id': 3}, {'id': 4}, {}]) == [500, 1500, 600, None, None]
+
+    # Cambio de precio: la caché sigue igual hasta que el tracker ve el cambio
+    db.execute('UPDATE ingredients SET unit_cost = 4000 WHERE id = 2')
+    db.commit()
+    assert engine.product_costs(db)[1] == 500
+    tracker.check(db)
+    assert engine.product_costs(db)[1] == 600 and engine.product_costs(db)[2] == 2000
+
+    # Orden editada: las líneas iguales (producto y opciones) conservan el costo de la venta
+    recorded = {line_key(1, []): [500], line_key(2, ['7']): [1500]}
+    cart = [{'id': '2', 'variations': [{'option_id': 7}]}, {'id': 2}, {'id': 1, 'quantity': 3}, {'id': 1}]
+    assert engine.cost_edited_cart(db, cart, recorded) == [1500, 2000, 500, 600]
+
+
+def test_cost_history_and_recompute(db, costing):
+    db.execute('UPDATE ingredients SET unit_cost = 4000 WHERE id = 2')
+    # La palta subió el 2025-03-05
+    db.executescript('''
+        INSERT INTO inventory_movements (ingredient_id, movement_type, quantity, unit_cost, created_at) VALUES
+            (2, 'purchase', 10, 2000, '2025-03-01 07:00:00'),
+            (2, 'purchase', 10, 4000, '2025-03-05 07:00:00'),
+            (2, 'consumption', -5, 9999, '2025-03-06 07:00:00');
+        INSERT INTO orders (id, order_number, subtotal, total_amount, created_at) VALUES
+            (1, 'A', 0, 0, '2025-02-20 12:00:00'), (2, 'B', 0, 0, '2025-03-04 12:00:00'),
+            (3, 'C', 0, 0, '2025-03-05 12:00:00');
+        INSERT INTO order_items (order_id, product_id, product_name, quantity, unit_price, total_price) VALUES
+            (1, 1, 'Italiano', 1, 0, 0), (2, 1, 'Italiano', 2, 0, 0), (3, 1, 'Italiano', 1, 0, 0),
+            (3, 3, 'Bebida', 1, 0, 0), (3, 9, 'Borrado', 1, 0, 0);
+    ''')
+    assert backfill_cost_history(db) == 2
+    record_cost(db, 1, 250, '2025-03-05 09:00:00', 'manual')
+    history = CostHistory.load(db)
+    assert history.cost_at(2, '2025-02-01') == 2000 and history.cost_at(2, '2025-03-05 07:00:00') == 4000
+    assert history.cost_at(1, '2025-03-05') == 250 and history.cost_at(3, '2025-03-05') == 0
+
+    assert recompute_line_costs(db, '2025-03-01', '2025-04-01') == 4
+    assert db.execute('SELECT unit_cost FROM order_items ORDER BY id').fetchall() == [
+        (None,), (450,), (650,), (600,), (None,)]
+    assert recompute_line_costs(db) == 5
+    assert db.execute('SELECT unit_cost FROM order_items WHERE id = 1').fetchone() == (450,)
@@ -0,0 +1,94 @@
+"""Resumen por hora y por producto al día con las escrituras (sales_rollup.py)"""
+
+import pytest
+
+from sales_rollup import (_CATEGORIES_QUERY, _PRODUCTS_QUERY, _TOTALS_QUERY, backfill, buckets, by_category, compare,
+                          create_sales_rollup, heatmap, hourly_sales, margin_report, order_hour, refresh_hours)
+
+
+def _direct(conn, start, end):
+    """Las mismas sumas de las tablas, calculadas directo desde orders"""
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS expected AS SELECT * FROM sales_hourly WHERE 0')
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS expected_products AS SELECT * FROM product_sales_daily WHERE 0')
+    conn.execute('DELETE FROM temp.expected')
+    conn.execute('DELETE FROM temp.expected_products')
+    for query in (_TOTALS_QUERY, _CATEGORIES_QUERY):
+        conn.execute(query.replace('INTO sales_hourly', 'INTO temp.expected'), (start, end))
+    conn.execute(_PRODUCTS_QUERY.replace('INTO product_sales_daily', 'INTO temp.expected_products'), (start, end))
+    return (sorted(conn.execute('SELECT * FROM temp.expected').fetchall()),
+            sorted(conn.execute('SELECT * FROM temp.expected_products').fetchall()))
+
+
+def _tables(conn):
+    return (sorted(conn.execute('SELECT * FROM sales_hourly').fetchall()),
+            sorted(conn.execute('SELECT * FROM product_sales_daily').fetchall()))
+
+
+def _write(conn, order_id, created_at, lines):
+    """Guarda la orden con sus líneas (producto, cantidad, precio; costo = 40%) y recalcula su hora"""
+    total = sum(quantity * price for _, quantity, price in lines)
+    conn.execute('DELETE FROM order_items WHERE order_id = ?', (order_id,))
+    conn.execute('INSERT OR REPLACE INTO orders (id, order_number, subtotal, total_amount, created_at) '
+                 'VALUES (?, ?, ?, ?, ?)', (order_id, f'ORD-{order_id}', total, total, created_at))
+    conn.executemany('''
+        INSERT INTO order_items (order_id, product_id, product_name, quantity, unit_price, total_price, unit_cost)
+        VALUES (?, ?, '', ?, ?, ?, ?)
+    ''', [(order_id, product, quantity, price, quantity * price, price * 0.4) for product, quantity, price in lines])
+    refresh_hours(conn, [order_hour(conn, order_id)])
+
+
+@pytest.fixture
+def sales(db):
+    """Órdenes de dos lunes y un martes, con una edición y una orden eliminada"""
+    db.executescript('''
+        INSERT INTO categories (id, name) VALUES (1, 'Sándwiches'), (2, 'Bebidas');
+        INSERT INTO products (id, name, price, category_id) VALUES
+            (1, 'Chacarero', 5000, 1), (2, 'Bebida', 1500, 2), (3, 'Sin categoría', 1000, NULL);
+    ''')
+    _write(db, 1, '2025-03-03 12:15:00', [(1, 2, 5000), (2, 1, 1500)])   # lunes
+    _write(db, 2, '2025-03-03 12:40:00', [(2, 3, 1500)])
+    _write(db, 3, '2025-03-04 23:59:59', [(3, 1, 1000), (1, 1, 5000)])   # martes, última hora
+    _write(db, 4, '2025-03-10 12:05:00', [(1, 1, 5000)])                 # lunes siguiente
+    _write(db, 2, '2025-03-03 12:40:00', [(1, 1, 5000)])                 # edición
+    hour = order_hour(db, 1)
+    db.execute('DELETE FROM order_items WHERE order_id = 1')
+    db.execute('DELETE FROM orders WHERE id = 1')
+    refresh_hours(db, [hour])
+    return db
+
+
+def test_tables_already_created(db):
+    assert not create_sales_rollup(db.cursor())
+
+
+def test_incremental_matches_backfill(sales):
+    incremental = _tables(sales)
+    # Límite con forma de fecha: orders.created_at es TIMESTAMP y '9999' se compararía como número
+    assert incremental == _direct(sales, '', '9999-12-31')
+    backfill(sales)
+    assert _tables(sales) == incremental
+
+
+def test_buckets_and_comparisons(sales):
+    assert buckets(sales, 'hour', '2025-03-01', '2025-03-15') == {12: 2, 23: 1}
+    assert buckets(sales, 'weekday', '2025-03-01', '2025-03-15', 'revenue') == {0: 10000, 1: 6000}
+    assert by_category(sales, '2025-03-01', '2025-03-15', 'quantity') == {1: {12: 2, 23: 1}, -1: {23: 1}}
+
+    grid = heatmap(sales, '2025-03-03', '2025-03-17')
+    assert grid['totals'][0][12] == 2 and grid['averages'][0][12] == 1 and grid['days'] == [2] * 7
+    rows = compare(sales, 'hour', '2025-03-10', '2025-03-17', '2025-03-03', '2025-03-10')
+    assert rows[0] == {'key': 12, 'value': 1, 'previous': 1, 'change': 0, 'change_pct': 0.0}
+    assert rows[1]['key'] == 23 and rows[1]['change_pct'] == -100.0
+    assert hourly_sales(sales, '2025-03-03', '2025-03-05') == [
+        {'hour': '12', 'order_count': 1}, {'hour': '23', 'order_count': 1}]
+
+
+def test_margins(sales):
+    # Costo = 40% del precio
+    assert margin_report(sales, 'product', '2025-03-01', '2025-03-15') == [
+        {'key': 1, 'quantity': 3, 'revenue': 15000, 'cost': 6000, 'margin': 9000, 'margin_pct': 60.0},
+        {'key': 3, 'quantity': 1, 'revenue': 1000, 'cost': 400, 'margin': 600, 'margin_pct': 60.0}]
+    assert [row['key'] for row in margin_report(sales, 'category', '2025-03-01', '2025-03-15')] == [1, -1]
+    assert [(row['key'], row['margin']) for row in margin_report(sales, 'day', '2025-03-01', '2025-03-15')] == [
+        ('2025-03-03', 3000), ('2025-03-04', 3600), ('2025-03-10', 3000)]
+    assert buckets(sales, 'day', '2025-03-04', '2025-03-05', 'cost') == {'2025-03-04': 2400}
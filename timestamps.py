@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Fechas y horas de las órdenes en un formato único
+
+Las órdenes guardan la hora de creación como epoch (segundos UTC) más el
+desfase UTC vigente en Chile en ese momento (`created_epoch`, `utc_offset`),
+y `created_at` / `updated_at` siempre como texto local de Chile
+'YYYY-MM-DD HH:MM:SS', que es lo que comparan las consultas por rango.
+
+Filas antiguas pueden traer 'T', fracciones de segundo o formato dd/mm/yyyy;
+migrate_timestamps() las deja en el formato canónico. El parseo y el
+formateo se guardan en caché por valor, así una lista de miles de órdenes
+no vuelve a parsear ni a convertir zona horaria para cada fila.
+
+    python timestamps.py --bench    # GET /orders con 5.000 órdenes: filtro anterior vs. cacheado
+"""
+
+import datetime
+import sys
+import time
+from functools import lru_cache
+
+from pytz import timezone
+
+CHILE_TZ = timezone('America/Santiago')
+CANONICAL_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Formatos que aparecen en datos importados o antiguos
+LEGACY_FORMATS = ('%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y')
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# Valores distintos que se guardan en caché (una orden por segundo = ~18 horas)
+CACHE_SIZE = 65536
+
+
+def _parse_naive(text):
+    """Texto -> datetime (con o sin zona) o None"""
+    # Camino rápido: 'YYYY-MM-DD HH:MM:SS' exacto
+    if len(text) == 19 and text[4] == '-' and text[10] == ' ':
+        try:
+            return datetime.datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                                     int(text[11:13]), int(text[14:16]), int(text[17:19]))
+        except ValueError:
+            pass
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    for fmt in LEGACY_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _local_offset(year, month, day, hour):
+    """Desfase UTC de Chile para una hora local (los cambios de horario son en horas exactas)"""
+    local = CHILE_TZ.localize(datetime.datetime(year, month, day, hour))
+    return int(local.utcoffset().total_seconds())
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _utc_offset(epoch_hour):
+    """Desfase UTC de Chile para una hora UTC (epoch // 3600)"""
+    moment = datetime.datetime.fromtimestamp(epoch_hour * 3600, CHILE_TZ)
+    return int(moment.utcoffset().total_seconds())
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_timestamp(value):
+    """(epoch, utc_offset) de un texto de fecha, o None si no se reconoce
+
+    Los textos sin zona se interpretan como hora local de Chile, que es como
+    los escribe get_chile_timestamp().
+    """
+    if not value:
+        return None
+    dt = _parse_naive(str(value).strip())
+    if dt is None:
+        return None
+    if dt.tzinfo is not None:
+        epoch = int(dt.timestamp())
+        return epoch, _utc_offset(epoch // 3600)
+    offset = _local_offset(dt.year, dt.month, dt.day, dt.hour)
+    return int((dt.replace(microsecond=0) - _EPOCH).total_seconds()) - offset, offset
+
+
+def local_datetime(epoch, utc_offset):
+    """datetime local (sin zona) a partir de epoch + desfase, sin pytz"""
+    return _EPOCH + datetime.timedelta(seconds=epoch + utc_offset)
+
+
+def to_datetime(value):
+    """datetime con zona de Chile desde texto, epoch o datetime (None si no se puede)"""
+    if isinstance(value, datetime.datetime):
+        return value.astimezone(CHILE_TZ) if value.tzinfo else CHILE_TZ.localize(value)
+    parsed = _parts(value)
+    if parsed is None:
+        return None
+    return datetime.datetime.fromtimestamp(parsed[0], CHILE_TZ)
+
+
+def _parts(value):
+    """(epoch, utc_offset) desde un epoch numérico o un texto"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        epoch = int(value)
+        return epoch, _utc_offset(epoch // 3600)
+    return parse_timestamp(value)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _format_cached(value, fmt):
+    parsed = _parts(value)
+    if parsed is None:
+        return None
+    return local_datetime(*parsed).strftime(fmt)
+
+
+def format_timestamp(value, fmt='%d/%m/%Y'):
+    """Formatear en hora de Chile un texto, epoch o datetime
+
+    Si el texto no se reconoce se devuelve su parte de fecha (como antes).
+    """
+    if not value:
+        return 'N/A'
+    if isinstance(value, datetime.datetime):
+        return to_datetime(value).strftime(fmt)
+    formatted = _format_cached(value, fmt)
+    if formatted is None:
+        value = str(value)
+        return value[:10] if len(value) >= 10 else value
+    return formatted
+
+
+def format_epoch(epoch, utc_offset, fmt='%d/%m/%Y'):
+    """Formatear columnas created_epoch/utc_offset (sin parseo ni pytz)"""
+    if epoch is None:
+        return 'N/A'
+    return local_datetime(epoch, utc_offset or 0).strftime(fmt)
+
+
+def from_epoch(epoch):
+    """(texto canónico, utc_offset) de un epoch en hora de Chile"""
+    offset = _utc_offset(epoch // 3600)
+    return local_datetime(epoch, offset).strftime(CANONICAL_FORMAT), offset
+
+
+def canonical(value):
+    """Texto local de Chile 'YYYY-MM-DD HH:MM:SS' (o None)"""
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        return None
+    return local_datetime(*parsed).strftime(CANONICAL_FORMAT)
+
+
+def now_parts():
+    """(texto canónico, epoch, utc_offset) de este instante en Chile"""
+    now = datetime.datetime.now(CHILE_TZ)
+    return (now.strftime(CANONICAL_FORMAT), int(now.timestamp()),
+            int(now.utcoffset().total_seconds()))
+
+
+# ===== MIGRACIÓN =====
+
+def add_timestamp_columns(cursor):
+    """Agregar created_epoch y utc_offset a orders si no existen"""
+    existing = {row[1] for row in cursor.execute('PRAGMA table_info(orders)').fetchall()}
+    for name in ('created_epoch', 'utc_offset'):
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE orders ADD COLUMN {name} INTEGER')
+
+
+def migrate_timestamps(conn, batch_size=1000):
+    """Llevar al formato canónico las órdenes sin created_epoch; devuelve cuántas"""
+    rows = conn.execute('''
+        SELECT id, created_at, updated_at FROM orders WHERE created_epoch IS NULL
+    ''').fetchall()
+
+    updates = []
+    for order_id, created_at, updated_at in rows:
+        parsed = parse_timestamp(created_at)
+        if parsed is None:
+            continue  # Fecha ilegible: se deja como está
+        created_text = local_datetime(*parsed).strftime(CANONICAL_FORMAT)
+        updated_text = canonical(updated_at) or created_text
+        updates.append((created_text, updated_text, parsed[0], parsed[1], order_id))
+
+    for start in range(0, len(updates), batch_size):
+        conn.executemany('''
+            UPDATE orders SET created_at = ?, updated_at = ?, created_epoch = ?, utc_offset = ?
+            WHERE id = ?
+        ''', updates[start:start + batch_size])
+    return len(updates)
+
+
+# ===== BENCHMARK =====
+
+def _reference_dateformat(value, format='%d/%m/%Y'):
+    """Filtro dateformat anterior (parseo y pytz en cada llamada), solo para comparar"""
+    if 'T' in value:
+        dt = datetime.datetime.fromisoformat(value.replace('T', ' '))
+    else:
+        dt = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    dt = dt.replace(tzinfo=datetime.timezone.utc).astimezone(CHILE_TZ)
+    return dt.strftime(format)
+
+
+def benchmark(orders=5000, renders=5):
+    """Tiempo de GET /orders sobre una base generada con `orders` órdenes
+
+    Se mide la ruta completa con app.test_client() (consulta, plantilla y
+    fecha y hora de cada fila), primero con el filtro dateformat anterior
+    y después con el cacheado, sobre la misma base temporal.
+    """
+    import os
+    import tempfile
+
+    import app as epicuro
+    import timestamps  # el módulo que usa la app (este archivo puede correr como __main__)
+    from generate_data import DataGenerator, create_database
+
+    filters = epicuro.app.jinja_env.filters
+    cached_filter = filters['dateformat']
+    production = epicuro.DATABASE
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        conn = create_database(path)
+        DataGenerator(conn, orders=orders, days=30).run()
+        conn.close()
+
+        epicuro.DATABASE = path
+        client = epicuro.app.test_client()
+
+        def render():
+            start = time.perf_counter()
+            response = client.get('/orders')
+            elapsed = time.perf_counter() - start
+            if response.status_code != 200:
+                raise RuntimeError(f'GET /orders respondió {response.status_code}')
+            return elapsed, response.data.count(b'<tr') - 1
+
+        try:
+            # Primera petición aparte: carga el repositorio de órdenes y compila la plantilla
+            render()
+            filters['dateformat'] = _reference_dateformat
+            reference = [render()[0] for _ in range(renders)]
+
+            filters['dateformat'] = cached_filter
+            for cache in (timestamps._format_cached, timestamps.parse_timestamp,
+                          timestamps._local_offset, timestamps._utc_offset):
+                cache.cache_clear()
+            cached = [render() for _ in range(renders)]
+        finally:
+            filters['dateformat'] = cached_filter
+            epicuro.DATABASE = production
+
+    rows = cached[0][1]
+    cached = [elapsed for elapsed, _ in cached]
+    print(f'GET /orders: {rows} filas (fecha y hora de cada una), {renders} peticiones')
+    print(f'  filtro anterior      : {min(reference) * 1000:7.1f} ms por petición')
+    print(f'  primera petición     : {cached[0] * 1000:7.1f} ms (caché vacía)')
+    print(f'  peticiones siguientes: {min(cached[1:]) * 1000:7.1f} ms')
+    return min(reference), cached[0], min(cached[1:])
+
+
+if __name__ == "__main__":
+    if '--bench' in sys.argv:
+        benchmark()
@@ -0,0 +1,129 @@
+"""
+Copia de las variaciones elegidas en cada línea de orden
+
+Al guardar una orden, cada item registra en order_items una copia compacta
+de sus variaciones (grupo, opción y recargo) en `variations_json`, más el
+texto ya armado para mostrar en `variations_display`. Las vistas, tickets y
+exportaciones leen solo order_items, y lo impreso sigue siendo correcto
+aunque después se borren o recreen las opciones de un grupo.
+"""
+
+import json
+
+# Columnas agregadas a order_items
+SNAPSHOT_COLUMNS = (
+    ('variations_json', 'TEXT'),
+    ('variations_display', 'TEXT'),
+)
+
+
+def add_snapshot_columns(cursor):
+    """Agregar las columnas de la copia; devuelve True si se crearon ahora"""
+    existing = {row[1] for row in cursor.execute('PRAGMA table_info(order_items)').fetchall()}
+    added = False
+    for name, column_type in SNAPSHOT_COLUMNS:
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE order_items ADD COLUMN {name} {column_type}')
+            added = True
+    return added
+
+
+def load_options(conn, option_ids):
+    """Opciones con su grupo en una sola consulta: {option_id: (grupo, opción)}"""
+    option_ids = sorted({int(i) for i in option_ids if i})
+    if not option_ids:
+        return {}
+
+    placeholders = ','.join('?' * len(option_ids))
+    rows = conn.execute(f'''
+        SELECT vo.id, vo.display_name, vg.display_name
+        FROM variation_options vo
+        LEFT JOIN variation_groups vg ON vo.variation_group_id = vg.id
+        WHERE vo.id IN ({placeholders})
+    ''', option_ids).fetchall()
+    return {row[0]: (row[2] or '', row[1]) for row in rows}
+
+
+def build_snapshot(variations, options):
+    """(variations_json, variations_display) para las variaciones de un item del carrito
+
+    `variations` es la lista enviada por el formulario (option_id,
+    price_modifier, name); `options` viene de load_options. Si una opción ya
+    no existe se conservan los nombres que trae el carrito.
+    """
+    entries = []
+    for variation in variations or []:
+        option_id = variation.get('option_id')
+        if not option_id:
+            continue
+        group, name = options.get(int(option_id), (variation.get('group', ''), variation.get('name', '')))
+        entries.append({
+            'option_id': int(option_id),
+            'group': group,
+            'name': name,
+            'price_modifier': variation.get('price_modifier', 0) or 0,
+        })
+
+    return encode_snapshot(entries)
+
+
+def encode_snapshot(entries):
+    """(variations_json, variations_display) de una lista de variaciones"""
+    if not entries:
+        return None, ''
+    return (json.dumps(entries, ensure_ascii=False, separators=(',', ':')),
+            ', '.join(entry['name'] for entry in entries))
+
+
+def snapshot_cart(conn, cart_items):
+    """Copias de todos los items de un carrito con una sola consulta"""
+    option_ids = [v.get('option_id') for item in cart_items for v in item.get('variations') or []]
+    options = load_options(conn, option_ids)
+    return [build_snapshot(item.get('variations'), options) for item in cart_items]
+
+
+def decode_snapshot(value):
+    """Lista de variaciones guardada en variations_json (vacía si no hay)"""
+    if not value:
+        return []
+    try:
+        return json.loads(value)
+    except ValueError:
+        return []
+
+
+def variation_lines(value):
+    """Líneas 'Grupo: Opción' para tickets de cocina"""
+    return [f"{entry['group']}: {entry['name']}" if entry.get('group') else entry['name']
+            for entry in decode_snapshot(value)]
+
+
+def backfill_snapshots(conn, batch_size=1000):
+    """Llenar la copia de las líneas antiguas desde order_item_variations"""
+    rows = conn.execute('''
+        SELECT oiv.order_item_id, oiv.variation_option_id, oiv.price_modifier,
+               vo.display_name, vg.display_name
+        FROM order_item_variations oiv
+        JOIN order_items oi ON oi.id = oiv.order_item_id
+        LEFT JOIN variation_options vo ON oiv.variation_option_id = vo.id
+        LEFT JOIN variation_groups vg ON vo.variation_group_id = vg.id
+        WHERE oi.variations_json IS NULL
+        ORDER BY oiv.order_item_id, oiv.id
+    ''').fetchall()
+
+    by_item = {}
+    for item_id, option_id, modifier, option_name, group_name in rows:
+        if option_name is None:
+            continue  # Opción borrada: ya no se puede reconstruir
+        by_item.setdefault(item_id, []).append({
+            'option_id': option_id,
+            'group': group_name or '',
+            'name': option_name,
+            'price_modifier': modifier or 0,
+        })
+
+    updates = [encode_snapshot(entries) + (item_id,) for item_id, entries in by_item.items()]
+    for start in range(0, len(updates), batch_size):
+        conn.executemany('UPDATE order_items SET variations_json = ?, variations_display = ? WHERE id = ?',
+                         updates[start:start + batch_size])
+    return len(updates)